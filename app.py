@@ -100,6 +100,10 @@ def create_app():
     with app.app_context():
         import models  # noqa: F401
         db.create_all()
+        from utils.vector_codec import ensure_embedding_columns
+        ensure_embedding_columns(db.engine)
+        from utils.keyword_backend import ensure_keyword_index
+        ensure_keyword_index(db.engine)
         logging.info("Autogent Studio database tables created")
     
     return app
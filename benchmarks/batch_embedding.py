@@ -0,0 +1,70 @@
+"""Serial vs batched embedding against the local stub server
+
+Embeds the same chunks once per chunk through get_embedding and once through
+BatchEmbedder, checks both give the same vectors in the same order, and
+reports wall time and request counts. A non-zero --failure-rate makes the
+stub answer some requests with 429 to show the retries at work.
+
+    python benchmarks/batch_embedding.py --chunks 2000 --latency-ms 40 --failure-rate 0.1
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_embedding_server import start_stub_server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--chunk-chars', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--skip-serial', action='store_true')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(dimension=256, latency=args.latency_ms / 1000)
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    # Measure requests, not the embedding cache
+    os.environ['EMBEDDING_CACHE_MAX_MB'] = '0'
+
+    from services.ai_providers import get_embedding
+    from services.batch_embedder import BatchEmbedder
+
+    rng = np.random.default_rng(0)
+    words = [''.join(rng.choice(list('abcdefghij'), 6)) for _ in range(5000)]
+    chunks = []
+    for i in range(args.chunks):
+        text = f"chunk {i} " + ' '.join(rng.choice(words, args.chunk_chars // 7))
+        chunks.append(text[:args.chunk_chars])
+
+    serial = None
+    if not args.skip_serial:
+        started = time.perf_counter()
+        serial = [get_embedding(chunk) for chunk in chunks]
+        elapsed = time.perf_counter() - started
+        print(f"serial : {elapsed:7.2f}s  {server.requests} requests")
+
+    server.requests = 0
+    server.failure_rate = args.failure_rate
+    embedder = BatchEmbedder(max_batch_inputs=args.batch_size, max_concurrency=args.concurrency,
+                             base_delay=0.05)
+    started = time.perf_counter()
+    batched = embedder.embed(chunks)
+    elapsed = time.perf_counter() - started
+    print(f"batched: {elapsed:7.2f}s  {server.requests} requests ({server.failures} rejected with 429)")
+
+    if serial is not None:
+        assert np.allclose(np.array(serial), np.array(batched)), "Batched vectors differ from serial ones"
+        print("batched vectors match serial vectors in order")
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Throughput of the streaming token chunker on a large text
+
+Generates --mb megabytes of prose-like text (Zipf-distributed words,
+sentences, paragraphs, numbers, the odd long unbroken run) and streams it
+in 64 KiB blocks through utils.chunker.iter_chunk_spans, checking a sample
+of chunks against their offsets. Token counts are exact when tiktoken and
+its encoding files are available and estimated otherwise; the report says
+which.
+
+    python benchmarks/chunker_throughput.py --mb 100 --chunk-tokens 512 --overlap 64
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.chunker import iter_chunk_spans
+from utils.tokenizer import get_tokenizer
+
+BLOCK_CHARS = 64 * 1024
+
+def make_text(rng, size: int, unique: int = 8 * 2**20) -> str:
+    """``unique`` characters of generated prose, repeated up to ``size``"""
+    letters = np.array(list('etaoinshrdlcumwfgypbvkjxqz'))
+    frequencies = 1.0 / np.arange(1, len(letters) + 1)
+    vocabulary = [''.join(rng.choice(letters, n, p=frequencies / frequencies.sum()))
+                  for n in rng.integers(1, 12, 30000)]
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+
+    words = rng.choice(len(vocabulary), unique // 6, p=weights)
+    separators = rng.choice([' ', ', ', '. ', '.\n\n', ' 2024 ', ' (see ', ') '], len(words),
+                            p=[0.83, 0.06, 0.06, 0.01, 0.01, 0.015, 0.015])
+    parts = []
+    for i, (word, separator) in enumerate(zip(words, separators)):
+        parts.append(vocabulary[word])
+        parts.append(separator)
+        if i % 100000 == 99999:
+            # An unbroken run, as in base64 data or minified code
+            parts.append('Zm9vYmFy' * 300 + ' ')
+    text = ''.join(parts)
+    return (text * (size // len(text) + 1))[:size]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=float, default=100)
+    parser.add_argument('--chunk-tokens', type=int, default=512)
+    parser.add_argument('--overlap', type=int, default=64)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    text = make_text(rng, int(args.mb * 2**20))
+    tokenizer = get_tokenizer()
+    blocks = (text[i:i + BLOCK_CHARS] for i in range(0, len(text), BLOCK_CHARS))
+
+    chunks = tokens = largest = 0
+    started = time.perf_counter()
+    for chunk in iter_chunk_spans(blocks, args.chunk_tokens, args.overlap, tokenizer):
+        chunks += 1
+        tokens += chunk.tokens
+        largest = max(largest, chunk.tokens)
+        if chunks % 97 == 0:
+            assert text[chunk.start:chunk.end] == chunk.text
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(text) / 2**20:.1f} MiB, tokenizer {tokenizer.name}, "
+          f"chunks of {args.chunk_tokens} tokens overlapping by {args.overlap}")
+    print(f"{elapsed:6.2f}s  {len(text) / 2**20 / elapsed:6.1f} MiB/s  {chunks} chunks  "
+          f"{tokens / max(chunks, 1):.0f} tokens/chunk avg  {largest} max")
+
+if __name__ == '__main__':
+    main()
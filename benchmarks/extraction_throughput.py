@@ -0,0 +1,162 @@
+"""Document extraction throughput: in-thread parsing vs the extraction pool
+
+Generates a mixed corpus (multi-page PDFs, plus DOCX and XLSX when
+python-docx and openpyxl are installed) and extracts every file through
+services.file_processor.iter_extracted_text, first in the calling thread
+and then with extraction pools of increasing size. Besides throughput it
+reports the longest stall of a heartbeat thread, i.e. how long the
+parsers kept the GIL from the rest of the server.
+
+    python benchmarks/extraction_throughput.py --pdfs 20 --pages 60 --workers 1 2 4
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import file_processor
+from utils.extraction_pool import ExtractionPool
+
+WORDS = ("retrieval augmented generation embeds documents into vectors and searches them by "
+         "similarity before asking the model to answer with the retrieved context").split()
+
+def _line(i: int) -> str:
+    return " ".join(WORDS[(i + j) % len(WORDS)] for j in range(12))
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 45) -> None:
+    """A plain PDF with ``pages`` pages of Helvetica text, no PDF library needed"""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for page in range(pages):
+        page_id, content_id = 4 + 2 * page, 5 + 2 * page
+        lines = "".join(f"({_line(page * lines_per_page + i)}) '\n" for i in range(lines_per_page))
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td\n{lines}ET".encode('latin-1')
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(b"%d 0 R" % page_id)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, objects[number])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for number in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[number]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def write_docx(path: str, paragraphs: int) -> None:
+    document = file_processor.DocxDocument()
+    for i in range(paragraphs):
+        document.add_paragraph(_line(i))
+    document.save(path)
+
+def write_xlsx(path: str, rows: int) -> None:
+    workbook = file_processor.openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['id', 'name', 'description', 'score'])
+    for i in range(rows):
+        sheet.append([i, f"item {i}", _line(i), i * 0.5])
+    workbook.save(path)
+
+def build_corpus(directory: str, args) -> list:
+    corpus = []
+    for i in range(args.pdfs):
+        path = os.path.join(directory, f"doc{i}.pdf")
+        write_pdf(path, args.pages)
+        corpus.append((path, 'pdf'))
+    if file_processor.DocxDocument:
+        for i in range(args.docx):
+            path = os.path.join(directory, f"doc{i}.docx")
+            write_docx(path, args.paragraphs)
+            corpus.append((path, 'document'))
+    if file_processor.openpyxl:
+        for i in range(args.xlsx):
+            path = os.path.join(directory, f"sheet{i}.xlsx")
+            write_xlsx(path, args.rows)
+            corpus.append((path, 'spreadsheet'))
+    return corpus
+
+class Heartbeat:
+    """Ticks every ``interval`` seconds and records the longest gap between ticks"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.max_gap = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self.max_gap = max(self.max_gap, now - last - self.interval)
+            last = now
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def extract_all(corpus: list, concurrency: int) -> int:
+    """Extract every file, ``concurrency`` files at a time; returns characters extracted"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def extract(item):
+        path, file_type = item
+        return sum(len(piece) for piece in file_processor.iter_extracted_text(path, file_type))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sum(executor.map(extract, corpus))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdfs', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=60)
+    parser.add_argument('--docx', type=int, default=10)
+    parser.add_argument('--paragraphs', type=int, default=2000)
+    parser.add_argument('--xlsx', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    if not file_processor.PyPDF2:
+        sys.exit("PyPDF2 is required")
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = build_corpus(directory, args)
+        size_mb = sum(os.path.getsize(path) for path, _ in corpus) / 2**20
+        print(f"corpus: {len(corpus)} files, {size_mb:.1f} MiB")
+
+        for workers in [0] + args.workers:
+            pool = ExtractionPool(max_workers=workers)
+            file_processor.extraction_pool = pool
+            if workers:
+                # Start the workers outside the timed run
+                list(pool.imap(file_processor.pdf_page_count, [(corpus[0][0],)] * workers))
+            concurrency = max(1, workers)
+            with Heartbeat() as heartbeat:
+                started = time.perf_counter()
+                characters = extract_all(corpus, concurrency)
+                elapsed = time.perf_counter() - started
+            label = 'in-thread' if workers == 0 else f"{workers} worker(s)"
+            print(f"{label:>12}: {elapsed:6.2f}s  {len(corpus) / elapsed:6.1f} files/s  "
+                  f"{size_mb / elapsed:6.1f} MiB/s  {characters / 1e6:5.1f}M chars  "
+                  f"max stall {heartbeat.max_gap * 1000:7.1f} ms")
+            pool.shutdown()
+
+if __name__ == '__main__':
+    main()
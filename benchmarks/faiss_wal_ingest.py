@@ -0,0 +1,86 @@
+"""Ingestion benchmark for the FAISS vector database
+
+Upserts random vectors in fixed-size batches and reports per-batch latency
+as the index grows. With write-ahead logging the latency of the last batches
+should match the first ones apart from the occasional snapshot.
+
+    python benchmarks/faiss_wal_ingest.py --vectors 1000000 --dimension 128
+
+Afterwards the index is reopened to time recovery from snapshot plus log.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vector_db import FAISSVectorDB
+
+def make_db(directory: str, dimension: int, fsync: bool) -> FAISSVectorDB:
+    return FAISSVectorDB({
+        'dimension': dimension,
+        'index_path': os.path.join(directory, 'faiss_index.bin'),
+        'metadata_path': os.path.join(directory, 'faiss_metadata.json'),
+        'wal_path': os.path.join(directory, 'faiss_index.wal'),
+        'fsync': fsync
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vectors', type=int, default=1_000_000)
+    parser.add_argument('--dimension', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--no-fsync', action='store_true')
+    parser.add_argument('--directory', default=None, help='Keep index files here instead of a temp dir')
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix='faiss_wal_')
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+
+    try:
+        db = make_db(directory, args.dimension, not args.no_fsync)
+        batches = (args.vectors + args.batch_size - 1) // args.batch_size
+        latencies = []
+        started = time.perf_counter()
+
+        for b in range(batches):
+            size = min(args.batch_size, args.vectors - b * args.batch_size)
+            values = rng.standard_normal((size, args.dimension), dtype=np.float32)
+            vectors = [
+                {'id': f'chunk-{b}-{i}', 'values': values[i], 'metadata': {'knowledge_base_id': str(b % 10)}}
+                for i in range(size)
+            ]
+            t0 = time.perf_counter()
+            if not db.upsert(vectors):
+                raise RuntimeError(f"Upsert failed at batch {b}")
+            latencies.append(time.perf_counter() - t0)
+
+            if (b + 1) % max(1, batches // 10) == 0:
+                window = latencies[-max(1, batches // 10):]
+                print(f"{db.index.ntotal:>10} vectors  median batch {np.median(window) * 1000:7.2f} ms  "
+                      f"max {max(window) * 1000:8.2f} ms")
+
+        total = time.perf_counter() - started
+        print(f"Ingested {args.vectors} vectors in {total:.1f}s ({args.vectors / total:,.0f} vectors/s)")
+
+        first = np.median(latencies[:max(1, len(latencies) // 10)])
+        last = np.median(latencies[-max(1, len(latencies) // 10):])
+        print(f"Median batch latency first 10%: {first * 1000:.2f} ms, last 10%: {last * 1000:.2f} ms")
+
+        wal_records = db.wal.last_lsn - db.snapshot_lsn
+        db.wal.close()
+        t0 = time.perf_counter()
+        reopened = make_db(directory, args.dimension, not args.no_fsync)
+        print(f"Recovered {reopened.index.ntotal} vectors ({wal_records} from the log) "
+              f"in {time.perf_counter() - t0:.2f}s")
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
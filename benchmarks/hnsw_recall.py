@@ -0,0 +1,72 @@
+"""Recall@10 and latency of the NumPy HNSW index against exact search
+
+Builds an index per dataset size on clustered synthetic vectors, then
+compares HNSW results for a range of ef values with brute-force top-10.
+
+    python benchmarks/hnsw_recall.py --sizes 100000,1000000 --dimension 128
+
+Building is pure Python per insert; expect roughly an hour for 1M vectors.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.hnsw import HNSWIndex
+from utils.vector_cache import normalize_rows, top_k_indices
+
+def clustered_vectors(rng, count: int, dimension: int, clusters: int = 1000) -> np.ndarray:
+    centres = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    labels = rng.integers(0, clusters, count)
+    return centres[labels] + 0.5 * rng.standard_normal((count, dimension), dtype=np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--dimension', type=int, default=128)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--M', type=int, default=16)
+    parser.add_argument('--ef-construction', type=int, default=100)
+    parser.add_argument('--ef', default='16,32,64,128,256')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ef_values = [int(ef) for ef in args.ef.split(',')]
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        data = clustered_vectors(rng, size, args.dimension)
+        queries = data[rng.integers(0, size, args.queries)] + \
+            0.1 * rng.standard_normal((args.queries, args.dimension), dtype=np.float32)
+
+        index = HNSWIndex(args.dimension, M=args.M, ef_construction=args.ef_construction, seed=0,
+                          capacity=size)
+        started = time.perf_counter()
+        for start in range(0, size, 10000):
+            index.add(data[start:start + 10000])
+        build = time.perf_counter() - started
+        print(f"\n{size} vectors: built in {build:.0f}s ({size / build:,.0f} inserts/s), "
+              f"graph + vectors {index.nbytes / 1e6:.0f} MB")
+
+        normalised = normalize_rows(data)
+        exact = []
+        started = time.perf_counter()
+        for query in normalize_rows(queries):
+            exact.append(set(top_k_indices(normalised @ query, args.k).tolist()))
+        exact_ms = (time.perf_counter() - started) / args.queries * 1000
+        print(f"  exact      recall 1.000  {exact_ms:8.2f} ms/query")
+
+        for ef in ef_values:
+            hits = 0
+            started = time.perf_counter()
+            results = [index.search(query, args.k, ef=ef) for query in queries]
+            latency = (time.perf_counter() - started) / args.queries * 1000
+            for found, truth in zip(results, exact):
+                hits += len({node for node, _ in found} & truth)
+            print(f"  ef={ef:<6}  recall {hits / (args.k * args.queries):.3f}  {latency:8.2f} ms/query")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Keyword search latency per database backend
+
+Fills scratch files/file_embeddings tables with synthetic chunks, sets up
+the dialect's keyword index through utils.keyword_backend and times
+searches with it and with the plain LIKE fallback.
+
+    python benchmarks/keyword_backend_latency.py --chunks 100000
+    python benchmarks/keyword_backend_latency.py --database-url postgresql://localhost/bench
+
+The tables are dropped and recreated, so point --database-url at a scratch
+database.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from utils.keyword_backend import KeywordBackend, ensure_keyword_index
+
+def create_tables(engine):
+    with engine.begin() as conn:
+        if engine.dialect.name == 'sqlite':
+            conn.execute(text("DROP TABLE IF EXISTS file_embeddings_fts"))
+        conn.execute(text("DROP TABLE IF EXISTS file_embeddings"))
+        conn.execute(text("DROP TABLE IF EXISTS files"))
+        conn.execute(text("""
+            CREATE TABLE files (
+                id VARCHAR(255) PRIMARY KEY,
+                user_id VARCHAR(255) NOT NULL,
+                filename VARCHAR(255) NOT NULL
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE file_embeddings (
+                id VARCHAR(255) PRIMARY KEY,
+                file_id VARCHAR(255) NOT NULL REFERENCES files(id),
+                knowledge_base_id VARCHAR(255),
+                chunk_text TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL
+            )
+        """))
+
+def fill(engine, rng, vocabulary, chunks: int, chunk_words: int, chunks_per_file: int = 100):
+    # Zipf-distributed words give realistic posting list lengths
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    with engine.begin() as conn:
+        for file_start in range(0, chunks, chunks_per_file):
+            file_id = f"file-{file_start // chunks_per_file}"
+            conn.execute(text("INSERT INTO files VALUES (:id, 'bench-user', :name)"),
+                         {'id': file_id, 'name': f"{file_id}.txt"})
+            rows = []
+            for index in range(min(chunks_per_file, chunks - file_start)):
+                words = rng.choice(vocabulary, chunk_words, p=weights)
+                rows.append({
+                    'id': f"chunk-{file_start + index}",
+                    'file_id': file_id,
+                    'kb': f"kb-{(file_start // chunks_per_file) % 10}",
+                    'text': ' '.join(words),
+                    'index': index
+                })
+            conn.execute(text("INSERT INTO file_embeddings VALUES (:id, :file_id, :kb, :text, :index)"), rows)
+
+def time_backend(backend, session, queries, knowledge_base_id, limit):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        backend.search(session, query, 'bench-user', knowledge_base_id, limit)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies = np.array(latencies)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:///data/keyword_benchmark.db')
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--chunk-words', type=int, default=150)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--skip-like', action='store_true')
+    args = parser.parse_args()
+
+    if args.database_url.startswith('sqlite:///'):
+        directory = os.path.dirname(args.database_url[len('sqlite:///'):])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    engine = create_engine(args.database_url)
+    rng = np.random.default_rng(0)
+    vocabulary = np.array([f"w{i}" for i in range(args.vocabulary)])
+
+    create_tables(engine)
+    started = time.perf_counter()
+    fill(engine, rng, vocabulary, args.chunks, args.chunk_words)
+    print(f"inserted {args.chunks} chunks in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    backend = ensure_keyword_index(engine)
+    print(f"{backend.name} index built in {time.perf_counter() - started:.1f}s")
+
+    # Mix of common and rare words, two to four terms per query
+    queries = [' '.join(rng.choice(vocabulary[:5000], rng.integers(2, 5))) for _ in range(args.queries)]
+
+    backends = [backend]
+    if not args.skip_like:
+        backends.append(KeywordBackend())
+
+    with Session(engine) as session:
+        for candidate in backends:
+            for knowledge_base_id in (None, 'kb-3'):
+                p50, p95 = time_backend(candidate, session, queries, knowledge_base_id, args.limit)
+                scope = knowledge_base_id or 'all'
+                print(f"{candidate.name:18s} scope={scope:5s} p50 {p50:8.2f} ms  p95 {p95:8.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Memory, recall and latency of quantized knowledge base matrices
+
+Builds a clustered synthetic corpus, then compares exact float32 search
+with int8 and product-quantized search (approximate pass plus exact
+rerank of the shortlist).
+
+    python benchmarks/quantization_recall.py --rows 100000 --dimension 1536
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.vector_cache import KnowledgeBaseMatrix
+from utils.quantization import QuantizedMatrix, quantization_report
+
+def make_corpus(rng, rows: int, dimension: int, clusters: int = 500) -> np.ndarray:
+    centroids = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    noise = rng.standard_normal((rows, dimension), dtype=np.float32)
+    return centroids[rng.integers(0, clusters, rows)] + 0.6 * noise
+
+def latency_ms(matrix, queries: np.ndarray, k: int = 10):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        matrix.search(query, k)
+        timings.append((time.perf_counter() - started) * 1000)
+    return np.percentile(timings, 50), np.percentile(timings, 95)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--pq-subspaces', type=int, default=None,
+                        help='PQ subspaces; defaults to one per PQ_DIMENSIONS_PER_SUBSPACE dimensions')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = make_corpus(rng, args.rows, args.dimension)
+    chunk_ids = [f"chunk-{i}" for i in range(args.rows)]
+    file_ids = [i // 20 for i in range(args.rows)]
+    exact = KnowledgeBaseMatrix(vectors, chunk_ids, file_ids)
+    queries = vectors[rng.integers(0, args.rows, args.queries)] + vectors[rng.integers(0, args.rows, args.queries)]
+
+    p50, p95 = latency_ms(exact, queries)
+    print(f"float32: resident {exact.matrix.nbytes / 2**20:8.1f} MiB  "
+          f"search p50 {p50:6.2f} ms  p95 {p95:6.2f} ms")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for method in ('int8', 'pq'):
+            started = time.perf_counter()
+            quantized = QuantizedMatrix.build(os.path.join(directory, f"{method}.npy"), vectors,
+                                              chunk_ids, file_ids, method=method,
+                                              pq_subspaces=args.pq_subspaces)
+            build = time.perf_counter() - started
+            report = quantization_report(exact, quantized)
+            p50, p95 = latency_ms(quantized, queries)
+            print(f"{method:>7}: resident {report['quantized_bytes'] / 2**20:8.1f} MiB  "
+                  f"search p50 {p50:6.2f} ms  p95 {p95:6.2f} ms  "
+                  f"recall@10 {report['recall_at_10']:.3f}  build {build:5.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Per-query latency of RAGUtils hybrid scoring and re-ranking
+
+For each corpus size, builds a ChunkIndex once and then times
+RAGUtils.hybrid_search against it, plus rerank_results over the top 50.
+The old per-chunk path (sklearn cosine_similarity and a word-set Jaccard
+for every chunk) is timed on the first --baseline-chunks chunks and scaled
+up for comparison.
+
+    python benchmarks/rag_scoring.py --sizes 10000,100000
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.metrics.pairwise import cosine_similarity
+
+from utils.rag_utils import RAGUtils
+
+def make_corpus(rng, size: int, dimension: int, words_per_chunk: int = 150):
+    vocabulary = np.array([f"term{i}" for i in range(20000)])
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    chunks = []
+    for _ in range(size):
+        words = rng.choice(vocabulary, words_per_chunk, p=weights)
+        chunks.append({'text': ' '.join(words) + '.'})
+    embeddings = rng.standard_normal((size, dimension), dtype=np.float32).tolist()
+    return vocabulary, chunks, embeddings
+
+def legacy_scores(query: str, chunks, embeddings, query_embedding, alpha: float = 0.7):
+    """The loop RAGUtils.hybrid_search used to run"""
+    query_keywords = set(re.findall(r'\b\w+\b', query.lower()))
+    scores = []
+    for chunk, embedding in zip(chunks, embeddings):
+        semantic = cosine_similarity([query_embedding], [embedding])[0][0]
+        chunk_keywords = set(re.findall(r'\b\w+\b', chunk['text'].lower()))
+        union = len(query_keywords | chunk_keywords)
+        keyword = len(query_keywords & chunk_keywords) / union if union else 0.0
+        scores.append(alpha * semantic + (1 - alpha) * keyword)
+    return sorted(scores, reverse=True)[:10]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--baseline-chunks', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rag_utils = RAGUtils()
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        vocabulary, chunks, embeddings = make_corpus(rng, size, args.dimension)
+        queries = [' '.join(rng.choice(vocabulary[:2000], 3)) for _ in range(args.queries)]
+        query_embeddings = rng.standard_normal((args.queries, args.dimension)).tolist()
+
+        started = time.perf_counter()
+        index = rag_utils.index_chunks(chunks, embeddings)
+        build = time.perf_counter() - started
+
+        hybrid_ms, rerank_ms = [], []
+        for query, query_embedding in zip(queries, query_embeddings):
+            started = time.perf_counter()
+            results = rag_utils.hybrid_search(query, chunks, embeddings, query_embedding, index=index)
+            hybrid_ms.append((time.perf_counter() - started) * 1000)
+
+            candidates = [chunks[i] for i in rng.choice(size, 50, replace=False)] + results
+            started = time.perf_counter()
+            rag_utils.rerank_results(query, candidates)
+            rerank_ms.append((time.perf_counter() - started) * 1000)
+
+        baseline = min(args.baseline_chunks, size)
+        started = time.perf_counter()
+        legacy_scores(queries[0], chunks[:baseline], embeddings[:baseline], query_embeddings[0])
+        legacy_ms = (time.perf_counter() - started) * 1000 * size / baseline
+
+        print(f"{size:>8} chunks: index build {build:6.1f}s  "
+              f"hybrid p50 {np.percentile(hybrid_ms, 50):7.2f} ms  p95 {np.percentile(hybrid_ms, 95):7.2f} ms  "
+              f"rerank(60) p50 {np.percentile(rerank_ms, 50):6.2f} ms  "
+              f"per-chunk loop ~{legacy_ms:9.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Local stand-in for the OpenAI embeddings endpoint
+
+Serves POST /v1/embeddings with deterministic vectors derived from each
+input's hash, so results can be checked for order. It can add latency per
+request and answer a share of requests with 429 to exercise retries.
+
+    python benchmarks/stub_embedding_server.py --port 8099 --latency-ms 50
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub ...
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+def stub_vector(text: str, dimension: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class StubEmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dimension: int = 1536, latency: float = 0.0, failure_rate: float = 0.0):
+        super().__init__(address, StubEmbeddingHandler)
+        self.dimension = dimension
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.inputs = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/embeddings'):
+            return self._send(404, {'error': {'message': 'not found'}})
+
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        server = self.server
+
+        with server.lock:
+            server.requests += 1
+            fail = random.random() < server.failure_rate
+            if fail:
+                server.failures += 1
+            else:
+                server.inputs += len(inputs)
+
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            return self._send(429, {'error': {'message': 'rate limited', 'type': 'rate_limit_exceeded'}})
+
+        dimension = body.get('dimensions') or server.dimension
+        tokens = sum(len(text) // 4 for text in inputs)
+        self._send(200, {
+            'object': 'list',
+            'model': body.get('model'),
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': stub_vector(text, dimension)}
+                for i, text in enumerate(inputs)
+            ],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+        })
+
+def start_stub_server(port: int = 0, **kwargs) -> Tuple[StubEmbeddingServer, str]:
+    """Start the stub in a background thread; returns the server and its /v1 base URL"""
+    server = StubEmbeddingServer(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubEmbeddingServer(('127.0.0.1', args.port), dimension=args.dimension,
+                                 latency=args.latency_ms / 1000, failure_rate=args.failure_rate)
+    print(f"Stub embedding server on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
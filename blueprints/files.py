@@ -4,12 +4,22 @@ from werkzeug.utils import secure_filename
 from models import File, KnowledgeBase, FileEmbedding, db
 from services.file_service import FileService
 from services.vector_service import VectorService
+from utils.extraction_pool import extraction_pool
+from utils.blob_store import blob_store
+from utils.knowledge_base_index import knowledge_base_ids_for_file, unindex_files
 import uuid
 import os
 import mimetypes
 
 files_bp = Blueprint('files', __name__, url_prefix='/files')
 
+def _store_upload(file, file_id, filename):
+    """Stream an upload into the blob store; identical content is stored once"""
+    extension = os.path.splitext(filename)[1]
+    content_hash, file_size, duplicate = blob_store.put_stream(file.stream, owner=file_id, extension=extension)
+    file_metadata = {'content_hash': content_hash, 'deduplicated': duplicate}
+    return blob_store.path(content_hash, extension), file_size, file_metadata
+
 @files_bp.route('/')
 @login_required
 def index():
@@ -46,10 +56,9 @@ def upload_file():
             file_id = str(uuid.uuid4())
             
             # Save file
-            file_path = file_service.save_file(file, file_id, filename)
+            file_path, file_size, file_metadata = _store_upload(file, file_id, filename)
             
             # Get file info
-            file_size = os.path.getsize(file_path)
             mime_type = mimetypes.guess_type(filename)[0]
             
             # Create database record
@@ -62,11 +71,17 @@ def upload_file():
                 file_size=file_size,
                 mime_type=mime_type,
                 storage_path=file_path,
+                file_metadata=file_metadata,
                 processing_status='uploaded'
             )
             
             db.session.add(db_file)
-            db.session.commit()
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                blob_store.release(file_id)
+                raise
             
             # Start background processing
             file_service.process_file_async(file_id)
@@ -76,7 +91,8 @@ def upload_file():
                 'file_id': file_id,
                 'filename': filename,
                 'file_size': file_size,
-                'mime_type': mime_type
+                'mime_type': mime_type,
+                'deduplicated': file_metadata['deduplicated']
             })
             
         except Exception as e:
@@ -121,13 +137,17 @@ def delete_file(file_id):
     ).first_or_404()
     
     try:
-        # Delete physical file
-        if os.path.exists(file.storage_path):
-            os.remove(file.storage_path)
+        # Stop any extraction still running on it
+        extraction_pool.cancel(str(file.id))
+        
+        # Delete physical file, or just this file's reference to shared content
+        blob_store.discard(file.id, file.storage_path)
         
         # Delete from database (cascades to embeddings)
+        kb_ids = knowledge_base_ids_for_file(file.id)
         db.session.delete(file)
         db.session.commit()
+        unindex_files(kb_ids, [file.id])
         
         return jsonify({'success': True})
     except Exception as e:
@@ -259,8 +279,7 @@ def batch_upload():
                 filename = secure_filename(file.filename)
                 file_id = str(uuid.uuid4())
                 
-                file_path = file_service.save_file(file, file_id, filename)
-                file_size = os.path.getsize(file_path)
+                file_path, file_size, file_metadata = _store_upload(file, file_id, filename)
                 mime_type = mimetypes.guess_type(filename)[0]
                 
                 db_file = File(
@@ -272,6 +291,7 @@ def batch_upload():
                     file_size=file_size,
                     mime_type=mime_type,
                     storage_path=file_path,
+                    file_metadata=file_metadata,
                     processing_status='uploaded'
                 )
                 
@@ -280,7 +300,8 @@ def batch_upload():
                 results.append({
                     'file_id': file_id,
                     'filename': filename,
-                    'status': 'success'
+                    'status': 'success',
+                    'deduplicated': file_metadata['deduplicated']
                 })
                 
                 # Start background processing
@@ -293,7 +314,14 @@ def batch_upload():
                     'error': str(e)
                 })
     
-    db.session.commit()
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for result in results:
+            if 'file_id' in result:
+                blob_store.release(result['file_id'])
+        raise
     
     return jsonify({
         'success': True,
@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from sqlalchemy import Text, JSON, Boolean, Integer, String, DateTime, Float, ForeignKey
+from sqlalchemy import Text, JSON, Boolean, Integer, String, DateTime, Float, ForeignKey, LargeBinary
 from sqlalchemy.orm import relationship
 from app import db
 
@@ -108,7 +108,10 @@ class FileEmbedding(db.Model):
     chunk_text = db.Column(Text, nullable=False)
     chunk_index = db.Column(Integer, nullable=False)
     embedding_model = db.Column(String(100), nullable=False)
-    embedding_vector = db.Column(Text)  # Store as JSON string for SQLite compatibility
+    embedding_vector = db.Column(Text)  # Legacy JSON encoding, cleared by utils.vector_codec migration
+    embedding_blob = db.Column(LargeBinary)  # Little-endian float32 vector
+    embedding_dim = db.Column(Integer)
+    embedding_dtype = db.Column(String(16), default='<f4')
     embedding_metadata = db.Column(JSON, default=dict)
     created_at = db.Column(DateTime, default=datetime.utcnow)
     
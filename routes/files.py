@@ -4,10 +4,12 @@ from app import db
 from models import User, File, FileChunk, KnowledgeBase, KnowledgeBaseFile
 from services.embedding_service import EmbeddingService
 from utils.file_processor import FileProcessor
+from utils.extraction_pool import extraction_pool
+from utils.blob_store import blob_store
+from utils.knowledge_base_index import knowledge_base_ids_for_file, unindex_files
 import os
 import logging
 import uuid
-import hashlib
 
 files_bp = Blueprint('files', __name__)
 
@@ -47,21 +49,17 @@ def upload_file():
         user = User.query.get(session['user_id'])
         
         # Generate unique filename
-        filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        file_path = os.path.join('uploads', filename)
+        file_id = str(uuid.uuid4())
+        filename = file_id + '_' + secure_filename(file.filename)
         
-        # Ensure upload directory exists
-        os.makedirs('uploads', exist_ok=True)
-        
-        # Save file
-        file.save(file_path)
-        
-        # Calculate file hash
-        with open(file_path, 'rb') as f:
-            file_hash = hashlib.sha256(f.read()).hexdigest()
+        # Save file into the content-addressed store, hashing it as it streams in
+        extension = os.path.splitext(secure_filename(file.filename))[1]
+        file_hash, _, _ = blob_store.put_stream(file.stream, owner=file_id, extension=extension)
+        file_path = blob_store.path(file_hash, extension)
         
         # Create file record
         file_record = File(
+            id=file_id,
             user_id=user.id,
             filename=filename,
             original_filename=file.filename,
@@ -79,7 +77,7 @@ def upload_file():
         # Process file asynchronously
         try:
             processor = FileProcessor()
-            content = processor.extract_text(file_path, file.content_type)
+            content = processor.extract_text(file_path, file_record.file_type, file_record.id, file_hash)
             
             if content:
                 # Create embeddings
@@ -163,13 +161,17 @@ def delete_file(file_id):
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        # Delete file from filesystem
-        if os.path.exists(file.file_path):
-            os.remove(file.file_path)
+        # Stop any extraction still running on it
+        extraction_pool.cancel(str(file.id))
+        
+        # Delete file from filesystem, or just this file's reference to shared content
+        blob_store.discard(file.id, file.file_path)
         
         # Delete from database (chunks will be deleted via cascade)
+        kb_ids = knowledge_base_ids_for_file(file.id)
         db.session.delete(file)
         db.session.commit()
+        unindex_files(kb_ids, [file.id])
         
         return jsonify({'success': True})
         
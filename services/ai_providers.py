@@ -2,6 +2,7 @@ import os
 import logging
 from typing import Dict, List, Any, Optional
 import json
+import threading
 
 # Import AI provider SDKs
 try:
@@ -21,6 +22,10 @@ try:
 except ImportError:
     genai = None
 
+from utils.embedding_cache import embedding_cache
+from utils.embedding_dimensions import cache_model, shorten_all, supports_dimensions
+from utils.tokenizer import count_tokens
+
 def get_provider_client(provider: str):
     """Get initialized client for AI provider"""
     if provider == 'openai':
@@ -187,65 +192,75 @@ def enhance_image_prompt(prompt: str, style: str) -> str:
         return f"{prompt}, {enhancement}"
     return prompt
 
+# Chat models offered per provider
+MODEL_CATALOG = {
+    'openai': [
+        {
+            'id': 'gpt-4o',
+            'name': 'GPT-4 Omni',
+            'description': 'Most capable multimodal model',
+            'context_window': 128000,
+            'capabilities': ['text', 'vision', 'function_calling']
+        },
+        {
+            'id': 'gpt-4o-mini',
+            'name': 'GPT-4 Omni Mini',
+            'description': 'Faster and more affordable GPT-4',
+            'context_window': 128000,
+            'capabilities': ['text', 'vision', 'function_calling']
+        },
+        {
+            'id': 'gpt-3.5-turbo',
+            'name': 'GPT-3.5 Turbo',
+            'description': 'Fast and capable for most tasks',
+            'context_window': 16385,
+            'capabilities': ['text', 'function_calling']
+        }
+    ],
+    'anthropic': [
+        {
+            'id': 'claude-sonnet-4-20250514',
+            'name': 'Claude 4 Sonnet',
+            'description': 'Most capable Claude model',
+            'context_window': 200000,
+            'capabilities': ['text', 'vision', 'function_calling']
+        },
+        {
+            'id': 'claude-3-5-sonnet-20241022',
+            'name': 'Claude 3.5 Sonnet',
+            'description': 'Previous generation Claude',
+            'context_window': 200000,
+            'capabilities': ['text', 'vision', 'function_calling']
+        }
+    ],
+    'google': [
+        {
+            'id': 'gemini-1.5-pro',
+            'name': 'Gemini 1.5 Pro',
+            'description': 'Extremely large context window',
+            'context_window': 2000000,
+            'capabilities': ['text', 'vision', 'function_calling']
+        },
+        {
+            'id': 'gemini-1.5-flash',
+            'name': 'Gemini 1.5 Flash',
+            'description': 'Fast and efficient',
+            'context_window': 1000000,
+            'capabilities': ['text', 'vision', 'function_calling']
+        }
+    ]
+}
+
+# Context windows of models missing from the catalog, by name prefix (most specific first)
+CONTEXT_WINDOW_PREFIXES = (
+    ('gpt-4o', 128000), ('gpt-4-turbo', 128000), ('gpt-4', 8192), ('gpt-3.5', 16385),
+    ('claude', 200000), ('gemini-1.5-pro', 2000000), ('gemini', 1000000)
+)
+DEFAULT_CONTEXT_WINDOW = 8192
+
 def get_available_models() -> Dict[str, List[Dict]]:
     """Get list of available models for each provider"""
-    models = {
-        'openai': [
-            {
-                'id': 'gpt-4o',
-                'name': 'GPT-4 Omni',
-                'description': 'Most capable multimodal model',
-                'context_window': 128000,
-                'capabilities': ['text', 'vision', 'function_calling']
-            },
-            {
-                'id': 'gpt-4o-mini',
-                'name': 'GPT-4 Omni Mini',
-                'description': 'Faster and more affordable GPT-4',
-                'context_window': 128000,
-                'capabilities': ['text', 'vision', 'function_calling']
-            },
-            {
-                'id': 'gpt-3.5-turbo',
-                'name': 'GPT-3.5 Turbo',
-                'description': 'Fast and capable for most tasks',
-                'context_window': 16385,
-                'capabilities': ['text', 'function_calling']
-            }
-        ],
-        'anthropic': [
-            {
-                'id': 'claude-sonnet-4-20250514',
-                'name': 'Claude 4 Sonnet',
-                'description': 'Most capable Claude model',
-                'context_window': 200000,
-                'capabilities': ['text', 'vision', 'function_calling']
-            },
-            {
-                'id': 'claude-3-5-sonnet-20241022',
-                'name': 'Claude 3.5 Sonnet',
-                'description': 'Previous generation Claude',
-                'context_window': 200000,
-                'capabilities': ['text', 'vision', 'function_calling']
-            }
-        ],
-        'google': [
-            {
-                'id': 'gemini-1.5-pro',
-                'name': 'Gemini 1.5 Pro',
-                'description': 'Extremely large context window',
-                'context_window': 2000000,
-                'capabilities': ['text', 'vision', 'function_calling']
-            },
-            {
-                'id': 'gemini-1.5-flash',
-                'name': 'Gemini 1.5 Flash',
-                'description': 'Fast and efficient',
-                'context_window': 1000000,
-                'capabilities': ['text', 'vision', 'function_calling']
-            }
-        ]
-    }
+    models = MODEL_CATALOG
     
     # Filter models based on available API keys
     available_models = {}
@@ -271,10 +286,20 @@ def validate_model_config(provider: str, model: str) -> bool:
     provider_models = [m['id'] for m in available_models[provider]]
     return model in provider_models
 
-def estimate_tokens(text: str) -> int:
-    """Estimate token count for text (simplified)"""
-    # Simple estimation: ~4 characters per token
-    return len(text) // 4
+def context_window(model: str) -> int:
+    """Tokens a model accepts per request, prompt and completion together"""
+    for provider_models in MODEL_CATALOG.values():
+        for entry in provider_models:
+            if entry['id'] == model:
+                return entry['context_window']
+    for prefix, window in CONTEXT_WINDOW_PREFIXES:
+        if (model or '').startswith(prefix):
+            return window
+    return DEFAULT_CONTEXT_WINDOW
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """Token count of text with the model's tokenizer (estimated if tiktoken is unavailable)"""
+    return count_tokens(text, model)
 
 def calculate_cost(provider: str, model: str, input_tokens: int, output_tokens: int) -> float:
     """Calculate API cost based on provider and token usage"""
@@ -304,22 +329,62 @@ def calculate_cost(provider: str, model: str, input_tokens: int, output_tokens:
     
     return input_cost + output_cost
 
-def get_embedding(text: str, model: str = 'text-embedding-3-small') -> List[float]:
-    """Generate text embedding using OpenAI"""
+_embedding_clients: Dict[str, Any] = {}
+_embedding_clients_lock = threading.Lock()
+
+def get_embedding_client():
+    """Shared OpenAI client for embedding calls
+    
+    Clients hold a connection pool and are thread-safe, so one per API key is
+    reused instead of building a new client (and TLS session) per request.
+    """
+    api_key = os.environ.get('OPENAI_API_KEY', '')
+    with _embedding_clients_lock:
+        client = _embedding_clients.get(api_key)
+        if client is None:
+            client = get_provider_client('openai')
+            _embedding_clients[api_key] = client
+        return client
+
+def get_embedding(text: str, model: str = 'text-embedding-3-small',
+                  dimensions: Optional[int] = None) -> List[float]:
+    """Generate text embedding using OpenAI, optionally shortened to ``dimensions``"""
     try:
-        client = get_provider_client('openai')
-        
-        response = client.embeddings.create(
-            model=model,
-            input=text
-        )
-        
-        return response.data[0].embedding
+        return get_embeddings([text], model, dimensions)[0]
         
     except Exception as e:
         logging.error(f"Error generating embedding: {e}")
         raise
 
+def get_embeddings(texts: List[str], model: str = 'text-embedding-3-small',
+                   dimensions: Optional[int] = None) -> List[List[float]]:
+    """Generate embeddings for several texts, requesting only those not cached"""
+    return embedding_cache.get_or_compute(
+        texts, cache_model(model, dimensions), lambda missing: request_embeddings(missing, model, dimensions)
+    )
+
+def request_embeddings(texts: List[str], model: str = 'text-embedding-3-small',
+                       dimensions: Optional[int] = None) -> List[List[float]]:
+    """Generate embeddings for several texts in one OpenAI request, in input order
+    
+    text-embedding-3 models shorten to ``dimensions`` server-side; older
+    models return full vectors that are shortened locally.
+    """
+    if not texts:
+        return []
+    
+    client = get_embedding_client()
+    options = {'dimensions': dimensions} if dimensions and supports_dimensions(model) else {}
+    response = client.embeddings.create(
+        model=model,
+        input=list(texts),
+        **options
+    )
+    
+    # The API tags each result with its input index; don't rely on response order
+    embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    return embeddings if options else shorten_all(embeddings, dimensions)
+
 def transcribe_audio(audio_file_path: str) -> str:
     """Transcribe audio using OpenAI Whisper"""
     try:
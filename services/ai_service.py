@@ -8,6 +8,8 @@ from anthropic import Anthropic
 import google.generativeai as genai
 import cohere
 
+from utils.embedding_cache import embedding_cache
+
 # <important_code_snippet_instructions>
 # The newest OpenAI model is "gpt-4o", not older versions
 # The newest Anthropic model is "claude-sonnet-4-20250514", not older models
@@ -433,12 +435,14 @@ class AIService:
         if not self.openai_client:
             raise Exception("OpenAI client not initialized")
         
-        response = self.openai_client.embeddings.create(
-            model=model,
-            input=text
-        )
+        def request(texts):
+            response = self.openai_client.embeddings.create(
+                model=model,
+                input=texts[0]
+            )
+            return [response.data[0].embedding]
         
-        return response.data[0].embedding
+        return embedding_cache.get_or_compute([text], model, request)[0]
     
     def transcribe_audio(self, audio_file_path: str) -> str:
         """Transcribe audio using Whisper"""
@@ -0,0 +1,121 @@
+import os
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from services.ai_providers import request_embeddings, estimate_tokens
+from utils.embedding_cache import EmbeddingCache, embedding_cache
+from utils.embedding_dimensions import cache_model
+
+# OpenAI accepts up to 2048 inputs and 300k tokens per embeddings request
+MAX_BATCH_INPUTS = int(os.environ.get('EMBEDDING_BATCH_SIZE', '2048'))
+MAX_BATCH_TOKENS = int(os.environ.get('EMBEDDING_BATCH_TOKENS', '300000'))
+MAX_CONCURRENCY = int(os.environ.get('EMBEDDING_MAX_CONCURRENCY', '4'))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and dropped connections are worth another try"""
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # openai.APIConnectionError / APITimeoutError carry no status code
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'RateLimitError')
+
+class BatchEmbedder:
+    """Embed many texts with few requests
+
+    Texts are grouped into batches bounded by the provider's input count and
+    token limits, up to ``max_concurrency`` batches are in flight at once,
+    and failed batches are retried with full-jitter exponential backoff.
+    Results come back in input order. Texts already in the embedding cache
+    are not sent at all. With ``dimensions`` set, vectors are shortened to
+    that size and cached separately from full-size ones.
+    """
+
+    def __init__(self, model: str = 'text-embedding-3-small',
+                 embed_batch: Callable[[List[str], str], List[List[float]]] = request_embeddings,
+                 max_batch_inputs: int = MAX_BATCH_INPUTS,
+                 max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 max_concurrency: int = MAX_CONCURRENCY,
+                 max_retries: int = 5,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0,
+                 cache: Optional[EmbeddingCache] = embedding_cache,
+                 dimensions: Optional[int] = None):
+        self.model = model
+        self.dimensions = dimensions
+        self.embed_batch = embed_batch
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cache = cache
+
+    def batches(self, texts: Sequence[str]) -> List[Tuple[int, int]]:
+        """Split texts into contiguous [start, end) ranges that fit one request"""
+        ranges = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            text_tokens = max(1, estimate_tokens(text))
+            if i > start and (i - start >= self.max_batch_inputs or tokens + text_tokens > self.max_batch_tokens):
+                ranges.append((start, i))
+                start = i
+                tokens = 0
+            tokens += text_tokens
+        if start < len(texts):
+            ranges.append((start, len(texts)))
+        return ranges
+
+    def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                if self.dimensions:
+                    embeddings = self.embed_batch(texts, self.model, dimensions=self.dimensions)
+                else:
+                    embeddings = self.embed_batch(texts, self.model)
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+                return embeddings
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                attempt += 1
+                logging.warning(f"Embedding batch of {len(texts)} failed ({e}), retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed all texts, returning one vector per text in the same order"""
+        if self.cache is not None:
+            return self.cache.get_or_compute(texts, cache_model(self.model, self.dimensions), self._embed_uncached)
+        return self._embed_uncached(texts)
+
+    def _embed_uncached(self, texts: Sequence[str]) -> List[List[float]]:
+        texts = list(texts)
+        ranges = self.batches(texts)
+        if not ranges:
+            return []
+        if len(ranges) == 1:
+            return self._embed_with_retry(texts)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(ranges))) as executor:
+            results = executor.map(lambda r: self._embed_with_retry(texts[r[0]:r[1]]), ranges)
+            embeddings: List[List[float]] = []
+            for batch in results:
+                embeddings.extend(batch)
+        return embeddings
+
+def embed_texts(texts: Sequence[str], model: str = 'text-embedding-3-small',
+                embedder: Optional[BatchEmbedder] = None,
+                dimensions: Optional[int] = None) -> List[List[float]]:
+    """Embed texts in batches with the default provider"""
+    return (embedder or BatchEmbedder(model=model, dimensions=dimensions)).embed(texts)
@@ -5,6 +5,7 @@ from sklearn.metrics.pairwise import cosine_similarity
 from app import db
 from models import DocumentChunk, UploadedFile, KnowledgeBase
 from services.openai_service import OpenAIService
+from utils.embedding_cache import embedding_cache
 
 class EmbeddingService:
     def __init__(self):
@@ -20,12 +21,13 @@ class EmbeddingService:
     def create_embedding(self, text, model='openai'):
         """Create embedding for text using specified model"""
         if model == 'openai':
-            result = self.openai_service.create_embedding(text)
-            return result['embedding']
+            # OpenAIService caches its own embeddings
+            return self.openai_service.create_embedding(text)
         elif model == 'sentence-transformers':
-            model = self.get_local_model()
-            embedding = model.encode([text])[0]
-            return embedding.tolist()
+            local_model = self.get_local_model()
+            return embedding_cache.get_or_compute(
+                [text], 'all-MiniLM-L6-v2', lambda texts: local_model.encode(texts).tolist()
+            )[0]
         else:
             raise ValueError(f"Unsupported embedding model: {model}")
     
@@ -1,6 +1,6 @@
 import os
 import numpy as np
-from typing import List, Union, Optional
+from typing import Dict, List, Union, Optional
 import json
 
 try:
@@ -9,18 +9,23 @@ except ImportError:
     SentenceTransformer = None
 
 from .openai_service import OpenAIService
+from utils.embedding_cache import embedding_cache
+from utils.embedding_dimensions import cache_model, shorten_all
 
 class EmbeddingService:
-    def __init__(self, provider: str = "openai", model_name: Optional[str] = None):
+    def __init__(self, provider: str = "openai", model_name: Optional[str] = None,
+                 dimension: Optional[int] = None):
         """
         Initialize embedding service
         
         Args:
             provider: Embedding provider ('openai', 'sentence_transformers', 'cohere')
             model_name: Specific model to use
+            dimension: Shorten embeddings to this many dimensions (None for full size)
         """
         self.provider = provider.lower()
         self.model_name = model_name
+        self.dimension = dimension
         
         if self.provider == "openai":
             self.openai_service = OpenAIService()
@@ -59,6 +64,8 @@ class EmbeddingService:
         """
         Get embeddings for multiple texts
         
+        Texts already in the shared embedding cache are not sent to the provider.
+        
         Args:
             texts: List of input texts
             
@@ -66,23 +73,28 @@ class EmbeddingService:
             List of embedding vectors
         """
         try:
-            if self.provider == "openai":
-                return self.openai_service.get_embeddings(texts, self.model_name)
-                
-            elif self.provider == "sentence_transformers":
-                embeddings = self.model.encode(texts)
-                return embeddings.tolist()
-                
-            elif self.provider == "cohere":
-                response = self.cohere_client.embed(
-                    texts=texts,
-                    model=self.model_name
-                )
-                return response.embeddings
+            return embedding_cache.get_or_compute(
+                texts, cache_model(self.model_name, self.dimension), self._compute_embeddings
+            )
                 
         except Exception as e:
             raise Exception(f"Embedding generation failed: {str(e)}")
 
+    def _compute_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if self.provider == "openai":
+            return self.openai_service.request_embeddings(texts, self.model_name, self.dimension)
+            
+        elif self.provider == "sentence_transformers":
+            embeddings = self.model.encode(texts)
+            return shorten_all(embeddings.tolist(), self.dimension)
+            
+        elif self.provider == "cohere":
+            response = self.cohere_client.embed(
+                texts=texts,
+                model=self.model_name
+            )
+            return shorten_all(response.embeddings, self.dimension)
+
     def compute_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """
         Compute cosine similarity between two embeddings
@@ -242,6 +254,9 @@ class EmbeddingService:
         Returns:
             Embedding dimension
         """
+        if self.dimension:
+            return self.dimension
+        
         if self.provider == "openai":
             if "text-embedding-3-small" in self.model_name:
                 return 1536
@@ -1,13 +1,20 @@
 import os
 import magic
-import PyPDF2
-import docx
 from PIL import Image
 import mimetypes
 import hashlib
+import uuid
 from models import File, FileEmbedding
 from app import db
+from utils.vector_codec import set_embedding
+from utils.knowledge_base_index import (
+    index_new_chunks, knowledge_base_ids_for_file, unindex_files
+)
 from services.ai_providers import AIProviders
+from services.file_processor import extract_pieces, iter_pdf_pages
+from utils.extraction_pool import extraction_pool
+from utils.blob_store import blob_store
+from utils.chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, chunk_texts
 import logging
 
 class FileManager:
@@ -63,7 +70,7 @@ class FileManager:
             if file_extension in self.supported_types['text']:
                 return self._extract_text_content(file_path)
             elif file_extension in self.supported_types['document']:
-                return self._extract_document_content(file_path, file_extension)
+                return self._extract_document_content(file_path, file_extension, str(file_record.id))
             elif file_extension in self.supported_types['image']:
                 return self._extract_image_content(file_path)
             else:
@@ -83,13 +90,13 @@ class FileManager:
             with open(file_path, 'r', encoding='latin-1') as file:
                 return file.read()
     
-    def _extract_document_content(self, file_path, file_extension):
-        """Extract content from document files"""
+    def _extract_document_content(self, file_path, file_extension, file_id=None):
+        """Extract content from document files; ``file_id`` keys their extraction jobs"""
         try:
             if file_extension == '.pdf':
-                return self._extract_pdf_content(file_path)
+                return self._extract_pdf_content(file_path, file_id)
             elif file_extension in ['.docx', '.doc']:
-                return self._extract_word_content(file_path)
+                return self._extract_word_content(file_path, file_id)
             elif file_extension in ['.pptx', '.ppt']:
                 return self._extract_powerpoint_content(file_path)
             elif file_extension in ['.xlsx', '.xls']:
@@ -101,33 +108,20 @@ class FileManager:
             logging.error(f"Error extracting document content: {str(e)}")
             return None
     
-    def _extract_pdf_content(self, file_path):
-        """Extract content from PDF files"""
+    def _extract_pdf_content(self, file_path, file_id=None):
+        """Extract content from PDF files, fanning pages out to the extraction pool"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                content = []
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    content.append(page.extract_text())
-                
-                return '\n'.join(content)
+            return "".join(iter_pdf_pages(file_path, file_id)).rstrip("\n")
         
         except Exception as e:
             logging.error(f"Error extracting PDF content: {str(e)}")
             return None
     
-    def _extract_word_content(self, file_path):
-        """Extract content from Word documents"""
+    def _extract_word_content(self, file_path, file_id=None):
+        """Extract content from Word documents in an extraction worker"""
         try:
-            doc = docx.Document(file_path)
-            content = []
-            
-            for paragraph in doc.paragraphs:
-                content.append(paragraph.text)
-            
-            return '\n'.join(content)
+            paragraphs = extraction_pool.run(extract_pieces, file_path, 'document', key=file_id)
+            return "".join(paragraphs).rstrip("\n")
         
         except Exception as e:
             logging.error(f"Error extracting Word content: {str(e)}")
@@ -172,6 +166,7 @@ class FileManager:
             # Split content into chunks
             chunks = self._split_content(content)
             
+            chunk_ids, embeddings, texts = [], [], []
             for i, chunk in enumerate(chunks):
                 if len(chunk.strip()) > 0:
                     # Generate embedding
@@ -179,38 +174,26 @@ class FileManager:
                     
                     # Save embedding
                     file_embedding = FileEmbedding(
+                        id=str(uuid.uuid4()),
                         file_id=file_record.id,
                         chunk_text=chunk,
-                        embedding=embedding,
                         chunk_index=i
                     )
+                    set_embedding(file_embedding, embedding)
                     db.session.add(file_embedding)
+                    chunk_ids.append(file_embedding.id)
+                    embeddings.append(embedding)
+                    texts.append(chunk)
             
             db.session.commit()
+            index_new_chunks(knowledge_base_ids_for_file(file_record.id), file_record.id, chunk_ids, embeddings, texts)
         
         except Exception as e:
             logging.error(f"Error generating embeddings: {str(e)}")
     
-    def _split_content(self, content, chunk_size=1000, overlap=200):
-        """Split content into chunks for embedding"""
-        chunks = []
-        start = 0
-        
-        while start < len(content):
-            end = start + chunk_size
-            
-            # Find the last space before the end to avoid splitting words
-            if end < len(content):
-                while end > start and content[end] != ' ':
-                    end -= 1
-            
-            chunk = content[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - overlap
-        
-        return chunks
+    def _split_content(self, content, chunk_size=DEFAULT_CHUNK_TOKENS, overlap=DEFAULT_OVERLAP_TOKENS):
+        """Split content into chunks of ``chunk_size`` tokens for embedding"""
+        return chunk_texts(content, chunk_size, overlap)
     
     def search_files(self, query, user_id, limit=10):
         """Search files using semantic search"""
@@ -260,16 +243,20 @@ class FileManager:
             if not file_record:
                 raise ValueError("File not found")
             
+            # Stop any extraction still running on it
+            extraction_pool.cancel(str(file_record.id))
+            
             # Delete file from filesystem
-            if os.path.exists(file_record.file_path):
-                os.remove(file_record.file_path)
+            blob_store.discard(file_record.id, file_record.file_path)
             
             # Delete embeddings
+            kb_ids = knowledge_base_ids_for_file(file_id)
             FileEmbedding.query.filter_by(file_id=file_id).delete()
             
             # Delete file record
             db.session.delete(file_record)
             db.session.commit()
+            unindex_files(kb_ids, [file_id])
             
             return True
         
@@ -1,8 +1,10 @@
 import os
+import codecs
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Iterable, Iterator, Optional
 import mimetypes
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # File processing libraries
 try:
@@ -41,7 +43,33 @@ try:
 except ImportError:
     eyed3 = None
 
+try:
+    from services.websocket_service import WebSocketService
+except ImportError:
+    WebSocketService = None
+
 from services.ai_providers import get_embedding
+from services.batch_embedder import embed_texts
+from utils.embedding_dimensions import cache_model, dimension_metadata, embedding_dimension
+from utils.extraction_pool import extraction_pool
+from utils.blob_store import artifact_cache, artifact_key, blob_store
+from utils.chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, Chunk, iter_chunk_spans
+from utils.tokenizer import get_tokenizer
+
+# Characters read per block from plain text files
+TEXT_BLOCK_CHARS = 64 * 1024
+
+# PDF pages parsed per extraction job; longer PDFs fan out across workers
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', '16'))
+
+# File types whose parsers are CPU-bound and run in the extraction pool
+POOLED_TYPES = ('pdf', 'document', 'spreadsheet', 'presentation')
+
+# Names the chunking algorithm in artifact cache keys; change it when chunk output changes
+CHUNKER_VERSION = 'tokens-v1'
+
+# Chunks embedded and inserted together while streaming a file into a knowledge base
+INGEST_BATCH_CHUNKS = int(os.environ.get('INGEST_BATCH_CHUNKS', '128'))
 
 def get_file_type(file_path: str) -> str:
     """Determine file type from path"""
@@ -83,13 +111,27 @@ def get_file_type(file_path: str) -> str:
     else:
         return 'unknown'
 
-def extract_text(file_path: str, file_type: str) -> str:
-    """Extract text content from various file types"""
+def _in_pool(file_path: str, file_type: str) -> bool:
+    """Whether a file is parsed by the extraction pool rather than in this thread
+    
+    CSV files stay local: pandas parses them in C, a chunk at a time.
+    """
+    return (extraction_pool.enabled and file_type in POOLED_TYPES
+            and not (file_type == 'spreadsheet' and Path(file_path).suffix.lower() == '.csv'))
+
+def extract_text(file_path: str, file_type: str, job_key: Optional[str] = None) -> str:
+    """Extract text content from various file types
+    
+    ``job_key`` (the file id) lets ``extraction_pool.cancel`` stop the
+    extraction; uploads share blob paths, so the path cannot serve.
+    """
     try:
-        if file_type == 'text' or file_type == 'code' or file_type == 'data':
+        if file_type != 'pdf' and _in_pool(file_path, file_type):
+            return extraction_pool.run(extract_text, file_path, file_type, key=job_key)
+        elif file_type == 'text' or file_type == 'code' or file_type == 'data':
             return extract_text_file(file_path)
         elif file_type == 'pdf':
-            return extract_pdf_text(file_path)
+            return extract_pdf_text(file_path, job_key)
         elif file_type == 'document':
             return extract_document_text(file_path)
         elif file_type == 'spreadsheet':
@@ -109,6 +151,35 @@ def extract_text(file_path: str, file_type: str) -> str:
         logging.error(f"Error extracting text from {file_path}: {e}")
         return f"Error extracting text: {str(e)}"
 
+def iter_extracted_text(file_path: str, file_type: str, job_key: Optional[str] = None) -> Iterator[str]:
+    """Stream the text of a file in pieces: blocks, pages, paragraphs, rows or slides
+    
+    Concatenating the pieces gives the full text; types without a streaming
+    extractor come back as one piece from ``extract_text``. Office documents
+    are parsed whole in an extraction worker and PDFs page range by page
+    range across the workers, all cancellable by ``job_key``.
+    """
+    if file_type in ('text', 'code', 'data'):
+        return iter_text_file(file_path)
+    elif file_type == 'pdf':
+        return iter_pdf_pages(file_path, job_key)
+    elif _in_pool(file_path, file_type):
+        return _iter_pooled(file_path, file_type, job_key)
+    elif file_type == 'document':
+        return iter_document_paragraphs(file_path)
+    elif file_type == 'spreadsheet':
+        return iter_spreadsheet_rows(file_path)
+    elif file_type == 'presentation':
+        return iter_presentation_slides(file_path)
+    return iter([extract_text(file_path, file_type, job_key)])
+
+def extract_pieces(file_path: str, file_type: str) -> List[str]:
+    """``iter_extracted_text`` as a list, the unit of work of an extraction worker"""
+    return list(iter_extracted_text(file_path, file_type))
+
+def _iter_pooled(file_path: str, file_type: str, job_key: Optional[str] = None) -> Iterator[str]:
+    yield from extraction_pool.run(extract_pieces, file_path, file_type, key=job_key)
+
 def extract_text_file(file_path: str) -> str:
     """Extract text from plain text files"""
     try:
@@ -124,21 +195,67 @@ def extract_text_file(file_path: str) -> str:
     except Exception as e:
         return f"Error reading text file: {str(e)}"
 
-def extract_pdf_text(file_path: str) -> str:
-    """Extract text from PDF files"""
+def _text_encoding(file_path: str) -> str:
+    """utf-8 if the whole file decodes as such, else latin-1; reads in blocks"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(TEXT_BLOCK_CHARS), b''):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def iter_text_file(file_path: str) -> Iterator[str]:
+    """Yield a plain text file in blocks of TEXT_BLOCK_CHARS characters"""
+    with open(file_path, 'r', encoding=_text_encoding(file_path)) as f:
+        for block in iter(lambda: f.read(TEXT_BLOCK_CHARS), ''):
+            yield block
+
+def pdf_page_count(file_path: str) -> int:
+    with open(file_path, 'rb') as file:
+        return len(PdfReader(file).pages)
+
+def _iter_pdf_page_range(file_path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    with open(file_path, 'rb') as file:
+        pdf_reader = PdfReader(file)
+        for page in pdf_reader.pages[start:stop]:
+            try:
+                yield page.extract_text() + "\n"
+            except Exception as e:
+                yield f"[Error extracting page: {str(e)}]\n"
+
+def pdf_page_texts(file_path: str, start: int, stop: int) -> List[str]:
+    """Text of pages ``start`` to ``stop`` of a PDF, one entry per page"""
+    return list(_iter_pdf_page_range(file_path, start, stop))
+
+def iter_pdf_pages(file_path: str, job_key: Optional[str] = None) -> Iterator[str]:
+    """Yield the text of a PDF one page at a time
+    
+    With the extraction pool enabled, runs of PDF_PAGES_PER_TASK pages are
+    parsed in parallel by the workers and yielded back in page order, all
+    under one per-file deadline and cancellable by ``job_key``.
+    """
     if not PyPDF2:
-        return "PyPDF2 not installed - PDF text extraction not available"
+        yield "PyPDF2 not installed - PDF text extraction not available"
+        return
+    
+    if not extraction_pool.enabled:
+        yield from _iter_pdf_page_range(file_path)
+        return
     
+    deadline = extraction_pool.deadline()
+    pages = extraction_pool.run(pdf_page_count, file_path, key=job_key, deadline=deadline)
+    ranges = [(file_path, start, min(start + PDF_PAGES_PER_TASK, pages))
+              for start in range(0, pages, PDF_PAGES_PER_TASK)]
+    for texts in extraction_pool.imap(pdf_page_texts, ranges, key=job_key, deadline=deadline):
+        yield from texts
+
+def extract_pdf_text(file_path: str, job_key: Optional[str] = None) -> str:
+    """Extract text from PDF files"""
     try:
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PdfReader(file)
-            for page in pdf_reader.pages:
-                try:
-                    text += page.extract_text() + "\n"
-                except Exception as e:
-                    text += f"[Error extracting page: {str(e)}]\n"
-        return text.strip()
+        return "".join(iter_pdf_pages(file_path, job_key)).strip()
     except Exception as e:
         return f"Error extracting PDF text: {str(e)}"
 
@@ -162,6 +279,64 @@ def extract_document_text(file_path: str) -> str:
     else:
         return f"Document format '{extension}' not supported"
 
+def iter_document_paragraphs(file_path: str) -> Iterator[str]:
+    """Yield the paragraphs of a Word document"""
+    if Path(file_path).suffix.lower() != '.docx' or not DocxDocument:
+        yield extract_document_text(file_path)
+        return
+    
+    for paragraph in DocxDocument(file_path).paragraphs:
+        yield paragraph.text + "\n"
+
+def _row_text(columns: List[str], values: Iterable[Any]) -> str:
+    cells = [f"{column}: {value}" for column, value in zip(columns, values)
+             if value is not None and value == value and str(value) != '']
+    return ", ".join(cells) + "\n" if cells else ""
+
+def iter_spreadsheet_rows(file_path: str) -> Iterator[str]:
+    """Yield every row of a spreadsheet as a "column: value" line
+    
+    CSV files are read in chunks of rows and Excel workbooks in openpyxl's
+    read-only mode, so no sheet is ever loaded whole.
+    """
+    extension = Path(file_path).suffix.lower()
+    
+    if extension == '.xlsx' and openpyxl:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                rows = sheet.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    continue
+                columns = [str(value) if value is not None else f"column_{i + 1}" for i, value in enumerate(header)]
+                yield f"Sheet {sheet.title}\nColumns: {', '.join(columns)}\n\n"
+                for values in rows:
+                    yield _row_text(columns, values)
+        finally:
+            workbook.close()
+        return
+    
+    if not pd:
+        yield "pandas not installed - Spreadsheet text extraction not available"
+        return
+    
+    if extension == '.csv':
+        frames = pd.read_csv(file_path, chunksize=1000)
+    elif extension in ['.xls', '.xlsx']:
+        frames = [pd.read_excel(file_path)]
+    else:
+        yield f"Spreadsheet format '{extension}' not supported"
+        return
+    
+    columns = None
+    for frame in frames:
+        if columns is None:
+            columns = [str(column) for column in frame.columns]
+            yield f"Columns: {', '.join(columns)}\n\n"
+        for values in frame.itertuples(index=False, name=None):
+            yield _row_text(columns, values)
+
 def extract_spreadsheet_text(file_path: str) -> str:
     """Extract text from spreadsheet files"""
     if not pd:
@@ -191,6 +366,12 @@ def extract_spreadsheet_text(file_path: str) -> str:
     except Exception as e:
         return f"Error extracting spreadsheet text: {str(e)}"
 
+def extract_table_text(file_path: str) -> str:
+    """A whole spreadsheet rendered as one plain-text table"""
+    if Path(file_path).suffix.lower() == '.csv':
+        return pd.read_csv(file_path).to_string()
+    return pd.read_excel(file_path).to_string()
+
 def extract_presentation_text(file_path: str) -> str:
     """Extract text from presentation files"""
     if not Presentation:
@@ -200,17 +381,7 @@ def extract_presentation_text(file_path: str) -> str:
     
     if extension == '.pptx':
         try:
-            prs = Presentation(file_path)
-            text = ""
-            
-            for slide_num, slide in enumerate(prs.slides, 1):
-                text += f"Slide {slide_num}:\n"
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-                text += "\n"
-            
-            return text.strip()
+            return "".join(iter_presentation_slides(file_path)).strip()
             
         except Exception as e:
             return f"Error extracting presentation text: {str(e)}"
@@ -218,6 +389,19 @@ def extract_presentation_text(file_path: str) -> str:
     else:
         return f"Presentation format '{extension}' not supported"
 
+def iter_presentation_slides(file_path: str) -> Iterator[str]:
+    """Yield the text of a presentation one slide at a time"""
+    if Path(file_path).suffix.lower() != '.pptx' or not Presentation:
+        yield extract_presentation_text(file_path)
+        return
+    
+    for slide_num, slide in enumerate(Presentation(file_path).slides, 1):
+        text = f"Slide {slide_num}:\n"
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                text += shape.text + "\n"
+        yield text + "\n"
+
 def extract_image_metadata(file_path: str) -> str:
     """Extract metadata from image files"""
     if not Image:
@@ -274,9 +458,163 @@ def extract_video_metadata(file_path: str) -> str:
     except Exception as e:
         return f"Error extracting video metadata: {str(e)}"
 
+def _batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _report_progress(file_record, status: str, message: str = "") -> None:
+    if WebSocketService is None:
+        return
+    WebSocketService().emit_file_processing_status(file_record.user_id, file_record.id, status, message)
+
+def iter_cached_text(file_path: str, file_type: str, content_hash: str,
+                     job_key: Optional[str] = None) -> Iterator[str]:
+    """Text pieces of a file, from the artifact cache when its content was extracted before
+    
+    Otherwise the extracted pieces are saved to the cache as they stream
+    past. Plain text needs no extraction and is always read from the file.
+    """
+    if file_type in ('text', 'code', 'data'):
+        yield from iter_text_file(file_path)
+        return
+    
+    cached = artifact_cache.text_path(content_hash)
+    if cached:
+        yield from iter_text_file(cached)
+        return
+    
+    writer = artifact_cache.text_writer(content_hash)
+    try:
+        for piece in iter_extracted_text(file_path, file_type, job_key):
+            writer.write(piece)
+            yield piece
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit()
+
+def stream_into_knowledge_base(file_record, kb, file_type: str,
+                               batch_size: int = INGEST_BATCH_CHUNKS) -> Dict[str, Any]:
+    """Extract, chunk, embed and store a file as one bounded-memory pipeline
+    
+    Pieces stream from the extractor into the token chunker; every
+    ``batch_size`` chunks are embedded on a worker thread while the next
+    batch is being extracted, then inserted and committed, so early chunks
+    are searchable before the file is finished. At most two batches are
+    held at a time whatever the file size.
+    
+    Text, chunks and embeddings are cached per content hash, chunker
+    settings and embedding model, so a file whose content was already
+    ingested with the same settings (say, by another user) is copied from
+    the cache without extraction or embedding requests.
+    """
+    from models import FileChunk
+    from app import db
+    
+    model = kb.embedding_model
+    dimensions = embedding_dimension(kb.settings, model)
+    counts = {'chunks_created': 0, 'text_length': 0, 'deduplicated': False}
+    
+    tokenizer = get_tokenizer(model)
+    content_hash = blob_store.content_hash(file_record.file_path)
+    chunker_key = artifact_key(chunker=CHUNKER_VERSION, tokenizer=tokenizer.name,
+                               chunk_size=kb.chunk_size, overlap=kb.chunk_overlap)
+    model_key = artifact_key(model=cache_model(model, dimensions))
+    
+    def pieces():
+        for piece in iter_cached_text(file_record.file_path, file_type, content_hash, str(file_record.id)):
+            counts['text_length'] += len(piece)
+            yield piece
+    
+    def store(first_index: int, batch: List[Chunk], embeddings: List[List[float]]) -> None:
+        import numpy as np
+        chunks = []
+        for i, (chunk, embedding) in enumerate(zip(batch, embeddings), first_index):
+            chunks.append(FileChunk(
+                file_id=file_record.id,
+                knowledge_base_id=kb.id,
+                chunk_index=i,
+                content=chunk.text,
+                # Convert embedding to bytes for storage
+                embedding=np.array(embedding, dtype=np.float32).tobytes(),
+                embedding_model=model,
+                metadata={
+                    'file_name': file_record.original_filename,
+                    'file_type': file_type,
+                    'chunk_size': len(chunk.text),
+                    'chunk_tokens': chunk.tokens,
+                    # Character span of the chunk in the extracted text, for citations
+                    'start': chunk.start,
+                    'end': chunk.end,
+                    **dimension_metadata(len(embedding), model)
+                }
+            ))
+        db.session.add_all(chunks)
+        db.session.commit()
+        counts['chunks_created'] += len(chunks)
+        _report_progress(file_record, 'processing',
+                         f"Indexed {counts['chunks_created']} chunks ({counts['text_length']} characters read)")
+    
+    # Reprocessing replaces the file's earlier chunks in this knowledge base
+    FileChunk.query.filter_by(file_id=file_record.id, knowledge_base_id=kb.id).delete()
+    db.session.commit()
+    
+    manifest = artifact_cache.embedding_manifest(content_hash, chunker_key, model_key)
+    if manifest is not None:
+        counts['text_length'] = manifest.get('text_length', 0)
+        counts['deduplicated'] = True
+        next_index = 0
+        for batch, embeddings in artifact_cache.iter_embedded_chunks(content_hash, chunker_key, model_key, batch_size):
+            store(next_index, [Chunk(*record) for record in batch], embeddings)
+            next_index += len(batch)
+        return counts
+    
+    chunk_manifest = artifact_cache.chunk_manifest(content_hash, chunker_key)
+    if chunk_manifest is not None:
+        counts['text_length'] = chunk_manifest.get('text_length', 0)
+        chunks = (Chunk(*record) for record in artifact_cache.iter_chunks(content_hash, chunker_key))
+    else:
+        chunks = iter_chunk_spans(pieces(), kb.chunk_size, kb.chunk_overlap, tokenizer)
+    
+    writer = artifact_cache.writer(content_hash, chunker_key, model_key)
+    
+    def store_and_cache(first_index: int, batch: List[Chunk], embeddings: List[List[float]]) -> None:
+        store(first_index, batch, embeddings)
+        writer.append(batch, embeddings)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = None
+            next_index = 0
+            for batch in _batches(chunks, batch_size):
+                future = executor.submit(embed_texts, [chunk.text for chunk in batch], model, None, dimensions)
+                if pending is not None:
+                    store_and_cache(pending[0], pending[1], pending[2].result())
+                pending = (next_index, batch, future)
+                next_index += len(batch)
+            if pending is not None:
+                store_and_cache(pending[0], pending[1], pending[2].result())
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit(text_length=counts['text_length'])
+    
+    return counts
+
 def process_file(file_id: str) -> Dict[str, Any]:
-    """Process file and return processing results"""
-    from models import File, FileChunk, KnowledgeBase
+    """Process file and return processing results
+    
+    Files in a knowledge base are streamed through
+    ``stream_into_knowledge_base`` and their full text is never held in
+    memory, so their result has ``text_length`` but no ``text_content``.
+    """
+    from models import File, KnowledgeBase
     from app import db
     
     try:
@@ -288,67 +626,39 @@ def process_file(file_id: str) -> Dict[str, Any]:
         # Update status
         file_record.processing_status = 'processing'
         db.session.commit()
+        _report_progress(file_record, 'processing', 'Extracting text')
         
         # Determine file type
         file_type = get_file_type(file_record.file_path)
         
-        # Extract text content
-        text_content = extract_text(file_record.file_path, file_type)
-        
         result = {
             'success': True,
             'file_type': file_type,
-            'text_content': text_content,
             'chunks_created': 0
         }
         
-        # If file belongs to a knowledge base, create chunks
-        if file_record.knowledge_base_id and text_content:
-            kb = KnowledgeBase.query.get(file_record.knowledge_base_id)
-            if kb:
-                chunks = chunk_text(text_content, kb.chunk_size, kb.chunk_overlap)
-                
-                # Create file chunks with embeddings
-                for i, chunk_content in enumerate(chunks):
-                    try:
-                        # Generate embedding
-                        embedding = get_embedding(chunk_content, kb.embedding_model)
-                        
-                        # Convert embedding to bytes for storage
-                        import numpy as np
-                        embedding_bytes = np.array(embedding, dtype=np.float32).tobytes()
-                        
-                        chunk = FileChunk(
-                            file_id=file_record.id,
-                            knowledge_base_id=kb.id,
-                            chunk_index=i,
-                            content=chunk_content,
-                            embedding=embedding_bytes,
-                            embedding_model=kb.embedding_model,
-                            metadata={
-                                'file_name': file_record.original_filename,
-                                'file_type': file_type,
-                                'chunk_size': len(chunk_content)
-                            }
-                        )
-                        db.session.add(chunk)
-                        
-                    except Exception as e:
-                        logging.error(f"Error creating chunk {i}: {e}")
-                        continue
-                
-                result['chunks_created'] = len(chunks)
+        kb = KnowledgeBase.query.get(file_record.knowledge_base_id) if file_record.knowledge_base_id else None
+        if kb:
+            result.update(stream_into_knowledge_base(file_record, kb, file_type))
+        else:
+            # Extract text content, or reuse it from an earlier upload of the same content
+            content_hash = blob_store.content_hash(file_record.file_path)
+            result['text_content'] = "".join(iter_cached_text(file_record.file_path, file_type, content_hash,
+                                                                str(file_record.id)))
+            result['text_length'] = len(result['text_content'])
         
         # Update file record
         file_record.processing_status = 'completed'
         file_record.is_processed = True
         file_record.metadata = {
             'file_type': file_type,
-            'text_length': len(text_content),
-            'chunks_created': result['chunks_created']
+            'text_length': result['text_length'],
+            'chunks_created': result['chunks_created'],
+            'deduplicated': result.get('deduplicated', False)
         }
         
         db.session.commit()
+        _report_progress(file_record, 'completed', f"Indexed {result['chunks_created']} chunks")
         
         return result
         
@@ -357,55 +667,33 @@ def process_file(file_id: str) -> Dict[str, Any]:
         
         # Update file status to failed
         try:
+            db.session.rollback()
             file_record = File.query.get(file_id)
             if file_record:
                 file_record.processing_status = 'failed'
                 db.session.commit()
+                _report_progress(file_record, 'failed', str(e))
         except:
             pass
         
         return {'success': False, 'error': str(e)}
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-    """Split text into overlapping chunks"""
+def iter_chunks(pieces: Iterable[str], chunk_size: int = DEFAULT_CHUNK_TOKENS,
+                overlap: int = DEFAULT_OVERLAP_TOKENS, model: Optional[str] = None) -> Iterator[str]:
+    """Split a stream of text pieces into chunks of ``chunk_size`` tokens overlapping by ``overlap``
+    
+    Thin wrapper over ``utils.chunker.iter_chunk_spans`` for callers that
+    only need the text; use that directly to keep the character offsets.
+    """
+    for chunk in iter_chunk_spans(pieces, chunk_size, overlap, get_tokenizer(model)):
+        yield chunk.text
+
+def chunk_text(text: str, chunk_size: int = DEFAULT_CHUNK_TOKENS, overlap: int = DEFAULT_OVERLAP_TOKENS,
+               model: Optional[str] = None) -> List[str]:
+    """Split text into overlapping chunks of ``chunk_size`` tokens"""
     if not text:
         return []
-    
-    chunks = []
-    start = 0
-    
-    while start < len(text):
-        end = start + chunk_size
-        
-        # If this isn't the last chunk, try to break at a sentence or word boundary
-        if end < len(text):
-            # Look for sentence boundary (period, exclamation, question mark)
-            sentence_end = max(
-                text.rfind('.', start, end),
-                text.rfind('!', start, end),
-                text.rfind('?', start, end)
-            )
-            
-            if sentence_end > start + chunk_size // 2:
-                end = sentence_end + 1
-            else:
-                # Look for word boundary (space)
-                word_end = text.rfind(' ', start, end)
-                if word_end > start + chunk_size // 2:
-                    end = word_end
-        
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        
-        # Move start position with overlap
-        start = end - overlap
-        
-        # Ensure we don't get stuck in infinite loop
-        if start >= len(text):
-            break
-    
-    return chunks
+    return list(iter_chunks([text], chunk_size, overlap, model))
 
 def generate_embeddings(text: str, model: str = 'text-embedding-3-small') -> List[float]:
     """Generate embeddings for text"""
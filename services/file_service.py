@@ -5,6 +5,8 @@ from werkzeug.datastructures import FileStorage
 from models import File, KnowledgeBase, User
 from app import db
 from utils.file_processor import file_processor
+from utils.blob_store import blob_store
+from utils.knowledge_base_index import knowledge_base_ids_for_file, unindex_files
 
 class FileService:
     def __init__(self):
@@ -54,7 +56,8 @@ class FileService:
             # Process file
             result = self.file_processor.process_file_for_rag(
                 file_record.file_path,
-                file_record.file_type
+                file_record.file_type,
+                str(file_record.id)
             )
             
             if 'error' in result:
@@ -99,12 +102,13 @@ class FileService:
                 raise ValueError("File not found")
             
             # Delete physical file
-            if os.path.exists(file_record.file_path):
-                os.remove(file_record.file_path)
+            blob_store.discard(file_record.id, file_record.file_path)
             
-            # Delete database record
+            # Delete database record (cascades to embeddings)
+            kb_ids = knowledge_base_ids_for_file(file_record.id)
             db.session.delete(file_record)
             db.session.commit()
+            unindex_files(kb_ids, [file_record.id])
             
             return True
         except Exception as e:
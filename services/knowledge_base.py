@@ -1,20 +1,41 @@
+import os
 import json
+import heapq
 import logging
-from typing import List, Dict, Any, Optional
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
+from flask import current_app
 from sqlalchemy import and_, or_
 
 from app import db
 from models import KnowledgeBase, File, FileEmbedding, User
 from services.ai_service import AIService
 from services.file_service import FileService
+from utils.vector_codec import decode_embedding
+from utils.vector_cache import KnowledgeBaseMatrix, normalize_rows
+from utils.vector_store import VectorStore
+from utils.knn_graph import KNN_GRAPH_K, knn_graphs
+from utils.knowledge_base_index import drop_knowledge_base, knowledge_base_rows
+from utils.embedding_dimensions import shorten
 
 logger = logging.getLogger(__name__)
 
+FEDERATED_SEARCH_WORKERS = int(os.environ.get('FEDERATED_SEARCH_WORKERS', '8'))
+
 class KnowledgeBaseService:
     def __init__(self):
         self.ai_service = AIService()
         self.file_service = FileService()
+        self._vector_store = None
+    
+    @property
+    def vector_store(self) -> VectorStore:
+        """VectorStore whose get_knowledge_base_matrix loads and caches every knowledge base matrix"""
+        if self._vector_store is None:
+            self._vector_store = VectorStore()
+        return self._vector_store
     
     def create_knowledge_base(self, name: str, description: str, user_id: int) -> KnowledgeBase:
         """Create a new knowledge base"""
@@ -93,7 +114,7 @@ class KnowledgeBaseService:
             results = []
             for embedding in embeddings:
                 try:
-                    stored_embedding = json.loads(embedding.embedding)
+                    stored_embedding = decode_embedding(embedding)
                     similarity = self.file_service.calculate_cosine_similarity(query_embedding, stored_embedding)
                     
                     results.append({
@@ -209,6 +230,7 @@ class KnowledgeBaseService:
             
             db.session.delete(kb)
             db.session.commit()
+            drop_knowledge_base(kb_id)
             
             logger.info(f"Deleted knowledge base {kb.name}")
             return True
@@ -242,62 +264,133 @@ class KnowledgeBaseService:
             return []
     
     def search_across_knowledge_bases(self, query: str, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-        """Search across all knowledge bases for a user"""
+        """Search across all knowledge bases for a user
+
+        The query is embedded once and every knowledge base is searched
+        concurrently against its cached vector matrix (a dense, quantized or
+        segment-backed one, all loaded through VectorStore). Each one contributes
+        its own top ``limit`` hits, and a heap bounded to ``limit`` keeps the
+        exact global top-k however the hits are spread across knowledge bases.
+        """
         try:
             user_kbs = KnowledgeBase.query.filter_by(user_id=user_id).all()
+            if not user_kbs or limit <= 0:
+                return []
+            kbs_by_id = {kb.id: kb for kb in user_kbs}
+            
+            query_embedding = self.ai_service.get_embedding(query)
+            vector_store = self.vector_store
+            app = current_app._get_current_object()
+            
+            def search_one(kb_id):
+                # Runs on a worker thread, which needs its own app context for the database
+                with app.app_context():
+                    matrix = vector_store.get_knowledge_base_matrix(kb_id)
+                if not len(matrix) or matrix.dimension > len(query_embedding):
+                    return kb_id, []
+                # Knowledge bases with a smaller embedding_dimension get the shortened query
+                return kb_id, matrix.search(shorten(query_embedding, matrix.dimension), limit)
+            
+            # Min-heap of (similarity, chunk_id, kb_id); its root is the worst hit kept so far
+            heap = []
+            workers = min(FEDERATED_SEARCH_WORKERS, len(user_kbs))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(search_one, kb_id) for kb_id in kbs_by_id]
+                for future in as_completed(futures):
+                    try:
+                        kb_id, hits = future.result()
+                    except Exception as e:
+                        logger.error(f"Error searching knowledge base: {str(e)}")
+                        continue
+                    for chunk_id, _, similarity in hits:
+                        entry = (similarity, chunk_id, kb_id)
+                        if len(heap) < limit:
+                            heapq.heappush(heap, entry)
+                        elif entry > heap[0]:
+                            heapq.heapreplace(heap, entry)
+                        else:
+                            # Hits arrive best first; the rest of this list can't make it either
+                            break
+            
+            top = sorted(heap, reverse=True)
+            records = FileEmbedding.query.filter(
+                FileEmbedding.id.in_([chunk_id for _, chunk_id, _ in top])
+            ).all()
+            records_by_id = {record.id: record for record in records}
             
-            all_results = []
-            for kb in user_kbs:
-                kb_results = self.query_knowledge_base(kb.id, query, user_id, limit=limit//len(user_kbs) + 1)
-                all_results.extend(kb_results)
-            
-            # Sort all results by similarity
-            all_results.sort(key=lambda x: x['similarity'], reverse=True)
-            return all_results[:limit]
+            results = []
+            for similarity, chunk_id, kb_id in top:
+                record = records_by_id.get(chunk_id)
+                if record is None:
+                    continue
+                results.append({
+                    'file_id': record.file_id,
+                    'chunk_text': record.chunk_text,
+                    'similarity': similarity,
+                    'file': record.file,
+                    'knowledge_base': kbs_by_id[kb_id].name,
+                    'knowledge_base_id': kb_id
+                })
+            return results
             
         except Exception as e:
             logger.error(f"Error searching across knowledge bases: {str(e)}")
             return []
     
+    def _related_by_search(self, kb_id: int, matrix, document_id: int, limit: int) -> List[Tuple[Any, float]]:
+        """Related documents of a knowledge base without a k-NN graph (segment-backed or quantized)
+
+        The document's chunk centroid is searched against the matrix and
+        every other document is ranked by its best matching chunk.
+        """
+        vectors = [
+            vector for vector in (
+                decode_embedding(row) for row in FileEmbedding.query.filter(
+                    knowledge_base_rows(kb_id), FileEmbedding.file_id == document_id
+                )
+            ) if vector is not None
+        ]
+        if not vectors:
+            return []
+        centroid = normalize_rows(np.vstack(vectors)).mean(axis=0)
+        
+        best: Dict[Any, float] = {}
+        for _, file_id, similarity in matrix.search(centroid, limit * KNN_GRAPH_K):
+            if file_id != document_id and similarity > best.get(file_id, -np.inf):
+                best[file_id] = similarity
+        return sorted(best.items(), key=lambda item: -item[1])[:limit]
+    
     def get_related_documents(self, kb_id: int, document_id: int, user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
-        """Get documents related to a specific document"""
+        """Get documents related to a specific document
+
+        Documents are compared by the centroid of their chunk vectors; the
+        nearest ones are precomputed in the knowledge base's k-NN graph.
+        Knowledge bases held as segments or quantized codes have no graph
+        and are searched instead.
+        """
         try:
-            # Get the document's embeddings
+            kb = KnowledgeBase.query.filter_by(id=kb_id, user_id=user_id).first()
             file = File.query.filter_by(id=document_id, user_id=user_id).first()
-            if not file:
+            if not kb or not file:
                 return []
             
-            embeddings = FileEmbedding.query.filter_by(file_id=document_id).all()
-            if not embeddings:
-                return []
+            matrix = self.vector_store.get_knowledge_base_matrix(kb_id)
+            if isinstance(matrix, KnowledgeBaseMatrix):
+                related = knn_graphs.get(kb_id, matrix).related_documents(document_id, limit)
+            else:
+                related = self._related_by_search(kb_id, matrix, document_id, limit)
             
-            # Use the first embedding as reference
-            reference_embedding = json.loads(embeddings[0].embedding)
-            
-            # Find similar documents
-            all_embeddings = FileEmbedding.query.filter(
-                FileEmbedding.file_id != document_id
-            ).all()
-            
-            results = []
-            for embedding in all_embeddings:
-                try:
-                    stored_embedding = json.loads(embedding.embedding)
-                    similarity = self.file_service.calculate_cosine_similarity(reference_embedding, stored_embedding)
-                    
-                    results.append({
-                        'file_id': embedding.file_id,
-                        'chunk_text': embedding.chunk_text,
-                        'similarity': similarity,
-                        'file': embedding.file
-                    })
-                except Exception as e:
-                    logger.error(f"Error calculating similarity: {str(e)}")
-                    continue
-            
-            # Sort by similarity and return top results
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            return results[:limit]
+            files_by_id = {
+                f.id: f for f in File.query.filter(File.id.in_([file_id for file_id, _ in related])).all()
+            }
+            return [
+                {
+                    'file_id': file_id,
+                    'similarity': similarity,
+                    'file': files_by_id[file_id]
+                }
+                for file_id, similarity in related if file_id in files_by_id
+            ]
             
         except Exception as e:
             logger.error(f"Error getting related documents: {str(e)}")
@@ -4,10 +4,12 @@ from typing import List, Dict, Any
 from app import db
 from models import KnowledgeBase, KnowledgeBaseFile, File, FileChunk
 import logging
+from utils.embedding_dimensions import DEFAULT_EMBEDDING_DIMENSION
+from utils.chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS
 
 class KnowledgeService:
     def __init__(self):
-        self.embedding_dimension = 1536  # OpenAI embedding dimension
+        self.embedding_dimension = DEFAULT_EMBEDDING_DIMENSION
     
     def create_knowledge_base(self, name: str, description: str, user_id: int) -> Dict[str, Any]:
         """Create a new knowledge base"""
@@ -18,8 +20,14 @@ class KnowledgeService:
                 description=description,
                 settings=json.dumps({
                     'embedding_model': 'text-embedding-3-small',
-                    'chunk_size': 1000,
-                    'chunk_overlap': 200
+                    # None keeps full-size vectors; text-embedding-3 models can be shortened to e.g. 256 or 512
+                    'embedding_dimension': None,
+                    # Chunk sizes are counted in tokens of the embedding model
+                    'chunk_size': DEFAULT_CHUNK_TOKENS,
+                    'chunk_overlap': DEFAULT_OVERLAP_TOKENS,
+                    'hybrid_fusion': 'rrf',
+                    'semantic_weight': 0.7,
+                    'keyword_weight': 0.3
                 })
             )
             
@@ -2,6 +2,9 @@ import os
 import logging
 from openai import OpenAI
 
+from utils.embedding_cache import embedding_cache
+from utils.embedding_dimensions import cache_model, shorten_all, supports_dimensions
+
 class OpenAIService:
     def __init__(self):
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
@@ -63,20 +66,32 @@ class OpenAIService:
             logging.error(f"Whisper API error: {str(e)}")
             raise e
     
-    def create_embedding(self, text, model="text-embedding-3-small"):
+    def create_embedding(self, text, model="text-embedding-3-small", dimensions=None):
         """Create embeddings for text"""
+        return self.create_embeddings([text], model, dimensions)[0]
+    
+    def create_embeddings(self, texts, model="text-embedding-3-small", dimensions=None):
+        """Create embeddings for several texts, requesting only those not cached"""
         try:
-            response = self.client.embeddings.create(
-                model=model,
-                input=text
+            return embedding_cache.get_or_compute(
+                texts, cache_model(model, dimensions), lambda missing: self.request_embeddings(missing, model, dimensions)
             )
             
-            return response.data[0].embedding
-            
         except Exception as e:
             logging.error(f"Embedding API error: {str(e)}")
             raise e
     
+    def request_embeddings(self, texts, model="text-embedding-3-small", dimensions=None):
+        """Embed texts in one API request, bypassing the cache"""
+        options = {'dimensions': dimensions} if dimensions and supports_dimensions(model) else {}
+        response = self.client.embeddings.create(
+            model=model,
+            input=list(texts),
+            **options
+        )
+        embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        return embeddings if options else shorten_all(embeddings, dimensions)
+    
     def fine_tune_model(self, training_file_id, model="gpt-3.5-turbo"):
         """Create a fine-tuning job"""
         try:
@@ -4,12 +4,26 @@ import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
 from flask import current_app
 from app import db
-from models import File, FileEmbedding, KnowledgeBase, KnowledgeBaseFile
+from models import File, FileEmbedding, KnowledgeBase
 from .embeddings import EmbeddingService
 from .openai_service import OpenAIService
 from .anthropic_service import AnthropicService
+from utils.vector_codec import decode_embedding
+from utils.keyword_backend import get_keyword_backend
+from utils.vector_cache import normalize_rows, top_k_indices
+from utils.hybrid_search import hybrid_settings, merge_candidates, rank_candidates
+from utils.embedding_dimensions import (
+    EmbeddingDimensionError, check_uniform_dimensions, embedding_dimension, shorten
+)
+from utils.context_packer import ContextPacker, PackedContext
+from utils.reranker import get_reranker
+from utils.multi_hop import CandidateMatrix, MultiHopPlanner
+from utils.tokenizer import get_tokenizer
 from sqlalchemy import text
 
+RAG_SYSTEM_PROMPT = ("You are a helpful AI assistant. Use the provided context to answer questions accurately. "
+                     "Always cite your sources using [Source: filename] format.")
+
 class RAGService:
     def __init__(self):
         """Initialize RAG service with advanced capabilities"""
@@ -20,9 +34,11 @@ class RAGService:
         # Advanced RAG parameters
         self.chunk_size = 1000
         self.chunk_overlap = 200
+        # Most tokens of retrieved context put in one prompt
         self.max_context_length = 8000
         self.similarity_threshold = 0.7
         self.reranking_enabled = True
+        self.reranker = get_reranker()
         self.query_expansion_enabled = True
         self.multi_hop_enabled = True
 
@@ -48,38 +64,15 @@ class RAGService:
             else:
                 expanded_queries = [query]
             
-            all_results = []
+            # Load the candidate rows once; every query and hop is scored against them in memory
+            rows = db.session.execute(self._build_search_query(user_id, knowledge_base_id)).fetchall()
+            matrix = CandidateMatrix(rows)
+            query_embeddings = dict(zip(expanded_queries, self.embedding_service.get_embeddings(expanded_queries)))
             
-            # Search with expanded queries
+            all_results = []
             for expanded_query in expanded_queries:
-                # Get query embedding
-                query_embedding = self.embedding_service.get_embedding(expanded_query)
-                
-                # Build search query
-                search_query = self._build_search_query(user_id, knowledge_base_id)
-                
-                # Execute vector search
-                results = db.session.execute(search_query).fetchall()
-                
-                # Calculate similarities
-                candidates = []
-                for result in results:
-                    embedding_vector = json.loads(result.embedding_vector)
-                    similarity = self.embedding_service.compute_similarity(
-                        query_embedding, embedding_vector
-                    )
-                    
-                    if similarity >= self.similarity_threshold:
-                        candidates.append({
-                            'file_id': result.file_id,
-                            'filename': result.filename,
-                            'chunk_text': result.chunk_text,
-                            'chunk_index': result.chunk_index,
-                            'similarity': similarity,
-                            'query': expanded_query
-                        })
-                
-                all_results.extend(candidates)
+                all_results.extend(matrix.search(expanded_query, query_embeddings[expanded_query],
+                                                 self.similarity_threshold))
             
             # Remove duplicates and sort by similarity
             unique_results = self._deduplicate_results(all_results)
@@ -89,9 +82,9 @@ class RAGService:
             if rerank and self.reranking_enabled:
                 unique_results = self._rerank_results(query, unique_results)
             
-            # Multi-hop reasoning if enabled
-            if self.multi_hop_enabled and len(unique_results) > 0:
-                unique_results = self._apply_multi_hop_reasoning(query, unique_results)
+            # Multi-hop reasoning if enabled, only to fill slots the first stage left empty
+            if self.multi_hop_enabled and 0 < len(unique_results) < top_k:
+                unique_results = self._apply_multi_hop_reasoning(query, unique_results, matrix, query_embeddings)
             
             return unique_results[:top_k]
             
@@ -113,33 +106,34 @@ class RAGService:
             Generated answer with citations
         """
         try:
-            # Prepare context
-            context = self._prepare_context(context_chunks)
+            # Prepare context within the model's token budget
+            packed = self._prepare_context(context_chunks, query, model)
             
             # Create RAG prompt
-            prompt = self._create_rag_prompt(query, context)
+            prompt = self._create_rag_prompt(query, packed.context)
             
             # Generate answer
             if model.startswith('gpt-'):
                 answer = self.openai_service.chat_completion([
-                    {"role": "system", "content": "You are a helpful AI assistant. Use the provided context to answer questions accurately. Always cite your sources using [Source: filename] format."},
+                    {"role": "system", "content": RAG_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ], model=model)
             elif model.startswith('claude-'):
                 answer = self.anthropic_service.chat_completion([
-                    {"role": "system", "content": "You are a helpful AI assistant. Use the provided context to answer questions accurately. Always cite your sources using [Source: filename] format."},
+                    {"role": "system", "content": RAG_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ], model=model)
             else:
                 raise ValueError(f"Unsupported model: {model}")
             
             # Extract citations
-            citations = self._extract_citations(answer, context_chunks)
+            citations = self._extract_citations(answer, packed.chunks)
             
             return {
                 'answer': answer,
                 'citations': citations,
-                'context_used': len(context_chunks),
+                'context_used': len(packed.chunks),
+                'token_usage': packed.token_counts,
                 'model': model
             }
             
@@ -153,34 +147,106 @@ class RAGService:
             }
 
     def hybrid_search(self, query: str, user_id: int, knowledge_base_id: Optional[int] = None,
-                     alpha: float = 0.7, top_k: int = 5) -> List[Dict[str, Any]]:
+                     alpha: Optional[float] = None, top_k: int = 5) -> List[Dict[str, Any]]:
         """
         Hybrid search combining vector and keyword search
         
+        Chunk rows are loaded once; dense scores come from one matrix product
+        over them and keyword scores from the database's full-text index.
+        The two are fused with the knowledge base's fusion settings.
+        
         Args:
             query: Search query
             user_id: User ID
             knowledge_base_id: Optional knowledge base filter
-            alpha: Weight for vector search (1-alpha for keyword search)
+            alpha: Weight for vector search (1-alpha for keyword search);
+                defaults to the knowledge base's settings
             top_k: Number of results to return
             
         Returns:
             Hybrid search results
         """
         try:
-            # Vector search results
-            vector_results = self.search(query, user_id, knowledge_base_id, top_k * 2, rerank=False)
+            kb_settings = None
+            if knowledge_base_id:
+                knowledge_base = KnowledgeBase.query.get(knowledge_base_id)
+                kb_settings = knowledge_base.settings if knowledge_base else None
+            settings = hybrid_settings(
+                kb_settings,
+                semantic_weight=alpha,
+                keyword_weight=None if alpha is None else 1 - alpha
+            )
             
-            # Keyword search results
-            keyword_results = self._keyword_search(query, user_id, knowledge_base_id, top_k * 2)
+            rows = db.session.execute(self._build_search_query(user_id, knowledge_base_id)).fetchall()
+            if not rows:
+                return []
+            
+            # Dense scores for every row, one product per stored dimension; undecodable rows stay NaN
+            dense = np.full(len(rows), np.nan, dtype=np.float32)
+            by_dimension: Dict[int, Tuple[List[np.ndarray], List[int]]] = {}
+            for i, row in enumerate(rows):
+                vector = decode_embedding(row)
+                if vector is not None:
+                    vectors, positions = by_dimension.setdefault(len(vector), ([], []))
+                    vectors.append(vector)
+                    positions.append(i)
+            
+            # One knowledge base must be uniform; across a user's knowledge bases sizes may differ
+            if knowledge_base_id:
+                stored = check_uniform_dimensions(
+                    (len(vector) for vectors, _ in by_dimension.values() for vector in vectors),
+                    knowledge_base_id
+                )
+                configured = embedding_dimension(kb_settings)
+                if stored is not None and configured is not None and stored != configured:
+                    raise EmbeddingDimensionError(
+                        f"Knowledge base {knowledge_base_id} is configured for {configured}-dimensional "
+                        f"embeddings but stores {stored}-dimensional ones; re-embed it"
+                    )
             
-            # Combine and rerank
-            hybrid_results = self._combine_search_results(
-                vector_results, keyword_results, alpha
+            full_query = self.embedding_service.get_embedding(query)
+            for dimension, (vectors, positions) in by_dimension.items():
+                if dimension > len(full_query):
+                    continue
+                query_embedding = np.asarray(shorten(full_query, dimension), dtype=np.float32)
+                if np.linalg.norm(query_embedding) > 0:
+                    matrix = normalize_rows(np.vstack(vectors))
+                    dense[positions] = matrix @ (query_embedding / np.linalg.norm(query_embedding))
+            dense[dense < self.similarity_threshold] = np.nan
+            
+            pool = max(top_k * 2, settings['hybrid_candidates'])
+            keyword_results = self._keyword_search(query, user_id, knowledge_base_id, pool)
+            
+            row_of = {row.id: i for i, row in enumerate(rows)}
+            sparse = np.full(len(rows), np.nan, dtype=np.float32)
+            for result in keyword_results:
+                if result['id'] in row_of:
+                    sparse[row_of[result['id']]] = result['similarity']
+            
+            scored_dense = np.nan_to_num(dense, nan=-np.inf)
+            candidates = merge_candidates(
+                [i for i in top_k_indices(scored_dense, pool) if not np.isnan(dense[i])],
+                np.flatnonzero(~np.isnan(sparse)).tolist()
             )
             
-            return hybrid_results[:top_k]
+            ranked = rank_candidates(candidates, dense[candidates], sparse[candidates], settings, top_k)
+            
+            return [
+                {
+                    'file_id': rows[i].file_id,
+                    'filename': rows[i].filename,
+                    'chunk_text': rows[i].chunk_text,
+                    'chunk_index': rows[i].chunk_index,
+                    'similarity': dense_score,
+                    'keyword_score': sparse_score,
+                    'combined_score': combined_score,
+                    'search_type': 'hybrid'
+                }
+                for i, combined_score, dense_score, sparse_score in ranked
+            ]
             
+        except EmbeddingDimensionError:
+            raise
         except Exception as e:
             current_app.logger.error(f"Hybrid search failed: {str(e)}")
             return []
@@ -213,66 +279,37 @@ Return only the variations, one per line."""
     def _build_search_query(self, user_id: int, knowledge_base_id: Optional[int] = None):
         """Build SQL query for vector search"""
         base_query = """
-        SELECT fe.file_id, f.filename, fe.chunk_text, fe.chunk_index, fe.embedding_vector
-        FROM file_embedding fe
-        JOIN file f ON fe.file_id = f.id
+        SELECT fe.id, fe.file_id, f.filename, fe.chunk_text, fe.chunk_index,
+               fe.embedding_blob, fe.embedding_dim, fe.embedding_dtype, fe.embedding_vector
+        FROM file_embeddings fe
+        JOIN files f ON fe.file_id = f.id
         WHERE f.user_id = :user_id
         """
+        params = {'user_id': user_id}
         
         if knowledge_base_id:
-            base_query += """
-            AND fe.file_id IN (
-                SELECT kbf.file_id FROM knowledge_base_file kbf
-                WHERE kbf.knowledge_base_id = :knowledge_base_id
-            )
-            """
+            base_query += " AND fe.knowledge_base_id = :knowledge_base_id"
+            params['knowledge_base_id'] = knowledge_base_id
         
-        return text(base_query).bindparam(
-            user_id=user_id,
-            knowledge_base_id=knowledge_base_id
-        )
+        return text(base_query).bindparams(**params)
 
     def _keyword_search(self, query: str, user_id: int, knowledge_base_id: Optional[int] = None,
                        top_k: int = 10) -> List[Dict[str, Any]]:
-        """Perform keyword-based search"""
+        """Perform keyword-based search with the database's full-text index"""
         try:
-            # Simple keyword search using SQL LIKE
-            search_query = """
-            SELECT fe.file_id, f.filename, fe.chunk_text, fe.chunk_index,
-                   ts_rank(to_tsvector('english', fe.chunk_text), plainto_tsquery('english', :query)) as rank
-            FROM file_embedding fe
-            JOIN file f ON fe.file_id = f.id
-            WHERE f.user_id = :user_id
-            AND to_tsvector('english', fe.chunk_text) @@ plainto_tsquery('english', :query)
-            """
-            
-            if knowledge_base_id:
-                search_query += """
-                AND fe.file_id IN (
-                    SELECT kbf.file_id FROM knowledge_base_file kbf
-                    WHERE kbf.knowledge_base_id = :knowledge_base_id
-                )
-                """
-            
-            search_query += " ORDER BY rank DESC LIMIT :limit"
-            
-            results = db.session.execute(
-                text(search_query),
-                {
-                    'query': query,
-                    'user_id': user_id,
-                    'knowledge_base_id': knowledge_base_id,
-                    'limit': top_k
-                }
-            ).fetchall()
+            backend = get_keyword_backend(db.engine)
+            results = backend.search(db.session, query, user_id, knowledge_base_id, top_k)
+            # Raw ranks are unbounded; scale to [0, 1] so scores compare across queries
+            top_score = max((result['score'] for result in results), default=0.0)
             
             return [
                 {
-                    'file_id': result.file_id,
-                    'filename': result.filename,
-                    'chunk_text': result.chunk_text,
-                    'chunk_index': result.chunk_index,
-                    'similarity': result.rank,
+                    'id': result['id'],
+                    'file_id': result['file_id'],
+                    'filename': result['filename'],
+                    'chunk_text': result['chunk_text'],
+                    'chunk_index': result['chunk_index'],
+                    'similarity': result['score'] / top_score if top_score > 0 else 0.0,
                     'search_type': 'keyword'
                 }
                 for result in results
@@ -282,67 +319,39 @@ Return only the variations, one per line."""
             current_app.logger.error(f"Keyword search failed: {str(e)}")
             return []
 
-    def _combine_search_results(self, vector_results: List[Dict], keyword_results: List[Dict],
-                               alpha: float) -> List[Dict]:
-        """Combine vector and keyword search results"""
-        combined = {}
-        
-        # Add vector results
-        for result in vector_results:
-            key = (result['file_id'], result['chunk_index'])
-            combined[key] = result.copy()
-            combined[key]['combined_score'] = alpha * result['similarity']
-        
-        # Add keyword results
-        for result in keyword_results:
-            key = (result['file_id'], result['chunk_index'])
-            if key in combined:
-                combined[key]['combined_score'] += (1 - alpha) * result['similarity']
-            else:
-                combined[key] = result.copy()
-                combined[key]['combined_score'] = (1 - alpha) * result['similarity']
-        
-        # Sort by combined score
-        sorted_results = sorted(combined.values(), key=lambda x: x['combined_score'], reverse=True)
-        return sorted_results
-
     def _rerank_results(self, query: str, results: List[Dict]) -> List[Dict]:
-        """Rerank results using cross-encoder or LLM"""
-        try:
-            # Use LLM-based reranking
-            rerank_prompt = f"""Given this query: "{query}"
+        """Rerank results locally (see utils.reranker); first-stage order if over budget"""
+        return self.reranker.rerank(query, results)
 
-Rank the following text chunks from most relevant (1) to least relevant based on how well they answer the query.
-
-Chunks:
-"""
-            
-            for i, result in enumerate(results[:10]):  # Limit to top 10 for reranking
-                rerank_prompt += f"\n{i+1}. {result['chunk_text'][:200]}..."
-            
-            rerank_prompt += "\n\nProvide only the ranking as numbers separated by commas (e.g., 3,1,5,2,4):"
-            
-            ranking_response = self.openai_service.chat_completion([
-                {"role": "user", "content": rerank_prompt}
-            ])
-            
-            # Parse ranking
-            try:
-                ranking = [int(x.strip()) - 1 for x in ranking_response.split(',')]
-                reranked_results = [results[i] for i in ranking if i < len(results)]
-                return reranked_results + results[len(reranked_results):]
-            except:
-                return results
+    def _apply_multi_hop_reasoning(self, query: str, results: List[Dict], matrix: CandidateMatrix,
+                                   query_embeddings: Optional[Dict[str, List[float]]] = None) -> List[Dict]:
+        """Add chunks found by sub-queries, within the planner's depth and fan-out limits
+        
+        Sub-queries are scored against the search's candidate matrix, never
+        through search() itself, so they add no query expansion, reranking
+        or database round trips. The added chunks follow ``results``, best
+        similarity first: first-stage and reranked results always rank above
+        them, as their scores are not comparable.
+        """
+        try:
+            planner = MultiHopPlanner(
+                matrix,
+                plan=self._extract_sub_queries,
+                embed=self.embedding_service.get_embeddings,
+                threshold=self.similarity_threshold,
+                embeddings=dict(query_embeddings or {})
+            )
+            added = planner.run(query, results)[len(results):]
+            added.sort(key=lambda x: x['similarity'], reverse=True)
+            return results + added
             
         except Exception as e:
-            current_app.logger.error(f"Reranking failed: {str(e)}")
+            current_app.logger.error(f"Multi-hop reasoning failed: {str(e)}")
             return results
 
-    def _apply_multi_hop_reasoning(self, query: str, results: List[Dict]) -> List[Dict]:
-        """Apply multi-hop reasoning to enhance results"""
-        try:
-            # Extract key entities and concepts from query
-            entity_prompt = f"""Extract the main entities, concepts, and relationships from this query: "{query}"
+    def _extract_sub_queries(self, query: str) -> List[str]:
+        """Entities and concepts of a query, as sub-queries for the next hop"""
+        entity_prompt = f"""Extract the main entities, concepts, and relationships from this query: "{query}"
 
 Provide:
 1. Key entities (people, places, things)
@@ -351,35 +360,15 @@ Provide:
 
 Format as JSON with keys: entities, concepts, relationships"""
 
-            entities_response = self.openai_service.chat_completion([
-                {"role": "user", "content": entity_prompt}
-            ])
-            
-            # Use entities to find additional relevant chunks
-            try:
-                entities_data = json.loads(entities_response)
-                additional_queries = entities_data.get('entities', []) + entities_data.get('concepts', [])
-                
-                # Search for additional context
-                for additional_query in additional_queries[:3]:  # Limit additional searches
-                    additional_results = self.search(additional_query, 
-                                                   results[0]['file_id'] if results else 0, 
-                                                   None, 3, rerank=False)
-                    
-                    # Add unique results
-                    for add_result in additional_results:
-                        if not any(r['chunk_text'] == add_result['chunk_text'] for r in results):
-                            add_result['multi_hop'] = True
-                            results.append(add_result)
-                
-            except json.JSONDecodeError:
-                pass
-            
-            return results
-            
-        except Exception as e:
-            current_app.logger.error(f"Multi-hop reasoning failed: {str(e)}")
-            return results
+        entities_response = self.openai_service.chat_completion([
+            {"role": "user", "content": entity_prompt}
+        ])
+        
+        try:
+            entities_data = json.loads(entities_response)
+        except json.JSONDecodeError:
+            return []
+        return list(entities_data.get('entities', [])) + list(entities_data.get('concepts', []))
 
     def _deduplicate_results(self, results: List[Dict]) -> List[Dict]:
         """Remove duplicate results"""
@@ -394,14 +383,21 @@ Format as JSON with keys: entities, concepts, relationships"""
         
         return unique_results
 
-    def _prepare_context(self, context_chunks: List[Dict]) -> str:
-        """Prepare context string from chunks"""
-        context_parts = []
+    def _prepare_context(self, context_chunks: List[Dict], query: str = '',
+                         model: str = "gpt-4o") -> PackedContext:
+        """Pack the best chunks that fit the model's prompt budget into a context string
         
-        for i, chunk in enumerate(context_chunks):
-            context_parts.append(f"[Source {i+1}: {chunk['filename']}]\n{chunk['chunk_text']}\n")
-        
-        return "\n".join(context_parts)
+        Near-duplicate chunks are dropped, and the rest of the prompt
+        (system message, instructions and ``query``) is counted against
+        the budget; ``token_counts`` of the result reports the accounting.
+        """
+        packer = ContextPacker(model, max_context_tokens=self.max_context_length)
+        return packer.pack(
+            context_chunks,
+            lambda i, chunk: f"[Source {i+1}: {chunk['filename']}]\n{chunk['chunk_text']}\n",
+            reserved_text=RAG_SYSTEM_PROMPT + self._create_rag_prompt(query, ''),
+            messages=2
+        )
 
     def _create_rag_prompt(self, query: str, context: str) -> str:
         """Create RAG prompt with context"""
@@ -469,7 +465,7 @@ Answer:"""
             # Generate summary
             summary_prompt = f"""Please provide a comprehensive summary of the following document:
 
-{full_text[:self.max_context_length]}
+{get_tokenizer().truncate(full_text, self.max_context_length)}
 
 Include:
 1. Main topics and themes
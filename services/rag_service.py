@@ -5,6 +5,7 @@ from typing import List, Dict, Any
 from app import db
 from models import File, FileChunk, KnowledgeBase, KnowledgeBaseFile
 from services.openai_service import OpenAIService
+from utils.chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, chunk_texts
 import PyPDF2
 import docx
 import numpy as np
@@ -13,8 +14,8 @@ from sklearn.metrics.pairwise import cosine_similarity
 class RAGService:
     def __init__(self):
         self.openai_service = OpenAIService()
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+        self.chunk_size = DEFAULT_CHUNK_TOKENS
+        self.chunk_overlap = DEFAULT_OVERLAP_TOKENS
     
     def process_file(self, file_record: File):
         """Process a file for RAG by creating chunks and embeddings"""
@@ -89,16 +90,8 @@ class RAGService:
             return ""
     
     def _create_chunks(self, text: str) -> List[str]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        words = text.split()
-        
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            chunk_text = ' '.join(chunk_words)
-            chunks.append(chunk_text)
-        
-        return chunks
+        """Split text into overlapping chunks of ``chunk_size`` tokens"""
+        return chunk_texts(text, self.chunk_size, self.chunk_overlap)
     
     def search(self, query: str, user_id: str, knowledge_base_id: str = None, top_k: int = 5) -> List[Dict[str, Any]]:
         """Search for relevant chunks using semantic similarity"""
@@ -1,8 +1,9 @@
 import os
 import logging
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 import json
+import threading
 
 # Vector database implementations
 try:
@@ -21,12 +22,30 @@ except ImportError:
     faiss = None
 
 from services.ai_providers import get_embedding
+from services.batch_embedder import embed_texts
+from utils.vector_segments import open_segment_store
+from utils.vector_wal import LogChanges, WriteAheadLog
+from utils.hnsw import HNSWIndex
+from utils.vector_metadata_index import VectorMetadataIndex
+from utils.embedding_dimensions import (
+    DEFAULT_EMBEDDING_DIMENSION, EmbeddingDimensionError, check_query_dimension, embedding_dimension
+)
 
 class VectorDB:
-    """Abstract vector database interface"""
+    """Abstract vector database interface
+    
+    Every backend mirrors the ids it upserts and deletes into a local
+    VectorMetadataIndex, so enumerating, counting and bulk-deleting the
+    vectors of a knowledge base or file never goes through a similarity
+    query.
+    """
     
     def __init__(self, config: Dict[str, Any]):
         self.config = config
+        self.metadata_index = VectorMetadataIndex(config.get(
+            'metadata_index_path',
+            os.path.join('data', 'vector_metadata', f"{type(self).__name__.lower()}.sqlite")
+        ))
         
     def upsert(self, vectors: List[Dict[str, Any]]) -> bool:
         """Insert or update vectors"""
@@ -40,6 +59,107 @@ class VectorDB:
     def delete(self, ids: List[str]) -> bool:
         """Delete vectors by IDs"""
         raise NotImplementedError
+    
+    def _entries(self) -> Optional[Iterable[Tuple[str, Dict[str, Any]]]]:
+        """Every stored (id, metadata) pair, or None if the backend cannot enumerate"""
+        return None
+    
+    def _entry_count(self) -> Optional[int]:
+        """Number of stored vectors, or None if unknown"""
+        return None
+    
+    def sync_metadata_index(self) -> None:
+        """Rebuild the metadata index if it is missing or out of step with the backend
+        
+        Called once when a backend is opened. Backends that cannot list
+        their contents can only adopt an index while they are still empty.
+        """
+        try:
+            count = self._entry_count()
+            if self.metadata_index.is_built and (count is None or count == self.metadata_index.count()):
+                return
+            entries = self._entries()
+            if entries is not None:
+                self.metadata_index.rebuild(entries)
+            elif count == 0:
+                self.metadata_index.rebuild([])
+            else:
+                logging.warning(f"{type(self).__name__} cannot list its vectors; metadata lookups "
+                                f"fall back to filtered queries")
+        except Exception as e:
+            logging.error(f"Error syncing vector metadata index: {e}")
+    
+    def _index_upserted(self, vectors: List[Dict[str, Any]]) -> None:
+        try:
+            self.metadata_index.upsert((vec['id'], vec.get('metadata', {})) for vec in vectors)
+        except Exception as e:
+            # A partial index would silently miss vectors; fall back until the next rebuild
+            logging.error(f"Error updating vector metadata index: {e}")
+            self.metadata_index.invalidate()
+    
+    def _index_deleted(self, ids: List[str]) -> None:
+        try:
+            self.metadata_index.delete(ids)
+        except Exception as e:
+            logging.error(f"Error updating vector metadata index: {e}")
+            self.metadata_index.invalidate()
+    
+    def _find_ids(self, filter_dict: Dict) -> List[str]:
+        """Ids matching a filter the metadata index cannot answer
+        
+        Backends that can enumerate ids by metadata override this; the
+        fallback finds them with a large filtered query and is capped at
+        10,000 results.
+        """
+        dummy_vector = [0.0] * self.config.get('dimension', DEFAULT_EMBEDDING_DIMENSION)
+        results = self.query(vector=dummy_vector, top_k=10000, filter_dict=filter_dict)
+        return [result['id'] for result in results]
+    
+    def list_ids(self, filter_dict: Optional[Dict] = None) -> List[str]:
+        """Ids of every vector whose metadata matches the filter"""
+        if self.metadata_index.is_built and self.metadata_index.supports(filter_dict):
+            return self.metadata_index.ids(filter_dict)
+        return self._find_ids(filter_dict or {})
+    
+    def count(self, filter_dict: Optional[Dict] = None) -> int:
+        """Number of vectors whose metadata matches the filter"""
+        if self.metadata_index.is_built and self.metadata_index.supports(filter_dict):
+            return self.metadata_index.count(filter_dict)
+        return len(self._find_ids(filter_dict or {}))
+    
+    def file_counts(self, filter_dict: Optional[Dict] = None) -> List[Tuple[Optional[str], Optional[str], int]]:
+        """(file_id, file_name, vector count) per file among the matching vectors"""
+        if self.metadata_index.is_built and self.metadata_index.supports(filter_dict):
+            return self.metadata_index.file_counts(filter_dict)
+        
+        dummy_vector = [0.0] * self.config.get('dimension', DEFAULT_EMBEDDING_DIMENSION)
+        counts: Dict[Any, List[Any]] = {}
+        for result in self.query(vector=dummy_vector, top_k=10000, filter_dict=filter_dict):
+            metadata = result.get('metadata', {})
+            entry = counts.setdefault(metadata.get('file_id'), [metadata.get('file_name'), 0])
+            entry[1] += 1
+        return sorted(((file_id, name, count) for file_id, (name, count) in counts.items()),
+                      key=lambda row: -row[2])
+        
+    def _delete_where(self, filter_dict: Dict) -> bool:
+        """Delete by metadata filter inside the backend; False if it cannot"""
+        return False
+    
+    def delete_by_filter(self, filter_dict: Dict) -> bool:
+        """Delete every vector whose metadata matches the filter
+        
+        Backends that filter deletes themselves do it in one call, which
+        also catches vectors the local metadata index never saw; the others
+        delete the ids the index lists.
+        """
+        if filter_dict and self._delete_where(filter_dict):
+            if self.metadata_index.is_built and self.metadata_index.supports(filter_dict):
+                self._index_deleted(self.metadata_index.ids(filter_dict))
+            else:
+                self.metadata_index.invalidate()
+            return True
+        ids = self.list_ids(filter_dict)
+        return self.delete(ids) if ids else True
 
 class PineconeDB(VectorDB):
     """Pinecone vector database implementation"""
@@ -60,6 +180,10 @@ class PineconeDB(VectorDB):
         
         self.index_name = config.get('index_name', 'autogent-studio')
         self.index = pinecone.Index(self.index_name)
+        self.sync_metadata_index()
+    
+    def _entry_count(self) -> Optional[int]:
+        return self.index.describe_index_stats().get('total_vector_count')
     
     def upsert(self, vectors: List[Dict[str, Any]]) -> bool:
         """Insert or update vectors in Pinecone"""
@@ -73,6 +197,7 @@ class PineconeDB(VectorDB):
                 })
             
             self.index.upsert(vectors=formatted_vectors)
+            self._index_upserted(vectors)
             return True
             
         except Exception as e:
@@ -103,6 +228,28 @@ class PineconeDB(VectorDB):
         except Exception as e:
             logging.error(f"Error querying Pinecone: {e}")
             return []
+    
+    def delete(self, ids: List[str]) -> bool:
+        """Delete vectors from Pinecone"""
+        try:
+            # Pinecone accepts at most 1000 ids per delete
+            for start in range(0, len(ids), 1000):
+                self.index.delete(ids=ids[start:start + 1000])
+            self._index_deleted(ids)
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error deleting from Pinecone: {e}")
+            return False
+    
+    def _delete_where(self, filter_dict: Dict) -> bool:
+        try:
+            self.index.delete(filter=filter_dict)
+            return True
+        except Exception as e:
+            # Serverless indexes only delete by id
+            logging.warning(f"Pinecone cannot delete by filter, deleting by id: {e}")
+            return False
 
 class ChromaDB(VectorDB):
     """ChromaDB vector database implementation"""
@@ -119,6 +266,14 @@ class ChromaDB(VectorDB):
             self.collection = self.client.get_collection(self.collection_name)
         except:
             self.collection = self.client.create_collection(self.collection_name)
+        self.sync_metadata_index()
+    
+    def _entry_count(self) -> Optional[int]:
+        return self.collection.count()
+    
+    def _entries(self) -> Optional[Iterable[Tuple[str, Dict[str, Any]]]]:
+        stored = self.collection.get(include=['metadatas'])
+        return zip(stored['ids'], [meta or {} for meta in stored['metadatas']])
     
     def upsert(self, vectors: List[Dict[str, Any]]) -> bool:
         """Insert or update vectors in ChromaDB"""
@@ -134,6 +289,7 @@ class ChromaDB(VectorDB):
                 metadatas=metadatas,
                 documents=documents
             )
+            self._index_upserted(vectors)
             return True
             
         except Exception as e:
@@ -163,27 +319,202 @@ class ChromaDB(VectorDB):
         except Exception as e:
             logging.error(f"Error querying ChromaDB: {e}")
             return []
+    
+    def delete(self, ids: List[str]) -> bool:
+        """Delete vectors from ChromaDB"""
+        try:
+            self.collection.delete(ids=ids)
+            self._index_deleted(ids)
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error deleting from ChromaDB: {e}")
+            return False
+    
+    def _delete_where(self, filter_dict: Dict) -> bool:
+        # Chroma takes one field per clause; several are combined with $and
+        clauses = [{key: value} for key, value in filter_dict.items()]
+        try:
+            self.collection.delete(where=clauses[0] if len(clauses) == 1 else {'$and': clauses})
+            return True
+        except Exception as e:
+            logging.warning(f"ChromaDB cannot delete by filter, deleting by id: {e}")
+            return False
 
 class FAISSVectorDB(VectorDB):
-    """FAISS vector database implementation for local storage"""
+    """FAISS vector database implementation for local storage
+
+    Vectors live in an ``IndexIDMap2`` under stable int64 ids, so re-upserting
+    an id replaces its vector and ``delete`` removes it. Each knowledge base
+    keeps the set of its ids, and filtered queries search only that set
+    through an ``IDSelectorBatch``, so they return up to ``top_k`` matching
+    results.
+
+    Upserts and deletes are appended to a write-ahead log (utils.vector_wal)
+    instead of rewriting the index. A snapshot of the index and metadata is
+    written once the log holds ``snapshot_ratio`` of the index size (at least
+    ``snapshot_min_records``), which keeps the amortised cost per upsert
+    constant. On startup the latest snapshot is loaded and the log replayed.
+    Processes sharing the files write under the log's file lock and first
+    apply what the others logged, reloading the snapshot if one replaced
+    the log.
+    """
     
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         if not faiss:
             raise ImportError("FAISS not installed")
             
-        self.dimension = config.get('dimension', 1536)
+        self.dimension = config.get('dimension', DEFAULT_EMBEDDING_DIMENSION)
         self.index_path = config.get('index_path', 'faiss_index.bin')
         self.metadata_path = config.get('metadata_path', 'faiss_metadata.json')
+        self.wal_path = config.get('wal_path', self.index_path + '.wal')
+        self.snapshot_min_records = config.get('snapshot_min_records', 10000)
+        self.snapshot_ratio = config.get('snapshot_ratio', 0.5)
+        self._lock = threading.RLock()
         
-        # Initialize or load FAISS index
+        self._load_snapshot()
+        self.wal = WriteAheadLog(self.wal_path, fsync=config.get('fsync', True),
+                                 start_lsn=self.snapshot_lsn)
+        self._replay()
+        self.sync_metadata_index()
+    
+    def _load_snapshot(self) -> None:
+        """Initialize or load FAISS index from the latest snapshot"""
+        self.snapshot_lsn = 0
+        self.next_id = 0
+        index_file = self.index_path
         try:
-            self.index = faiss.read_index(self.index_path)
             with open(self.metadata_path, 'r') as f:
-                self.metadata = json.load(f)
+                snapshot = json.load(f)
+            if 'items' in snapshot:
+                self.metadata = snapshot['items']
+                self.snapshot_lsn = snapshot.get('last_lsn', 0)
+                self.next_id = snapshot.get('next_id', 0)
+                index_file = snapshot.get('index_file', self.index_path)
+            else:
+                # Snapshot written before the log existed: a bare metadata dict
+                self.metadata = snapshot
+            self.index = faiss.read_index(index_file)
+            if 'next_id' not in snapshot:
+                self._convert_positional_index()
         except FileNotFoundError:
-            self.index = faiss.IndexFlatIP(self.dimension)  # Inner product (cosine similarity)
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))  # Inner product (cosine similarity)
             self.metadata = {}
+        self._index_file = index_file
+        self._rebuild_lookups()
+    
+    def _entry_count(self) -> Optional[int]:
+        return len(self._id_map)
+    
+    def _entries(self) -> Optional[Iterable[Tuple[str, Dict[str, Any]]]]:
+        return [(meta['original_id'], meta.get('metadata', {})) for meta in self.metadata.values()]
+    
+    def _convert_positional_index(self) -> None:
+        """Move a flat index addressed by row position under an id map"""
+        vectors = self.index.reconstruct_n(0, self.index.ntotal) if self.index.ntotal else \
+            np.empty((0, self.dimension), dtype=np.float32)
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+        
+        # Positions become ids; duplicates of an original id keep only the latest row
+        latest = {}
+        for position in sorted(self.metadata, key=int):
+            latest[self.metadata[position].get('original_id', position)] = int(position)
+        keep = np.array(sorted(latest.values()), dtype=np.int64)
+        
+        if len(keep):
+            self.index.add_with_ids(np.ascontiguousarray(vectors[keep]), keep)
+        self.metadata = {str(i): self.metadata[str(i)] for i in keep}
+        self.next_id = int(keep.max()) + 1 if len(keep) else 0
+    
+    def _rebuild_lookups(self) -> None:
+        self._id_map: Dict[str, int] = {}
+        self._kb_members: Dict[str, set] = {}
+        for internal_id, meta in self.metadata.items():
+            self._track(int(internal_id), meta)
+    
+    def _track(self, internal_id: int, meta: Dict[str, Any]) -> None:
+        self._id_map[meta.get('original_id', str(internal_id))] = internal_id
+        kb_id = meta.get('metadata', {}).get('knowledge_base_id')
+        if kb_id is not None:
+            self._kb_members.setdefault(str(kb_id), set()).add(internal_id)
+    
+    def _untrack(self, original_id: str) -> Optional[int]:
+        internal_id = self._id_map.pop(original_id, None)
+        if internal_id is None:
+            return None
+        meta = self.metadata.pop(str(internal_id), {})
+        kb_id = meta.get('metadata', {}).get('knowledge_base_id')
+        members = self._kb_members.get(str(kb_id))
+        if members is not None:
+            members.discard(internal_id)
+            if not members:
+                del self._kb_members[str(kb_id)]
+        return internal_id
+    
+    def _apply_records(self, records: Iterable[Dict[str, Any]]) -> int:
+        applied = 0
+        for record in records:
+            if record['op'] == 'upsert':
+                self._apply_upserts([record['id']], record['vector'].reshape(1, -1), [record['metadata']])
+            elif record['op'] == 'delete':
+                self._apply_delete(record['ids'])
+            applied += 1
+        return applied
+    
+    def _replay(self) -> None:
+        """Apply log records written after the snapshot"""
+        applied = self._apply_records(self.wal.replay(after_lsn=self.snapshot_lsn))
+        if applied:
+            logging.info(f"Replayed {applied} FAISS log records from {self.wal_path}")
+    
+    def _catch_up(self, changes: LogChanges) -> None:
+        """Apply what other processes logged or snapshotted since this one last held the log lock"""
+        if changes.reset:
+            self._load_snapshot()
+            self.wal.last_lsn = max(self.wal.last_lsn, self.snapshot_lsn)
+        self._apply_records(record for record in changes.records if record['lsn'] > self.snapshot_lsn)
+    
+    def _refresh(self) -> None:
+        if self.wal.changed():
+            with self.wal.exclusive() as changes:
+                self._catch_up(changes)
+    
+    def _apply_upserts(self, ids: List[str], embeddings: np.ndarray,
+                       metadata: List[Dict[str, Any]]) -> None:
+        # Replaced ids keep their internal id; new ones take the next free one
+        internal_ids = []
+        replaced = []
+        for original_id in ids:
+            internal_id = self._untrack(original_id)
+            if internal_id is None:
+                internal_id = self.next_id
+                self.next_id += 1
+            else:
+                replaced.append(internal_id)
+            internal_ids.append(internal_id)
+        
+        if replaced:
+            self.index.remove_ids(np.array(replaced, dtype=np.int64))
+        
+        # A batch may name the same id twice; the last occurrence wins
+        last = {original_id: i for i, original_id in enumerate(ids)}
+        rows = sorted(last.values())
+        self.index.add_with_ids(
+            np.ascontiguousarray(embeddings[rows]),
+            np.array([internal_ids[i] for i in rows], dtype=np.int64)
+        )
+        
+        for i in rows:
+            meta = {'original_id': ids[i], 'metadata': metadata[i]}
+            self.metadata[str(internal_ids[i])] = meta
+            self._track(internal_ids[i], meta)
+    
+    def _apply_delete(self, ids: List[str]) -> int:
+        removed = [internal_id for internal_id in map(self._untrack, ids) if internal_id is not None]
+        if removed:
+            self.index.remove_ids(np.array(removed, dtype=np.int64))
+        return len(removed)
     
     def upsert(self, vectors: List[Dict[str, Any]]) -> bool:
         """Insert or update vectors in FAISS"""
@@ -193,22 +524,18 @@ class FAISSVectorDB(VectorDB):
             # Normalize vectors for cosine similarity
             faiss.normalize_L2(embeddings)
             
-            # Add to index
-            start_id = self.index.ntotal
-            self.index.add(embeddings)
-            
-            # Store metadata
-            for i, vec in enumerate(vectors):
-                vector_id = start_id + i
-                self.metadata[str(vector_id)] = {
-                    'original_id': vec['id'],
-                    'metadata': vec.get('metadata', {})
-                }
+            ids = [vec['id'] for vec in vectors]
+            metadata = [vec.get('metadata', {}) for vec in vectors]
             
-            # Save index and metadata
-            faiss.write_index(self.index, self.index_path)
-            with open(self.metadata_path, 'w') as f:
-                json.dump(self.metadata, f)
+            with self._lock, self.wal.exclusive() as changes:
+                self._catch_up(changes)
+                # Log first so an acknowledged upsert survives a crash
+                self.wal.append_upserts(ids, embeddings, metadata)
+                self._apply_upserts(ids, embeddings, metadata)
+                self._index_upserted(vectors)
+                
+                if self._snapshot_due():
+                    self.snapshot()
             
             return True
             
@@ -216,6 +543,62 @@ class FAISSVectorDB(VectorDB):
             logging.error(f"Error upserting to FAISS: {e}")
             return False
     
+    def _snapshot_due(self) -> bool:
+        pending = self.wal.last_lsn - self.snapshot_lsn
+        return pending >= max(self.snapshot_min_records, self.index.ntotal * self.snapshot_ratio)
+    
+    def snapshot(self) -> None:
+        """Persist the index and metadata, then truncate the log
+        
+        The index goes to a file named after the last LSN it contains and the
+        metadata file, replaced atomically, points at it. A crash at any step
+        leaves a readable snapshot whose LSN tells replay where to resume.
+        """
+        with self._lock, self.wal.exclusive() as changes:
+            self._catch_up(changes)
+            last_lsn = self.wal.last_lsn
+            index_file = f"{self.index_path}.{last_lsn}"
+            
+            faiss.write_index(self.index, index_file + '.tmp')
+            os.replace(index_file + '.tmp', index_file)
+            
+            tmp_metadata = self.metadata_path + '.tmp'
+            with open(tmp_metadata, 'w') as f:
+                json.dump({
+                    'last_lsn': last_lsn,
+                    'next_id': self.next_id,
+                    'index_file': index_file,
+                    'items': self.metadata
+                }, f)
+            os.replace(tmp_metadata, self.metadata_path)
+            
+            previous = self._index_file
+            self._index_file = index_file
+            self.snapshot_lsn = last_lsn
+            self.wal.reset()
+            
+            if previous != index_file and previous != self.index_path and os.path.exists(previous):
+                os.remove(previous)
+            
+            logging.info(f"FAISS snapshot at LSN {last_lsn} ({self.index.ntotal} vectors)")
+    
+    def _candidate_ids(self, filter_dict: Dict) -> np.ndarray:
+        """Internal ids whose metadata matches every filter field"""
+        kb_id = filter_dict.get('knowledge_base_id')
+        if kb_id is not None:
+            candidates = self._kb_members.get(str(kb_id), set())
+        else:
+            candidates = self._id_map.values()
+        
+        rest = {k: v for k, v in filter_dict.items() if k != 'knowledge_base_id'}
+        if rest:
+            candidates = [
+                internal_id for internal_id in candidates
+                if all(self.metadata[str(internal_id)].get('metadata', {}).get(k) == v
+                       for k, v in rest.items())
+            ]
+        return np.fromiter(candidates, dtype=np.int64)
+    
     def query(self, vector: List[float], top_k: int = 10, 
               filter_dict: Optional[Dict] = None) -> List[Dict[str, Any]]:
         """Query similar vectors from FAISS"""
@@ -223,32 +606,375 @@ class FAISSVectorDB(VectorDB):
             query_vector = np.array([vector], dtype=np.float32)
             faiss.normalize_L2(query_vector)
             
-            scores, indices = self.index.search(query_vector, top_k)
-            
-            results = []
-            for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-                if idx == -1:  # No more results
-                    break
-                    
-                meta = self.metadata.get(str(idx), {})
-                
-                # Apply filters if specified
+            with self._lock:
+                self._refresh()
                 if filter_dict:
-                    item_metadata = meta.get('metadata', {})
-                    if not all(item_metadata.get(k) == v for k, v in filter_dict.items()):
-                        continue
+                    # Restrict the search itself to matching ids rather than filtering afterwards
+                    candidates = self._candidate_ids(filter_dict)
+                    if not len(candidates):
+                        return []
+                    params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(candidates))
+                    scores, indices = self.index.search(query_vector, min(top_k, len(candidates)),
+                                                        params=params)
+                else:
+                    scores, indices = self.index.search(query_vector, top_k)
                 
-                results.append({
-                    'id': meta.get('original_id', str(idx)),
-                    'score': float(score),
-                    'metadata': meta.get('metadata', {})
-                })
+                results = []
+                for score, idx in zip(scores[0], indices[0]):
+                    if idx == -1:  # No more results
+                        break
+                    
+                    meta = self.metadata.get(str(idx), {})
+                    results.append({
+                        'id': meta.get('original_id', str(idx)),
+                        'score': float(score),
+                        'metadata': meta.get('metadata', {})
+                    })
             
             return results
             
         except Exception as e:
             logging.error(f"Error querying FAISS: {e}")
             return []
+    
+    def delete(self, ids: List[str]) -> bool:
+        """Delete vectors from FAISS"""
+        try:
+            with self._lock, self.wal.exclusive() as changes:
+                self._catch_up(changes)
+                self.wal.append_delete(ids)
+                self._apply_delete(ids)
+                self._index_deleted(ids)
+                
+                if self._snapshot_due():
+                    self.snapshot()
+            
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error deleting from FAISS: {e}")
+            return False
+    
+    def _find_ids(self, filter_dict: Dict) -> List[str]:
+        with self._lock:
+            return [self.metadata[str(i)]['original_id'] for i in self._candidate_ids(filter_dict)]
+
+class SegmentVectorDB(VectorDB):
+    """Local vector database on memory-mapped segment files
+
+    Needs nothing beyond NumPy. Sealed segments are shared between worker
+    processes through the page cache; see utils.vector_segments.
+    """
+    
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.dimension = config.get('dimension', DEFAULT_EMBEDDING_DIMENSION)
+        self.store = open_segment_store(
+            config.get('path', 'data/segments/vector_db'),
+            dimension=self.dimension,
+            tail_limit=config.get('tail_limit', 10000)
+        )
+        self.sync_metadata_index()
+    
+    def _entry_count(self) -> Optional[int]:
+        return len(self.store)
+    
+    def _entries(self) -> Optional[Iterable[Tuple[str, Dict[str, Any]]]]:
+        return self.store.live_entries()
+    
+    def upsert(self, vectors: List[Dict[str, Any]]) -> bool:
+        """Insert or update vectors in the segment store"""
+        try:
+            ids = [vec['id'] for vec in vectors]
+            
+            # Replace semantics: retire earlier rows with the same ids
+            self.store.delete(ids)
+            self.store.append(
+                [vec['values'] for vec in vectors],
+                ids,
+                [vec.get('metadata', {}).get('file_id') for vec in vectors],
+                [vec.get('metadata', {}) for vec in vectors]
+            )
+            self._index_upserted(vectors)
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error upserting to segment store: {e}")
+            return False
+    
+    def query(self, vector: List[float], top_k: int = 10, 
+              filter_dict: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        """Query similar vectors from the segment store"""
+        try:
+            return [
+                {'id': hit['id'], 'score': hit['score'], 'metadata': hit['metadata']}
+                for hit in self.store.query(vector, top_k, filter_dict)
+            ]
+            
+        except Exception as e:
+            logging.error(f"Error querying segment store: {e}")
+            return []
+    
+    def delete(self, ids: List[str]) -> bool:
+        """Delete vectors from the segment store"""
+        try:
+            self.store.delete(ids)
+            self._index_deleted(ids)
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error deleting from segment store: {e}")
+            return False
+    
+    def _find_ids(self, filter_dict: Dict) -> List[str]:
+        return self.store.find_ids(filter_dict)
+
+class HNSWVectorDB(VectorDB):
+    """Local HNSW graph index that needs nothing beyond NumPy
+
+    The graph lives in memory (utils.hnsw). As with FAISSVectorDB, upserts and
+    deletes go to a write-ahead log, shared between processes under its file
+    lock, and a snapshot is written once the log holds ``snapshot_ratio`` of
+    the index size. A snapshot is one binary file
+    holding the graph, vectors, ids and metadata. Deleted vectors stay in
+    the graph for routing until a snapshot finds more than
+    ``max_deleted_ratio`` of them, and then the graph is rebuilt.
+    """
+    
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.dimension = config.get('dimension', DEFAULT_EMBEDDING_DIMENSION)
+        self.path = config.get('path', 'data/hnsw/index.hnsw')
+        self.wal_path = config.get('wal_path', self.path + '.wal')
+        self.snapshot_min_records = config.get('snapshot_min_records', 10000)
+        self.snapshot_ratio = config.get('snapshot_ratio', 0.5)
+        self.max_deleted_ratio = config.get('max_deleted_ratio', 0.2)
+        self._lock = threading.RLock()
+        
+        self._load_snapshot()
+        self.wal = WriteAheadLog(self.wal_path, fsync=config.get('fsync', True),
+                                 start_lsn=self.snapshot_lsn)
+        self._replay()
+        self.sync_metadata_index()
+    
+    def _load_snapshot(self) -> None:
+        """Load the graph from the latest snapshot, or start an empty one"""
+        self.snapshot_lsn = 0
+        if os.path.exists(self.path):
+            self.index, extra = HNSWIndex.load(self.path)
+            self.snapshot_lsn = extra.get('last_lsn', 0)
+            self._labels = extra.get('ids', [])
+            self._metadata = extra.get('metadata', [])
+        else:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.index = HNSWIndex(
+                self.dimension,
+                M=self.config.get('M', 16),
+                ef_construction=self.config.get('ef_construction', 200),
+                ef_search=self.config.get('ef_search', 64)
+            )
+            self._labels = []
+            self._metadata = []
+        self._rebuild_lookups()
+    
+    def _entry_count(self) -> Optional[int]:
+        return len(self._id_map)
+    
+    def _entries(self) -> Optional[Iterable[Tuple[str, Dict[str, Any]]]]:
+        return [(label, self._metadata[node]) for label, node in self._id_map.items()]
+    
+    def _rebuild_lookups(self) -> None:
+        self._id_map: Dict[str, int] = {}
+        self._kb_members: Dict[str, set] = {}
+        for node, label in enumerate(self._labels):
+            if not self.index.is_deleted(node):
+                self._track(node)
+    
+    def _track(self, node: int) -> None:
+        self._id_map[self._labels[node]] = node
+        kb_id = self._metadata[node].get('knowledge_base_id')
+        if kb_id is not None:
+            self._kb_members.setdefault(str(kb_id), set()).add(node)
+    
+    def _untrack(self, original_id: str) -> Optional[int]:
+        node = self._id_map.pop(original_id, None)
+        if node is None:
+            return None
+        kb_id = self._metadata[node].get('knowledge_base_id')
+        members = self._kb_members.get(str(kb_id))
+        if members is not None:
+            members.discard(node)
+            if not members:
+                del self._kb_members[str(kb_id)]
+        self.index.mark_deleted(node)
+        return node
+    
+    def _apply_records(self, records: Iterable[Dict[str, Any]]) -> int:
+        applied = 0
+        for record in records:
+            if record['op'] == 'upsert':
+                self._apply_upserts([record['id']], record['vector'].reshape(1, -1), [record['metadata']])
+            elif record['op'] == 'delete':
+                self._apply_delete(record['ids'])
+            applied += 1
+        return applied
+    
+    def _replay(self) -> None:
+        """Apply log records written after the snapshot"""
+        applied = self._apply_records(self.wal.replay(after_lsn=self.snapshot_lsn))
+        if applied:
+            logging.info(f"Replayed {applied} HNSW log records from {self.wal_path}")
+    
+    def _catch_up(self, changes: LogChanges) -> None:
+        """Apply what other processes logged or snapshotted since this one last held the log lock"""
+        if changes.reset:
+            self._load_snapshot()
+            self.wal.last_lsn = max(self.wal.last_lsn, self.snapshot_lsn)
+        self._apply_records(record for record in changes.records if record['lsn'] > self.snapshot_lsn)
+    
+    def _refresh(self) -> None:
+        if self.wal.changed():
+            with self.wal.exclusive() as changes:
+                self._catch_up(changes)
+    
+    def _apply_upserts(self, ids: List[str], embeddings: np.ndarray,
+                       metadata: List[Dict[str, Any]]) -> None:
+        for original_id in ids:
+            self._untrack(original_id)
+        
+        # A batch may name the same id twice; the last occurrence wins
+        last = {original_id: i for i, original_id in enumerate(ids)}
+        rows = sorted(last.values())
+        nodes = self.index.add(embeddings[rows])
+        
+        for node, i in zip(nodes, rows):
+            self._labels.append(ids[i])
+            self._metadata.append(metadata[i])
+            self._track(node)
+    
+    def _apply_delete(self, ids: List[str]) -> None:
+        for original_id in ids:
+            self._untrack(original_id)
+    
+    def upsert(self, vectors: List[Dict[str, Any]]) -> bool:
+        """Insert or update vectors in the HNSW index"""
+        try:
+            embeddings = np.array([vec['values'] for vec in vectors], dtype=np.float32)
+            ids = [vec['id'] for vec in vectors]
+            metadata = [vec.get('metadata', {}) for vec in vectors]
+            
+            with self._lock, self.wal.exclusive() as changes:
+                self._catch_up(changes)
+                # Log first so an acknowledged upsert survives a crash
+                self.wal.append_upserts(ids, embeddings, metadata)
+                self._apply_upserts(ids, embeddings, metadata)
+                self._index_upserted(vectors)
+                
+                if self._snapshot_due():
+                    self.snapshot()
+            
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error upserting to HNSW index: {e}")
+            return False
+    
+    def _snapshot_due(self) -> bool:
+        pending = self.wal.last_lsn - self.snapshot_lsn
+        return pending >= max(self.snapshot_min_records, len(self.index) * self.snapshot_ratio)
+    
+    def snapshot(self) -> None:
+        """Persist the graph, ids and metadata in one file, then truncate the log"""
+        with self._lock, self.wal.exclusive() as changes:
+            self._catch_up(changes)
+            if self.index.node_count and \
+                    self.index.deleted_count / self.index.node_count > self.max_deleted_ratio:
+                self._compact()
+            
+            last_lsn = self.wal.last_lsn
+            self.index.save(self.path, {
+                'last_lsn': last_lsn,
+                'ids': self._labels,
+                'metadata': self._metadata
+            })
+            self.snapshot_lsn = last_lsn
+            self.wal.reset()
+            
+            logging.info(f"HNSW snapshot at LSN {last_lsn} ({len(self.index)} vectors)")
+    
+    def _compact(self) -> None:
+        index, mapping = self.index.compacted()
+        keep = np.flatnonzero(mapping >= 0)
+        self.index = index
+        self._labels = [self._labels[node] for node in keep]
+        self._metadata = [self._metadata[node] for node in keep]
+        self._rebuild_lookups()
+    
+    def _allowed_mask(self, filter_dict: Dict) -> np.ndarray:
+        """Boolean mask over graph nodes whose metadata matches every filter field"""
+        kb_id = filter_dict.get('knowledge_base_id')
+        if kb_id is not None:
+            candidates = self._kb_members.get(str(kb_id), set())
+        else:
+            candidates = self._id_map.values()
+        
+        rest = {k: v for k, v in filter_dict.items() if k != 'knowledge_base_id'}
+        if rest:
+            candidates = [
+                node for node in candidates
+                if all(self._metadata[node].get(k) == v for k, v in rest.items())
+            ]
+        
+        mask = np.zeros(self.index.node_count, dtype=bool)
+        mask[np.fromiter(candidates, dtype=np.int64)] = True
+        return mask
+    
+    def query(self, vector: List[float], top_k: int = 10, 
+              filter_dict: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        """Query similar vectors from the HNSW index"""
+        try:
+            with self._lock:
+                self._refresh()
+                allowed = self._allowed_mask(filter_dict) if filter_dict else None
+                hits = self.index.search(vector, top_k, allowed=allowed)
+                return [
+                    {'id': self._labels[node], 'score': score, 'metadata': self._metadata[node]}
+                    for node, score in hits
+                ]
+            
+        except Exception as e:
+            logging.error(f"Error querying HNSW index: {e}")
+            return []
+    
+    def delete(self, ids: List[str]) -> bool:
+        """Delete vectors from the HNSW index"""
+        try:
+            with self._lock, self.wal.exclusive() as changes:
+                self._catch_up(changes)
+                self.wal.append_delete(ids)
+                self._apply_delete(ids)
+                self._index_deleted(ids)
+                
+                if self._snapshot_due():
+                    self.snapshot()
+            
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error deleting from HNSW index: {e}")
+            return False
+    
+    def _find_ids(self, filter_dict: Dict) -> List[str]:
+        with self._lock:
+            return [self._labels[node] for node in np.flatnonzero(self._allowed_mask(filter_dict))]
+
+_LOCAL_BACKENDS = {
+    'faiss': FAISSVectorDB,
+    'segments': SegmentVectorDB,
+    'hnsw': HNSWVectorDB
+}
+_local_instances: Dict[str, VectorDB] = {}
+_local_instances_lock = threading.Lock()
 
 def get_vector_db(db_type: str = None) -> VectorDB:
     """Get vector database instance based on configuration"""
@@ -258,21 +984,40 @@ def get_vector_db(db_type: str = None) -> VectorDB:
             db_type = 'pinecone'
         elif chromadb:
             db_type = 'chromadb'
-        else:
+        elif faiss:
             db_type = 'faiss'
+        else:
+            db_type = 'hnsw'
     
     config = {
         'pinecone': {
             'environment': os.environ.get('PINECONE_ENVIRONMENT', 'us-west1-gcp'),
-            'index_name': os.environ.get('PINECONE_INDEX', 'autogent-studio')
+            'index_name': os.environ.get('PINECONE_INDEX', 'autogent-studio'),
+            'metadata_index_path': f"data/vector_metadata/pinecone-{os.environ.get('PINECONE_INDEX', 'autogent-studio')}.sqlite"
         },
         'chromadb': {
-            'collection_name': 'autogent_studio'
+            'collection_name': 'autogent_studio',
+            'metadata_index_path': 'data/vector_metadata/chromadb-autogent_studio.sqlite'
         },
         'faiss': {
-            'dimension': 1536,
+            'dimension': DEFAULT_EMBEDDING_DIMENSION,
             'index_path': 'data/faiss_index.bin',
-            'metadata_path': 'data/faiss_metadata.json'
+            'metadata_path': 'data/faiss_metadata.json',
+            'wal_path': 'data/faiss_index.wal',
+            'metadata_index_path': 'data/vector_metadata/faiss.sqlite'
+        },
+        'segments': {
+            'dimension': DEFAULT_EMBEDDING_DIMENSION,
+            'path': 'data/segments/vector_db',
+            'metadata_index_path': 'data/vector_metadata/segments.sqlite'
+        },
+        'hnsw': {
+            'dimension': DEFAULT_EMBEDDING_DIMENSION,
+            'path': 'data/hnsw/index.hnsw',
+            'metadata_index_path': 'data/vector_metadata/hnsw.sqlite',
+            'M': int(os.environ.get('HNSW_M', '16')),
+            'ef_construction': int(os.environ.get('HNSW_EF_CONSTRUCTION', '200')),
+            'ef_search': int(os.environ.get('HNSW_EF_SEARCH', '64'))
         }
     }
     
@@ -280,21 +1025,26 @@ def get_vector_db(db_type: str = None) -> VectorDB:
         return PineconeDB(config['pinecone'])
     elif db_type == 'chromadb':
         return ChromaDB(config['chromadb'])
-    elif db_type == 'faiss':
-        return FAISSVectorDB(config['faiss'])
+    elif db_type in _LOCAL_BACKENDS:
+        # Local indexes own their log files and in-memory state: one instance per process
+        with _local_instances_lock:
+            if db_type not in _local_instances:
+                _local_instances[db_type] = _LOCAL_BACKENDS[db_type](config[db_type])
+            return _local_instances[db_type]
     else:
         raise ValueError(f"Unsupported vector database type: {db_type}")
 
-def generate_embeddings(text: str, model: str = 'text-embedding-3-small') -> List[float]:
-    """Generate embeddings for text"""
+def generate_embeddings(text: str, model: str = 'text-embedding-3-small',
+                        dimension: int = DEFAULT_EMBEDDING_DIMENSION) -> List[float]:
+    """Generate embeddings for text, shortened to the vector database dimension"""
     try:
-        return get_embedding(text, model)
+        return get_embedding(text, model, dimension)
     except Exception as e:
         logging.error(f"Error generating embeddings: {e}")
         # Fallback to simple hash-based embedding (not recommended for production)
-        return simple_text_embedding(text)
+        return simple_text_embedding(text, dimension)
 
-def simple_text_embedding(text: str, dimension: int = 1536) -> List[float]:
+def simple_text_embedding(text: str, dimension: int = DEFAULT_EMBEDDING_DIMENSION) -> List[float]:
     """Simple fallback embedding using text hashing"""
     import hashlib
     
@@ -313,14 +1063,34 @@ def simple_text_embedding(text: str, dimension: int = 1536) -> List[float]:
     
     return vector[:dimension]
 
+def knowledge_base_index_dimension(vector_db: VectorDB, knowledge_base_id: str) -> int:
+    """Dimension of the vector database, checked against the knowledge base's embedding_dimension
+    
+    One index holds every knowledge base, so a knowledge base configured
+    for another size cannot be stored in it and raises EmbeddingDimensionError.
+    """
+    from models import KnowledgeBase
+    
+    dimension = vector_db.config.get('dimension', DEFAULT_EMBEDDING_DIMENSION)
+    knowledge_base = KnowledgeBase.query.get(knowledge_base_id)
+    configured = embedding_dimension(knowledge_base.settings if knowledge_base else None)
+    if configured is not None and configured != dimension:
+        raise EmbeddingDimensionError(
+            f"Knowledge base {knowledge_base_id} uses {configured}-dimensional embeddings, "
+            f"the {type(vector_db).__name__} index stores {dimension}"
+        )
+    return dimension
+
 def search_similar_chunks(query: str, knowledge_base_id: str, limit: int = 10) -> List[Dict[str, Any]]:
     """Search for similar chunks in knowledge base"""
     try:
-        # Generate query embedding
-        query_embedding = generate_embeddings(query)
-        
         # Get vector database
         vector_db = get_vector_db()
+        dimension = knowledge_base_index_dimension(vector_db, knowledge_base_id)
+        
+        # Generate query embedding at the index's dimension
+        query_embedding = get_embedding(query, dimensions=dimension)
+        check_query_dimension(query_embedding, dimension, knowledge_base_id)
         
         # Search with knowledge base filter
         results = vector_db.query(
@@ -342,6 +1112,8 @@ def search_similar_chunks(query: str, knowledge_base_id: str, limit: int = 10) -
         
         return formatted_results
         
+    except EmbeddingDimensionError:
+        raise
     except Exception as e:
         logging.error(f"Error searching similar chunks: {e}")
         return []
@@ -351,11 +1123,13 @@ def index_document_chunks(chunks: List[Dict[str, Any]], knowledge_base_id: str)
     try:
         vector_db = get_vector_db()
         
+        # Embed all chunks in a few batched requests instead of one call per chunk
+        dimension = knowledge_base_index_dimension(vector_db, knowledge_base_id)
+        contents = [chunk['content'] for chunk in chunks]
+        embeddings = embed_texts(contents, dimensions=dimension)
+        
         vectors = []
-        for chunk in chunks:
-            # Generate embedding for chunk content
-            embedding = generate_embeddings(chunk['content'])
-            
+        for chunk, embedding in zip(chunks, embeddings):
             vectors.append({
                 'id': chunk['id'],
                 'values': embedding,
@@ -370,6 +1144,8 @@ def index_document_chunks(chunks: List[Dict[str, Any]], knowledge_base_id: str)
         
         return vector_db.upsert(vectors)
         
+    except EmbeddingDimensionError:
+        raise
     except Exception as e:
         logging.error(f"Error indexing document chunks: {e}")
         return False
@@ -378,22 +1154,7 @@ def delete_knowledge_base_vectors(knowledge_base_id: str) -> bool:
     """Delete all vectors for a knowledge base"""
     try:
         vector_db = get_vector_db()
-        
-        # Query all vectors for this knowledge base
-        dummy_vector = [0.0] * 1536  # Dummy vector for query
-        results = vector_db.query(
-            vector=dummy_vector,
-            top_k=10000,  # Large number to get all
-            filter_dict={'knowledge_base_id': knowledge_base_id}
-        )
-        
-        # Extract IDs
-        ids_to_delete = [result['id'] for result in results]
-        
-        if ids_to_delete:
-            return vector_db.delete(ids_to_delete)
-        
-        return True
+        return vector_db.delete_by_filter({'knowledge_base_id': knowledge_base_id})
         
     except Exception as e:
         logging.error(f"Error deleting knowledge base vectors: {e}")
@@ -403,36 +1164,18 @@ def get_vector_stats(knowledge_base_id: str) -> Dict[str, Any]:
     """Get statistics for vectors in knowledge base"""
     try:
         vector_db = get_vector_db()
+        file_counts = vector_db.file_counts({'knowledge_base_id': knowledge_base_id})
         
-        # Query vectors for this knowledge base
-        dummy_vector = [0.0] * 1536
-        results = vector_db.query(
-            vector=dummy_vector,
-            top_k=10000,
-            filter_dict={'knowledge_base_id': knowledge_base_id}
-        )
-        
-        stats = {
-            'total_chunks': len(results),
-            'files': set(),
-            'avg_score': 0.0
+        files = sorted({name for _, name, _ in file_counts if name})
+        return {
+            'total_chunks': sum(count for _, _, count in file_counts),
+            'unique_files': len(files),
+            'files': files,
+            'chunks_per_file': {
+                str(file_id): count for file_id, _, count in file_counts if file_id is not None
+            }
         }
         
-        total_score = 0.0
-        for result in results:
-            metadata = result.get('metadata', {})
-            if metadata.get('file_name'):
-                stats['files'].add(metadata['file_name'])
-            total_score += result.get('score', 0.0)
-        
-        stats['unique_files'] = len(stats['files'])
-        stats['files'] = list(stats['files'])
-        
-        if len(results) > 0:
-            stats['avg_score'] = total_score / len(results)
-        
-        return stats
-        
     except Exception as e:
         logging.error(f"Error getting vector stats: {e}")
-        return {'total_chunks': 0, 'unique_files': 0, 'files': [], 'avg_score': 0.0}
+        return {'total_chunks': 0, 'unique_files': 0, 'files': [], 'chunks_per_file': {}}
@@ -3,71 +3,60 @@ import numpy as np
 from typing import List, Dict, Any
 from models import FileEmbedding, KnowledgeBase, File, db
 from services.ai_service import AIService
+from utils.vector_codec import set_embedding
+from utils.knowledge_base_index import index_new_chunks
+from utils.vector_store import VectorStore
+from utils.chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, Chunk, chunk_spans
+from utils.tokenizer import get_tokenizer
+from utils.context_packer import ContextPacker
+from utils.embedding_dimensions import (
+    DEFAULT_EMBEDDING_DIMENSION, dimension_metadata, embedding_dimension, native_dimension, shorten
+)
 import uuid
-from sqlalchemy import text
 
 class VectorService:
     def __init__(self):
         self.ai_service = AIService()
         self.embedding_model = "text-embedding-3-small"  # OpenAI's latest embedding model
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+        self.chunk_size = DEFAULT_CHUNK_TOKENS
+        self.chunk_overlap = DEFAULT_OVERLAP_TOKENS
+        self._vector_store = None
     
-    def create_embeddings(self, text_chunks: List[str], model: str = None) -> List[List[float]]:
-        """Create embeddings for text chunks"""
+    @property
+    def vector_store(self) -> VectorStore:
+        """VectorStore whose get_knowledge_base_matrix loads and caches knowledge base matrices"""
+        if self._vector_store is None:
+            self._vector_store = VectorStore()
+        return self._vector_store
+    
+    def create_embeddings(self, text_chunks: List[str], model: str = None,
+                          dimension: int = None) -> List[List[float]]:
+        """Create embeddings for text chunks, shortened to ``dimension`` if given"""
         if not model:
             model = self.embedding_model
         
         embeddings = []
         for chunk in text_chunks:
             if chunk.strip():  # Only process non-empty chunks
-                embedding = self.ai_service.get_embedding(chunk, model)
+                embedding = shorten(self.ai_service.get_embedding(chunk, model), dimension)
                 embeddings.append(embedding)
             else:
-                embeddings.append([0.0] * 1536)  # Default embedding dimension
+                embeddings.append([0.0] * (dimension or native_dimension(model) or DEFAULT_EMBEDDING_DIMENSION))
         
         return embeddings
     
     def chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
-        """Split text into chunks with overlap"""
+        """Split text into chunks of ``chunk_size`` tokens with overlap"""
+        return [chunk.text for chunk in self.chunk_spans(text, chunk_size, overlap)]
+    
+    def chunk_spans(self, text: str, chunk_size: int = None, overlap: int = None) -> List[Chunk]:
+        """Chunks of text with their character offsets in ``text``"""
         if not chunk_size:
             chunk_size = self.chunk_size
-        if not overlap:
+        if overlap is None:
             overlap = self.chunk_overlap
         
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # Try to break at sentence or word boundary
-            if end < len(text):
-                # Look for sentence boundary
-                last_period = text.rfind('.', start, end)
-                last_exclamation = text.rfind('!', start, end)
-                last_question = text.rfind('?', start, end)
-                
-                sentence_end = max(last_period, last_exclamation, last_question)
-                
-                if sentence_end > start:
-                    end = sentence_end + 1
-                else:
-                    # Look for word boundary
-                    last_space = text.rfind(' ', start, end)
-                    if last_space > start:
-                        end = last_space
-            
-            chunks.append(text[start:end].strip())
-            start = end - overlap if end - overlap > start else end
-            
-            if start >= len(text):
-                break
-        
-        return [chunk for chunk in chunks if chunk.strip()]
+        return chunk_spans(text, chunk_size, overlap, get_tokenizer(self.embedding_model))
     
     def add_file_to_knowledge_base(self, file: File, knowledge_base: KnowledgeBase):
         """Add file embeddings to knowledge base"""
@@ -77,29 +66,38 @@ class VectorService:
                 content = f.read()
             
             # Chunk the text
-            chunks = self.chunk_text(content)
+            spans = self.chunk_spans(content)
+            chunks = [span.text for span in spans]
             
-            # Create embeddings
-            embeddings = self.create_embeddings(chunks)
+            # Create embeddings at the knowledge base's configured size
+            dimension = embedding_dimension(knowledge_base.settings, self.embedding_model)
+            embeddings = self.create_embeddings(chunks, dimension=dimension)
             
             # Store embeddings in database
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            chunk_ids = []
+            for i, (span, embedding) in enumerate(zip(spans, embeddings)):
                 file_embedding = FileEmbedding(
                     id=str(uuid.uuid4()),
                     file_id=file.id,
                     knowledge_base_id=knowledge_base.id,
-                    chunk_text=chunk,
+                    chunk_text=span.text,
                     chunk_index=i,
                     embedding_model=self.embedding_model,
-                    embedding_vector=embedding,
+                    embedding_metadata=dimension_metadata(len(embedding), self.embedding_model),
                     metadata={
-                        'chunk_size': len(chunk),
+                        'chunk_size': len(span.text),
+                        'chunk_tokens': span.tokens,
+                        # Character span of the chunk in the file, for citations
+                        'start': span.start,
+                        'end': span.end,
                         'file_name': file.original_filename,
                         'file_type': file.file_type
                     }
                 )
+                set_embedding(file_embedding, embedding)
                 
                 db.session.add(file_embedding)
+                chunk_ids.append(file_embedding.id)
             
             # Update knowledge base stats
             knowledge_base.total_chunks += len(chunks)
@@ -107,6 +105,7 @@ class VectorService:
                 knowledge_base.file_count += 1
             
             db.session.commit()
+            index_new_chunks([knowledge_base.id], file.id, chunk_ids, embeddings, chunks)
             
             # Mark file as processed
             file.is_processed = True
@@ -128,52 +127,41 @@ class VectorService:
     
     def search_knowledge_base(self, knowledge_base: KnowledgeBase, query: str, 
                              limit: int = 5, similarity_threshold: float = 0.7) -> List[Dict]:
-        """Search knowledge base using vector similarity"""
+        """Search knowledge base using vector similarity
+        
+        The query is scored against the knowledge base's cached vector
+        matrix, decoded from the stored embedding blobs.
+        """
         try:
-            # Get query embedding
-            query_embedding = self.ai_service.get_embedding(query)
-            
-            # Convert to string format for PostgreSQL
-            query_vector_str = str(query_embedding).replace('[', '{').replace(']', '}')
-            
-            # Use pgvector similarity search
-            # This requires pgvector extension to be installed
-            sql_query = text("""
-                SELECT 
-                    fe.id,
-                    fe.chunk_text,
-                    fe.chunk_index,
-                    fe.metadata,
-                    f.original_filename,
-                    f.file_type,
-                    (fe.embedding_vector <=> :query_vector) as distance
-                FROM file_embeddings fe
-                JOIN files f ON fe.file_id = f.id
-                WHERE fe.knowledge_base_id = :kb_id
-                ORDER BY fe.embedding_vector <=> :query_vector
-                LIMIT :limit
-            """)
-            
-            results = db.session.execute(sql_query, {
-                'query_vector': query_vector_str,
-                'kb_id': knowledge_base.id,
-                'limit': limit
-            }).fetchall()
-            
-            # Filter by similarity threshold (distance = 1 - cosine_similarity)
+            matrix = self.vector_store.get_knowledge_base_matrix(knowledge_base.id)
+            if not len(matrix):
+                return []
+            
+            # Get query embedding at the knowledge base's size
+            query_embedding = shorten(self.ai_service.get_embedding(query, self.embedding_model), matrix.dimension)
+            hits = [(chunk_id, similarity) for chunk_id, _, similarity in matrix.search(query_embedding, limit)
+                    if similarity >= similarity_threshold]
+            
+            records = {
+                record.id: record for record in FileEmbedding.query.filter(
+                    FileEmbedding.id.in_([chunk_id for chunk_id, _ in hits])
+                ).join(File).all()
+            } if hits else {}
+            
             filtered_results = []
-            for result in results:
-                similarity = 1 - result.distance
-                if similarity >= similarity_threshold:
-                    filtered_results.append({
-                        'id': result.id,
-                        'text': result.chunk_text,
-                        'chunk_index': result.chunk_index,
-                        'filename': result.original_filename,
-                        'file_type': result.file_type,
-                        'similarity': similarity,
-                        'metadata': result.metadata
-                    })
+            for chunk_id, similarity in hits:
+                record = records.get(chunk_id)
+                if record is None:
+                    continue
+                filtered_results.append({
+                    'id': record.id,
+                    'text': record.chunk_text,
+                    'chunk_index': record.chunk_index,
+                    'filename': record.file.original_filename,
+                    'file_type': record.file.file_type,
+                    'similarity': similarity,
+                    'metadata': record.embedding_metadata
+                })
             
             return filtered_results
             
@@ -212,22 +200,15 @@ class VectorService:
         """Get relevant context for RAG (Retrieval-Augmented Generation)"""
         search_results = self.search_knowledge_base(knowledge_base, query)
         
-        context_parts = []
-        current_tokens = 0
-        
-        for result in search_results:
-            # Rough token estimation (1 token ≈ 4 characters)
-            estimated_tokens = len(result['text']) // 4
-            
-            if current_tokens + estimated_tokens > max_tokens:
-                break
-            
-            context_parts.append(
-                f"[{result['filename']}] {result['text']}"
-            )
-            current_tokens += estimated_tokens
-        
-        return "\n\n".join(context_parts)
+        # Best-scoring distinct results whose exact token count fits ``max_tokens``
+        packed = ContextPacker().pack(
+            search_results,
+            lambda i, result: f"[{result['filename']}] {result['text']}",
+            separator="\n\n",
+            text_key='text',
+            budget=max_tokens
+        )
+        return packed.context
     
     def hybrid_search(self, knowledge_base: KnowledgeBase, query: str, 
                      alpha: float = 0.7) -> List[Dict]:
@@ -0,0 +1,345 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR', os.path.join('uploads', 'blobs'))
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', os.path.join('data', 'artifacts'))
+
+# Bytes read from an upload stream at a time
+_COPY_BLOCK = 1024 * 1024
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_COPY_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def artifact_key(**params: Any) -> str:
+    """Short stable key for the settings an artifact was derived with"""
+    encoded = json.dumps(params, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def _fanout(root: str, content_hash: str) -> str:
+    return os.path.join(root, content_hash[:2], content_hash)
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+class BlobStore:
+    """Uploaded files stored once per SHA-256 of their content
+
+    ``put_stream`` hashes an upload while copying it to a temporary file in
+    the store and then renames it to ``<hash[:2]>/<hash><extension>``; the
+    extension is kept because parsers pick a format from it. Content that is
+    already stored is not written again. A SQLite table records which file
+    records reference which blob, and ``release`` deletes the blob and its
+    derived artifacts when the last reference goes.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR, artifact_root: str = ARTIFACT_DIR):
+        self.root = root
+        self.artifact_root = artifact_root
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.root, 'refs.sqlite3'), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS refs (
+                    owner TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    extension TEXT NOT NULL DEFAULT ''
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_refs_hash ON refs (content_hash);
+            ''')
+            self._local.conn = conn
+        return conn
+
+    def path(self, content_hash: str, extension: str = '') -> str:
+        return _fanout(self.root, content_hash) + extension.lower()
+
+    def exists(self, content_hash: str, extension: str = '') -> bool:
+        return os.path.exists(self.path(content_hash, extension))
+
+    def content_hash(self, file_path: str) -> str:
+        """SHA-256 of a file; free for files inside the store"""
+        directory, name = os.path.split(os.path.abspath(file_path))
+        if os.path.dirname(directory) == os.path.abspath(self.root) and name[:2] == os.path.basename(directory):
+            return name[:64]
+        return file_sha256(file_path)
+
+    def put_stream(self, stream: BinaryIO, owner: Optional[str] = None,
+                   extension: str = '') -> Tuple[str, int, bool]:
+        """Store a readable binary stream; returns (hash, size, already stored)
+
+        With ``owner`` (a file id) the reference is recorded in the same
+        transaction, so a concurrent ``release`` cannot delete the blob in
+        between.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for block in iter(lambda: stream.read(_COPY_BLOCK), b''):
+                    digest.update(block)
+                    out.write(block)
+                    size += len(block)
+            content_hash = digest.hexdigest()
+            target = self.path(content_hash, extension)
+
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                duplicate = os.path.exists(target)
+                if not duplicate:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(temp_path, target)
+                if owner is not None:
+                    conn.execute('INSERT OR REPLACE INTO refs VALUES (?, ?, ?)',
+                                 (str(owner), content_hash, extension.lower()))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return content_hash, size, duplicate
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def add_ref(self, owner: str, content_hash: str, extension: str = '') -> None:
+        """Record that ``owner`` (a file id) uses the blob"""
+        self._connection().execute('INSERT OR REPLACE INTO refs VALUES (?, ?, ?)',
+                                   (str(owner), content_hash, extension.lower()))
+
+    def ref_count(self, content_hash: str) -> int:
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM refs WHERE content_hash = ?', (content_hash,)
+        ).fetchone()[0]
+
+    def release(self, owner: str) -> bool:
+        """Drop ``owner``'s reference, deleting the blob if it was the last
+
+        Returns False when ``owner`` never referenced a blob, so callers can
+        fall back to deleting a file stored the old way.
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT content_hash, extension FROM refs WHERE owner = ?',
+                               (str(owner),)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return False
+            content_hash, extension = row
+            conn.execute('DELETE FROM refs WHERE owner = ?', (str(owner),))
+            same_blob, remaining = conn.execute(
+                'SELECT SUM(extension = ?), COUNT(*) FROM refs WHERE content_hash = ?',
+                (extension, content_hash)
+            ).fetchone()
+            # Deleted inside the transaction so a concurrent upload of the same content waits
+            if not same_blob and os.path.exists(self.path(content_hash, extension)):
+                os.remove(self.path(content_hash, extension))
+            if remaining == 0:
+                shutil.rmtree(_fanout(self.artifact_root, content_hash), ignore_errors=True)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        if remaining == 0:
+            logging.info(f"Deleted blob {content_hash} and its artifacts")
+        return True
+
+    def discard(self, owner: str, file_path: Optional[str] = None) -> None:
+        """Delete an uploaded file, whether it is a blob or was stored before the blob store"""
+        if self.release(owner) or not file_path:
+            return
+        inside_store = os.path.abspath(file_path).startswith(os.path.abspath(self.root) + os.sep)
+        if not inside_store and os.path.exists(file_path):
+            os.remove(file_path)
+
+    def get_stats(self) -> Dict[str, int]:
+        conn = self._connection()
+        references, blobs = conn.execute('SELECT COUNT(*), COUNT(DISTINCT content_hash) FROM refs').fetchone()
+        return {'references': references, 'blobs': blobs}
+
+class ArtifactWriter:
+    """Appends chunks (and optionally their embeddings) for one artifact
+
+    Nothing is visible to readers until ``commit`` writes the JSON
+    manifests, which double as completion markers; ``discard`` removes the
+    temporary files of an abandoned writer.
+    """
+
+    def __init__(self, directory: str, chunk_name: str, embedding_name: Optional[str]):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_name = chunk_name
+        self.embedding_name = embedding_name
+        self.count = 0
+        self.dimension = None
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        self._chunk_temp = os.path.join(directory, chunk_name + suffix)
+        self._chunks = open(self._chunk_temp, 'w', encoding='utf-8')
+        self._embedding_temp = os.path.join(directory, embedding_name + '.f32' + suffix) if embedding_name else None
+        self._embeddings = open(self._embedding_temp, 'wb') if embedding_name else None
+
+    def append(self, chunks: Sequence[Any], embeddings: Optional[Sequence[Sequence[float]]] = None) -> None:
+        for chunk in chunks:
+            self._chunks.write(json.dumps(chunk) + '\n')
+        if self._embeddings is not None:
+            matrix = np.asarray(embeddings, dtype='<f4')
+            if len(matrix):
+                self.dimension = matrix.shape[1]
+                self._embeddings.write(matrix.tobytes())
+        self.count += len(chunks)
+
+    def commit(self, **manifest: Any) -> None:
+        """Publish the artifact; ``manifest`` entries (e.g. text_length) are stored with it"""
+        manifest = {**manifest, 'chunks': self.count, 'created_at': datetime.utcnow().isoformat()}
+        self._chunks.close()
+        os.replace(self._chunk_temp, os.path.join(self.directory, self.chunk_name + '.jsonl'))
+        _write_json(os.path.join(self.directory, self.chunk_name + '.json'), manifest)
+        if self._embeddings is not None:
+            self._embeddings.close()
+            os.replace(self._embedding_temp, os.path.join(self.directory, self.embedding_name + '.f32'))
+            _write_json(os.path.join(self.directory, self.embedding_name + '.json'),
+                        {**manifest, 'dimension': self.dimension})
+
+    def discard(self) -> None:
+        for handle, path in ((self._chunks, self._chunk_temp), (self._embeddings, self._embedding_temp)):
+            if handle is not None:
+                handle.close()
+                if os.path.exists(path):
+                    os.remove(path)
+
+class TextWriter:
+    """Streams extracted text to an artifact file, renamed into place on commit"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self._temp, 'w', encoding='utf-8', errors='replace')
+
+    def write(self, piece: str) -> None:
+        self._file.write(piece)
+
+    def commit(self) -> None:
+        self._file.close()
+        os.replace(self._temp, self.path)
+
+    def discard(self) -> None:
+        self._file.close()
+        if os.path.exists(self._temp):
+            os.remove(self._temp)
+
+class ArtifactCache:
+    """Text, chunk lists and embeddings derived from a blob, shared by every upload of it
+
+    Artifacts live under ``<artifact_root>/<hash[:2]>/<hash>/``:
+    ``text.txt`` for the extracted text, ``chunks-<chunker key>.jsonl`` per
+    chunker configuration and ``embeddings-<chunker key>-<model key>.f32``
+    (little-endian float32 rows) per chunker and embedding model, each list
+    with a JSON manifest. Chunk lists hold one JSON value per line, as
+    written by the chunker (its records are lists of text and offsets). Every file is written to a temporary name and
+    renamed, so readers never see a partial artifact.
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR):
+        self.root = root
+
+    def directory(self, content_hash: str) -> str:
+        return _fanout(self.root, content_hash)
+
+    def text_path(self, content_hash: str) -> Optional[str]:
+        path = os.path.join(self.directory(content_hash), 'text.txt')
+        return path if os.path.exists(path) else None
+
+    def text_writer(self, content_hash: str) -> TextWriter:
+        return TextWriter(os.path.join(self.directory(content_hash), 'text.txt'))
+
+    def put_text(self, content_hash: str, text: str) -> None:
+        writer = self.text_writer(content_hash)
+        writer.write(text)
+        writer.commit()
+
+    def get_text(self, content_hash: str) -> Optional[str]:
+        path = self.text_path(content_hash)
+        if path is None:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    @staticmethod
+    def _names(chunker_key: str, model_key: Optional[str]) -> Tuple[str, Optional[str]]:
+        return f"chunks-{chunker_key}", (f"embeddings-{chunker_key}-{model_key}" if model_key else None)
+
+    def _manifest(self, content_hash: str, name: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.directory(content_hash), name + '.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def writer(self, content_hash: str, chunker_key: str, model_key: Optional[str] = None) -> ArtifactWriter:
+        chunk_name, embedding_name = self._names(chunker_key, model_key)
+        return ArtifactWriter(self.directory(content_hash), chunk_name, embedding_name)
+
+    def chunk_manifest(self, content_hash: str, chunker_key: str) -> Optional[Dict[str, Any]]:
+        """Manifest of a cached chunk list, None if there is none"""
+        chunk_name, _ = self._names(chunker_key, None)
+        return self._manifest(content_hash, chunk_name)
+
+    def iter_chunks(self, content_hash: str, chunker_key: str) -> Iterator[Any]:
+        chunk_name, _ = self._names(chunker_key, None)
+        with open(os.path.join(self.directory(content_hash), chunk_name + '.jsonl'), 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def embedding_manifest(self, content_hash: str, chunker_key: str, model_key: str) -> Optional[Dict[str, Any]]:
+        """Manifest of cached embeddings, None if there are none"""
+        _, embedding_name = self._names(chunker_key, model_key)
+        return self._manifest(content_hash, embedding_name)
+
+    def iter_embedded_chunks(self, content_hash: str, chunker_key: str, model_key: str,
+                             batch_size: int = 512) -> Iterator[Tuple[List[Any], np.ndarray]]:
+        """Cached (chunks, embeddings) in batches, or nothing if not cached"""
+        manifest = self.embedding_manifest(content_hash, chunker_key, model_key)
+        if manifest is None:
+            return
+        _, embedding_name = self._names(chunker_key, model_key)
+        path = os.path.join(self.directory(content_hash), embedding_name + '.f32')
+        if manifest['chunks']:
+            vectors = np.memmap(path, dtype='<f4', mode='r').reshape(manifest['chunks'], manifest['dimension'])
+        batch: List[Any] = []
+        start = 0
+        for chunk in self.iter_chunks(content_hash, chunker_key):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch, np.array(vectors[start:start + len(batch)], dtype=np.float32)
+                start += len(batch)
+                batch = []
+        if batch:
+            yield batch, np.array(vectors[start:start + len(batch)], dtype=np.float32)
+
+# Global instances
+blob_store = BlobStore()
+artifact_cache = ArtifactCache()
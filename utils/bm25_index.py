@@ -0,0 +1,336 @@
+import os
+import re
+import math
+import heapq
+import sqlite3
+import threading
+import numpy as np
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+BM25_INDEX_DIR = os.environ.get('BM25_INDEX_DIR', os.path.join('data', 'bm25'))
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# SQLite caps the number of bound parameters per statement
+_PARAM_BATCH = 500
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def _batched(items: Sequence[Any], size: int = _PARAM_BATCH) -> Iterable[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class BM25Index:
+    """Persistent inverted index of one knowledge base with BM25 ranking
+
+    Postings (term, chunk id, term frequency) live in a SQLite file clustered
+    by term, so a query reads only the posting lists of its own terms.
+    Document frequencies and corpus totals are kept up to date on every add
+    and delete, so nothing is ever rescanned.
+
+    ``search`` uses MaxScore: terms are visited rarest first and, once the
+    remaining terms can no longer lift an unseen chunk into the top k, their
+    posting lists are only probed for the chunks still in contention.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._local = threading.local()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(path)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS docs (
+                    doc_id TEXT PRIMARY KEY,
+                    file_id TEXT,
+                    length INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_docs_file ON docs (file_id);
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, doc_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+                CREATE TABLE IF NOT EXISTS terms (
+                    term TEXT PRIMARY KEY,
+                    df INTEGER NOT NULL
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            ''')
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, conn: sqlite3.Connection, key: str) -> int:
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _add_meta(self, conn: sqlite3.Connection, key: str, delta: int) -> None:
+        conn.execute('''
+            INSERT INTO meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = value + excluded.value
+        ''', (key, delta))
+
+    @property
+    def is_built(self) -> bool:
+        """Whether the index has been filled with the knowledge base's existing chunks"""
+        return bool(self._meta(self._connection(), 'built'))
+
+    def mark_built(self) -> None:
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', 1)")
+
+    def __len__(self) -> int:
+        return self._meta(self._connection(), 'doc_count')
+
+    def doc_ids(self) -> List[str]:
+        return [row[0] for row in self._connection().execute('SELECT doc_id FROM docs')]
+
+    def add_documents(self, documents: Iterable[Tuple[str, Any, str]]) -> int:
+        """Index (chunk id, file id, text) triples; existing ids are replaced"""
+        documents = list(documents)
+        if not documents:
+            return 0
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._delete(conn, [doc_id for doc_id, _, _ in documents])
+
+            postings = []
+            df = Counter()
+            total_length = 0
+            for doc_id, file_id, text in documents:
+                counts = Counter(tokenize(text or ''))
+                length = sum(counts.values())
+                total_length += length
+                conn.execute('INSERT INTO docs (doc_id, file_id, length) VALUES (?, ?, ?)',
+                             (doc_id, None if file_id is None else str(file_id), length))
+                postings.extend((term, doc_id, tf) for term, tf in counts.items())
+                df.update(counts.keys())
+
+            conn.executemany('INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)', postings)
+            conn.executemany('''
+                INSERT INTO terms (term, df) VALUES (?, ?)
+                ON CONFLICT(term) DO UPDATE SET df = df + excluded.df
+            ''', df.items())
+            self._add_meta(conn, 'doc_count', len(documents))
+            self._add_meta(conn, 'total_length', total_length)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(documents)
+
+    def _delete(self, conn: sqlite3.Connection, doc_ids: Sequence[str]) -> int:
+        removed = 0
+        for batch in _batched(list(doc_ids)):
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(
+                f'SELECT doc_id, length FROM docs WHERE doc_id IN ({placeholders})', batch
+            ).fetchall()
+            if not rows:
+                continue
+            present = [doc_id for doc_id, _ in rows]
+            placeholders = ','.join('?' * len(present))
+
+            df = conn.execute(
+                f'SELECT term, COUNT(*) FROM postings WHERE doc_id IN ({placeholders}) GROUP BY term', present
+            ).fetchall()
+            conn.executemany('UPDATE terms SET df = df - ? WHERE term = ?', [(count, term) for term, count in df])
+            conn.execute('DELETE FROM terms WHERE df <= 0')
+            conn.execute(f'DELETE FROM postings WHERE doc_id IN ({placeholders})', present)
+            conn.execute(f'DELETE FROM docs WHERE doc_id IN ({placeholders})', present)
+
+            self._add_meta(conn, 'doc_count', -len(rows))
+            self._add_meta(conn, 'total_length', -sum(length for _, length in rows))
+            removed += len(rows)
+        return removed
+
+    def delete_documents(self, doc_ids: Sequence[str]) -> int:
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            removed = self._delete(conn, doc_ids)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return removed
+
+    def delete_files(self, file_ids: Iterable[Any]) -> int:
+        """Remove every chunk of the given files"""
+        conn = self._connection()
+        keys = [str(file_id) for file_id in file_ids]
+        doc_ids = []
+        for batch in _batched(keys):
+            placeholders = ','.join('?' * len(batch))
+            doc_ids.extend(row[0] for row in conn.execute(
+                f'SELECT doc_id FROM docs WHERE file_id IN ({placeholders})', batch
+            ))
+        return self.delete_documents(doc_ids) if doc_ids else 0
+
+    def _corpus(self, conn: sqlite3.Connection) -> Tuple[int, float]:
+        doc_count = self._meta(conn, 'doc_count')
+        total_length = self._meta(conn, 'total_length')
+        return doc_count, (total_length / doc_count if doc_count else 0.0)
+
+    def _idf(self, df: int, doc_count: int) -> float:
+        return math.log(1.0 + (doc_count - df + 0.5) / (df + 0.5))
+
+    def _term_scores(self, idf: float, tf: np.ndarray, length: np.ndarray, avgdl: float) -> np.ndarray:
+        norm = self.k1 * (1.0 - self.b + self.b * length / max(avgdl, 1e-9))
+        return idf * tf * (self.k1 + 1.0) / (tf + norm)
+
+    def _query_terms(self, conn: sqlite3.Connection, query: str) -> List[Tuple[str, int]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        placeholders = ','.join('?' * len(terms))
+        return conn.execute(f'SELECT term, df FROM terms WHERE term IN ({placeholders})', terms).fetchall()
+
+    def _postings(self, conn: sqlite3.Connection, term: str,
+                  doc_ids: Optional[Sequence[str]] = None) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        if doc_ids is None:
+            rows = conn.execute('''
+                SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id
+                WHERE p.term = ?
+            ''', (term,)).fetchall()
+        else:
+            rows = []
+            for batch in _batched(list(doc_ids)):
+                placeholders = ','.join('?' * len(batch))
+                rows.extend(conn.execute(f'''
+                    SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id
+                    WHERE p.term = ? AND p.doc_id IN ({placeholders})
+                ''', [term] + list(batch)).fetchall())
+        ids = [row[0] for row in rows]
+        tf = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        length = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+        return ids, tf, length
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float, int]]:
+        """Return (chunk id, BM25 score, matched query terms) for the top k chunks"""
+        conn = self._connection()
+        doc_count, avgdl = self._corpus(conn)
+        terms = self._query_terms(conn, query)
+        if not terms or k <= 0 or not doc_count:
+            return []
+
+        # Rarest (highest idf, hence highest upper bound) terms first
+        weighted = sorted(((self._idf(df, doc_count), term) for term, df in terms), reverse=True)
+        bounds = [idf * (self.k1 + 1.0) for idf, _ in weighted]
+        remaining = [sum(bounds[i + 1:]) for i in range(len(bounds))]
+
+        scores: Dict[str, float] = {}
+        matches: Counter = Counter()
+        threshold = 0.0
+        for i, (idf, term) in enumerate(weighted):
+            if len(scores) >= k and bounds[i] + remaining[i] < threshold:
+                # Unseen chunks can't reach the top k any more; probe only live candidates
+                candidates = [doc_id for doc_id, score in scores.items()
+                              if score + bounds[i] + remaining[i] >= threshold]
+                if not candidates:
+                    break
+                ids, tf, length = self._postings(conn, term, candidates)
+            else:
+                ids, tf, length = self._postings(conn, term)
+
+            for doc_id, score in zip(ids, self._term_scores(idf, tf, length, avgdl).tolist()):
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+                matches[doc_id] += 1
+
+            if len(scores) >= k:
+                threshold = heapq.nlargest(k, scores.values())[-1]
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(doc_id, score, matches[doc_id]) for doc_id, score in top]
+
+    def score_documents(self, query: str, doc_ids: Sequence[str]) -> List[float]:
+        """BM25 scores of specific chunks, reading only their query-term postings"""
+        conn = self._connection()
+        doc_count, avgdl = self._corpus(conn)
+        scores = dict.fromkeys(doc_ids, 0.0)
+        if not doc_count or not scores:
+            return [0.0] * len(doc_ids)
+
+        for term, df in self._query_terms(conn, query):
+            ids, tf, length = self._postings(conn, term, list(scores))
+            idf = self._idf(df, doc_count)
+            for doc_id, score in zip(ids, self._term_scores(idf, tf, length, avgdl).tolist()):
+                scores[doc_id] += score
+        return [scores[doc_id] for doc_id in doc_ids]
+
+    def clear(self) -> None:
+        conn = self._connection()
+        conn.executescript('''
+            BEGIN IMMEDIATE;
+            DELETE FROM postings;
+            DELETE FROM docs;
+            DELETE FROM terms;
+            DELETE FROM meta;
+            COMMIT;
+        ''')
+
+    def close(self) -> None:
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connection()
+        doc_count, avgdl = self._corpus(conn)
+        return {
+            'documents': doc_count,
+            'avg_document_length': round(avgdl, 2),
+            'terms': conn.execute('SELECT COUNT(*) FROM terms').fetchone()[0],
+            'built': bool(self._meta(conn, 'built'))
+        }
+
+_indexes: Dict[str, BM25Index] = {}
+_indexes_lock = threading.Lock()
+
+def bm25_index_path(knowledge_base_id: Any) -> str:
+    return os.path.join(BM25_INDEX_DIR, f"{knowledge_base_id}.sqlite3")
+
+def get_bm25_index(knowledge_base_id: Any) -> BM25Index:
+    """Process-wide BM25 index of a knowledge base"""
+    path = bm25_index_path(knowledge_base_id)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = BM25Index(path)
+            _indexes[path] = index
+        return index
+
+def remove_bm25_index(knowledge_base_id: Any) -> None:
+    """Forget the index of a deleted knowledge base and delete its files"""
+    path = bm25_index_path(knowledge_base_id)
+    with _indexes_lock:
+        index = _indexes.pop(path, None)
+    if index is not None:
+        index.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
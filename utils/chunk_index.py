@@ -0,0 +1,196 @@
+import re
+import math
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from utils.vector_cache import normalize_rows
+
+_WORD_RE = re.compile(r'\w+')
+_SENTENCE_END_RE = re.compile(r'[.!?]+')
+
+# IDF of a term found in only one of two documents with sklearn's smoothed
+# formula ln((1 + n) / (1 + df)) + 1; a term in both has IDF 1
+_PAIR_IDF_SINGLE = math.log(3 / 2) + 1
+
+def _tokens(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+def _is_tfidf_term(term: str) -> bool:
+    # TfidfVectorizer's default pattern keeps words of two or more characters
+    return len(term) > 1 and term not in ENGLISH_STOP_WORDS
+
+def document_quality(document: str) -> float:
+    """Length, sentence structure and content-word share of a text, in [0, 1]"""
+    words = document.split()
+    word_count = len(words)
+    sentence_count = len(_SENTENCE_END_RE.findall(document))
+
+    # Prefer documents with reasonable length and proper sentence structure
+    length_score = min(word_count / 200, 1.0)
+    structure_score = min(sentence_count / 10, 1.0)
+
+    # Check for informative content (not just stop words)
+    content_words = sum(1 for word in words if len(word) > 3)
+    content_score = min(content_words / word_count, 1.0) if word_count > 0 else 0.0
+
+    return (length_score + structure_score + content_score) / 3
+
+class ChunkIndex:
+    """Chunks tokenised once into term postings, plus their stacked embeddings
+
+    Every per-query score is computed for all chunks at once: semantic
+    similarity is one matrix-vector product and keyword scores only touch
+    the postings of the query's terms. Build an index once per chunk list
+    and reuse it across queries.
+    """
+
+    def __init__(self, texts: Sequence[str], embeddings: Optional[Sequence[Sequence[float]]] = None):
+        self.texts = [text or '' for text in texts]
+        self.lowered = [text.lower() for text in self.texts]
+        count = len(self.texts)
+
+        vocabulary: Dict[str, int] = {}
+        rows: List[int] = []
+        term_ids: List[int] = []
+        frequencies: List[int] = []
+        self.distinct_terms = np.zeros(count, dtype=np.int64)
+        self.quality = np.zeros(count, dtype=np.float64)
+
+        for row, text in enumerate(self.lowered):
+            counts: Dict[int, int] = {}
+            for term in _WORD_RE.findall(text):
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            rows.extend([row] * len(counts))
+            term_ids.extend(counts.keys())
+            frequencies.extend(counts.values())
+            self.distinct_terms[row] = len(counts)
+            self.quality[row] = document_quality(self.texts[row])
+
+        self.vocabulary = vocabulary
+        self.tfidf_terms = np.array([_is_tfidf_term(term) for term in vocabulary], dtype=bool)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        frequencies = np.asarray(frequencies, dtype=np.float64)
+
+        # Sum of squared frequencies of each chunk's TF-IDF terms, for its vector norm
+        self.tfidf_sq = np.bincount(rows, weights=frequencies ** 2 * self.tfidf_terms[term_ids], minlength=count)
+
+        # Postings grouped by term: rows and frequencies of term t live in [ptr[t], ptr[t + 1])
+        order = np.argsort(term_ids, kind='stable')
+        self.posting_rows = rows[order]
+        self.posting_tf = frequencies[order]
+        self.posting_ptr = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)))])
+
+        self.matrix, self.has_embedding = self._stack(embeddings, count)
+
+    @staticmethod
+    def _stack(embeddings: Optional[Sequence[Sequence[float]]], count: int) -> Tuple[np.ndarray, np.ndarray]:
+        has_embedding = np.zeros(count, dtype=bool)
+        if embeddings is None:
+            return np.empty((count, 0), dtype=np.float32), has_embedding
+
+        dimension = next((len(e) for e in embeddings if e is not None and len(e)), 0)
+        matrix = np.zeros((count, dimension), dtype=np.float32)
+        for row, embedding in enumerate(embeddings[:count]):
+            if embedding is not None and len(embedding) == dimension and dimension:
+                matrix[row] = embedding
+                has_embedding[row] = True
+        return normalize_rows(matrix), has_embedding
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return self.posting_rows[:0], self.posting_tf[:0]
+        start, end = self.posting_ptr[term_id], self.posting_ptr[term_id + 1]
+        return self.posting_rows[start:end], self.posting_tf[start:end]
+
+    def _matched_terms(self, terms: Sequence[str]) -> np.ndarray:
+        """Number of the given distinct terms each chunk contains"""
+        matched = np.zeros(len(self), dtype=np.float64)
+        for term in terms:
+            rows, _ = self._postings(term)
+            matched[rows] += 1
+        return matched
+
+    def semantic_scores(self, query_embedding: Sequence[float]) -> np.ndarray:
+        """Cosine similarity of every chunk to the query, 0 for chunks without an embedding"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or self.matrix.shape[1] != len(query):
+            return np.zeros(len(self), dtype=np.float64)
+        return (self.matrix @ (query / norm)).astype(np.float64)
+
+    def keyword_scores(self, query: str) -> np.ndarray:
+        """Jaccard overlap of query and chunk words, plus 0.3 for an exact phrase match, capped at 1"""
+        query_terms = list(dict.fromkeys(_tokens(query)))
+        intersection = self._matched_terms(query_terms)
+        union = len(query_terms) + self.distinct_terms - intersection
+        scores = np.divide(intersection, union, out=np.zeros(len(self)), where=union > 0)
+
+        if len(query) > 5:
+            phrase = query.lower()
+            # Words strictly inside the phrase are whole words of any chunk containing it
+            interior = list(dict.fromkeys(_tokens(query)[1:-1]))
+            if interior:
+                candidates = np.flatnonzero(self._matched_terms(interior) == len(interior))
+            else:
+                candidates = range(len(self))
+            for row in candidates:
+                if phrase in self.lowered[row]:
+                    scores[row] += 0.3
+
+        return np.minimum(scores, 1.0)
+
+    def coverage_scores(self, query: str) -> np.ndarray:
+        """Share of the distinct query words present in each chunk"""
+        query_terms = list(dict.fromkeys(_tokens(query)))
+        if not query_terms:
+            return np.zeros(len(self))
+        return self._matched_terms(query_terms) / len(query_terms)
+
+    def relevance_scores(self, query: str) -> np.ndarray:
+        """TF-IDF cosine between the query and each chunk, as a query/chunk pair
+
+        Matches fitting sklearn's TfidfVectorizer (English stop words) on
+        ``[query, chunk]`` for every chunk separately: shared terms get IDF 1
+        and terms in only one of the two get ln(1.5) + 1. Chunks where
+        neither side has a usable term fall back to Jaccard word overlap.
+        """
+        counts: Dict[str, int] = {}
+        for term in _tokens(query):
+            if _is_tfidf_term(term):
+                counts[term] = counts.get(term, 0) + 1
+
+        idf_sq = _PAIR_IDF_SINGLE ** 2
+        dot = np.zeros(len(self))
+        shared_query_sq = np.zeros(len(self))
+        shared_doc_sq = np.zeros(len(self))
+        for term, query_tf in counts.items():
+            rows, doc_tf = self._postings(term)
+            dot[rows] += query_tf * doc_tf
+            shared_query_sq[rows] += query_tf ** 2
+            shared_doc_sq[rows] += doc_tf ** 2
+
+        query_sq = sum(tf ** 2 for tf in counts.values())
+        query_norm_sq = idf_sq * query_sq - (idf_sq - 1) * shared_query_sq
+        doc_norm_sq = idf_sq * self.tfidf_sq - (idf_sq - 1) * shared_doc_sq
+        denominator = np.sqrt(query_norm_sq * doc_norm_sq)
+        scores = np.divide(dot, denominator, out=np.zeros(len(self)), where=denominator > 0)
+
+        # sklearn raises on an empty vocabulary; the old code then used word overlap
+        empty = (self.tfidf_sq == 0) if not counts else np.zeros(len(self), dtype=bool)
+        if empty.any():
+            query_terms = list(dict.fromkeys(_tokens(query)))
+            intersection = self._matched_terms(query_terms)
+            union = len(query_terms) + self.distinct_terms - intersection
+            jaccard = np.divide(intersection, union, out=np.zeros(len(self)),
+                                where=(union > 0) & (self.distinct_terms > 0) & (len(query_terms) > 0))
+            scores[empty] = jaccard[empty]
+        return scores
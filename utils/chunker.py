@@ -0,0 +1,160 @@
+import os
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from utils.tokenizer import MAX_PIECE_CHARS, PIECE_PATTERN, Tokenizer, get_tokenizer
+
+# Chunk sizes are measured in tokens of the embedding model's tokenizer
+DEFAULT_CHUNK_TOKENS = int(os.environ.get('CHUNK_TOKENS', '512'))
+DEFAULT_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', '64'))
+
+# Characters a piece may end with to close a sentence or paragraph
+SENTENCE_ENDINGS = frozenset('.!?\n。！？')
+
+class Chunk(NamedTuple):
+    """A chunk of text and the span ``[start, end)`` of the source it was cut from
+
+    ``text`` is exactly ``source[start:end]``: chunks are stripped of
+    surrounding whitespace by moving the offsets, never by rewriting text.
+    """
+    text: str
+    start: int
+    end: int
+    tokens: int
+
+def _split_long(pieces: List[str]) -> List[str]:
+    split = []
+    for piece in pieces:
+        if len(piece) > MAX_PIECE_CHARS:
+            split.extend(piece[i:i + MAX_PIECE_CHARS] for i in range(0, len(piece), MAX_PIECE_CHARS))
+        else:
+            split.append(piece)
+    return split
+
+def iter_chunk_spans(pieces: Iterable[str], chunk_size: int = DEFAULT_CHUNK_TOKENS,
+                     overlap: int = DEFAULT_OVERLAP_TOKENS,
+                     tokenizer: Optional[Tokenizer] = None) -> Iterator[Chunk]:
+    """Split a stream of text into chunks of at most ``chunk_size`` tokens
+
+    Text is cut between the pieces ``PIECE_PATTERN`` splits it into (so
+    never inside a word), preferring the last sentence or paragraph end in
+    the second half of a chunk, and each chunk repeats up to ``overlap``
+    tokens from the end of the previous one (from a sentence start when
+    one falls within them). A single piece (a word, or a
+    ``MAX_PIECE_CHARS`` slice of an unbroken run) larger than
+    ``chunk_size`` becomes a chunk of its own.
+
+    Each block is split and counted in bulk, keeping prefix sums of the
+    token counts, and chunk ends are found by bisecting them, so the work
+    is linear in the text length and per-chunk Python work does not depend
+    on the chunk size. Only the text of the current chunk is kept between
+    blocks.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1 token")
+    if not 0 <= overlap < chunk_size:
+        raise ValueError("overlap must be at least 0 and smaller than chunk_size")
+    piece_counts = (tokenizer or get_tokenizer()).piece_counts
+    min_cut = chunk_size // 2
+
+    buffer = ''
+    base = 0          # source offset of buffer[0]
+    # Per piece read so far: its source offset and the token total before
+    # it, each with a trailing entry for the end of the last piece
+    starts = [0]
+    totals = [0]
+    boundaries: List[int] = []   # pieces ending a sentence
+    head = 0          # first piece of the current chunk
+    emitted = -1      # last piece already emitted in a chunk
+    last_end = 0      # source offset where the last chunk ended
+
+    def make(first: int, last: int) -> Optional[Chunk]:
+        start, end = starts[first], starts[last + 1]
+        text = buffer[start - base:end - base]
+        stripped = text.strip()
+        if not stripped:
+            return None
+        start += len(text) - len(text.lstrip())
+        return Chunk(stripped, start, start + len(stripped), totals[last + 1] - totals[first])
+
+    def blocks():
+        yield from pieces
+        yield None
+
+    for block in blocks():
+        final = block is None
+        if not final:
+            if not block:
+                continue
+            if head * 2 > len(starts):
+                # Forget pieces before the current chunk
+                del starts[:head], totals[:head]
+                boundaries = [b - head for b in boundaries[bisect_left(boundaries, head):]]
+                emitted -= head
+                head = 0
+            keep = starts[head] - base
+            if keep * 2 > len(buffer):
+                buffer = buffer[keep:]
+                base += keep
+            buffer += block
+
+        scan = starts[-1] - base
+        found = PIECE_PATTERN.findall(buffer, scan)
+        if found and not final:
+            # The last piece may continue in the next block
+            found.pop()
+        if found:
+            if max(map(len, found)) > MAX_PIECE_CHARS:
+                found = _split_long(found)
+            first = len(starts) - 1
+            starts.pop()
+            starts.extend(accumulate(map(len, found), initial=base + scan))
+            total = totals.pop()
+            totals.extend(accumulate(piece_counts(found), initial=total))
+            boundaries.extend([i for i, piece in enumerate(found, first) if piece[-1] in SENTENCE_ENDINGS])
+
+        count = len(starts) - 1
+        while emitted < count - 1:
+            # Pieces head..fit-1 fit in one chunk
+            fit = bisect_right(totals, totals[head] + chunk_size, head) - 1
+            if fit >= count:
+                if not final:
+                    break
+                last = count - 1
+            else:
+                last = max(fit - 1, head)
+                if last <= emitted:
+                    # Overlap plus the next piece do not fit; shorten the overlap
+                    head = min(bisect_left(totals, totals[emitted + 2] - chunk_size, head), emitted + 1)
+                    continue
+                k = bisect_right(boundaries, last) - 1
+                if k >= 0:
+                    boundary = boundaries[k]
+                    if boundary > emitted and boundary >= head and totals[boundary + 1] - totals[head] >= min_cut:
+                        last = boundary
+
+            chunk = make(head, last)
+            # Whitespace after the last chunk does not make a new one
+            if chunk is not None and chunk.end > last_end:
+                last_end = chunk.end
+                yield chunk
+            emitted = last
+            # The next chunk starts with up to ``overlap`` tokens before the cut,
+            # from the first sentence start among them if there is one
+            head = min(bisect_left(totals, totals[last + 1] - overlap, head + 1), last + 1)
+            k = bisect_left(boundaries, head - 1)
+            if k < len(boundaries) and boundaries[k] < last:
+                head = boundaries[k] + 1
+
+def chunk_spans(text: str, chunk_size: int = DEFAULT_CHUNK_TOKENS, overlap: int = DEFAULT_OVERLAP_TOKENS,
+                tokenizer: Optional[Tokenizer] = None) -> List[Chunk]:
+    """Chunks of ``text`` with their character offsets"""
+    if not text:
+        return []
+    return list(iter_chunk_spans([text], chunk_size, overlap, tokenizer))
+
+def chunk_texts(text: str, chunk_size: int = DEFAULT_CHUNK_TOKENS, overlap: int = DEFAULT_OVERLAP_TOKENS,
+                tokenizer: Optional[Tokenizer] = None) -> List[str]:
+    """Chunks of ``text`` as plain strings"""
+    return [chunk.text for chunk in chunk_spans(text, chunk_size, overlap, tokenizer)]
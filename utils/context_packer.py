@@ -0,0 +1,171 @@
+import os
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+
+from services.ai_providers import context_window
+from utils.tokenizer import get_tokenizer
+
+# Tokens kept free for the model's answer
+DEFAULT_OUTPUT_TOKENS = int(os.environ.get('RAG_OUTPUT_TOKENS', '2048'))
+
+# Tokens each chat message costs for its role and framing
+MESSAGE_OVERHEAD_TOKENS = 8
+
+# Word-shingle Jaccard similarity at which a chunk repeats a better one
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('RAG_NEAR_DUPLICATE_THRESHOLD', '0.8'))
+SHINGLE_WORDS = 4
+
+# Cells on the knapsack's token axis; budgets above this are solved in coarser units
+KNAPSACK_CELLS = 4096
+
+# Score fields of search results, most specific first
+SCORE_KEYS = ('rerank_score', 'combined_score', 'similarity', 'score')
+
+class PackedContext(NamedTuple):
+    """Context text, the chunks it holds (in input order) and its token accounting"""
+    context: str
+    chunks: List[Dict[str, Any]]
+    token_counts: Dict[str, Any]
+
+def shingles(text: str) -> Set[int]:
+    """Hashed runs of ``SHINGLE_WORDS`` words, for near-duplicate detection"""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {hash(tuple(words))} if words else set()
+    return {hash(tuple(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def drop_near_duplicates(texts: Sequence[str], threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[int]:
+    """Indices of the texts to keep: each one unless it nearly repeats an earlier kept one
+
+    Pass texts best first, so the better of two near-duplicates survives.
+    """
+    kept: List[int] = []
+    kept_shingles: List[Set[int]] = []
+    for i, text in enumerate(texts):
+        current = shingles(text)
+        duplicate = False
+        for other in kept_shingles:
+            union = len(current | other)
+            if union and len(current & other) / union >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(i)
+            kept_shingles.append(current)
+    return kept
+
+def knapsack(costs: Sequence[int], values: Sequence[float], capacity: int) -> List[int]:
+    """Indices of items with the highest total value whose costs fit in ``capacity``
+
+    0/1 knapsack by dynamic programming over a token axis of at most
+    ``KNAPSACK_CELLS`` cells. Costs are rounded up and the capacity down
+    to whole cells, so the chosen set always fits.
+    """
+    if capacity <= 0 or not costs:
+        return []
+    unit = max(1, -(-capacity // KNAPSACK_CELLS))
+    cells = capacity // unit
+    weights = [-(-cost // unit) for cost in costs]
+
+    best = np.zeros(cells + 1)
+    taken = np.zeros((len(costs), cells + 1), dtype=bool)
+    for i, (weight, value) in enumerate(zip(weights, values)):
+        if weight > cells or value <= 0:
+            continue
+        with_item = best[:cells + 1 - weight] + value
+        better = with_item > best[weight:]
+        taken[i, weight:] = better
+        best[weight:] = np.where(better, with_item, best[weight:])
+
+    chosen = []
+    cell = cells
+    for i in range(len(costs) - 1, -1, -1):
+        if taken[i, cell]:
+            chosen.append(i)
+            cell -= weights[i]
+    return sorted(chosen)
+
+def chunk_score(chunk: Dict[str, Any], rank: int) -> float:
+    """Relevance of a search result, falling back to its rank"""
+    for key in SCORE_KEYS:
+        score = chunk.get(key)
+        if score is not None and score == score:
+            return max(float(score), 1e-6)
+    return 1.0 / (rank + 1)
+
+class ContextPacker:
+    """Fits retrieved chunks into a model's prompt budget
+
+    Tokens are counted with the model's own tokenizer (see
+    ``utils.tokenizer``). The budget is the model's context window minus
+    the answer's reserve, the fixed prompt text and per-message framing,
+    optionally capped by ``max_context_tokens``. Near-duplicate chunks are
+    dropped in favour of the better-scored copy, then the set of chunks
+    with the highest total score that fits the budget is chosen.
+    """
+
+    def __init__(self, model: str = 'gpt-4o', output_tokens: int = DEFAULT_OUTPUT_TOKENS,
+                 max_context_tokens: Optional[int] = None,
+                 duplicate_threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.model = model
+        self.tokenizer = get_tokenizer(model)
+        self.context_window = context_window(model)
+        self.output_tokens = output_tokens
+        self.max_context_tokens = max_context_tokens
+        self.duplicate_threshold = duplicate_threshold
+
+    def budget(self, reserved_text: str = '', messages: int = 1) -> int:
+        """Tokens left for context after the answer, fixed prompt text and message framing"""
+        budget = (self.context_window - self.output_tokens - self.tokenizer.count(reserved_text)
+                  - MESSAGE_OVERHEAD_TOKENS * messages)
+        if self.max_context_tokens is not None:
+            budget = min(budget, self.max_context_tokens)
+        return max(0, budget)
+
+    def pack(self, chunks: Sequence[Dict[str, Any]], format_chunk: Callable[[int, Dict[str, Any]], str],
+             reserved_text: str = '', messages: int = 1, separator: str = '\n',
+             text_key: str = 'chunk_text', budget: Optional[int] = None) -> PackedContext:
+        """Choose and join chunks, best first in ``chunks``, under the token budget
+
+        ``format_chunk(position, chunk)`` renders a chunk at its position in
+        the packed context. ``reserved_text`` is the rest of the prompt
+        (system message, instructions, question); ``budget`` overrides the
+        computed one.
+        """
+        count = self.tokenizer.count
+        if budget is None:
+            budget = self.budget(reserved_text, messages)
+        kept = drop_near_duplicates([chunk.get(text_key) or '' for chunk in chunks], self.duplicate_threshold)
+        candidates = [chunks[i] for i in kept]
+        values = [chunk_score(chunks[i], i) for i in kept]
+
+        # Positions are unknown until selection; render at the last one so labels are never undercounted
+        separator_tokens = count(separator)
+        last = max(len(candidates) - 1, 0)
+        costs = [count(format_chunk(last, chunk)) + separator_tokens for chunk in candidates]
+        chosen = knapsack(costs, values, budget + separator_tokens)
+
+        # Token merges across chunk boundaries can shift the sum slightly; verify the joined text
+        while True:
+            selected = [candidates[i] for i in chosen]
+            context = separator.join(format_chunk(position, chunk) for position, chunk in enumerate(selected))
+            context_tokens = count(context)
+            if context_tokens <= budget or not chosen:
+                break
+            chosen.remove(min(chosen, key=lambda i: values[i]))
+
+        reserved_tokens = count(reserved_text)
+        return PackedContext(context, selected, {
+            'tokenizer': self.tokenizer.name,
+            'context_window': self.context_window,
+            'output_reserved': self.output_tokens,
+            'budget': budget,
+            'context': context_tokens,
+            'prompt': context_tokens + reserved_tokens + MESSAGE_OVERHEAD_TOKENS * messages,
+            'chunks_considered': len(chunks),
+            'chunks_used': len(selected),
+            'near_duplicates_dropped': len(chunks) - len(candidates),
+            'over_budget_dropped': len(candidates) - len(selected)
+        })
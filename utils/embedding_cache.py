@@ -0,0 +1,209 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Callable, Dict, List, Optional, Sequence
+
+from utils.vector_codec import encode_vector, decode_vector
+
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', 'data/embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get('EMBEDDING_CACHE_MAX_MB', '1024'))
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFKC with runs of whitespace collapsed"""
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """Embeddings keyed by (model, hash of normalised text) in a SQLite file
+
+    The file is shared by every worker process. Once the stored vectors
+    exceed ``max_bytes`` the least recently used tenth is evicted. A cache
+    with ``max_bytes`` of 0 is disabled and always misses.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stored_bytes = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, texts: Sequence[str], model: str) -> List[Optional[List[float]]]:
+        """Cached vectors for the texts, None where missing"""
+        if not self.enabled or not texts:
+            with self._lock:
+                self.misses += len(texts)
+            return [None] * len(texts)
+
+        keys = [cache_key(model, text) for text in texts]
+        found: Dict[str, bytes] = {}
+        try:
+            conn = self._connection()
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start:start + _LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                found.update(conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch
+                ).fetchall())
+
+            if found:
+                now = time.time()
+                hit_keys = list(found)
+                for start in range(0, len(hit_keys), _LOOKUP_BATCH):
+                    batch = hit_keys[start:start + _LOOKUP_BATCH]
+                    placeholders = ','.join('?' * len(batch))
+                    conn.execute(f'UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})',
+                                 [now] + batch)
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Embedding cache lookup failed: {e}")
+            found = {}
+
+        results = [decode_vector(found[key]).tolist() if key in found else None for key in keys]
+        with self._lock:
+            hit_count = sum(1 for result in results if result is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        return self.get_many([text], model)[0]
+
+    def put_many(self, texts: Sequence[str], model: str, vectors: Sequence[Sequence[float]]) -> None:
+        if not self.enabled or not texts:
+            return
+
+        now = time.time()
+        rows = [(cache_key(model, text), model, encode_vector(vector), now)
+                for text, vector in zip(texts, vectors)]
+        try:
+            conn = self._connection()
+            conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)', rows)
+            conn.commit()
+            with self._lock:
+                if self._stored_bytes is not None:
+                    self._stored_bytes += sum(len(row[2]) for row in rows)
+            self._evict(conn)
+        except sqlite3.Error as e:
+            logging.warning(f"Embedding cache write failed: {e}")
+
+    def put(self, text: str, model: str, vector: Sequence[float]) -> None:
+        self.put_many([text], model, [vector])
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if self._stored_bytes is None:
+                self._stored_bytes = conn.execute(
+                    'SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings'
+                ).fetchone()[0]
+            if self._stored_bytes <= self.max_bytes:
+                return
+
+        # Other processes write too; recount before deciding how much to drop
+        total, count = conn.execute(
+            'SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings'
+        ).fetchone()
+        if total > self.max_bytes and count:
+            drop = max(1, count // 10)
+            conn.execute('''
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+                )
+            ''', (drop,))
+            conn.commit()
+            total = conn.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()[0]
+            with self._lock:
+                self.evictions += drop
+            logging.info(f"Evicted {drop} embeddings from cache")
+        with self._lock:
+            self._stored_bytes = total
+
+    def get_or_compute(self, texts: Sequence[str], model: str,
+                       compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Return vectors for all texts, computing and storing only the missing ones
+
+        ``compute`` receives each distinct missing text once, in first-seen order.
+        """
+        texts = list(texts)
+        results = self.get_many(texts, model)
+
+        missing: Dict[str, List[int]] = {}
+        for i, result in enumerate(results):
+            if result is None:
+                missing.setdefault(cache_key(model, texts[i]), []).append(i)
+
+        if missing:
+            positions = list(missing.values())
+            to_compute = [texts[indices[0]] for indices in positions]
+            computed = compute(to_compute)
+            if len(computed) != len(to_compute):
+                raise ValueError(f"Expected {len(to_compute)} embeddings, got {len(computed)}")
+            self.put_many(to_compute, model, computed)
+            for indices, vector in zip(positions, computed):
+                vector = list(vector)
+                for i in indices:
+                    results[i] = vector
+
+        return results
+
+    def clear(self) -> None:
+        conn = self._connection()
+        conn.execute('DELETE FROM embeddings')
+        conn.commit()
+        with self._lock:
+            self._stored_bytes = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'stored_bytes': self._stored_bytes or 0,
+                'max_bytes': self.max_bytes
+            }
+
+# Global instance
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,101 @@
+import os
+import json
+import numpy as np
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+# Dimension of the shared vector database indexes (FAISS, HNSW, segments)
+DEFAULT_EMBEDDING_DIMENSION = int(os.environ.get('EMBEDDING_DIMENSION', '1536'))
+
+NATIVE_DIMENSIONS = {
+    'text-embedding-3-small': 1536,
+    'text-embedding-3-large': 3072,
+    'text-embedding-ada-002': 1536
+}
+
+# Models that accept the ``dimensions`` request parameter
+SHORTENABLE_MODELS = ('text-embedding-3-small', 'text-embedding-3-large')
+
+class EmbeddingDimensionError(ValueError):
+    """A vector's dimension does not match the knowledge base it is used with"""
+
+def native_dimension(model: Optional[str]) -> Optional[int]:
+    return NATIVE_DIMENSIONS.get(model or '')
+
+def supports_dimensions(model: Optional[str]) -> bool:
+    return (model or '') in SHORTENABLE_MODELS
+
+def cache_model(model: str, dimension: Optional[int] = None) -> str:
+    """Embedding cache key for a model at a target dimension
+
+    Full-size vectors keep the plain model name so existing cache entries
+    stay valid.
+    """
+    if dimension is None or dimension == native_dimension(model):
+        return model
+    return f"{model}@{dimension}"
+
+def embedding_dimension(kb_settings: Any = None, model: Optional[str] = None) -> Optional[int]:
+    """Target embedding dimension of a knowledge base, None for the model's full size
+
+    ``kb_settings`` is KnowledgeBase.settings, either a dict or its JSON
+    string form, with an optional ``embedding_dimension`` key.
+    """
+    if isinstance(kb_settings, str):
+        try:
+            kb_settings = json.loads(kb_settings)
+        except ValueError:
+            kb_settings = None
+    if not isinstance(kb_settings, dict) or kb_settings.get('embedding_dimension') is None:
+        return None
+
+    dimension = int(kb_settings['embedding_dimension'])
+    model = model or kb_settings.get('embedding_model')
+    limit = native_dimension(model)
+    if dimension <= 0 or (limit is not None and dimension > limit):
+        raise EmbeddingDimensionError(f"embedding_dimension must be between 1 and {limit or 'the model size'}, got {dimension}")
+    return dimension
+
+def shorten(vector: Sequence[float], dimension: Optional[int]) -> List[float]:
+    """Keep the first ``dimension`` components and rescale to unit length
+
+    This is what the text-embedding-3 models do server-side for the
+    ``dimensions`` parameter, so locally shortened and API-shortened vectors
+    are interchangeable.
+    """
+    if dimension is None or len(vector) == dimension:
+        return list(vector)
+    if len(vector) < dimension:
+        raise EmbeddingDimensionError(f"Cannot shorten a {len(vector)}-dimensional vector to {dimension}")
+    head = np.asarray(vector[:dimension], dtype=np.float64)
+    norm = np.linalg.norm(head)
+    return (head / norm if norm else head).tolist()
+
+def shorten_all(vectors: Iterable[Sequence[float]], dimension: Optional[int]) -> List[List[float]]:
+    return [shorten(vector, dimension) for vector in vectors]
+
+def dimension_metadata(dimension: int, model: Optional[str] = None) -> Dict[str, Any]:
+    """Entries recorded in FileEmbedding.embedding_metadata for a stored vector"""
+    native = native_dimension(model)
+    return {
+        'embedding_dimension': dimension,
+        'dimension_mode': 'full' if native in (None, dimension) else 'shortened'
+    }
+
+def check_query_dimension(query_vector: Sequence[float], dimension: int, knowledge_base_id: Any = None) -> None:
+    if dimension and len(query_vector) != dimension:
+        raise EmbeddingDimensionError(
+            f"Query embedding has {len(query_vector)} dimensions, "
+            f"knowledge base {knowledge_base_id} stores {dimension}"
+        )
+
+def check_uniform_dimensions(dimensions: Iterable[int], knowledge_base_id: Any = None) -> Optional[int]:
+    """The single dimension of a knowledge base's vectors; raises if they are mixed"""
+    counts = Counter(dimensions)
+    if len(counts) > 1:
+        found = ', '.join(f"{count} x {dimension}" for dimension, count in counts.most_common())
+        raise EmbeddingDimensionError(
+            f"Knowledge base {knowledge_base_id} mixes embedding dimensions ({found}); re-embed it "
+            f"with a single embedding_dimension"
+        )
+    return next(iter(counts), None)
@@ -0,0 +1,324 @@
+import os
+import time
+import queue
+import logging
+import threading
+import importlib
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Worker processes used for document parsing; 0 parses in the calling thread
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Seconds a single file may take to extract before its worker is killed
+EXTRACTION_TIMEOUT = float(os.environ.get('EXTRACTION_TIMEOUT', '300'))
+# Address-space limit of each worker; 0 leaves it unlimited
+EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get('EXTRACTION_MEMORY_LIMIT_MB', '4096'))
+
+# Modules imported by workers before the memory limit applies
+PRELOAD_MODULES = ('services.file_processor',)
+
+# How often a waiting job checks for cancellation
+_POLL_INTERVAL = 0.1
+
+# Set inside worker processes so nested extraction runs inline
+_IN_WORKER = False
+
+class ExtractionError(RuntimeError):
+    """A worker failed to extract a file"""
+
+class ExtractionTimeout(ExtractionError):
+    """Extraction ran past its deadline and the worker was killed"""
+
+class ExtractionCancelled(ExtractionError):
+    """Extraction was cancelled, e.g. because the file was deleted"""
+
+def _limit_memory(limit_mb: int) -> None:
+    if resource is None or limit_mb <= 0:
+        return
+    limit = limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _worker_main(conn, memory_limit_mb: int, preload: Sequence[str]) -> None:
+    global _IN_WORKER
+    _IN_WORKER = True
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logging.warning(f"Extraction worker could not preload {module}: {e}")
+    _limit_memory(memory_limit_mb)
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        fn, args = message
+        try:
+            result = (True, fn(*args))
+        except BaseException as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # Unpicklable result or exception
+            conn.send((False, ExtractionError(f"{type(e).__name__}: {e}")))
+        del result
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: int, preload: Sequence[str]):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, memory_limit_mb, tuple(preload)),
+                                       name='extraction-worker', daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+class ExtractionJob:
+    """Handle for a submitted extraction; ``cancel`` works queued or running"""
+
+    def __init__(self, key: Optional[str]):
+        self.key = key
+        self.cancelled = threading.Event()
+        self.future: Future = None
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        return self.future.result(timeout)
+
+class ExtractionPool:
+    """Bounded pool of worker processes for CPU-bound document parsing
+
+    PDF, Office and spreadsheet parsers are pure Python and hold the GIL for
+    the whole file, so parsing them in a request or socket thread stalls the
+    server. Jobs sent here run in one of ``max_workers`` processes, each
+    with an address-space limit. A job that passes its deadline, is
+    cancelled or kills its worker is reported as an ExtractionError and the
+    worker is replaced; the other workers keep running.
+
+    Workers start lazily and are forked from a forkserver that has already
+    imported the parsers, so replacing one is cheap. ``fn`` must be a
+    module-level function and its arguments and result picklable. With
+    ``max_workers`` of 0 jobs run in the caller, without limits.
+    """
+
+    def __init__(self, max_workers: int = EXTRACTION_WORKERS,
+                 timeout: float = EXTRACTION_TIMEOUT,
+                 memory_limit_mb: int = EXTRACTION_MEMORY_LIMIT_MB,
+                 preload: Sequence[str] = PRELOAD_MODULES):
+        self.max_workers = max(0, max_workers)
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.preload = tuple(preload)
+        self._lock = threading.Lock()
+        self._idle: 'queue.LifoQueue[_Worker]' = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, self.max_workers))
+        self._jobs: Set[ExtractionJob] = set()
+        self._context = None
+        self._dispatcher: Optional[ThreadPoolExecutor] = None
+        self.stats = {'completed': 0, 'failed': 0, 'timeouts': 0, 'cancelled': 0, 'workers_started': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_workers > 0 and not _IN_WORKER
+
+    def _get_context(self):
+        with self._lock:
+            if self._context is None:
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    self._context = multiprocessing.get_context('forkserver')
+                    self._context.set_forkserver_preload(['__main__', *self.preload])
+                else:
+                    self._context = multiprocessing.get_context('spawn')
+            return self._context
+
+    def _checkout(self) -> _Worker:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker.process.is_alive():
+                return worker
+            worker.kill()
+        self.stats['workers_started'] += 1
+        return _Worker(self._get_context(), self.memory_limit_mb, self.preload)
+
+    def _execute(self, fn: Callable, args: Tuple, deadline: float, job: ExtractionJob) -> Any:
+        if job.cancelled.is_set():
+            raise ExtractionCancelled(f"Extraction of {job.key} was cancelled")
+        if not self.enabled:
+            return fn(*args)
+        label = job.key or getattr(fn, '__name__', 'job')
+
+        with self._slots:
+            if job.cancelled.is_set():
+                raise ExtractionCancelled(f"Extraction of {label} was cancelled")
+            worker = self._checkout()
+            reusable = False
+            try:
+                worker.conn.send((fn, args))
+                while not worker.conn.poll(_POLL_INTERVAL):
+                    if job.cancelled.is_set():
+                        self.stats['cancelled'] += 1
+                        raise ExtractionCancelled(f"Extraction of {label} was cancelled")
+                    if time.monotonic() > deadline:
+                        self.stats['timeouts'] += 1
+                        raise ExtractionTimeout(f"Extraction of {label} timed out")
+                try:
+                    ok, value = worker.conn.recv()
+                except EOFError:
+                    worker.process.join(timeout=5)
+                    self.stats['failed'] += 1
+                    raise ExtractionError(f"Extraction worker for {label} died "
+                                          f"(exit code {worker.process.exitcode})")
+                # A worker that ran out of memory may be left in a bad state
+                reusable = not isinstance(value, MemoryError)
+            finally:
+                if reusable:
+                    self._idle.put(worker)
+                else:
+                    worker.kill()
+
+        if not ok:
+            self.stats['failed'] += 1
+            if isinstance(value, MemoryError):
+                raise ExtractionError(f"Extraction of {label} exceeded the "
+                                      f"{self.memory_limit_mb} MB memory limit")
+            raise value
+        self.stats['completed'] += 1
+        return value
+
+    def _track(self, job: ExtractionJob) -> None:
+        with self._lock:
+            self._jobs.add(job)
+
+    def _untrack(self, job: ExtractionJob) -> None:
+        with self._lock:
+            self._jobs.discard(job)
+
+    def deadline(self, timeout: Optional[float] = None) -> float:
+        """Monotonic deadline ``timeout`` seconds (default: the pool's) from now"""
+        timeout = self.timeout if timeout is None else timeout
+        return time.monotonic() + timeout if timeout and timeout > 0 else float('inf')
+
+    def run(self, fn: Callable, *args, key: Optional[str] = None,
+            timeout: Optional[float] = None, deadline: Optional[float] = None) -> Any:
+        """Run ``fn(*args)`` in a worker and return its result
+
+        ``key`` (usually the file id) lets ``cancel`` stop the job. Several
+        jobs for one file can share a ``deadline`` from ``deadline()``.
+        """
+        job = ExtractionJob(key)
+        self._track(job)
+        try:
+            return self._execute(fn, args, self.deadline(timeout) if deadline is None else deadline, job)
+        finally:
+            self._untrack(job)
+
+    def submit(self, fn: Callable, *args, key: Optional[str] = None,
+               timeout: Optional[float] = None, deadline: Optional[float] = None) -> ExtractionJob:
+        """Queue ``fn(*args)`` without waiting for it; see ``run``"""
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = ThreadPoolExecutor(max_workers=max(1, self.max_workers),
+                                                      thread_name_prefix='extraction')
+            dispatcher = self._dispatcher
+        job = ExtractionJob(key)
+        deadline = self.deadline(timeout) if deadline is None else deadline
+
+        def execute():
+            return self._execute(fn, args, deadline, job)
+
+        self._track(job)
+        job.future = dispatcher.submit(execute)
+        job.future.add_done_callback(lambda _: self._untrack(job))
+        return job
+
+    def imap(self, fn: Callable, arg_tuples: Iterable[Tuple], key: Optional[str] = None,
+             timeout: Optional[float] = None, deadline: Optional[float] = None) -> Iterator[Any]:
+        """Run ``fn`` over ``arg_tuples`` across the workers, yielding results in order
+
+        ``timeout`` (or ``deadline``) bounds all the jobs together. At most twice as many jobs
+        as workers are queued ahead of the consumer; if it stops early or a
+        job fails, the rest are cancelled.
+        """
+        deadline = self.deadline(timeout) if deadline is None else deadline
+        window = max(1, self.max_workers) * 2
+        pending: List[ExtractionJob] = []
+        arg_tuples = iter(arg_tuples)
+        try:
+            for args in arg_tuples:
+                pending.append(self.submit(fn, *args, key=key, deadline=deadline))
+                if len(pending) >= window:
+                    yield pending.pop(0).result()
+            while pending:
+                yield pending.pop(0).result()
+        finally:
+            for job in pending:
+                job.cancel()
+
+    def cancel(self, key: str) -> int:
+        """Cancel every queued or running job for ``key``; returns how many"""
+        with self._lock:
+            jobs = [job for job in self._jobs if job.key == key]
+        for job in jobs:
+            job.cancel()
+        if jobs:
+            logging.info(f"Cancelled {len(jobs)} extraction job(s) for {key}")
+        return len(jobs)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            jobs = list(self._jobs)
+            dispatcher, self._dispatcher = self._dispatcher, None
+        for job in jobs:
+            job.cancel()
+        if dispatcher is not None:
+            dispatcher.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            active = len(self._jobs)
+        return {**self.stats, 'active_jobs': active, 'idle_workers': self._idle.qsize(),
+                'max_workers': self.max_workers}
+
+# Global instance
+extraction_pool = ExtractionPool()
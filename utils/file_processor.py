@@ -2,11 +2,16 @@ import os
 import uuid
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
-import PyPDF2
-import docx
 import pandas as pd
 from sentence_transformers import SentenceTransformer
 import numpy as np
+from services.file_processor import extract_pieces, extract_table_text, iter_pdf_pages
+from utils.extraction_pool import extraction_pool
+from utils.blob_store import artifact_cache, blob_store
+from utils.chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, chunk_texts
+
+# Types parsed in the extraction pool, whose text is kept in the artifact cache
+CACHED_TYPES = {'pdf', 'doc', 'docx', 'xls', 'xlsx'}
 
 class FileProcessor:
     def __init__(self, upload_folder='uploads'):
@@ -53,31 +58,45 @@ class FileProcessor:
             'file_type': file_type
         }
     
-    def extract_text(self, file_path: str, file_type: str) -> str:
-        """Extract text content from various file types"""
+    def extract_text(self, file_path: str, file_type: str, job_key: str = None,
+                     content_hash: str = None) -> str:
+        """Extract text content from various file types; ``job_key`` (the file id) keys pooled jobs
+        
+        Text of binary formats is cached per content hash, so content
+        uploaded before, by any user, is not parsed again.
+        """
+        if file_type not in CACHED_TYPES:
+            return self._extract_text(file_path, file_type, job_key)
+        
+        try:
+            content_hash = content_hash or blob_store.content_hash(file_path)
+            cached = artifact_cache.get_text(content_hash)
+        except Exception as e:
+            return f"Error extracting text: {str(e)}"
+        if cached is not None:
+            return cached
+        
+        text = self._extract_text(file_path, file_type, job_key)
+        # Parse errors and missing parsers are not the content's text
+        if text and not text.startswith("Error") and "not installed" not in text[:100]:
+            artifact_cache.put_text(content_hash, text)
+        return text
+    
+    def _extract_text(self, file_path: str, file_type: str, job_key: str = None) -> str:
         try:
             if file_type == 'txt':
                 with open(file_path, 'r', encoding='utf-8') as f:
                     return f.read()
             
+            # Binary formats are parsed in the extraction pool
             elif file_type == 'pdf':
-                text = ""
-                with open(file_path, 'rb') as f:
-                    pdf_reader = PyPDF2.PdfReader(f)
-                    for page in pdf_reader.pages:
-                        text += page.extract_text() + "\n"
-                return text
+                return "".join(iter_pdf_pages(file_path, job_key))
             
             elif file_type in ['doc', 'docx']:
-                doc = docx.Document(file_path)
-                text = ""
-                for paragraph in doc.paragraphs:
-                    text += paragraph.text + "\n"
-                return text
+                return "".join(extraction_pool.run(extract_pieces, file_path, 'document', key=job_key))
             
             elif file_type in ['xls', 'xlsx']:
-                df = pd.read_excel(file_path)
-                return df.to_string()
+                return extraction_pool.run(extract_table_text, file_path, key=job_key)
             
             elif file_type == 'csv':
                 df = pd.read_csv(file_path)
@@ -89,33 +108,10 @@ class FileProcessor:
         except Exception as e:
             return f"Error extracting text: {str(e)}"
     
-    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> list:
-        """Split text into overlapping chunks for better RAG performance"""
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = min(start + chunk_size, len(text))
-            
-            # Try to end at a sentence boundary
-            if end < len(text):
-                last_period = text.rfind('.', start, end)
-                last_newline = text.rfind('\n', start, end)
-                boundary = max(last_period, last_newline)
-                
-                if boundary > start + chunk_size // 2:
-                    end = boundary + 1
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = max(start + chunk_size - overlap, end)
-        
-        return chunks
+    def chunk_text(self, text: str, chunk_size: int = DEFAULT_CHUNK_TOKENS,
+                   overlap: int = DEFAULT_OVERLAP_TOKENS) -> list:
+        """Split text into overlapping chunks of ``chunk_size`` tokens for better RAG performance"""
+        return chunk_texts(text, chunk_size, overlap)
     
     def generate_embeddings(self, chunks: list, model_name: str = 'all-MiniLM-L6-v2') -> np.ndarray:
         """Generate embeddings for text chunks"""
@@ -129,11 +125,11 @@ class FileProcessor:
             print(f"Error generating embeddings: {e}")
             return np.array([])
     
-    def process_file_for_rag(self, file_path: str, file_type: str) -> dict:
+    def process_file_for_rag(self, file_path: str, file_type: str, job_key: str = None) -> dict:
         """Process file for RAG integration"""
         try:
             # Extract text
-            text = self.extract_text(file_path, file_type)
+            text = self.extract_text(file_path, file_type, job_key)
             
             if not text or text.startswith("Error"):
                 return {"error": text or "Failed to extract text"}
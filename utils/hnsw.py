@@ -0,0 +1,351 @@
+import os
+import json
+import heapq
+import struct
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.vector_cache import normalize_rows, top_k_indices
+
+MAGIC = b'HNSW'
+VERSION = 1
+# version, dimension, M, ef_construction, ef_search, node count, entry point, max level
+FILE_HEADER = struct.Struct('<IIIIIqqi')
+LENGTH = struct.Struct('<Q')
+
+class HNSWIndex:
+    """Hierarchical navigable small world graph over normalised vectors
+
+    Similarity is the inner product of L2-normalised vectors (cosine). Nodes
+    are numbered in insertion order. Deleting a node only marks it: it keeps
+    routing searches but never appears in results, and ``compacted()``
+    rebuilds the graph without it.
+
+    Level 0 links live in a dense (n, 2M) int32 matrix padded with -1. The
+    few nodes on upper levels keep their links in per-level dicts.
+    """
+
+    def __init__(self, dimension: int, M: int = 16, ef_construction: int = 200,
+                 ef_search: int = 64, seed: Optional[int] = None, capacity: int = 1024):
+        if M < 2:
+            raise ValueError("M must be at least 2")
+
+        self.dimension = dimension
+        self.M = M
+        self.max_m0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1.0 / np.log(M)
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.RLock()
+
+        self._n = 0
+        self._deleted_count = 0
+        self.entry_point = -1
+        self.max_level = -1
+        self._upper: List[Dict[int, List[int]]] = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        self._vectors = np.zeros((capacity, self.dimension), dtype=np.float32)
+        self._levels = np.zeros(capacity, dtype=np.int8)
+        self._deleted = np.zeros(capacity, dtype=bool)
+        self._links0 = np.full((capacity, self.max_m0), -1, dtype=np.int32)
+        self._count0 = np.zeros(capacity, dtype=np.int32)
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._vectors)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        old = (self._vectors, self._levels, self._deleted, self._links0, self._count0)
+        self._allocate(new_capacity)
+        for target, source in zip((self._vectors, self._levels, self._deleted, self._links0, self._count0), old):
+            target[:self._n] = source[:self._n]
+
+    def __len__(self) -> int:
+        return self._n - self._deleted_count
+
+    @property
+    def node_count(self) -> int:
+        return self._n
+
+    @property
+    def deleted_count(self) -> int:
+        return self._deleted_count
+
+    @property
+    def nbytes(self) -> int:
+        upper = sum(len(links) for level in self._upper for links in level.values()) * 4
+        return int(self._vectors[:self._n].nbytes + self._links0[:self._n].nbytes + upper)
+
+    def is_deleted(self, node: int) -> bool:
+        return bool(self._deleted[node])
+
+    def vector(self, node: int) -> np.ndarray:
+        return self._vectors[node]
+
+    def _neighbours(self, node: int, level: int) -> np.ndarray:
+        if level == 0:
+            return self._links0[node, :self._count0[node]]
+        return np.asarray(self._upper[level - 1].get(node, ()), dtype=np.int32)
+
+    def _set_neighbours(self, node: int, level: int, neighbours: Sequence[int]) -> None:
+        if level == 0:
+            count = len(neighbours)
+            self._links0[node, :count] = neighbours
+            self._links0[node, count:] = -1
+            self._count0[node] = count
+        else:
+            self._upper[level - 1][node] = list(neighbours)
+
+    def _search_layer(self, query: np.ndarray, entry_points: Sequence[int], ef: int,
+                      level: int) -> List[Tuple[float, int]]:
+        """Best-first search of one layer; returns (similarity, node) best first"""
+        entry_points = list(entry_points)
+        visited = set(entry_points)
+        sims = self._vectors[entry_points] @ query
+
+        candidates = [(-float(s), node) for s, node in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(s), node) for s, node in zip(sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            negative_sim, node = heapq.heappop(candidates)
+            if -negative_sim < results[0][0] and len(results) >= ef:
+                break
+
+            fresh = [n for n in self._neighbours(node, level).tolist() if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+
+            for sim, neighbour in zip((self._vectors[fresh] @ query).tolist(), fresh):
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, neighbour))
+                    heapq.heappush(results, (sim, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _select_neighbours(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """Diversity heuristic from the HNSW paper, topped up with the best pruned candidates
+
+        ``candidates`` are (similarity to the base node, node), best first. A
+        candidate is kept only if it is closer to the base than to any already
+        kept neighbour.
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+
+        nodes = np.array([node for _, node in candidates], dtype=np.int64)
+        base_sims = np.array([sim for sim, _ in candidates], dtype=np.float32)
+        vectors = self._vectors[nodes]
+        pairwise = vectors @ vectors.T
+
+        selected: List[int] = []
+        pruned: List[int] = []
+        for i in range(len(nodes)):
+            if selected and pairwise[i, selected].max() > base_sims[i]:
+                pruned.append(i)
+                continue
+            selected.append(i)
+            if len(selected) == m:
+                break
+
+        selected.extend(pruned[:m - len(selected)])
+        return nodes[selected].tolist()
+
+    def _random_level(self) -> int:
+        return int(-np.log(1.0 - self._rng.random()) * self._level_mult)
+
+    def add(self, vectors: Sequence[Sequence[float]]) -> List[int]:
+        """Insert vectors and return their node numbers"""
+        block = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension))
+        with self._lock:
+            self._grow(self._n + len(block))
+            return [self._insert(vector) for vector in block]
+
+    def _insert(self, vector: np.ndarray) -> int:
+        node = self._n
+        level = self._random_level()
+        self._vectors[node] = vector
+        self._levels[node] = level
+        self._n += 1
+
+        while len(self._upper) < level:
+            self._upper.append({})
+
+        if self.entry_point < 0:
+            self.entry_point = node
+            self.max_level = level
+            for lc in range(1, level + 1):
+                self._upper[lc - 1][node] = []
+            return node
+
+        entry = self.entry_point
+        for lc in range(self.max_level, level, -1):
+            entry = self._search_layer(vector, [entry], 1, lc)[0][1]
+
+        entry_points = [entry]
+        for lc in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(vector, entry_points, self.ef_construction, lc)
+            max_links = self.max_m0 if lc == 0 else self.M
+            neighbours = self._select_neighbours(found, self.M)
+            self._set_neighbours(node, lc, neighbours)
+
+            for neighbour in neighbours:
+                links = self._neighbours(neighbour, lc).tolist()
+                links.append(node)
+                if len(links) > max_links:
+                    sims = self._vectors[links] @ self._vectors[neighbour]
+                    order = np.argsort(-sims)
+                    links = self._select_neighbours([(float(sims[i]), links[i]) for i in order], max_links)
+                self._set_neighbours(neighbour, lc, links)
+
+            entry_points = [n for _, n in found]
+
+        for lc in range(self.max_level + 1, level + 1):
+            self._upper[lc - 1][node] = []
+        if level > self.max_level:
+            self.max_level = level
+            self.entry_point = node
+
+        return node
+
+    def mark_deleted(self, node: int) -> None:
+        with self._lock:
+            if not self._deleted[node]:
+                self._deleted[node] = True
+                self._deleted_count += 1
+
+    def search(self, query: Sequence[float], k: int = 10, ef: Optional[int] = None,
+               allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Return (node, similarity) for the k nearest live nodes, best first
+
+        ``allowed`` is an optional boolean mask over nodes. Results are always
+        taken from the allowed live nodes; when the mask is small enough an
+        exact scan is cheaper than walking the graph, and otherwise ``ef`` is
+        widened until k allowed nodes are found.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if k <= 0 or norm == 0 or len(self) == 0:
+            return []
+        query = query / norm
+
+        with self._lock:
+            n = self._n
+            live = ~self._deleted[:n]
+            if allowed is not None:
+                live &= allowed[:n]
+                candidates = np.flatnonzero(live)
+                if len(candidates) <= max(4 * (ef or self.ef_search), 2048):
+                    sims = self._vectors[candidates] @ query
+                    return [(int(candidates[i]), float(sims[i])) for i in top_k_indices(sims, k)]
+
+            entry = self.entry_point
+            for lc in range(self.max_level, 0, -1):
+                entry = self._search_layer(query, [entry], 1, lc)[0][1]
+
+            ef = max(ef or self.ef_search, k)
+            while True:
+                found = self._search_layer(query, [entry], ef, 0)
+                hits = [(node, sim) for sim, node in found if live[node]]
+                if len(hits) >= k or ef >= n:
+                    return hits[:k]
+                ef = min(ef * 2, n)
+
+    def compacted(self) -> Tuple['HNSWIndex', np.ndarray]:
+        """Rebuild without deleted nodes; returns the new index and old→new node map (-1 if dropped)"""
+        with self._lock:
+            keep = np.flatnonzero(~self._deleted[:self._n])
+            rebuilt = HNSWIndex(self.dimension, self.M, self.ef_construction, self.ef_search,
+                                capacity=max(len(keep), 1))
+            rebuilt.add(self._vectors[keep])
+            mapping = np.full(self._n, -1, dtype=np.int64)
+            mapping[keep] = np.arange(len(keep))
+            return rebuilt, mapping
+
+    def save(self, path: str, extra: Optional[Dict[str, Any]] = None) -> None:
+        """Write the graph, vectors and a JSON ``extra`` payload to one binary file"""
+        with self._lock:
+            n = self._n
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC)
+                f.write(FILE_HEADER.pack(VERSION, self.dimension, self.M, self.ef_construction,
+                                         self.ef_search, n, self.entry_point, self.max_level))
+                f.write(self._vectors[:n].tobytes())
+                f.write(self._levels[:n].tobytes())
+                f.write(self._deleted[:n].astype(np.uint8).tobytes())
+                f.write(self._links0[:n].tobytes())
+
+                for level in self._upper:
+                    nodes = np.fromiter(level.keys(), dtype=np.int32, count=len(level))
+                    links = np.full((len(level), self.M), -1, dtype=np.int32)
+                    for row, neighbours in enumerate(level.values()):
+                        links[row, :len(neighbours)] = neighbours
+                    f.write(LENGTH.pack(len(level)))
+                    f.write(nodes.tobytes())
+                    f.write(links.tobytes())
+
+                payload = json.dumps(extra or {}).encode('utf-8')
+                f.write(LENGTH.pack(len(payload)))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple['HNSWIndex', Dict[str, Any]]:
+        """Read an index written by ``save``; returns it with the ``extra`` payload"""
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an HNSW index file")
+        offset = len(MAGIC)
+        version, dimension, M, ef_construction, ef_search, n, entry_point, max_level = \
+            FILE_HEADER.unpack_from(data, offset)
+        if version != VERSION:
+            raise ValueError(f"Unsupported HNSW index version {version}")
+        offset += FILE_HEADER.size
+
+        index = cls(dimension, M, ef_construction, ef_search, capacity=max(n, 1))
+
+        def take(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+
+        index._vectors[:n] = take(np.float32, n * dimension).reshape(n, dimension)
+        index._levels[:n] = take(np.int8, n)
+        index._deleted[:n] = take(np.uint8, n).astype(bool)
+        index._links0[:n] = take(np.int32, n * index.max_m0).reshape(n, index.max_m0)
+        index._count0[:n] = (index._links0[:n] >= 0).sum(axis=1)
+
+        for _ in range(max(max_level, 0)):
+            (count,) = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            nodes = take(np.int32, count)
+            links = take(np.int32, count * M).reshape(count, M)
+            index._upper.append({
+                int(node): [int(x) for x in row if x >= 0] for node, row in zip(nodes, links)
+            })
+
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        extra = json.loads(data[offset:offset + length]) if length else {}
+
+        index._n = n
+        index._deleted_count = int(index._deleted[:n].sum())
+        index.entry_point = entry_point
+        index.max_level = max_level
+        return index, extra
@@ -0,0 +1,107 @@
+import json
+import numpy as np
+from typing import Any, Dict, List, Sequence, Tuple
+
+from utils.vector_cache import top_k_indices
+
+FUSION_METHODS = ('rrf', 'weighted')
+
+DEFAULT_SETTINGS = {
+    'hybrid_fusion': 'rrf',
+    'semantic_weight': 0.7,
+    'keyword_weight': 0.3,
+    'rrf_k': 60,
+    'hybrid_candidates': 50
+}
+
+def hybrid_settings(kb_settings: Any = None, **overrides) -> Dict[str, Any]:
+    """Fusion settings of a knowledge base, falling back to the defaults
+
+    ``kb_settings`` is KnowledgeBase.settings, either a dict or its JSON
+    string form. Overrides that are None are ignored so callers can pass
+    their optional arguments straight through.
+    """
+    if isinstance(kb_settings, str):
+        try:
+            kb_settings = json.loads(kb_settings)
+        except ValueError:
+            kb_settings = None
+
+    settings = dict(DEFAULT_SETTINGS)
+    for key in DEFAULT_SETTINGS:
+        if isinstance(kb_settings, dict) and kb_settings.get(key) is not None:
+            settings[key] = kb_settings[key]
+        if overrides.get(key) is not None:
+            settings[key] = overrides[key]
+
+    if settings['hybrid_fusion'] not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method {settings['hybrid_fusion']!r}, expected one of {FUSION_METHODS}")
+    semantic_weight = max(0.0, float(settings['semantic_weight']))
+    keyword_weight = max(0.0, float(settings['keyword_weight']))
+    total = semantic_weight + keyword_weight
+    if total == 0:
+        raise ValueError("semantic_weight and keyword_weight cannot both be zero")
+    settings['semantic_weight'] = semantic_weight / total
+    settings['keyword_weight'] = keyword_weight / total
+    settings['rrf_k'] = max(1, int(settings['rrf_k']))
+    settings['hybrid_candidates'] = max(1, int(settings['hybrid_candidates']))
+    return settings
+
+def _ranks(scores: np.ndarray) -> np.ndarray:
+    """1-based rank of each score among the present ones, 0 where absent"""
+    ranks = np.zeros(len(scores), dtype=np.int64)
+    present = np.flatnonzero(~np.isnan(scores))
+    order = present[np.argsort(-scores[present], kind='stable')]
+    ranks[order] = np.arange(1, len(order) + 1)
+    return ranks
+
+def fuse_scores(dense: np.ndarray, sparse: np.ndarray, settings: Dict[str, Any]) -> np.ndarray:
+    """Fuse aligned dense and sparse scores of one candidate set into [0, 1]
+
+    ``dense`` holds cosine similarities and ``sparse`` keyword scores; NaN
+    marks a candidate the signal did not score, and a sparse score of 0
+    counts as no keyword match. With ``rrf`` each signal contributes
+    ``weight / (rrf_k + rank)``, scaled so a candidate ranked first by both
+    gets 1. With ``weighted`` cosine is clipped to [0, 1] and keyword scores
+    are divided by the best one before the weighted sum. Either way the
+    result does not depend on the size or score scale of the knowledge base.
+    """
+    dense = np.asarray(dense, dtype=np.float64)
+    sparse = np.asarray(sparse, dtype=np.float64).copy()
+    sparse[sparse <= 0] = np.nan
+    semantic_weight = settings['semantic_weight']
+    keyword_weight = settings['keyword_weight']
+
+    if settings['hybrid_fusion'] == 'rrf':
+        rrf_k = settings['rrf_k']
+        fused = np.zeros(len(dense))
+        for scores, weight in ((dense, semantic_weight), (sparse, keyword_weight)):
+            ranks = _ranks(scores)
+            ranked = ranks > 0
+            fused[ranked] += weight / (rrf_k + ranks[ranked])
+        return fused * (rrf_k + 1)
+
+    dense_norm = np.clip(np.nan_to_num(dense, nan=0.0), 0.0, 1.0)
+    top_sparse = np.nanmax(sparse) if np.any(~np.isnan(sparse)) else 0.0
+    sparse_norm = np.nan_to_num(sparse / top_sparse, nan=0.0) if top_sparse > 0 else np.zeros(len(sparse))
+    return semantic_weight * dense_norm + keyword_weight * sparse_norm
+
+def rank_candidates(candidate_ids: Sequence[Any], dense: Sequence[float], sparse: Sequence[float],
+                    settings: Dict[str, Any], limit: int) -> List[Tuple[Any, float, float, float]]:
+    """Fuse and return the best (id, fused, dense, sparse) tuples, best first
+
+    Missing scores come back as 0.0.
+    """
+    dense = np.asarray(dense, dtype=np.float64)
+    sparse = np.asarray(sparse, dtype=np.float64)
+    fused = fuse_scores(dense, sparse, settings)
+    dense = np.nan_to_num(dense, nan=0.0)
+    sparse = np.nan_to_num(sparse, nan=0.0)
+    return [
+        (candidate_ids[i], float(fused[i]), float(dense[i]), float(sparse[i]))
+        for i in top_k_indices(fused, limit)
+    ]
+
+def merge_candidates(*id_lists: Sequence[Any]) -> List[Any]:
+    """Union of candidate id lists, keeping first-seen order"""
+    return list(dict.fromkeys(chunk_id for ids in id_lists for chunk_id in ids))
@@ -0,0 +1,242 @@
+import re
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import inspect, text
+
+FTS_TABLE = 'file_embeddings_fts'
+TSV_COLUMN = 'chunk_tsv'
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+def query_terms(query: str) -> List[str]:
+    """Distinct lowercased word terms of a free-text query, in order"""
+    return list(dict.fromkeys(term.lower() for term in _TERM_RE.findall(query or '')))
+
+class KeywordBackend:
+    """Full-text search over file_embeddings.chunk_text
+
+    Each dialect keeps its own index in sync with the table. ``search``
+    returns chunks matching any query term, best first, as dicts with
+    id, file_id, filename, chunk_text, chunk_index and score (higher is
+    better; scores are comparable within one backend only).
+    """
+
+    name = 'like'
+
+    def ensure_schema(self, engine) -> None:
+        """Create whatever index structures the backend needs, idempotently"""
+
+    def rebuild(self, engine) -> None:
+        """Rebuild the index from the table contents"""
+
+    def search(self, session, query: str, user_id: Any,
+               knowledge_base_id: Optional[Any] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        terms = query_terms(query)
+        if not terms:
+            return []
+        params: Dict[str, Any] = {'user_id': user_id, 'limit': limit}
+        matches = []
+        for i, term in enumerate(terms):
+            params[f'term{i}'] = f'%{term}%'
+            matches.append(f"CASE WHEN LOWER(fe.chunk_text) LIKE :term{i} THEN 1 ELSE 0 END")
+        score = ' + '.join(matches)
+        sql = f"""
+            SELECT * FROM (
+                SELECT fe.id, fe.file_id, f.filename, fe.chunk_text, fe.chunk_index, {score} AS score
+                FROM file_embeddings fe
+                JOIN files f ON fe.file_id = f.id
+                WHERE f.user_id = :user_id {self._kb_clause(knowledge_base_id, params)}
+            ) ranked
+            WHERE score > 0
+            ORDER BY score DESC
+            LIMIT :limit
+        """
+        return self._rows(session.execute(text(sql), params))
+
+    @staticmethod
+    def _kb_clause(knowledge_base_id: Optional[Any], params: Dict[str, Any]) -> str:
+        if not knowledge_base_id:
+            return ''
+        params['knowledge_base_id'] = knowledge_base_id
+        return 'AND fe.knowledge_base_id = :knowledge_base_id'
+
+    @staticmethod
+    def _rows(result) -> List[Dict[str, Any]]:
+        return [
+            {
+                'id': row.id,
+                'file_id': row.file_id,
+                'filename': row.filename,
+                'chunk_text': row.chunk_text,
+                'chunk_index': row.chunk_index,
+                'score': float(row.score)
+            }
+            for row in result
+        ]
+
+class SQLiteFTSBackend(KeywordBackend):
+    """FTS5 external-content table over file_embeddings, ranked by bm25()
+
+    The FTS table indexes the rowid of each file_embeddings row and reads
+    the text back from the table itself, so chunks are not stored twice.
+    Triggers keep it in sync on insert, delete and chunk_text updates.
+    VACUUM may renumber the rowids of file_embeddings (its primary key is
+    a string); call ``rebuild`` after vacuuming.
+    """
+
+    name = 'sqlite_fts5'
+
+    def ensure_schema(self, engine) -> None:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': FTS_TABLE}
+            ).first()
+            if not exists:
+                conn.execute(text(f"""
+                    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+                        chunk_text,
+                        content='file_embeddings',
+                        content_rowid='rowid',
+                        tokenize='porter unicode61'
+                    )
+                """))
+
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON file_embeddings BEGIN
+                    INSERT INTO {FTS_TABLE}(rowid, chunk_text) VALUES (new.rowid, new.chunk_text);
+                END
+            """))
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON file_embeddings BEGIN
+                    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, chunk_text)
+                    VALUES ('delete', old.rowid, old.chunk_text);
+                END
+            """))
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF chunk_text ON file_embeddings BEGIN
+                    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, chunk_text)
+                    VALUES ('delete', old.rowid, old.chunk_text);
+                    INSERT INTO {FTS_TABLE}(rowid, chunk_text) VALUES (new.rowid, new.chunk_text);
+                END
+            """))
+
+        if not exists:
+            self.rebuild(engine)
+            logging.info(f"Created FTS5 keyword index {FTS_TABLE}")
+
+    def rebuild(self, engine) -> None:
+        with engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+    def search(self, session, query: str, user_id: Any,
+               knowledge_base_id: Optional[Any] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        terms = query_terms(query)
+        if not terms:
+            return []
+        # Quoted terms keep FTS5 operators and punctuation in user input inert
+        params: Dict[str, Any] = {
+            'match': ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms),
+            'user_id': user_id,
+            'limit': limit
+        }
+        sql = f"""
+            SELECT fe.id, fe.file_id, f.filename, fe.chunk_text, fe.chunk_index,
+                   -bm25({FTS_TABLE}) AS score
+            FROM {FTS_TABLE}
+            JOIN file_embeddings fe ON fe.rowid = {FTS_TABLE}.rowid
+            JOIN files f ON fe.file_id = f.id
+            WHERE {FTS_TABLE} MATCH :match
+            AND f.user_id = :user_id {self._kb_clause(knowledge_base_id, params)}
+            ORDER BY bm25({FTS_TABLE})
+            LIMIT :limit
+        """
+        return self._rows(session.execute(text(sql), params))
+
+class PostgresTSVectorBackend(KeywordBackend):
+    """Stored generated tsvector column with a GIN index, ranked by ts_rank
+
+    Postgres maintains the generated column on every write, so no triggers
+    are needed and ORM inserts never mention it.
+    """
+
+    name = 'postgres_tsvector'
+
+    def ensure_schema(self, engine) -> None:
+        columns = {col['name'] for col in inspect(engine).get_columns('file_embeddings')}
+        with engine.begin() as conn:
+            if TSV_COLUMN not in columns:
+                conn.execute(text(f"""
+                    ALTER TABLE file_embeddings ADD COLUMN {TSV_COLUMN} tsvector
+                    GENERATED ALWAYS AS (to_tsvector('english', coalesce(chunk_text, ''))) STORED
+                """))
+                logging.info(f"Added generated column file_embeddings.{TSV_COLUMN}")
+            conn.execute(text(f"""
+                CREATE INDEX IF NOT EXISTS idx_file_embeddings_{TSV_COLUMN}
+                ON file_embeddings USING GIN ({TSV_COLUMN})
+            """))
+
+    def rebuild(self, engine) -> None:
+        with engine.begin() as conn:
+            conn.execute(text(f"REINDEX INDEX idx_file_embeddings_{TSV_COLUMN}"))
+
+    def search(self, session, query: str, user_id: Any,
+               knowledge_base_id: Optional[Any] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        terms = query_terms(query)
+        if not terms:
+            return []
+        # \w+ terms need no escaping in to_tsquery; OR them like the SQLite backend
+        params: Dict[str, Any] = {'tsquery': ' | '.join(terms), 'user_id': user_id, 'limit': limit}
+        sql = f"""
+            SELECT fe.id, fe.file_id, f.filename, fe.chunk_text, fe.chunk_index,
+                   ts_rank(fe.{TSV_COLUMN}, q.query) AS score
+            FROM file_embeddings fe
+            JOIN files f ON fe.file_id = f.id
+            CROSS JOIN to_tsquery('english', :tsquery) AS q(query)
+            WHERE fe.{TSV_COLUMN} @@ q.query
+            AND f.user_id = :user_id {self._kb_clause(knowledge_base_id, params)}
+            ORDER BY score DESC
+            LIMIT :limit
+        """
+        return self._rows(session.execute(text(sql), params))
+
+_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresTSVectorBackend,
+}
+
+_backends: Dict[int, KeywordBackend] = {}
+_backends_lock = threading.Lock()
+
+def _sqlite_has_fts5(engine) -> bool:
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)"))
+            conn.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+    except Exception:
+        return False
+
+def get_keyword_backend(engine) -> KeywordBackend:
+    """Keyword backend for the engine's dialect, LIKE matching when it has no full-text index"""
+    with _backends_lock:
+        backend = _backends.get(id(engine))
+        if backend is None:
+            backend_class = _BACKENDS.get(engine.dialect.name, KeywordBackend)
+            if backend_class is SQLiteFTSBackend and not _sqlite_has_fts5(engine):
+                logging.warning("SQLite was built without FTS5, keyword search falls back to LIKE")
+                backend_class = KeywordBackend
+            backend = backend_class()
+            _backends[id(engine)] = backend
+        return backend
+
+def ensure_keyword_index(engine) -> KeywordBackend:
+    """Set up the keyword index for the engine; called once at startup"""
+    backend = get_keyword_backend(engine)
+    try:
+        backend.ensure_schema(engine)
+    except Exception as e:
+        logging.error(f"Keyword index setup failed ({backend.name}): {str(e)}")
+    return backend
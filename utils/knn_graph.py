@@ -0,0 +1,231 @@
+import os
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.vector_cache import KnowledgeBaseMatrix, normalize_rows
+
+KNN_GRAPH_K = int(os.environ.get('KNN_GRAPH_K', '20'))
+
+# Memory budget of the graphs kept across searches
+KNN_GRAPH_CACHE_MB = int(os.environ.get('KNN_GRAPH_CACHE_MB', '256'))
+
+# Rows per block when multiplying the matrix by itself; bounds the (block, n) score buffer
+_BLOCK_ROWS = 1024
+
+def _top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Column indices and values of the k best scores of every row, best first"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int32), empty.astype(np.float32)
+    if k < scores.shape[1]:
+        columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    values = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-values, axis=1, kind='stable')
+    return (np.take_along_axis(columns, order, axis=1).astype(np.int32),
+            np.take_along_axis(values, order, axis=1).astype(np.float32))
+
+def _self_knn(matrix: np.ndarray, k: int, start: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """k nearest other rows of matrix for rows [start, n), computed block by block"""
+    neighbors, similarities = [], []
+    for block_start in range(start, len(matrix), _BLOCK_ROWS):
+        block_end = min(block_start + _BLOCK_ROWS, len(matrix))
+        scores = matrix[block_start:block_end] @ matrix.T
+        scores[np.arange(block_end - block_start), np.arange(block_start, block_end)] = -np.inf
+        block_neighbors, block_similarities = _top_k_rows(scores, k)
+        neighbors.append(block_neighbors)
+        similarities.append(block_similarities)
+    if not neighbors:
+        width = min(k, len(matrix))
+        return np.empty((0, width), dtype=np.int32), np.empty((0, width), dtype=np.float32)
+    return np.vstack(neighbors), np.vstack(similarities)
+
+def _valid(neighbors: np.ndarray, similarities: np.ndarray, row: int, limit: int):
+    """Neighbour entries of one row, skipping the -inf padding of tiny graphs"""
+    for column, similarity in zip(neighbors[row][:limit], similarities[row][:limit]):
+        if np.isfinite(similarity):
+            yield int(column), float(similarity)
+
+class KnnGraph:
+    """k-nearest-neighbour graph over the chunks of one knowledge base
+
+    Alongside the chunk graph it keeps one normalised centroid per
+    document and the k nearest documents of each, so similar-chunk and
+    related-document lookups read a precomputed row instead of scanning
+    vectors. Built from a KnowledgeBaseMatrix; ``extended`` adds appended
+    rows without recomputing the existing ones from scratch.
+    """
+
+    def __init__(self, chunk_ids: Sequence[str], file_ids: Sequence[Any], k: int,
+                 neighbors: np.ndarray, similarities: np.ndarray, matrix: np.ndarray):
+        self.k = k
+        self.chunk_ids = np.asarray(chunk_ids, dtype=object)
+        self.file_ids = np.asarray(file_ids, dtype=object)
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        self._build_documents(matrix)
+
+    @classmethod
+    def build(cls, source: KnowledgeBaseMatrix, k: int = KNN_GRAPH_K) -> 'KnnGraph':
+        neighbors, similarities = _self_knn(source.matrix, k)
+        return cls(source.chunk_ids, source.file_ids, k, neighbors, similarities, source.matrix)
+
+    def _build_documents(self, matrix: np.ndarray) -> None:
+        if len(self.file_ids) == 0:
+            self.document_ids = np.empty(0, dtype=object)
+            self.document_neighbors = np.empty((0, 0), dtype=np.int32)
+            self.document_similarities = np.empty((0, 0), dtype=np.float32)
+            self._document_of = {}
+            return
+
+        # Mean of each document's normalised chunk vectors, summed over contiguous runs
+        keys = np.array([str(file_id) for file_id in self.file_ids])
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        centroids = normalize_rows(np.add.reduceat(matrix[order], starts, axis=0))
+
+        self.document_ids = self.file_ids[order[starts]]
+        self.document_neighbors, self.document_similarities = _self_knn(centroids, self.k)
+        self._document_of = {file_id: row for row, file_id in enumerate(self.document_ids)}
+
+    def extended(self, source: KnowledgeBaseMatrix) -> 'KnnGraph':
+        """Graph for ``source``, which must be this graph's rows with more rows appended"""
+        old_count = len(self.chunk_ids)
+        matrix = source.matrix
+
+        # New rows against everything, then old rows against the new ones only
+        new_neighbors, new_similarities = _self_knn(matrix, self.k, start=old_count)
+        appended = np.arange(old_count, len(matrix), dtype=np.int32)
+        old_neighbors, old_similarities = [], []
+        for block_start in range(0, old_count, _BLOCK_ROWS):
+            block_end = min(block_start + _BLOCK_ROWS, old_count)
+            scores = matrix[block_start:block_end] @ matrix[old_count:].T
+            candidates = np.hstack([self.neighbors[block_start:block_end],
+                                    np.tile(appended, (block_end - block_start, 1))])
+            candidate_scores = np.hstack([self.similarities[block_start:block_end], scores])
+            columns, values = _top_k_rows(candidate_scores, self.k)
+            old_neighbors.append(np.take_along_axis(candidates, columns, axis=1))
+            old_similarities.append(values)
+
+        # Both halves are min(k, n) wide, so they stack directly
+        neighbors = np.vstack(old_neighbors + [new_neighbors])
+        similarities = np.vstack(old_similarities + [new_similarities])
+        return KnnGraph(source.chunk_ids, source.file_ids, self.k, neighbors, similarities, matrix)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.neighbors.nbytes + self.similarities.nbytes +
+                   self.document_neighbors.nbytes + self.document_similarities.nbytes)
+
+    def similar_chunks(self, chunk_id: str, limit: int = 5) -> List[Tuple[str, Any, float]]:
+        """(chunk_id, file_id, similarity) of up to min(limit, k) nearest chunks"""
+        row = self._row_of.get(chunk_id)
+        if row is None:
+            return []
+        return [(self.chunk_ids[column], self.file_ids[column], similarity)
+                for column, similarity in _valid(self.neighbors, self.similarities, row, limit)]
+
+    def related_documents(self, file_id: Any, limit: int = 5) -> List[Tuple[Any, float]]:
+        """(file_id, centroid similarity) of up to min(limit, k) nearest documents"""
+        row = self._document_of.get(file_id)
+        if row is None:
+            return []
+        return [(self.document_ids[column], similarity)
+                for column, similarity in _valid(self.document_neighbors, self.document_similarities, row, limit)]
+
+class KnnGraphCache:
+    """Per-knowledge-base graphs, refreshed lazily when the vectors change
+
+    A graph is stored with the ``signature`` (row count and chunk-id hash)
+    of the matrix it was built from, so it outlives that matrix object:
+    a knowledge base reloaded with the same rows, or one too large for the
+    vector cache, reuses its graph. When the signature changes, appended
+    rows are merged into the existing graph and anything else triggers a
+    rebuild. Graphs are evicted least recently used past ``max_bytes``.
+    """
+
+    def __init__(self, k: int = KNN_GRAPH_K, max_bytes: int = KNN_GRAPH_CACHE_MB * 1024 * 1024):
+        self.k = k
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Any, Tuple[Tuple[int, str], KnnGraph]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[Any, threading.Lock] = {}
+        self.builds = 0
+        self.extensions = 0
+
+    def _lookup(self, knowledge_base_id: Any, signature: Tuple[int, str]):
+        with self._lock:
+            entry = self._entries.get(knowledge_base_id)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(knowledge_base_id)
+            return entry
+
+    def get(self, knowledge_base_id: Any, source: KnowledgeBaseMatrix) -> KnnGraph:
+        signature = source.signature
+        entry = self._lookup(knowledge_base_id, signature)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        with self._lock:
+            build_lock = self._build_locks.setdefault(knowledge_base_id, threading.Lock())
+
+        # One build per knowledge base at a time; other knowledge bases are not blocked
+        with build_lock:
+            entry = self._lookup(knowledge_base_id, signature)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+
+            graph = self._refresh(entry[1] if entry else None, source)
+            with self._lock:
+                self._entries.pop(knowledge_base_id, None)
+                self._entries[knowledge_base_id] = (signature, graph)
+                while len(self._entries) > 1 and self._resident_bytes() > self.max_bytes:
+                    self._entries.popitem(last=False)
+            return graph
+
+    def _refresh(self, previous: Optional[KnnGraph], source: KnowledgeBaseMatrix) -> KnnGraph:
+        old_count = len(previous) if previous is not None else 0
+        appended = (
+            previous is not None and 0 < old_count < len(source) and
+            len(source) - old_count <= old_count and
+            np.array_equal(previous.chunk_ids, source.chunk_ids[:old_count])
+        )
+        if appended:
+            self.extensions += 1
+            return previous.extended(source)
+
+        self.builds += 1
+        logging.info(f"Building k-NN graph over {len(source)} chunks")
+        return KnnGraph.build(source, self.k)
+
+    def invalidate(self, knowledge_base_id: Any = None) -> None:
+        with self._lock:
+            if knowledge_base_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(knowledge_base_id, None)
+
+    def _resident_bytes(self) -> int:
+        return sum(graph.nbytes for _, graph in self._entries.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'knowledge_bases': len(self._entries),
+                'resident_bytes': self._resident_bytes(),
+                'max_bytes': self.max_bytes,
+                'builds': self.builds,
+                'extensions': self.extensions
+            }
+
+# Global instance
+knn_graphs = KnnGraphCache()
@@ -0,0 +1,149 @@
+import os
+import logging
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, or_
+
+from app import db
+from models import FileEmbedding
+from utils.vector_cache import vector_cache
+from utils.knn_graph import knn_graphs
+from utils.vector_segments import SegmentStore, open_segment_store, remove_segment_store
+from utils.bm25_index import BM25Index, bm25_index_path, get_bm25_index, remove_bm25_index
+from utils.quantization import remove_quantized
+
+try:
+    from models import KnowledgeBaseFile
+except ImportError:
+    # Schemas without the link table tie chunks to a knowledge base only through FileEmbedding.knowledge_base_id
+    KnowledgeBaseFile = None
+
+# Memory-mapped segment stores of large knowledge bases, one directory each
+SEGMENT_ROOT = os.environ.get('VECTOR_SEGMENT_DIR', os.path.join('data', 'segments'))
+
+# Exact float32 vectors behind quantized knowledge bases, memory-mapped for reranking,
+# with their codes and quantizer alongside
+QUANTIZED_ROOT = os.environ.get('VECTOR_QUANTIZED_DIR', os.path.join('data', 'quantized'))
+
+def knowledge_base_rows(knowledge_base_id: Any):
+    """Filter selecting the FileEmbedding rows of a knowledge base
+
+    A chunk belongs to a knowledge base when it is tagged with it or when its
+    file is linked to it. Every loader, index and version check uses this one
+    definition so they all see the same rows.
+    """
+    condition = FileEmbedding.knowledge_base_id == knowledge_base_id
+    if KnowledgeBaseFile is not None:
+        linked = db.session.query(KnowledgeBaseFile.file_id).filter(
+            KnowledgeBaseFile.knowledge_base_id == knowledge_base_id
+        )
+        condition = or_(condition, FileEmbedding.file_id.in_(linked))
+    return condition
+
+def knowledge_base_version(knowledge_base_id: Any) -> Tuple[int, Optional[str]]:
+    """Cheap signature of a knowledge base's stored chunks: (row count, newest created_at)
+
+    Any insert or delete changes it, whichever process or code path made it,
+    so caches and indexes compare it to decide whether they are stale.
+    """
+    count, newest = db.session.query(
+        func.count(FileEmbedding.id),
+        func.max(FileEmbedding.created_at)
+    ).filter(knowledge_base_rows(knowledge_base_id)).one()
+    return int(count or 0), newest.isoformat() if newest is not None else None
+
+def knowledge_base_ids_for_file(file_id: Any) -> List[Any]:
+    """Knowledge bases a file's chunks belong to; call before deleting them"""
+    kb_ids = [row[0] for row in db.session.query(FileEmbedding.knowledge_base_id).filter(
+        FileEmbedding.file_id == file_id, FileEmbedding.knowledge_base_id.isnot(None)
+    ).distinct()]
+    if KnowledgeBaseFile is not None:
+        kb_ids.extend(kbf.knowledge_base_id for kbf in KnowledgeBaseFile.query.filter_by(file_id=file_id))
+    return list(dict.fromkeys(kb_ids))
+
+def segment_path(knowledge_base_id: Any) -> str:
+    return os.path.join(SEGMENT_ROOT, str(knowledge_base_id))
+
+def quantized_path(knowledge_base_id: Any) -> str:
+    return os.path.join(QUANTIZED_ROOT, f"{knowledge_base_id}.npy")
+
+def segment_store(knowledge_base_id: Any) -> Optional[SegmentStore]:
+    """The on-disk segment store of a knowledge base, if it has one"""
+    path = segment_path(knowledge_base_id)
+    if not SegmentStore.exists(path):
+        return None
+    return open_segment_store(path)
+
+def index_new_chunks(kb_ids: Iterable[Any], file_id: Any, chunk_ids: Sequence[str],
+                     embeddings: Sequence[Sequence[float]], texts: Sequence[str]) -> None:
+    """Patch vector caches and keyword indexes with committed chunk rows
+
+    Every writer of FileEmbedding rows calls this (or ``unindex_*``) after
+    its commit, so in-process caches stay current without a reload. Other
+    processes notice the change through ``knowledge_base_version``.
+    """
+    if not chunk_ids:
+        return
+    file_ids = [file_id] * len(chunk_ids)
+    for kb_id in kb_ids:
+        try:
+            version = knowledge_base_version(kb_id)
+            store = segment_store(kb_id)
+            if store is not None:
+                store.append(embeddings[:len(chunk_ids)], chunk_ids, file_ids, source_version=version)
+                vector_cache.invalidate(kb_id)
+            else:
+                vector_cache.append(kb_id, embeddings[:len(chunk_ids)], chunk_ids, file_ids, version=version)
+
+            # Indexes that haven't been built yet pick these chunks up from the database later
+            if BM25Index.exists(bm25_index_path(kb_id)) and get_bm25_index(kb_id).is_built:
+                get_bm25_index(kb_id).add_documents(zip(chunk_ids, file_ids, texts))
+        except Exception as e:
+            logging.warning(f"Could not index new chunks of knowledge base {kb_id}, dropping its cache: {str(e)}")
+            vector_cache.invalidate(kb_id)
+
+def unindex_chunks(kb_ids: Iterable[Any], chunk_ids: Sequence[str]) -> None:
+    """Remove deleted chunk rows from vector caches and keyword indexes"""
+    if not chunk_ids:
+        return
+    for kb_id in kb_ids:
+        try:
+            version = knowledge_base_version(kb_id)
+            store = segment_store(kb_id)
+            if store is not None:
+                store.delete(chunk_ids, source_version=version)
+                vector_cache.invalidate(kb_id)
+            else:
+                vector_cache.remove_chunks(kb_id, chunk_ids, version=version)
+            if BM25Index.exists(bm25_index_path(kb_id)):
+                get_bm25_index(kb_id).delete_documents(chunk_ids)
+        except Exception as e:
+            logging.warning(f"Could not unindex chunks of knowledge base {kb_id}, dropping its cache: {str(e)}")
+            vector_cache.invalidate(kb_id)
+
+def unindex_files(kb_ids: Iterable[Any], file_ids: Sequence[Any]) -> None:
+    """Remove every chunk of deleted files from vector caches and keyword indexes"""
+    if not file_ids:
+        return
+    for kb_id in kb_ids:
+        try:
+            version = knowledge_base_version(kb_id)
+            store = segment_store(kb_id)
+            if store is not None:
+                store.delete_files(file_ids, source_version=version)
+                vector_cache.invalidate(kb_id)
+            else:
+                vector_cache.remove_files(kb_id, file_ids, version=version)
+            if BM25Index.exists(bm25_index_path(kb_id)):
+                get_bm25_index(kb_id).delete_files(file_ids)
+        except Exception as e:
+            logging.warning(f"Could not unindex files of knowledge base {kb_id}, dropping its cache: {str(e)}")
+            vector_cache.invalidate(kb_id)
+
+def drop_knowledge_base(knowledge_base_id: Any) -> None:
+    """Forget everything cached or stored on disk for a deleted knowledge base"""
+    vector_cache.invalidate(knowledge_base_id)
+    knn_graphs.invalidate(knowledge_base_id)
+    remove_segment_store(segment_path(knowledge_base_id))
+    remove_bm25_index(knowledge_base_id)
+    remove_quantized(quantized_path(knowledge_base_id))
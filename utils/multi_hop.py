@@ -0,0 +1,178 @@
+import os
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.embedding_dimensions import shorten
+from utils.vector_cache import normalize_rows, top_k_indices
+from utils.vector_codec import decode_embedding
+
+# Hops of sub-queries after the original query
+MULTI_HOP_MAX_DEPTH = int(os.environ.get('MULTI_HOP_MAX_DEPTH', '2'))
+
+# Sub-queries taken from each query, and from the whole plan
+MULTI_HOP_FAN_OUT = int(os.environ.get('MULTI_HOP_FAN_OUT', '3'))
+MULTI_HOP_MAX_QUERIES = int(os.environ.get('MULTI_HOP_MAX_QUERIES', '9'))
+
+# Results each sub-query adds at most
+MULTI_HOP_RESULTS_PER_QUERY = int(os.environ.get('MULTI_HOP_RESULTS_PER_QUERY', '3'))
+
+# Sub-queries planned at the same time
+MULTI_HOP_WORKERS = int(os.environ.get('MULTI_HOP_WORKERS', '4'))
+
+def _query_key(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+class CandidateMatrix:
+    """The chunk rows of one search loaded once, with their vectors as normalised matrices
+
+    Rows are grouped by vector size (a user's knowledge bases may differ)
+    and a query is shortened to each stored size, so every query of a
+    search, including every hop of a multi-hop plan, is scored with matrix
+    products and no further database round trips.
+    """
+
+    def __init__(self, rows: Sequence[Any]):
+        self.rows = [{
+            'id': getattr(row, 'id', None),
+            'file_id': row.file_id,
+            'filename': row.filename,
+            'chunk_text': row.chunk_text,
+            'chunk_index': row.chunk_index
+        } for row in rows]
+
+        by_dimension: Dict[int, Tuple[List[Any], List[int]]] = {}
+        for i, row in enumerate(rows):
+            vector = decode_embedding(row)
+            if vector is not None:
+                vectors, positions = by_dimension.setdefault(len(vector), ([], []))
+                vectors.append(vector)
+                positions.append(i)
+        self.groups = [
+            (dimension, normalize_rows(np.vstack(vectors)), np.asarray(positions))
+            for dimension, (vectors, positions) in by_dimension.items()
+        ]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def scores(self, query_vector: Sequence[float]) -> np.ndarray:
+        """Cosine similarity of every row to the query, NaN where it cannot be scored"""
+        scores = np.full(len(self.rows), np.nan, dtype=np.float32)
+        for dimension, matrix, positions in self.groups:
+            if dimension > len(query_vector):
+                continue
+            query = np.asarray(shorten(query_vector, dimension), dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                scores[positions] = matrix @ (query / norm)
+        return scores
+
+    def search(self, query: str, query_vector: Sequence[float], threshold: float,
+               k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rows at or above ``threshold``, best first, as search results for ``query``"""
+        scores = np.nan_to_num(self.scores(query_vector), nan=-np.inf)
+        order = top_k_indices(scores, len(scores) if k is None else k)
+        return [
+            {**self.rows[i], 'similarity': float(scores[i]), 'query': query}
+            for i in order if scores[i] >= threshold
+        ]
+
+class MultiHopPlanner:
+    """Widens a search with sub-queries derived from the query, hop by hop
+
+    ``plan(query)`` proposes sub-queries for a query (typically its
+    entities and concepts, from an LLM). Each hop plans the previous hop's
+    new sub-queries concurrently, keeping at most ``fan_out`` from each
+    and ``max_queries`` in total, embeds all of them in one batch and
+    scores them against the shared ``CandidateMatrix``. Embeddings are
+    kept in ``embeddings`` for the life of the planner, so no query is
+    embedded twice and no hop touches the database.
+    """
+
+    def __init__(self, matrix: CandidateMatrix, plan: Callable[[str], List[str]],
+                 embed: Callable[[List[str]], List[List[float]]], threshold: float,
+                 max_depth: int = MULTI_HOP_MAX_DEPTH, fan_out: int = MULTI_HOP_FAN_OUT,
+                 max_queries: int = MULTI_HOP_MAX_QUERIES,
+                 results_per_query: int = MULTI_HOP_RESULTS_PER_QUERY, workers: int = MULTI_HOP_WORKERS,
+                 embeddings: Optional[Dict[str, List[float]]] = None):
+        self.matrix = matrix
+        self.plan = plan
+        self.embed = embed
+        self.threshold = threshold
+        self.max_depth = max_depth
+        self.fan_out = fan_out
+        self.max_queries = max_queries
+        self.results_per_query = results_per_query
+        self.workers = max(1, workers)
+        self.embeddings: Dict[str, List[float]] = embeddings if embeddings is not None else {}
+        self._lock = threading.Lock()
+        self.stats = {'hops': 0, 'planned': 0, 'sub_queries': 0, 'embedded': 0, 'added': 0, 'plan_errors': 0}
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embeddings of ``queries``, computing only the ones not seen before in one batch"""
+        with self._lock:
+            missing = list(dict.fromkeys(query for query in queries if query not in self.embeddings))
+        if missing:
+            vectors = self.embed(missing)
+            with self._lock:
+                self.embeddings.update(zip(missing, vectors))
+                self.stats['embedded'] += len(missing)
+        return [self.embeddings[query] for query in queries]
+
+    def _plan(self, query: str) -> List[str]:
+        try:
+            return [str(sub_query).strip() for sub_query in self.plan(query) or [] if str(sub_query).strip()]
+        except Exception as e:
+            with self._lock:
+                self.stats['plan_errors'] += 1
+            logging.warning(f"Multi-hop planning failed for {query!r}: {e}")
+            return []
+
+    def run(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """``results`` followed by the new chunks the sub-queries found, marked ``multi_hop``"""
+        seen_chunks = {(result['file_id'], result['chunk_index']) for result in results}
+        seen_queries = {_query_key(query)}
+        frontier = [query]
+        results = list(results)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for hop in range(1, self.max_depth + 1):
+                if not frontier or self.stats['sub_queries'] >= self.max_queries:
+                    break
+                self.stats['hops'] += 1
+                self.stats['planned'] += len(frontier)
+
+                sub_queries = []
+                for proposed in executor.map(self._plan, frontier):
+                    for sub_query in proposed[:self.fan_out]:
+                        key = _query_key(sub_query)
+                        if key in seen_queries or self.stats['sub_queries'] >= self.max_queries:
+                            continue
+                        seen_queries.add(key)
+                        sub_queries.append(sub_query)
+                        self.stats['sub_queries'] += 1
+                if not sub_queries:
+                    break
+
+                vectors = self.embed_queries(sub_queries)
+                found = executor.map(
+                    lambda item: self.matrix.search(item[0], item[1], self.threshold, self.results_per_query),
+                    zip(sub_queries, vectors)
+                )
+                for sub_query_results in found:
+                    for result in sub_query_results:
+                        key = (result['file_id'], result['chunk_index'])
+                        if key in seen_chunks:
+                            continue
+                        seen_chunks.add(key)
+                        result['multi_hop'] = True
+                        result['hop'] = hop
+                        results.append(result)
+                        self.stats['added'] += 1
+                frontier = sub_queries
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
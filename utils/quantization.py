@@ -0,0 +1,472 @@
+import os
+import json
+import numpy as np
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils.vector_cache import KnowledgeBaseMatrix, normalize_rows, top_k_indices
+
+QUANTIZATION_METHODS = ('int8', 'pq')
+
+# PQ codes are coarser than int8 ones, so its shortlist needs to be longer for the same recall
+DEFAULT_RERANK_FACTORS = {'int8': 4, 'pq': 10}
+
+# Dimensions per PQ subspace when pq_subspaces is not set: 1/16 of the float32 size,
+# recall@10 close to 1 where a fixed 16 subspaces of 1536-d vectors gave 0.5
+PQ_DIMENSIONS_PER_SUBSPACE = 4
+
+DEFAULT_SETTINGS = {
+    'vector_quantization': 'none',
+    'pq_subspaces': None,
+    'rerank_factor': None
+}
+
+# Rows scored per block, so approximate passes never materialise an (n, d) float copy
+_BLOCK_ROWS = 4096
+
+def quantization_settings(kb_settings: Any = None) -> Dict[str, Any]:
+    """Quantization settings of a knowledge base, falling back to the defaults
+
+    ``kb_settings`` is KnowledgeBase.settings, either a dict or its JSON
+    string form. ``vector_quantization`` is 'none', 'int8' or 'pq'.
+    ``pq_subspaces`` stays None unless set; see ``pq_subspaces_for``.
+    """
+    if isinstance(kb_settings, str):
+        try:
+            kb_settings = json.loads(kb_settings)
+        except ValueError:
+            kb_settings = None
+
+    settings = dict(DEFAULT_SETTINGS)
+    for key in DEFAULT_SETTINGS:
+        if isinstance(kb_settings, dict) and kb_settings.get(key) is not None:
+            settings[key] = kb_settings[key]
+
+    method = settings['vector_quantization'] or 'none'
+    if method != 'none' and method not in QUANTIZATION_METHODS:
+        raise ValueError(f"Unknown quantization method {method!r}, expected 'none' or one of {QUANTIZATION_METHODS}")
+    settings['vector_quantization'] = method
+    if settings['pq_subspaces'] is not None:
+        settings['pq_subspaces'] = max(1, int(settings['pq_subspaces']))
+    if settings['rerank_factor'] is None:
+        settings['rerank_factor'] = DEFAULT_RERANK_FACTORS.get(method, 1)
+    settings['rerank_factor'] = max(1, int(settings['rerank_factor']))
+    return settings
+
+def pq_subspaces_for(dimension: int, pq_subspaces: Optional[int] = None) -> int:
+    """Subspaces of a product quantizer over ``dimension``-d vectors, one per PQ_DIMENSIONS_PER_SUBSPACE by default"""
+    subspaces = pq_subspaces or dimension // PQ_DIMENSIONS_PER_SUBSPACE
+    return max(1, min(int(subspaces), dimension))
+
+class ScalarQuantizer:
+    """Per-dimension 8-bit scalar quantizer
+
+    Each dimension is mapped linearly from its [min, max] over the training
+    rows onto 256 levels, a quarter of the float32 size.
+    """
+
+    method = 'int8'
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray):
+        self.low = np.asarray(low, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def train(cls, matrix: np.ndarray) -> 'ScalarQuantizer':
+        low = matrix.min(axis=0)
+        high = matrix.max(axis=0)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+        return cls(low, scale)
+
+    @property
+    def subspaces(self) -> int:
+        return len(self.low)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {'low': self.low, 'scale': self.scale}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'ScalarQuantizer':
+        return cls(arrays['low'], arrays['scale'])
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(matrix, dtype=np.float32) - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.low
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate dot products: q . (low + scale * code) = q . low + (q * scale) . code"""
+        weighted = (query * self.scale).astype(np.float32)
+        offset = float(query @ self.low)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK_ROWS):
+            block = codes[start:start + _BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ weighted + offset
+        return scores
+
+class ProductQuantizer:
+    """Product quantizer with one 256-entry k-means codebook per subspace
+
+    Vectors are split into ``subspaces`` contiguous slices and each slice is
+    stored as the index of its nearest centroid, one byte per subspace.
+    Queries are scored with per-subspace lookup tables (asymmetric distance
+    computation), so the query itself is never quantized.
+    """
+
+    method = 'pq'
+
+    def __init__(self, codebooks: List[np.ndarray], bounds: List[Tuple[int, int]]):
+        self.codebooks = codebooks
+        self.bounds = bounds
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, subspaces: Optional[int] = None, iterations: int = 20,
+              sample: int = 20000, seed: int = 0) -> 'ProductQuantizer':
+        rng = np.random.default_rng(seed)
+        subspaces = pq_subspaces_for(matrix.shape[1], subspaces)
+        if len(matrix) > sample:
+            matrix = matrix[rng.choice(len(matrix), sample, replace=False)]
+        matrix = np.asarray(matrix, dtype=np.float32)
+
+        edges = np.linspace(0, matrix.shape[1], subspaces + 1).astype(int)
+        bounds = [(int(edges[i]), int(edges[i + 1])) for i in range(subspaces)]
+        codebooks = [cls._kmeans(matrix[:, start:end], min(256, len(matrix)), iterations, rng)
+                     for start, end in bounds]
+        return cls(codebooks, bounds)
+
+    @property
+    def subspaces(self) -> int:
+        return len(self.bounds)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {'bounds': np.asarray(self.bounds, dtype=np.int64)}
+        arrays.update((f'codebook_{i}', codebook) for i, codebook in enumerate(self.codebooks))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'ProductQuantizer':
+        bounds = [(int(start), int(end)) for start, end in arrays['bounds']]
+        return cls([arrays[f'codebook_{i}'] for i in range(len(bounds))], bounds)
+
+    @staticmethod
+    def _kmeans(points: np.ndarray, clusters: int, iterations: int, rng) -> np.ndarray:
+        centroids = points[rng.choice(len(points), clusters, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = ProductQuantizer._nearest(points, centroids)
+            counts = np.bincount(assignment, minlength=clusters)
+            sums = np.stack([np.bincount(assignment, weights=points[:, column], minlength=clusters)
+                             for column in range(points.shape[1])], axis=1)
+            empty = counts == 0
+            centroids[~empty] = (sums[~empty] / counts[~empty, None]).astype(np.float32)
+            # Reseed empty clusters on random points so every code stays useful
+            if empty.any():
+                centroids[empty] = points[rng.choice(len(points), int(empty.sum()), replace=False)]
+        return centroids
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        nearest = np.empty(len(points), dtype=np.int64)
+        centroid_sq = (centroids ** 2).sum(axis=1)
+        for start in range(0, len(points), _BLOCK_ROWS):
+            block = points[start:start + _BLOCK_ROWS]
+            distances = centroid_sq[None, :] - 2 * block @ centroids.T
+            nearest[start:start + len(block)] = distances.argmin(axis=1)
+        return nearest
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        codes = np.empty((len(matrix), len(self.bounds)), dtype=np.uint8)
+        for i, ((start, end), codebook) in enumerate(zip(self.bounds, self.codebooks)):
+            codes[:, i] = self._nearest(matrix[:, start:end], codebook)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.hstack([codebook[codes[:, i]] for i, codebook in enumerate(self.codebooks)])
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        tables = [codebook @ query[start:end] for (start, end), codebook in zip(self.bounds, self.codebooks)]
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for i, table in enumerate(tables):
+            scores += table.astype(np.float32)[codes[:, i]]
+        return scores
+
+QUANTIZERS = {'int8': ScalarQuantizer, 'pq': ProductQuantizer}
+
+def _artifact_path(path: str, suffix: str) -> str:
+    """Sibling of the exact-vector file: {kb}.npy -> {kb}.{suffix}"""
+    return f"{os.path.splitext(path)[0]}.{suffix}"
+
+def _write_atomic(path: str, write) -> None:
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _write_exact(path: str, matrix: np.ndarray) -> np.ndarray:
+    """Write normalised float32 rows to an .npy file and map it back read-only"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='<f4', shape=matrix.shape)
+    out[:] = matrix
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    return np.lib.format.open_memmap(path, mode='r')
+
+class QuantizedMatrix:
+    """Drop-in replacement for KnowledgeBaseMatrix that keeps only codes in memory
+
+    Search scores every row approximately from the quantized codes, takes
+    the best ``k * rerank_factor`` as a shortlist and reranks it against the
+    exact float32 vectors, which live in a memory-mapped file shared through
+    the page cache. Rows appended later keep their exact vectors in memory
+    until the knowledge base is next loaded. Like KnowledgeBaseMatrix,
+    instances are never mutated; patches return a new one.
+    """
+
+    def __init__(self, quantizer, codes: np.ndarray, exact: np.ndarray, tail: np.ndarray,
+                 positions: np.ndarray, chunk_ids: Sequence[str], file_ids: Sequence[Any],
+                 rerank_factor: int = 4):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.exact = exact
+        self.tail = tail
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.chunk_ids = np.asarray(chunk_ids, dtype=object)
+        self.file_ids = np.asarray(file_ids, dtype=object)
+        self.rerank_factor = max(1, rerank_factor)
+        self._row_of: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def build(cls, path: str, matrix: np.ndarray, chunk_ids: Sequence[str], file_ids: Sequence[Any],
+              method: str = 'int8', pq_subspaces: Optional[int] = None,
+              rerank_factor: Optional[int] = None, quantizer=None,
+              source_version: Optional[Sequence[Any]] = None) -> 'QuantizedMatrix':
+        """Encode rows with ``quantizer`` (trained on them if not given) and persist everything at ``path``
+
+        The exact vectors go to ``path``; codes, quantizer and a JSON
+        manifest with the row ids and ``source_version`` go next to it, so
+        ``load`` can reopen the matrix without retraining.
+        """
+        if method not in QUANTIZATION_METHODS:
+            raise ValueError(f"Unknown quantization method {method!r}, expected one of {QUANTIZATION_METHODS}")
+        matrix = normalize_rows(matrix)
+        if quantizer is None:
+            if method == 'int8':
+                quantizer = ScalarQuantizer.train(matrix)
+            else:
+                quantizer = ProductQuantizer.train(matrix, subspaces=pq_subspaces)
+        codes = quantizer.encode(matrix)
+        exact = _write_exact(path, matrix)
+        tail = np.empty((0, matrix.shape[1]), dtype=np.float32)
+        rerank_factor = rerank_factor or DEFAULT_RERANK_FACTORS[method]
+        quantized = cls(quantizer, codes, exact, tail, np.arange(len(matrix)), chunk_ids, file_ids, rerank_factor)
+        quantized._save(path, source_version)
+        return quantized
+
+    def _save(self, path: str, source_version: Optional[Sequence[Any]]) -> None:
+        _write_atomic(_artifact_path(path, 'codes.npy'), lambda f: np.save(f, self.codes))
+        _write_atomic(_artifact_path(path, 'quantizer.npz'), lambda f: np.savez(f, **self.quantizer.arrays()))
+        # The manifest goes last; load() checks every file against it
+        manifest = {
+            'method': self.quantizer.method,
+            'subspaces': self.quantizer.subspaces,
+            'dimension': self.dimension,
+            'rows': len(self),
+            'source_version': list(source_version) if source_version is not None else None,
+            'chunk_ids': [str(chunk_id) for chunk_id in self.chunk_ids],
+            'file_ids': self.file_ids.tolist()
+        }
+        _write_atomic(_artifact_path(path, 'json'), lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+    @staticmethod
+    def _manifest(path: str, method: str, pq_subspaces: Optional[int]) -> Optional[Dict[str, Any]]:
+        try:
+            with open(_artifact_path(path, 'json'), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        subspaces = manifest['dimension'] if method == 'int8' else pq_subspaces_for(manifest['dimension'], pq_subspaces)
+        if manifest.get('method') != method or manifest.get('subspaces') != subspaces:
+            return None
+        return manifest
+
+    @staticmethod
+    def load_quantizer(path: str, method: str, pq_subspaces: Optional[int] = None, dimension: Optional[int] = None):
+        """The quantizer persisted at ``path`` if it was trained with these settings, else None"""
+        manifest = QuantizedMatrix._manifest(path, method, pq_subspaces)
+        if manifest is None or (dimension is not None and manifest['dimension'] != dimension):
+            return None
+        try:
+            with np.load(_artifact_path(path, 'quantizer.npz')) as arrays:
+                return QUANTIZERS[method].from_arrays(dict(arrays))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def load(cls, path: str, method: str, pq_subspaces: Optional[int] = None,
+             rerank_factor: Optional[int] = None,
+             source_version: Optional[Sequence[Any]] = None) -> Optional['QuantizedMatrix']:
+        """The matrix persisted at ``path`` if its settings and ``source_version`` match, else None"""
+        manifest = cls._manifest(path, method, pq_subspaces)
+        if manifest is None or manifest['source_version'] != (list(source_version) if source_version is not None else None):
+            return None
+        quantizer = cls.load_quantizer(path, method, pq_subspaces)
+        try:
+            codes = np.load(_artifact_path(path, 'codes.npy'))
+            exact = np.lib.format.open_memmap(path, mode='r')
+        except (OSError, ValueError):
+            return None
+        rows = manifest['rows']
+        if quantizer is None or len(codes) != rows or exact.shape != (rows, manifest['dimension']):
+            # Caught between two writers' files; the caller rebuilds
+            return None
+        tail = np.empty((0, manifest['dimension']), dtype=np.float32)
+        return cls(quantizer, codes, exact, tail, np.arange(rows), manifest['chunk_ids'], manifest['file_ids'],
+                   rerank_factor or DEFAULT_RERANK_FACTORS[method])
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def dimension(self) -> int:
+        return self.exact.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        # The exact vectors are file-backed pages, not private memory
+        return int(self.codes.nbytes + self.tail.nbytes + self.positions.nbytes +
+                   self.chunk_ids.nbytes + self.file_ids.nbytes + 64 * len(self))
+
+    @property
+    def float32_nbytes(self) -> int:
+        return len(self) * self.dimension * 4
+
+    def _exact_rows(self, rows: np.ndarray) -> np.ndarray:
+        positions = self.positions[rows]
+        vectors = np.empty((len(rows), self.dimension), dtype=np.float32)
+        on_disk = positions < len(self.exact)
+        vectors[on_disk] = self.exact[positions[on_disk]]
+        vectors[~on_disk] = self.tail[positions[~on_disk] - len(self.exact)]
+        return vectors
+
+    def _normalized_query(self, query_vector: Sequence[float]) -> Optional[np.ndarray]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, knowledge base has {self.dimension}")
+        norm = np.linalg.norm(query)
+        return query / norm if norm else None
+
+    def search(self, query_vector: Sequence[float], k: int = 10) -> List[Tuple[str, Any, float]]:
+        """Return (chunk_id, file_id, cosine similarity) for the top k rows"""
+        if len(self) == 0 or k <= 0:
+            return []
+        query = self._normalized_query(query_vector)
+        if query is None:
+            return []
+
+        shortlist = top_k_indices(self.quantizer.scores(self.codes, query), k * self.rerank_factor)
+        exact_scores = self._exact_rows(shortlist) @ query
+        best = top_k_indices(exact_scores, k)
+        return [(self.chunk_ids[shortlist[i]], self.file_ids[shortlist[i]], float(exact_scores[i])) for i in best]
+
+    def score_ids(self, query_vector: Sequence[float], chunk_ids: Sequence[str]) -> np.ndarray:
+        """Exact cosine similarity of the query to each given chunk, NaN for unknown ids"""
+        scores = np.full(len(chunk_ids), np.nan, dtype=np.float32)
+        if len(self) == 0 or not len(chunk_ids):
+            return scores
+        query = self._normalized_query(query_vector)
+        if query is None:
+            return scores
+
+        if self._row_of is None:
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        positions = [(i, self._row_of[chunk_id]) for i, chunk_id in enumerate(chunk_ids) if chunk_id in self._row_of]
+        if positions:
+            found, rows = zip(*positions)
+            scores[list(found)] = self._exact_rows(np.asarray(rows)) @ query
+        return scores
+
+    def append(self, vectors: Sequence[Sequence[float]], chunk_ids: Sequence[str],
+               file_ids: Sequence[Any]) -> 'QuantizedMatrix':
+        """Return a new matrix with extra rows, encoded with the existing quantizer"""
+        new_rows = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        if new_rows.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {new_rows.shape[1]}")
+        first = len(self.exact) + len(self.tail)
+        return QuantizedMatrix(
+            self.quantizer,
+            np.vstack([self.codes, self.quantizer.encode(new_rows)]),
+            self.exact,
+            np.vstack([self.tail, new_rows]),
+            np.concatenate([self.positions, np.arange(first, first + len(new_rows))]),
+            np.concatenate([self.chunk_ids, np.asarray(chunk_ids, dtype=object)]),
+            np.concatenate([self.file_ids, np.asarray(file_ids, dtype=object)]),
+            self.rerank_factor
+        )
+
+    def without_files(self, file_ids: Iterable[Any]) -> 'QuantizedMatrix':
+        """Return a new matrix without the rows that belong to the given files"""
+        drop = set(file_ids)
+        keep = np.array([file_id not in drop for file_id in self.file_ids], dtype=bool)
+        if keep.all():
+            return self
+        return QuantizedMatrix(self.quantizer, self.codes[keep], self.exact, self.tail,
+                               self.positions[keep], self.chunk_ids[keep], self.file_ids[keep],
+                               self.rerank_factor)
+
+    def without_chunks(self, chunk_ids: Iterable[str]) -> 'QuantizedMatrix':
+        """Return a new matrix without the given chunks"""
+        drop = set(chunk_ids)
+        keep = np.array([chunk_id not in drop for chunk_id in self.chunk_ids], dtype=bool)
+        if keep.all():
+            return self
+        return QuantizedMatrix(self.quantizer, self.codes[keep], self.exact, self.tail,
+                               self.positions[keep], self.chunk_ids[keep], self.file_ids[keep],
+                               self.rerank_factor)
+
+def measure_recall(exact: KnowledgeBaseMatrix, quantized: QuantizedMatrix,
+                   queries: int = 200, k: int = 10, seed: int = 0) -> float:
+    """Recall@k of quantized search against exact search
+
+    Queries are midpoints of random pairs of stored vectors, which look
+    like real queries (close to the data, but not equal to any row).
+    """
+    if len(exact) < 2:
+        return 1.0
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(exact), (queries, 2))
+    found = 0
+    for a, b in pairs:
+        query = exact.matrix[a] + exact.matrix[b]
+        expected = {chunk_id for chunk_id, _, _ in exact.search(query, k)}
+        found += len(expected & {chunk_id for chunk_id, _, _ in quantized.search(query, k)})
+    return found / (queries * min(k, len(exact)))
+
+def quantization_report(exact: KnowledgeBaseMatrix, quantized: QuantizedMatrix, k: int = 10) -> Dict[str, Any]:
+    """Memory and recall figures recorded in the knowledge base settings"""
+    float32_bytes = exact.matrix.nbytes
+    code_bytes = quantized.codes.nbytes
+    return {
+        'method': quantized.quantizer.method,
+        'rows': len(quantized),
+        'dimension': quantized.dimension,
+        'float32_bytes': int(float32_bytes),
+        'quantized_bytes': int(code_bytes),
+        'memory_saved_bytes': int(float32_bytes - code_bytes),
+        'rerank_factor': quantized.rerank_factor,
+        f'recall_at_{k}': round(measure_recall(exact, quantized, k=k), 4),
+        'measured_at': datetime.utcnow().isoformat()
+    }
+
+def remove_quantized(path: str) -> None:
+    """Delete the exact vectors, codes, quantizer and manifest persisted at ``path``"""
+    for artifact in (path, _artifact_path(path, 'codes.npy'), _artifact_path(path, 'quantizer.npz'),
+                     _artifact_path(path, 'json')):
+        if os.path.exists(artifact):
+            os.remove(artifact)
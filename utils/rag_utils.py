@@ -3,71 +3,45 @@ import json
 import logging
 import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
 import re
 from collections import defaultdict
 
+from utils.bm25_index import BM25Index, bm25_index_path, get_bm25_index
+from utils.chunk_index import ChunkIndex
+from utils.chunker import DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, chunk_spans
+from utils.vector_cache import top_k_indices
+
 class RAGUtils:
     """Utility functions for Retrieval-Augmented Generation (RAG)"""
     
     def __init__(self):
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+        self.chunk_size = DEFAULT_CHUNK_TOKENS
+        self.chunk_overlap = DEFAULT_OVERLAP_TOKENS
         self.max_chunks_per_query = 10
         
     def advanced_text_chunking(self, text: str, chunk_size: int = None, overlap: int = None) -> List[Dict[str, Any]]:
         """
         Advanced text chunking with semantic awareness
+        
+        Chunks are sized in tokens and cut at sentence ends where possible;
+        ``start`` and ``end`` give each chunk's character span in ``text``.
         """
         try:
             chunk_size = chunk_size or self.chunk_size
-            overlap = overlap or self.chunk_overlap
-            
-            if not text:
-                return []
-            
-            # Clean and normalize text
-            text = self._clean_text(text)
-            
-            # Split into sentences first
-            sentences = self._split_into_sentences(text)
+            overlap = self.chunk_overlap if overlap is None else overlap
             
             chunks = []
-            current_chunk = ""
-            current_chunk_sentences = []
-            
-            for sentence in sentences:
-                # Check if adding this sentence would exceed chunk size
-                if len(current_chunk + sentence) > chunk_size and current_chunk:
-                    # Create chunk
-                    chunk_data = {
-                        'text': current_chunk.strip(),
-                        'sentences': current_chunk_sentences,
-                        'word_count': len(current_chunk.split()),
-                        'char_count': len(current_chunk),
-                        'keywords': self._extract_keywords(current_chunk)
-                    }
-                    chunks.append(chunk_data)
-                    
-                    # Start new chunk with overlap
-                    overlap_text = self._get_overlap_text(current_chunk_sentences, overlap)
-                    current_chunk = overlap_text + sentence
-                    current_chunk_sentences = [sentence]
-                else:
-                    current_chunk += sentence
-                    current_chunk_sentences.append(sentence)
-            
-            # Add final chunk
-            if current_chunk.strip():
-                chunk_data = {
-                    'text': current_chunk.strip(),
-                    'sentences': current_chunk_sentences,
-                    'word_count': len(current_chunk.split()),
-                    'char_count': len(current_chunk),
-                    'keywords': self._extract_keywords(current_chunk)
-                }
-                chunks.append(chunk_data)
+            for span in chunk_spans(text, chunk_size, overlap):
+                chunks.append({
+                    'text': span.text,
+                    'start': span.start,
+                    'end': span.end,
+                    'tokens': span.tokens,
+                    'sentences': self._split_into_sentences(self._clean_text(span.text)),
+                    'word_count': len(span.text.split()),
+                    'char_count': len(span.text),
+                    'keywords': self._extract_keywords(span.text)
+                })
             
             return chunks
             
@@ -113,26 +87,6 @@ class RAGUtils:
             logging.error(f"Error splitting into sentences: {e}")
             return [text]
     
-    def _get_overlap_text(self, sentences: List[str], overlap: int) -> str:
-        """Get overlap text from previous chunk"""
-        try:
-            if not sentences:
-                return ""
-            
-            # Take last few sentences for overlap
-            overlap_sentences = sentences[-2:] if len(sentences) > 1 else sentences
-            overlap_text = ''.join(overlap_sentences)
-            
-            # Ensure overlap doesn't exceed specified length
-            if len(overlap_text) > overlap:
-                overlap_text = overlap_text[-overlap:]
-            
-            return overlap_text
-            
-        except Exception as e:
-            logging.error(f"Error getting overlap text: {e}")
-            return ""
-    
     def _extract_keywords(self, text: str) -> List[str]:
         """Extract keywords from text using TF-IDF"""
         try:
@@ -157,83 +111,69 @@ class RAGUtils:
             logging.error(f"Error extracting keywords: {e}")
             return []
     
+    def index_chunks(self, chunks: List[Dict[str, Any]],
+                     embeddings: Optional[List[List[float]]] = None) -> ChunkIndex:
+        """Tokenise and stack chunks once so repeated queries over them are cheap"""
+        return ChunkIndex([chunk.get('text', '') for chunk in chunks], embeddings)
+    
     def hybrid_search(self, query: str, chunks: List[Dict[str, Any]], embeddings: List[List[float]], 
-                     query_embedding: List[float], alpha: float = 0.7) -> List[Dict[str, Any]]:
+                     query_embedding: List[float], alpha: float = 0.7,
+                     knowledge_base_id: Optional[int] = None,
+                     index: Optional[ChunkIndex] = None) -> List[Dict[str, Any]]:
         """
         Hybrid search combining semantic similarity and keyword matching
+        
+        When the chunks come from a knowledge base with a BM25 index, pass its
+        id and keyword scores are read from the index instead of re-tokenising
+        every chunk. When searching the same chunks repeatedly, pass the
+        result of ``index_chunks`` as ``index``.
         """
         try:
             if not chunks or not embeddings or not query_embedding:
                 return []
             
-            # Semantic similarity scores
-            semantic_scores = []
-            for embedding in embeddings:
-                if embedding:
-                    similarity = cosine_similarity([query_embedding], [embedding])[0][0]
-                    semantic_scores.append(similarity)
-                else:
-                    semantic_scores.append(0.0)
-            
-            # Keyword matching scores
-            keyword_scores = self._calculate_keyword_scores(query, chunks)
+            index = index or self.index_chunks(chunks, embeddings)
             
-            # Combine scores
-            combined_scores = []
-            for i in range(len(chunks)):
-                semantic_score = semantic_scores[i] if i < len(semantic_scores) else 0.0
-                keyword_score = keyword_scores[i] if i < len(keyword_scores) else 0.0
-                
-                # Weighted combination
-                combined_score = alpha * semantic_score + (1 - alpha) * keyword_score
-                combined_scores.append(combined_score)
+            # One matrix-vector product for every chunk's semantic score
+            semantic_scores = index.semantic_scores(query_embedding)
+            keyword_scores = np.asarray(
+                self._calculate_keyword_scores(query, chunks, knowledge_base_id, index), dtype=np.float64
+            )
+            combined_scores = alpha * semantic_scores + (1 - alpha) * keyword_scores
             
-            # Sort by combined score
+            # Only the top results are copied
             scored_chunks = []
-            for i, chunk in enumerate(chunks):
-                chunk_copy = chunk.copy()
-                chunk_copy['score'] = combined_scores[i]
-                chunk_copy['semantic_score'] = semantic_scores[i] if i < len(semantic_scores) else 0.0
-                chunk_copy['keyword_score'] = keyword_scores[i] if i < len(keyword_scores) else 0.0
+            for i in top_k_indices(combined_scores, self.max_chunks_per_query):
+                chunk_copy = chunks[i].copy()
+                chunk_copy['score'] = float(combined_scores[i])
+                chunk_copy['semantic_score'] = float(semantic_scores[i])
+                chunk_copy['keyword_score'] = float(keyword_scores[i])
                 scored_chunks.append(chunk_copy)
             
-            # Sort by score and return top results
-            scored_chunks.sort(key=lambda x: x['score'], reverse=True)
-            return scored_chunks[:self.max_chunks_per_query]
+            return scored_chunks
             
         except Exception as e:
             logging.error(f"Error in hybrid search: {e}")
             return []
     
-    def _calculate_keyword_scores(self, query: str, chunks: List[Dict[str, Any]]) -> List[float]:
+    def _calculate_keyword_scores(self, query: str, chunks: List[Dict[str, Any]],
+                                  knowledge_base_id: Optional[int] = None,
+                                  index: Optional[ChunkIndex] = None) -> List[float]:
         """Calculate keyword matching scores"""
         try:
-            query_keywords = set(re.findall(r'\b\w+\b', query.lower()))
-            
-            scores = []
-            for chunk in chunks:
-                chunk_text = chunk.get('text', '').lower()
-                chunk_keywords = set(re.findall(r'\b\w+\b', chunk_text))
-                
-                # Calculate Jaccard similarity
-                intersection = len(query_keywords.intersection(chunk_keywords))
-                union = len(query_keywords.union(chunk_keywords))
-                
-                if union > 0:
-                    jaccard_score = intersection / union
-                else:
-                    jaccard_score = 0.0
-                
-                # Boost score for exact phrase matches
-                phrase_boost = 0.0
-                if len(query) > 5:  # Only for longer queries
-                    if query.lower() in chunk_text:
-                        phrase_boost = 0.3
-                
-                final_score = jaccard_score + phrase_boost
-                scores.append(min(final_score, 1.0))  # Cap at 1.0
-            
-            return scores
+            if knowledge_base_id is not None and all('id' in chunk for chunk in chunks):
+                index_path = bm25_index_path(knowledge_base_id)
+                if BM25Index.exists(index_path) and get_bm25_index(knowledge_base_id).is_built:
+                    # BM25 from the postings of the query terms, scaled to [0, 1]
+                    scores = get_bm25_index(knowledge_base_id).score_documents(
+                        query, [chunk['id'] for chunk in chunks]
+                    )
+                    top = max(scores, default=0.0)
+                    return [score / top if top > 0 else 0.0 for score in scores]
+            
+            # Jaccard similarity of word sets plus an exact phrase boost
+            index = index or self.index_chunks(chunks)
+            return index.keyword_scores(query).tolist()
             
         except Exception as e:
             logging.error(f"Error calculating keyword scores: {e}")
@@ -243,118 +183,43 @@ class RAGUtils:
                       rerank_model: str = "cross-encoder") -> List[Dict[str, Any]]:
         """
         Re-rank search results using more sophisticated methods
+        
+        Each result is tokenised once; coverage, TF-IDF relevance and
+        quality are then computed for all results together.
         """
         try:
             if not search_results:
                 return []
             
-            # For now, implement a simple re-ranking based on query-document similarity
-            # In production, this could use specialized re-ranking models
+            index = self.index_chunks(search_results)
+            query_coverage = index.coverage_scores(query)
+            relevance_score = index.relevance_scores(query)
+            document_quality = index.quality
+            base_score = np.array([result.get('score', 0.0) for result in search_results], dtype=np.float64)
+            
+            # Combine metrics
+            rerank_scores = (
+                0.4 * query_coverage +
+                0.3 * relevance_score +
+                0.2 * document_quality +
+                0.1 * base_score
+            )
             
             reranked_results = []
-            for result in search_results:
-                chunk_text = result.get('text', '')
-                
-                # Calculate query-document similarity metrics
-                query_coverage = self._calculate_query_coverage(query, chunk_text)
-                document_quality = self._calculate_document_quality(chunk_text)
-                relevance_score = self._calculate_relevance_score(query, chunk_text)
-                
-                # Combine metrics
-                rerank_score = (
-                    0.4 * query_coverage +
-                    0.3 * relevance_score +
-                    0.2 * document_quality +
-                    0.1 * result.get('score', 0.0)
-                )
-                
-                result_copy = result.copy()
-                result_copy['rerank_score'] = rerank_score
-                result_copy['query_coverage'] = query_coverage
-                result_copy['document_quality'] = document_quality
-                result_copy['relevance_score'] = relevance_score
-                
+            for i in np.argsort(-rerank_scores, kind='stable'):
+                result_copy = search_results[i].copy()
+                result_copy['rerank_score'] = float(rerank_scores[i])
+                result_copy['query_coverage'] = float(query_coverage[i])
+                result_copy['document_quality'] = float(document_quality[i])
+                result_copy['relevance_score'] = float(relevance_score[i])
                 reranked_results.append(result_copy)
             
-            # Sort by re-rank score
-            reranked_results.sort(key=lambda x: x['rerank_score'], reverse=True)
-            
             return reranked_results
             
         except Exception as e:
             logging.error(f"Error in re-ranking: {e}")
             return search_results
     
-    def _calculate_query_coverage(self, query: str, document: str) -> float:
-        """Calculate how well the document covers the query terms"""
-        try:
-            query_terms = set(re.findall(r'\b\w+\b', query.lower()))
-            document_terms = set(re.findall(r'\b\w+\b', document.lower()))
-            
-            if not query_terms:
-                return 0.0
-            
-            covered_terms = query_terms.intersection(document_terms)
-            coverage = len(covered_terms) / len(query_terms)
-            
-            return coverage
-            
-        except Exception as e:
-            logging.error(f"Error calculating query coverage: {e}")
-            return 0.0
-    
-    def _calculate_document_quality(self, document: str) -> float:
-        """Calculate document quality score"""
-        try:
-            # Simple quality metrics
-            word_count = len(document.split())
-            sentence_count = len(re.findall(r'[.!?]+', document))
-            
-            # Prefer documents with reasonable length
-            length_score = min(word_count / 200, 1.0)  # Normalize to 200 words
-            
-            # Prefer documents with proper sentence structure
-            structure_score = min(sentence_count / 10, 1.0)  # Normalize to 10 sentences
-            
-            # Check for informative content (not just stop words)
-            content_words = len([word for word in document.split() if len(word) > 3])
-            content_score = min(content_words / word_count, 1.0) if word_count > 0 else 0.0
-            
-            quality_score = (length_score + structure_score + content_score) / 3
-            
-            return quality_score
-            
-        except Exception as e:
-            logging.error(f"Error calculating document quality: {e}")
-            return 0.0
-    
-    def _calculate_relevance_score(self, query: str, document: str) -> float:
-        """Calculate relevance score between query and document"""
-        try:
-            # Use TF-IDF similarity
-            vectorizer = TfidfVectorizer(stop_words='english', max_features=1000)
-            
-            try:
-                tfidf_matrix = vectorizer.fit_transform([query, document])
-                similarity = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
-                return similarity
-            except:
-                # Fallback to simple word overlap
-                query_words = set(re.findall(r'\b\w+\b', query.lower()))
-                doc_words = set(re.findall(r'\b\w+\b', document.lower()))
-                
-                if not query_words or not doc_words:
-                    return 0.0
-                
-                intersection = len(query_words.intersection(doc_words))
-                union = len(query_words.union(doc_words))
-                
-                return intersection / union if union > 0 else 0.0
-                
-        except Exception as e:
-            logging.error(f"Error calculating relevance score: {e}")
-            return 0.0
-    
     def query_expansion(self, query: str, knowledge_base_chunks: List[Dict[str, Any]]) -> List[str]:
         """
         Expand query with related terms from knowledge base
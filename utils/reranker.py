@@ -0,0 +1,295 @@
+import os
+import time
+import hashlib
+import json
+import logging
+import threading
+import numpy as np
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+from utils.bm25_index import tokenize
+from utils.hybrid_search import fuse_scores, hybrid_settings
+
+# Reranker used by default: 'auto' (a cross-encoder when sentence-transformers
+# is installed, fusion otherwise), 'fusion', 'cross-encoder' or 'none'
+RERANKER = os.environ.get('RERANKER', 'auto')
+
+# Wall-clock budget of one rerank; past it the first-stage ranking is returned as is
+RERANK_BUDGET_MS = float(os.environ.get('RERANK_BUDGET_MS', '250'))
+
+# Candidates rescored per query; the rest keep their first-stage order after them
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', '50'))
+
+# Query-chunk pairs scored per model call
+RERANK_BATCH_SIZE = int(os.environ.get('RERANK_BATCH_SIZE', '16'))
+
+# (query, chunk) scores memoized across searches
+RERANK_CACHE_SIZE = int(os.environ.get('RERANK_CACHE_SIZE', '50000'))
+
+CROSS_ENCODER_MODEL = os.environ.get('RERANK_CROSS_ENCODER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+
+def query_hash(query: str) -> str:
+    return hashlib.sha1(' '.join(query.lower().split()).encode('utf-8')).hexdigest()
+
+def chunk_id(candidate: Dict[str, Any]) -> str:
+    """Stable identity of a search result: its row id, else file and chunk index, else its text"""
+    if candidate.get('id') is not None:
+        return str(candidate['id'])
+    if candidate.get('file_id') is not None and candidate.get('chunk_index') is not None:
+        return f"{candidate['file_id']}:{candidate['chunk_index']}"
+    text = candidate.get('chunk_text') or candidate.get('text') or ''
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def candidate_text(candidate: Dict[str, Any]) -> str:
+    return candidate.get('chunk_text') or candidate.get('text') or ''
+
+def bm25_scores(query: str, texts: Sequence[str], k1: float = 1.2, b: float = 0.75) -> np.ndarray:
+    """BM25 of each text for ``query``, with IDF taken over ``texts`` themselves"""
+    documents = [Counter(tokenize(text)) for text in texts]
+    lengths = np.array([sum(document.values()) for document in documents], dtype=np.float64)
+    scores = np.zeros(len(documents))
+    if not len(documents):
+        return scores
+    average = lengths.mean() or 1.0
+    for term in set(tokenize(query)):
+        tf = np.array([document.get(term, 0) for document in documents], dtype=np.float64)
+        df = np.count_nonzero(tf)
+        if not df:
+            continue
+        idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        scores += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / average))
+    return scores
+
+class ScoreCache:
+    """Bounded LRU of rerank scores keyed by (reranker scope, query hash, chunk id)"""
+
+    def __init__(self, max_entries: int = RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._scores: 'OrderedDict[Tuple[str, str, str], float]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: Sequence[Tuple[str, str, str]]) -> List[Optional[float]]:
+        with self._lock:
+            scores = []
+            for key in keys:
+                score = self._scores.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._scores.move_to_end(key)
+                scores.append(score)
+            return scores
+
+    def put_many(self, keys: Sequence[Tuple[str, str, str]], scores: Sequence[float]) -> None:
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = float(score)
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scores.clear()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+class Reranker:
+    """Rescores first-stage search results for a query
+
+    Subclasses implement ``score(query, candidates)``. ``rerank`` serves
+    what it can from the score cache, scores the rest ``batch_size`` at a
+    time and gives up once ``budget_ms`` has passed, returning the
+    candidates in their original order, so a slow model never holds a
+    search up for longer than the budget plus one batch.
+    """
+
+    name = 'base'
+    # Scores depend on the whole candidate set, so it is scored in one batch
+    set_wise = False
+
+    def __init__(self, budget_ms: float = RERANK_BUDGET_MS, max_candidates: int = RERANK_CANDIDATES,
+                 batch_size: int = RERANK_BATCH_SIZE, cache: Optional[ScoreCache] = None):
+        self.budget_ms = budget_ms
+        self.max_candidates = max_candidates
+        self.batch_size = max(1, batch_size)
+        self.cache = cache if cache is not None else score_cache
+        self.stats = {'queries': 0, 'scored': 0, 'over_budget': 0, 'errors': 0}
+
+    def score(self, query: str, candidates: Sequence[Dict[str, Any]]) -> np.ndarray:
+        raise NotImplementedError
+
+    def cache_scope(self, candidates: Sequence[Dict[str, Any]]) -> str:
+        """First part of the cache keys of scores for ``candidates``"""
+        return self.name
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Candidates reordered by score (with ``rerank_score`` set), or unchanged if over budget"""
+        if not candidates:
+            return candidates
+        deadline = time.perf_counter() + self.budget_ms / 1000.0
+        self.stats['queries'] += 1
+        head, tail = candidates[:self.max_candidates], candidates[self.max_candidates:]
+
+        query_key = query_hash(query)
+        scope = self.cache_scope(head)
+        keys = [(scope, query_key, chunk_id(candidate)) for candidate in head]
+        scores = self.cache.get_many(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        batch_size = self.batch_size
+        if self.set_wise and missing:
+            # A partly cached set is rescored whole so all scores share one candidate set
+            missing = list(range(len(head)))
+            batch_size = len(head)
+
+        try:
+            for start in range(0, len(missing), batch_size):
+                if time.perf_counter() > deadline:
+                    self.stats['over_budget'] += 1
+                    logging.info(f"Reranking took over {self.budget_ms:.0f} ms; keeping the first-stage order")
+                    return candidates
+                batch = missing[start:start + batch_size]
+                batch_scores = self.score(query, [head[i] for i in batch])
+                for i, score in zip(batch, batch_scores):
+                    scores[i] = float(score)
+                self.cache.put_many([keys[i] for i in batch], batch_scores)
+                self.stats['scored'] += len(batch)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logging.error(f"Reranking failed, keeping the first-stage order: {e}")
+            return candidates
+
+        reranked = []
+        for i in sorted(range(len(head)), key=lambda i: -scores[i]):
+            result = dict(head[i])
+            result['rerank_score'] = scores[i]
+            result['reranker'] = self.name
+            reranked.append(result)
+        return reranked + tail
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'reranker': self.name, **self.stats, 'cache_entries': len(self.cache),
+                'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses}
+
+class FusionReranker(Reranker):
+    """BM25 over the candidate set fused with their embedding similarity
+
+    Needs no model: the dense score is the ``similarity`` the first stage
+    already computed, and the two are combined with the same fusion as
+    hybrid search (``utils.hybrid_search``), weighted or reciprocal rank.
+    """
+
+    name = 'fusion'
+    set_wise = True
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.settings = hybrid_settings(settings, hybrid_fusion='weighted')
+
+    def score(self, query: str, candidates: Sequence[Dict[str, Any]]) -> np.ndarray:
+        dense = np.array([candidate.get('similarity', np.nan) for candidate in candidates], dtype=np.float64)
+        sparse = bm25_scores(query, [candidate_text(candidate) for candidate in candidates])
+        return fuse_scores(dense, sparse, self.settings)
+
+    def cache_scope(self, candidates: Sequence[Dict[str, Any]]) -> str:
+        """Scores are relative to the candidate set, their similarities and the fusion settings"""
+        members = sorted((chunk_id(candidate), repr(candidate.get('similarity'))) for candidate in candidates)
+        digest = hashlib.sha1(json.dumps([members, self.settings], sort_keys=True, default=str).encode('utf-8'))
+        return f"{self.name}:{digest.hexdigest()}"
+
+_cross_encoders: Dict[str, Any] = {}
+_cross_encoder_lock = threading.Lock()
+
+def load_cross_encoder(model_name: str = CROSS_ENCODER_MODEL):
+    """Shared CrossEncoder instance, loaded on first use"""
+    with _cross_encoder_lock:
+        if model_name not in _cross_encoders:
+            _cross_encoders[model_name] = CrossEncoder(model_name, device='cpu')
+        return _cross_encoders[model_name]
+
+class CrossEncoderReranker(Reranker):
+    """A small local cross-encoder scoring each (query, chunk) pair on the CPU
+
+    If sentence-transformers is missing or the model cannot be loaded the
+    reranker falls back to ``FusionReranker`` for good.
+    """
+
+    name = 'cross-encoder'
+
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL, **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = model_name
+        self.name = f"cross-encoder:{model_name}"
+        self.fallback: Optional[FusionReranker] = None
+
+    def _model(self):
+        if self.fallback is None:
+            try:
+                if CrossEncoder is None:
+                    raise ImportError("sentence-transformers is not installed")
+                return load_cross_encoder(self.model_name)
+            except Exception as e:
+                logging.warning(f"Cross-encoder {self.model_name} unavailable, reranking with fusion: {e}")
+                self.fallback = FusionReranker(budget_ms=self.budget_ms, max_candidates=self.max_candidates,
+                                               cache=self.cache)
+        return None
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self._model()
+        if self.fallback is not None:
+            return self.fallback.rerank(query, candidates)
+        return super().rerank(query, candidates)
+
+    def score(self, query: str, candidates: Sequence[Dict[str, Any]]) -> np.ndarray:
+        pairs = [(query, candidate_text(candidate)) for candidate in candidates]
+        return np.asarray(self._model().predict(pairs, batch_size=self.batch_size), dtype=np.float64)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.fallback.get_stats() if self.fallback is not None else super().get_stats()
+
+class NoopReranker(Reranker):
+    """Keeps the first-stage ranking"""
+
+    name = 'none'
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return candidates
+
+RERANKERS: Dict[str, Type[Reranker]] = {
+    'fusion': FusionReranker,
+    'cross-encoder': CrossEncoderReranker,
+    'none': NoopReranker
+}
+
+def register_reranker(name: str, reranker_class: Type[Reranker]) -> None:
+    """Make a Reranker subclass selectable by name (RERANKER or ``get_reranker``)"""
+    RERANKERS[name] = reranker_class
+    _rerankers.pop(name, None)
+
+_rerankers: Dict[str, Reranker] = {}
+_rerankers_lock = threading.Lock()
+
+def get_reranker(name: Optional[str] = None) -> Reranker:
+    """Shared reranker by name; defaults to RERANKER"""
+    name = name or RERANKER
+    if name == 'auto':
+        name = 'cross-encoder' if CrossEncoder is not None else 'fusion'
+    if name not in RERANKERS:
+        raise ValueError(f"Unknown reranker {name!r}, expected one of {sorted(RERANKERS)} or 'auto'")
+    with _rerankers_lock:
+        if name not in _rerankers:
+            _rerankers[name] = RERANKERS[name]()
+        return _rerankers[name]
+
+# Global instances
+score_cache = ScoreCache()
@@ -0,0 +1,136 @@
+import os
+import re
+import logging
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Encoding used when a model has no tiktoken mapping of its own
+TOKENIZER_ENCODING = os.environ.get('TOKENIZER_ENCODING', 'cl100k_base')
+
+# Pieces whose token counts are memoized before the memo is reset
+PIECE_CACHE_SIZE = 200000
+
+# Longest piece counted as a unit; longer runs (base64, minified code) are sliced
+MAX_PIECE_CHARS = 256
+
+# The pre-tokenizer split of cl100k_base expressed with ``re``: BPE never
+# merges across these pieces, so summing per-piece counts gives the token
+# count of the whole text up to the few places where ``re``'s character
+# classes differ from the Unicode property classes tiktoken uses. The
+# trailing alternative makes sure every character belongs to some piece.
+PIECE_PATTERN = re.compile(
+    r"'(?i:[sdmt]|ll|ve|re)"
+    r"|[^\r\n\w]?[^\W\d_]+"
+    r"|\d{1,3}"
+    r"| ?[^\s\w]+[\r\n]*"
+    r"|\s*[\r\n]+"
+    r"|\s+(?!\S)"
+    r"|\s+"
+    r"|[\s\S]"
+)
+
+def _estimate_piece(piece: str) -> int:
+    """Token estimate for one piece when no BPE tables are available"""
+    stripped = piece.strip()
+    if not stripped:
+        return 1
+    if stripped.isalpha():
+        # Common words are a single token, long ones split every 6-8 letters
+        return 1 + len(stripped) // 8
+    return max(1, (len(stripped) + 1) // 2)
+
+@lru_cache(maxsize=None)
+def _load_encoding(name: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        # Encodings are downloaded on first use; offline hosts fall back to estimates
+        logging.warning(f"Could not load tiktoken encoding {name}, estimating token counts: {e}")
+        return None
+
+def encoding_name(model: Optional[str] = None) -> str:
+    """tiktoken encoding of ``model``, the default encoding for unknown models"""
+    if tiktoken is not None and model:
+        try:
+            return tiktoken.encoding_for_model(model).name
+        except Exception:
+            pass
+    return TOKENIZER_ENCODING
+
+class Tokenizer:
+    """Counts tokens with tiktoken, or estimates them without it
+
+    ``count`` measures whole texts; ``piece_tokens`` measures the pieces
+    ``PIECE_PATTERN`` splits text into and memoizes them, which is what
+    lets the chunker size a stream of text without encoding it twice.
+    """
+
+    def __init__(self, name: str = TOKENIZER_ENCODING):
+        self.encoding = _load_encoding(name)
+        self.name = name if self.encoding is not None else 'estimate'
+        self._piece_cache: Dict[str, int] = {}
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode_ordinary(text))
+        return sum(self.piece_counts(PIECE_PATTERN.findall(text)))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest prefix of ``text`` that is at most ``max_tokens`` tokens"""
+        if max_tokens <= 0:
+            return ''
+        if self.encoding is not None:
+            tokens = self.encoding.encode_ordinary(text)
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        pieces = PIECE_PATTERN.findall(text)
+        totals = list(accumulate(self.piece_counts(pieces)))
+        if not totals or totals[-1] <= max_tokens:
+            return text
+        return ''.join(pieces[:bisect_right(totals, max_tokens)])
+
+    def piece_tokens(self, piece: str) -> int:
+        count = self._piece_cache.get(piece)
+        if count is None:
+            if self.encoding is not None:
+                count = len(self.encoding.encode_ordinary(piece))
+            else:
+                count = _estimate_piece(piece)
+            if len(self._piece_cache) >= PIECE_CACHE_SIZE:
+                self._piece_cache.clear()
+            self._piece_cache[piece] = count
+        return count
+
+    def piece_counts(self, pieces: List[str]) -> List[int]:
+        """``piece_tokens`` of every piece, looked up in bulk"""
+        counts = list(map(self._piece_cache.get, pieces))
+        if None in counts:
+            piece_tokens = self.piece_tokens
+            counts = [count if count is not None else piece_tokens(piece)
+                      for count, piece in zip(counts, pieces)]
+        return counts
+
+@lru_cache(maxsize=None)
+def _tokenizer(name: str) -> Tokenizer:
+    return Tokenizer(name)
+
+def get_tokenizer(model: Optional[str] = None) -> Tokenizer:
+    """Shared tokenizer for ``model`` (the default encoding if None)"""
+    return _tokenizer(encoding_name(model))
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    return get_tokenizer(model).count(text)
@@ -3,6 +3,8 @@ import uuid
 from typing import Any, Dict, List, Optional
 from urllib.parse import urlparse
 
+from utils.chunker import DEFAULT_CHUNK_TOKENS
+
 def validate_email(email: str) -> bool:
     """Validate email address format"""
     if not email or len(email) > 254:
@@ -171,13 +173,15 @@ def validate_knowledge_base_config(config: Dict[str, Any]) -> Dict[str, Any]:
     if 'chunk_size' in config:
         chunk_size = config['chunk_size']
         if not isinstance(chunk_size, int) or chunk_size < 100 or chunk_size > 8192:
-            return {'valid': False, 'message': 'Chunk size must be between 100 and 8192'}
+            return {'valid': False, 'message': 'Chunk size must be between 100 and 8192 tokens'}
     
     # Validate chunk_overlap
     if 'chunk_overlap' in config:
         overlap = config['chunk_overlap']
         if not isinstance(overlap, int) or overlap < 0 or overlap > 1000:
             return {'valid': False, 'message': 'Chunk overlap must be between 0 and 1000'}
+        if overlap >= config.get('chunk_size', DEFAULT_CHUNK_TOKENS):
+            return {'valid': False, 'message': 'Chunk overlap must be smaller than the chunk size'}
     
     # Validate embedding model
     valid_embedding_models = [
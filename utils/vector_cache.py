@@ -0,0 +1,303 @@
+import os
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalise the rows of a matrix, leaving zero rows untouched"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= scores.size:
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+class KnowledgeBaseMatrix:
+    """All vectors of one knowledge base as a single normalised (n, d) matrix
+
+    Instances are never mutated in place; patches return a new matrix so
+    searches running in other threads keep a consistent snapshot.
+    """
+
+    def __init__(self, matrix: np.ndarray, chunk_ids: Sequence[str], file_ids: Sequence[Any]):
+        self.matrix = normalize_rows(matrix)
+        self.chunk_ids = np.asarray(chunk_ids, dtype=object)
+        self.file_ids = np.asarray(file_ids, dtype=object)
+        self._row_of: Optional[Dict[str, int]] = None
+        self._signature: Optional[Tuple[int, str]] = None
+
+        if self.matrix.ndim != 2 and self.matrix.size:
+            raise ValueError(f"Expected a 2-D matrix, got shape {self.matrix.shape}")
+        if len(self.chunk_ids) != len(self.matrix) or len(self.file_ids) != len(self.matrix):
+            raise ValueError("Row id arrays must match the number of matrix rows")
+
+    @classmethod
+    def empty(cls, dimension: int = 0) -> 'KnowledgeBaseMatrix':
+        return cls(np.empty((0, dimension), dtype=np.float32), [], [])
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def dimension(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    @property
+    def signature(self) -> Tuple[int, str]:
+        """(row count, hash of the chunk ids in order); equal signatures mean the same rows"""
+        if self._signature is None:
+            digest = hashlib.sha1('\0'.join(str(chunk_id) for chunk_id in self.chunk_ids).encode('utf-8'))
+            self._signature = (len(self), digest.hexdigest())
+        return self._signature
+
+    @property
+    def nbytes(self) -> int:
+        # Object arrays hold pointers; count the id strings roughly as well
+        return int(self.matrix.nbytes + self.chunk_ids.nbytes + self.file_ids.nbytes + 64 * len(self))
+
+    def search(self, query_vector: Sequence[float], k: int = 10) -> List[Tuple[str, Any, float]]:
+        """Return (chunk_id, file_id, cosine similarity) for the top k rows"""
+        if len(self) == 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, knowledge base has {self.dimension}")
+
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+
+        scores = self.matrix @ (query / norm)
+        rows = top_k_indices(scores, k)
+        return [(self.chunk_ids[i], self.file_ids[i], float(scores[i])) for i in rows]
+
+    def score_ids(self, query_vector: Sequence[float], chunk_ids: Sequence[str]) -> np.ndarray:
+        """Cosine similarity of the query to each given chunk, NaN for unknown ids"""
+        scores = np.full(len(chunk_ids), np.nan, dtype=np.float32)
+        if len(self) == 0 or not len(chunk_ids):
+            return scores
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, knowledge base has {self.dimension}")
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return scores
+
+        if self._row_of is None:
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        positions = [(i, self._row_of[chunk_id]) for i, chunk_id in enumerate(chunk_ids) if chunk_id in self._row_of]
+        if positions:
+            found, rows = zip(*positions)
+            scores[list(found)] = self.matrix[list(rows)] @ (query / norm)
+        return scores
+
+    def append(self, vectors: Sequence[Sequence[float]], chunk_ids: Sequence[str],
+               file_ids: Sequence[Any]) -> 'KnowledgeBaseMatrix':
+        """Return a new matrix with extra rows appended"""
+        new_rows = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        if len(self) == 0:
+            return KnowledgeBaseMatrix(new_rows, chunk_ids, file_ids)
+        return KnowledgeBaseMatrix(
+            np.vstack([self.matrix, new_rows]),
+            np.concatenate([self.chunk_ids, np.asarray(chunk_ids, dtype=object)]),
+            np.concatenate([self.file_ids, np.asarray(file_ids, dtype=object)])
+        )
+
+    def without_files(self, file_ids: Iterable[Any]) -> 'KnowledgeBaseMatrix':
+        """Return a new matrix without the rows that belong to the given files"""
+        drop = set(file_ids)
+        keep = np.array([file_id not in drop for file_id in self.file_ids], dtype=bool)
+        if keep.all():
+            return self
+        return KnowledgeBaseMatrix(self.matrix[keep], self.chunk_ids[keep], self.file_ids[keep])
+
+    def without_chunks(self, chunk_ids: Iterable[str]) -> 'KnowledgeBaseMatrix':
+        """Return a new matrix without the given chunks"""
+        drop = set(chunk_ids)
+        keep = np.array([chunk_id not in drop for chunk_id in self.chunk_ids], dtype=bool)
+        if keep.all():
+            return self
+        return KnowledgeBaseMatrix(self.matrix[keep], self.chunk_ids[keep], self.file_ids[keep])
+
+class VectorMatrixCache:
+    """Process-wide LRU cache of knowledge base matrices under a memory budget
+
+    Whole knowledge bases are evicted, least recently used first, whenever the
+    resident matrices exceed ``max_bytes``. A knowledge base larger than the
+    budget on its own is still served but never retained.
+
+    Each knowledge base has a generation that every patch and invalidation
+    bumps, cached or not, so a load that raced with one is served but not
+    cached. Entries can also carry a version, a cheap signature of the
+    stored rows whose first item is the row count (see
+    ``utils.knowledge_base_index.knowledge_base_version``): ``get`` reloads
+    an entry whose version no longer matches, which catches writes made by
+    other processes.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Any, KnowledgeBaseMatrix]' = OrderedDict()
+        self._versions: Dict[Any, Any] = {}
+        self._generations: Dict[Any, int] = {}
+        self._epoch = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _generation(self, knowledge_base_id: Any) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(knowledge_base_id, 0)
+
+    def _bump(self, knowledge_base_id: Any) -> None:
+        self._generations[knowledge_base_id] = self._generations.get(knowledge_base_id, 0) + 1
+
+    def get(self, knowledge_base_id: Any, loader: Callable[[Any], KnowledgeBaseMatrix],
+            version: Optional[Callable[[Any], Any]] = None) -> KnowledgeBaseMatrix:
+        """Return the cached matrix for a knowledge base, loading it on a miss
+
+        With ``version`` the cached entry is only served while
+        ``version(knowledge_base_id)`` still matches the one it was loaded at.
+        """
+        current = version(knowledge_base_id) if version is not None else None
+        with self._lock:
+            entry = self._entries.get(knowledge_base_id)
+            if entry is not None:
+                if version is None or self._versions.get(knowledge_base_id) == current:
+                    self._entries.move_to_end(knowledge_base_id)
+                    self.hits += 1
+                    return entry
+                self.stale += 1
+            self.misses += 1
+            generation = self._generation(knowledge_base_id)
+
+        # Load outside the lock so a slow database read doesn't block other knowledge bases
+        entry = loader(knowledge_base_id)
+        self.put(knowledge_base_id, entry, version=current, generation=generation)
+        return entry
+
+    def peek(self, knowledge_base_id: Any) -> Optional[KnowledgeBaseMatrix]:
+        """Return the cached matrix without loading or touching LRU order"""
+        with self._lock:
+            return self._entries.get(knowledge_base_id)
+
+    def put(self, knowledge_base_id: Any, entry: KnowledgeBaseMatrix, version: Any = None,
+            generation: Optional[Tuple[int, int]] = None) -> None:
+        """Cache an entry; skipped if ``generation`` is given and a patch has landed since"""
+        with self._lock:
+            if generation is not None and generation != self._generation(knowledge_base_id):
+                logging.debug(f"Knowledge base {knowledge_base_id} changed while loading, not caching")
+                return
+            self._entries.pop(knowledge_base_id, None)
+            self._versions.pop(knowledge_base_id, None)
+            if entry.nbytes > self.max_bytes:
+                logging.info(f"Knowledge base {knowledge_base_id} exceeds vector cache budget, not caching")
+                return
+            self._entries[knowledge_base_id] = entry
+            if version is not None:
+                self._versions[knowledge_base_id] = version
+            self._evict()
+
+    def _patched(self, knowledge_base_id: Any, entry: KnowledgeBaseMatrix, before: int, version: Any) -> None:
+        """Store a patched entry, adopting ``version`` if the row counts agree
+
+        The writer reads ``version`` after its commit; if the count moved by
+        more than this patch, someone else wrote too and the next ``get``
+        reloads.
+        """
+        self._entries[knowledge_base_id] = entry
+        cached = self._versions.pop(knowledge_base_id, None)
+        if version is not None and cached is not None and cached[0] + len(entry) - before == version[0]:
+            self._versions[knowledge_base_id] = version
+
+    def append(self, knowledge_base_id: Any, vectors: Sequence[Sequence[float]],
+               chunk_ids: Sequence[str], file_ids: Sequence[Any], version: Any = None) -> None:
+        """Patch a cached knowledge base with new rows; only bumps its generation if not cached"""
+        if not len(chunk_ids):
+            return
+        with self._lock:
+            self._bump(knowledge_base_id)
+            entry = self._entries.get(knowledge_base_id)
+            if entry is None:
+                return
+            try:
+                before = len(entry)
+                self._patched(knowledge_base_id, entry.append(vectors, chunk_ids, file_ids), before, version)
+                self._evict()
+            except ValueError as e:
+                logging.warning(f"Dropping cached matrix for knowledge base {knowledge_base_id}: {str(e)}")
+                self._entries.pop(knowledge_base_id, None)
+                self._versions.pop(knowledge_base_id, None)
+
+    def remove_files(self, knowledge_base_id: Any, file_ids: Iterable[Any], version: Any = None) -> None:
+        """Drop all rows of the given files from a cached knowledge base"""
+        with self._lock:
+            self._bump(knowledge_base_id)
+            entry = self._entries.get(knowledge_base_id)
+            if entry is not None:
+                before = len(entry)
+                self._patched(knowledge_base_id, entry.without_files(file_ids), before, version)
+
+    def remove_chunks(self, knowledge_base_id: Any, chunk_ids: Iterable[str], version: Any = None) -> None:
+        """Drop individual chunks from a cached knowledge base"""
+        with self._lock:
+            self._bump(knowledge_base_id)
+            entry = self._entries.get(knowledge_base_id)
+            if entry is not None:
+                before = len(entry)
+                self._patched(knowledge_base_id, entry.without_chunks(chunk_ids), before, version)
+
+    def invalidate(self, knowledge_base_id: Any = None) -> None:
+        """Forget one knowledge base, or everything when no id is given"""
+        with self._lock:
+            if knowledge_base_id is None:
+                self._epoch += 1
+                self._entries.clear()
+                self._versions.clear()
+            else:
+                self._bump(knowledge_base_id)
+                self._entries.pop(knowledge_base_id, None)
+                self._versions.pop(knowledge_base_id, None)
+
+    def _evict(self) -> None:
+        while self._entries and self.resident_bytes() > self.max_bytes:
+            evicted_id, _ = self._entries.popitem(last=False)
+            self._versions.pop(evicted_id, None)
+            self.evictions += 1
+            logging.debug(f"Evicted knowledge base {evicted_id} from vector cache")
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'knowledge_bases': len(self._entries),
+                'resident_bytes': self.resident_bytes(),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions
+            }
+
+# Global instance
+vector_cache = VectorMatrixCache(
+    max_bytes=int(os.environ.get('VECTOR_CACHE_MAX_MB', '512')) * 1024 * 1024
+)
@@ -0,0 +1,119 @@
+import json
+import logging
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Union
+from sqlalchemy import inspect, text
+
+# Stored vectors are little-endian float32 regardless of host byte order
+EMBEDDING_DTYPE = '<f4'
+
+def encode_vector(vector: Union[Sequence[float], np.ndarray]) -> bytes:
+    """Encode an embedding vector as a little-endian float32 blob"""
+    array = np.asarray(vector, dtype=EMBEDDING_DTYPE)
+    if array.ndim != 1:
+        raise ValueError(f"Expected a 1-D vector, got shape {array.shape}")
+    return array.tobytes()
+
+def decode_vector(blob: bytes, dimension: Optional[int] = None,
+                  dtype: str = EMBEDDING_DTYPE) -> np.ndarray:
+    """Decode a stored blob into a read-only float32 view without copying"""
+    vector = np.frombuffer(blob, dtype=dtype or EMBEDDING_DTYPE)
+    if dimension is not None and vector.shape[0] != dimension:
+        raise ValueError(f"Stored vector has {vector.shape[0]} dimensions, expected {dimension}")
+    return vector
+
+def decode_embedding(record: Any) -> Optional[np.ndarray]:
+    """Decode the vector of a FileEmbedding row or a raw result row
+
+    Rows that have not been migrated yet still carry the legacy JSON text
+    column and are parsed from there.
+    """
+    blob = getattr(record, 'embedding_blob', None)
+    if blob is not None:
+        return decode_vector(blob, getattr(record, 'embedding_dim', None),
+                             getattr(record, 'embedding_dtype', None) or EMBEDDING_DTYPE)
+
+    legacy = getattr(record, 'embedding_vector', None)
+    if legacy:
+        return np.asarray(json.loads(legacy), dtype=np.float32)
+
+    return None
+
+def set_embedding(record: Any, vector: Union[Sequence[float], np.ndarray]) -> None:
+    """Store a vector on a FileEmbedding row in the binary format"""
+    blob = encode_vector(vector)
+    record.embedding_blob = blob
+    record.embedding_dim = len(blob) // np.dtype(EMBEDDING_DTYPE).itemsize
+    record.embedding_dtype = EMBEDDING_DTYPE
+    record.embedding_vector = None
+
+def ensure_embedding_columns(engine) -> List[str]:
+    """Add the binary embedding columns to an existing file_embeddings table"""
+    columns = {col['name'] for col in inspect(engine).get_columns('file_embeddings')}
+    blob_type = 'BYTEA' if engine.dialect.name == 'postgresql' else 'BLOB'
+
+    wanted = [
+        ('embedding_blob', blob_type),
+        ('embedding_dim', 'INTEGER'),
+        ('embedding_dtype', 'VARCHAR(16)'),
+    ]
+
+    added = []
+    with engine.begin() as conn:
+        for name, column_type in wanted:
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE file_embeddings ADD COLUMN {name} {column_type}"))
+                added.append(name)
+
+    if added:
+        logging.info(f"Added columns to file_embeddings: {', '.join(added)}")
+    return added
+
+def migrate_embedding_vectors(batch_size: int = 500) -> Dict[str, int]:
+    """Convert legacy JSON embedding rows to float32 blobs in batches
+
+    Rows are walked in primary key order so a row that fails to parse is
+    skipped rather than retried forever. Each batch is committed on its own,
+    which makes the migration safe to interrupt and re-run.
+    """
+    from app import db
+    from models import FileEmbedding
+
+    ensure_embedding_columns(db.engine)
+
+    stats = {'converted': 0, 'skipped': 0, 'batches': 0}
+    last_id = None
+
+    while True:
+        query = FileEmbedding.query.filter(
+            FileEmbedding.embedding_blob.is_(None),
+            FileEmbedding.embedding_vector.isnot(None)
+        )
+        if last_id is not None:
+            query = query.filter(FileEmbedding.id > last_id)
+
+        batch = query.order_by(FileEmbedding.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        for record in batch:
+            try:
+                set_embedding(record, json.loads(record.embedding_vector))
+                stats['converted'] += 1
+            except (json.JSONDecodeError, TypeError, ValueError) as e:
+                logging.warning(f"Skipping embedding {record.id}: {str(e)}")
+                stats['skipped'] += 1
+
+        last_id = batch[-1].id
+        db.session.commit()
+        stats['batches'] += 1
+        logging.info(f"Migrated embedding batch {stats['batches']} ({stats['converted']} rows so far)")
+
+    return stats
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        result = migrate_embedding_vectors()
+        print(f"Converted {result['converted']} embeddings, skipped {result['skipped']}")
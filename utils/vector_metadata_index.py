@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Metadata keys the index can answer filters on
+INDEXED_KEYS = ('knowledge_base_id', 'file_id')
+
+# SQLite caps the number of bound parameters per statement
+_PARAM_BATCH = 500
+
+def _batched(items: Sequence[Any], size: int = _PARAM_BATCH) -> Iterable[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _key(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+class VectorMetadataIndex:
+    """Local SQLite map of vector id -> knowledge base, file and file name
+
+    Vector databases are good at nearest-neighbour queries and bad at
+    "every vector of knowledge base X". Each VectorDB writes the ids it
+    upserts and deletes here as well, so enumeration, counts, per-file
+    statistics and bulk deletes are index lookups that behave the same on
+    every backend.
+
+    ``is_built`` is set once the index has been filled from the backend's
+    own contents; until then callers must not trust it to be complete.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS vectors (
+                    vector_id TEXT PRIMARY KEY,
+                    knowledge_base_id TEXT,
+                    file_id TEXT,
+                    file_name TEXT
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_vectors_kb_file ON vectors (knowledge_base_id, file_id);
+                CREATE INDEX IF NOT EXISTS idx_vectors_file ON vectors (file_id);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            ''')
+            self._local.conn = conn
+        return conn
+
+    @property
+    def is_built(self) -> bool:
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return bool(row and row[0])
+
+    def invalidate(self) -> None:
+        """Mark the index incomplete so lookups fall back until it is rebuilt"""
+        self._connection().execute("INSERT OR REPLACE INTO meta VALUES ('built', 0)")
+
+    @staticmethod
+    def supports(filter_dict: Optional[Dict[str, Any]]) -> bool:
+        """Whether a metadata filter only uses keys this index tracks"""
+        return not filter_dict or set(filter_dict) <= set(INDEXED_KEYS)
+
+    def upsert(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Record (vector id, metadata) pairs, replacing earlier entries for the same ids"""
+        rows = [
+            (vector_id, _key(meta.get('knowledge_base_id')), _key(meta.get('file_id')), meta.get('file_name'))
+            for vector_id, meta in entries
+        ]
+        if not rows:
+            return
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, vector_ids: Sequence[str]) -> None:
+        vector_ids = list(vector_ids)
+        if not vector_ids:
+            return
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            for batch in _batched(vector_ids):
+                conn.execute(f"DELETE FROM vectors WHERE vector_id IN ({','.join('?' * len(batch))})", list(batch))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def rebuild(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """Replace the whole index with the given entries and mark it built"""
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            conn.execute('DELETE FROM vectors')
+            count = 0
+            batch = []
+            for vector_id, meta in entries:
+                batch.append((vector_id, _key(meta.get('knowledge_base_id')),
+                              _key(meta.get('file_id')), meta.get('file_name')))
+                if len(batch) >= 5000:
+                    conn.executemany('INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)', batch)
+                    count += len(batch)
+                    batch = []
+            conn.executemany('INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)', batch)
+            count += len(batch)
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('built', 1)")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logging.info(f"Rebuilt vector metadata index {self.path} ({count} vectors)")
+        return count
+
+    def _where(self, filter_dict: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        if not self.supports(filter_dict):
+            raise ValueError(f"Metadata index can only filter on {INDEXED_KEYS}, got {sorted(filter_dict)}")
+        clauses, params = [], []
+        for key in INDEXED_KEYS:
+            if filter_dict and key in filter_dict:
+                clauses.append(f"{key} = ?")
+                params.append(_key(filter_dict[key]))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def ids(self, filter_dict: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Ids of every vector matching the filter"""
+        where, params = self._where(filter_dict)
+        return [row[0] for row in self._connection().execute(f"SELECT vector_id FROM vectors{where}", params)]
+
+    def count(self, filter_dict: Optional[Dict[str, Any]] = None) -> int:
+        where, params = self._where(filter_dict)
+        return self._connection().execute(f"SELECT COUNT(*) FROM vectors{where}", params).fetchone()[0]
+
+    def file_counts(self, filter_dict: Optional[Dict[str, Any]] = None) -> List[Tuple[Optional[str], Optional[str], int]]:
+        """(file_id, file_name, vector count) per file, largest first"""
+        where, params = self._where(filter_dict)
+        return self._connection().execute(
+            f"SELECT file_id, MAX(file_name), COUNT(*) FROM vectors{where} "
+            f"GROUP BY file_id ORDER BY COUNT(*) DESC", params
+        ).fetchall()
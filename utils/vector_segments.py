@@ -0,0 +1,641 @@
+import os
+import json
+import heapq
+import shutil
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from utils.vector_cache import normalize_rows, top_k_indices
+
+MANIFEST_FILE = 'manifest.json'
+TAIL_VECTORS_FILE = 'tail.f32'
+TAIL_ROWS_FILE = 'tail.jsonl'
+TOMBSTONES_FILE = 'tombstones.json'
+LOCK_FILE = '.lock'
+TAIL = 'tail'
+
+def _write_json_atomic(path: str, data: Any) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _matches(metadata: Dict[str, Any], filter_dict: Dict[str, Any]) -> bool:
+    return all(metadata.get(key) == value for key, value in filter_dict.items())
+
+class Segment:
+    """Immutable segment: an .npy float32 matrix opened with np.memmap plus a row sidecar
+
+    The sidecar lists the id, file id and metadata of every row in matrix
+    order, so a row's position in the list is its offset in the matrix.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        self.matrix = np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='r')
+        with open(os.path.join(directory, f"{name}.ids.json"), 'r') as f:
+            rows = json.load(f)
+        self.ids = rows['ids']
+        self.file_ids = rows['file_ids']
+        self.metadata = rows.get('metadata') or [{} for _ in self.ids]
+        self._columns = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def column(self, key: str) -> np.ndarray:
+        """Metadata values for one key as an object array, for vectorised filtering"""
+        if key not in self._columns:
+            self._columns[key] = np.asarray([meta.get(key) for meta in self.metadata], dtype=object)
+        return self._columns[key]
+
+    @staticmethod
+    def write(directory: str, name: str, blocks: Iterable[np.ndarray], rows: int, dimension: int,
+              ids: List[str], file_ids: List[Any], metadata: List[Dict[str, Any]]) -> None:
+        """Stream matrix blocks into a new segment file and publish it atomically"""
+        matrix_path = os.path.join(directory, f"{name}.npy")
+        tmp_path = f"{matrix_path}.tmp"
+
+        matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='<f4', shape=(rows, dimension))
+        offset = 0
+        for block in blocks:
+            matrix[offset:offset + len(block)] = block
+            offset += len(block)
+        matrix.flush()
+        del matrix
+
+        os.replace(tmp_path, matrix_path)
+        _write_json_atomic(os.path.join(directory, f"{name}.ids.json"), {
+            'ids': ids,
+            'file_ids': file_ids,
+            'metadata': metadata
+        })
+
+class SegmentStore:
+    """On-disk vector store made of immutable memory-mapped segments plus a mutable tail
+
+    New rows are appended to a small tail file and sealed into a new segment
+    once the tail reaches ``tail_limit`` rows. Deletes only record tombstones;
+    ``compact`` rewrites all live rows into a single segment in the background.
+    Segment files are shared read-only between processes through the page
+    cache, so every worker can open the same store without copying vectors.
+    Writers take an advisory file lock so only one process mutates at a time.
+
+    The manifest records ``source_version``, the database version (row
+    count, newest row) the store is known to match. Patches advance it only
+    when their own row delta explains the new count; otherwise the store's
+    owner sees the mismatch and calls ``reconcile``.
+    """
+
+    def __init__(self, directory: str, dimension: Optional[int] = None,
+                 tail_limit: int = 10000, max_segments: int = 8, max_deleted_ratio: float = 0.2):
+        self.directory = directory
+        self.tail_limit = tail_limit
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        # _lock guards swapping in-memory state; _write_mutex serialises writers
+        self._lock = threading.RLock()
+        self._write_mutex = threading.RLock()
+        self._compaction_thread = None
+        self._manifest_mtime = None
+        self._locations = None
+
+        os.makedirs(directory, exist_ok=True)
+
+        if not os.path.exists(self._path(MANIFEST_FILE)):
+            if dimension is None:
+                raise ValueError(f"No segment store at {directory} and no dimension given")
+            _write_json_atomic(self._path(MANIFEST_FILE), {
+                'dimension': dimension,
+                'segments': [],
+                'next_segment': 1,
+                'generation': 0
+            })
+
+        self._load()
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, MANIFEST_FILE))
+
+    @classmethod
+    def create(cls, directory: str, matrix: np.ndarray, ids: Sequence[str], file_ids: Sequence[Any],
+               metadata: Optional[Sequence[Dict[str, Any]]] = None,
+               source_version: Optional[Sequence[Any]] = None, **kwargs) -> 'SegmentStore':
+        """Create a store whose first segment holds the given rows"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        store = cls(directory, dimension=matrix.shape[1], **kwargs)
+        with store._write_lock():
+            if source_version is not None:
+                store.manifest['source_version'] = list(source_version)
+            store._write_segment([normalize_rows(matrix)], len(matrix), list(ids), list(file_ids),
+                                 list(metadata) if metadata is not None else [{} for _ in ids])
+        return store
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self) -> None:
+        with open(self._path(MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        self._manifest_mtime = os.stat(self._path(MANIFEST_FILE)).st_mtime_ns
+
+        self.segments = [Segment(self.directory, name) for name in self.manifest['segments']]
+
+        dimension = self.manifest['dimension']
+        if os.path.exists(self._path(TAIL_VECTORS_FILE)):
+            tail = np.fromfile(self._path(TAIL_VECTORS_FILE), dtype='<f4')
+            self.tail_matrix = tail.reshape(-1, dimension)
+        else:
+            self.tail_matrix = np.empty((0, dimension), dtype=np.float32)
+
+        self.tail_rows = []
+        if os.path.exists(self._path(TAIL_ROWS_FILE)):
+            with open(self._path(TAIL_ROWS_FILE), 'r') as f:
+                self.tail_rows = [json.loads(line) for line in f if line.strip()]
+
+        # A crash between the two tail writes can leave one file a row ahead
+        rows = min(len(self.tail_matrix), len(self.tail_rows))
+        self.tail_matrix = self.tail_matrix[:rows]
+        self.tail_rows = self.tail_rows[:rows]
+
+        self.tombstones = {}
+        if os.path.exists(self._path(TOMBSTONES_FILE)):
+            with open(self._path(TOMBSTONES_FILE), 'r') as f:
+                self.tombstones = {name: set(rows) for name, rows in json.load(f).items()}
+
+        self._locations = None
+
+    def refresh(self) -> None:
+        """Reload if another process has changed the store since it was opened"""
+        try:
+            mtime = os.stat(self._path(MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._manifest_mtime:
+            with self._lock:
+                try:
+                    self._load()
+                except FileNotFoundError:
+                    # A compaction elsewhere removed files between reading the manifest and opening them
+                    self._load()
+
+    @contextmanager
+    def _write_lock(self):
+        with self._write_mutex:
+            with open(self._path(LOCK_FILE), 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.refresh()
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _publish(self) -> None:
+        """Persist tombstones and bump the manifest so readers reload"""
+        _write_json_atomic(self._path(TOMBSTONES_FILE),
+                           {name: sorted(rows) for name, rows in self.tombstones.items() if rows})
+        self.manifest['generation'] += 1
+        _write_json_atomic(self._path(MANIFEST_FILE), self.manifest)
+        self._manifest_mtime = os.stat(self._path(MANIFEST_FILE)).st_mtime_ns
+        self._locations = None
+
+    @property
+    def dimension(self) -> int:
+        return self.manifest['dimension']
+
+    @property
+    def source_version(self) -> Optional[List[Any]]:
+        self.refresh()
+        return self.manifest.get('source_version')
+
+    def _adopt_source_version(self, source_version: Optional[Sequence[Any]], delta: int) -> bool:
+        """Record the version a patch of ``delta`` rows brought the store to, if nothing else changed"""
+        recorded = self.manifest.get('source_version')
+        if source_version is None or recorded is None or recorded[0] + delta != source_version[0]:
+            return False
+        self.manifest['source_version'] = list(source_version)
+        return True
+
+    @property
+    def deleted_count(self) -> int:
+        return sum(len(rows) for rows in self.tombstones.values())
+
+    @property
+    def total_rows(self) -> int:
+        return sum(len(segment) for segment in self.segments) + len(self.tail_rows)
+
+    def __len__(self) -> int:
+        return self.total_rows - self.deleted_count
+
+    @property
+    def nbytes(self) -> int:
+        # Segment pages live in the shared page cache; only the tail is private memory
+        return int(self.tail_matrix.nbytes + 64 * len(self.tail_rows))
+
+    def _parts(self) -> List[Tuple[str, np.ndarray, List[str], List[Any], List[Dict[str, Any]]]]:
+        parts = [(s.name, s.matrix, s.ids, s.file_ids, s.metadata) for s in self.segments]
+        parts.append((TAIL, self.tail_matrix,
+                      [row['id'] for row in self.tail_rows],
+                      [row.get('file_id') for row in self.tail_rows],
+                      [row.get('metadata') or {} for row in self.tail_rows]))
+        return parts
+
+    def _live_mask(self, name: str, rows: int) -> Optional[np.ndarray]:
+        deleted = self.tombstones.get(name)
+        if not deleted:
+            return None
+        mask = np.ones(rows, dtype=bool)
+        mask[list(deleted)] = False
+        return mask
+
+    def _filter_mask(self, name: str, metadata: List[Dict[str, Any]],
+                     filter_dict: Dict[str, Any]) -> np.ndarray:
+        segment = next((s for s in self.segments if s.name == name), None)
+        if segment is None:
+            return np.array([_matches(meta, filter_dict) for meta in metadata], dtype=bool)
+        mask = np.ones(len(segment), dtype=bool)
+        for key, value in filter_dict.items():
+            mask &= segment.column(key) == value
+        return mask
+
+    def query(self, vector: Sequence[float], k: int = 10,
+              filter_dict: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Exact top-k search over every live row, optionally filtered on metadata"""
+        self.refresh()
+
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, store has {self.dimension}")
+        norm = np.linalg.norm(query)
+        if norm == 0 or k <= 0:
+            return []
+        query = query / norm
+
+        with self._lock:
+            parts = self._parts()
+            tombstones = {name: set(rows) for name, rows in self.tombstones.items()}
+
+        candidates = []
+        for name, matrix, ids, file_ids, metadata in parts:
+            if len(ids) == 0:
+                continue
+
+            scores = np.asarray(matrix @ query, dtype=np.float32)
+
+            deleted = tombstones.get(name)
+            if deleted:
+                scores[list(deleted)] = -np.inf
+            if filter_dict:
+                scores[~self._filter_mask(name, metadata, filter_dict)] = -np.inf
+
+            for row in top_k_indices(scores, k):
+                if scores[row] == -np.inf:
+                    break
+                candidates.append((float(scores[row]), ids[row], file_ids[row], metadata[row]))
+
+        return [
+            {'id': chunk_id, 'file_id': file_id, 'score': score, 'metadata': meta}
+            for score, chunk_id, file_id, meta in heapq.nlargest(k, candidates, key=lambda c: c[0])
+        ]
+
+    def search(self, vector: Sequence[float], k: int = 10) -> List[Tuple[str, Any, float]]:
+        """Return (chunk_id, file_id, score) tuples like KnowledgeBaseMatrix.search"""
+        return [(hit['id'], hit['file_id'], hit['score']) for hit in self.query(vector, k)]
+
+    def score_ids(self, vector: Sequence[float], chunk_ids: Sequence[str]) -> np.ndarray:
+        """Cosine similarity of the query to each given live row, NaN for unknown ids"""
+        self.refresh()
+        scores = np.full(len(chunk_ids), np.nan, dtype=np.float32)
+
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, store has {self.dimension}")
+        norm = np.linalg.norm(query)
+        if norm == 0 or not len(chunk_ids):
+            return scores
+        query = query / norm
+
+        with self._lock:
+            matrices = {name: matrix for name, matrix, ids, file_ids, metadata in self._parts()}
+            tombstones = {name: set(rows) for name, rows in self.tombstones.items()}
+            locations = self._locate()
+
+        # Group lookups per segment so each is one fancy-indexed product
+        by_segment: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, chunk_id in enumerate(chunk_ids):
+            for name, row in locations.get(chunk_id, []):
+                if row not in tombstones.get(name, ()):
+                    positions, rows = by_segment.setdefault(name, ([], []))
+                    positions.append(i)
+                    rows.append(row)
+                    break
+
+        for name, (positions, rows) in by_segment.items():
+            scores[positions] = np.asarray(matrices[name][rows] @ query, dtype=np.float32)
+        return scores
+
+    def find_ids(self, filter_dict: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Ids of all live rows, optionally restricted to matching metadata"""
+        self.refresh()
+        ids = []
+        with self._lock:
+            for name, matrix, row_ids, file_ids, metadata in self._parts():
+                mask = self._live_mask(name, len(row_ids))
+                if filter_dict:
+                    filtered = self._filter_mask(name, metadata, filter_dict)
+                    mask = filtered if mask is None else mask & filtered
+                ids.extend(row_ids[i] for i in range(len(row_ids)) if mask is None or mask[i])
+        return ids
+
+    def live_entries(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """(id, metadata) of every live row"""
+        self.refresh()
+        entries = []
+        with self._lock:
+            for name, matrix, row_ids, file_ids, metadata in self._parts():
+                mask = self._live_mask(name, len(row_ids))
+                entries.extend((row_ids[i], {'file_id': file_ids[i], **(metadata[i] or {})})
+                               for i in range(len(row_ids)) if mask is None or mask[i])
+        return entries
+
+    def append(self, vectors: Sequence[Sequence[float]], chunk_ids: Sequence[str], file_ids: Sequence[Any],
+               metadata: Optional[Sequence[Dict[str, Any]]] = None,
+               source_version: Optional[Sequence[Any]] = None) -> 'SegmentStore':
+        """Append rows to the mutable tail, sealing it into a segment when full"""
+        if not len(chunk_ids):
+            return self
+
+        with self._write_lock():
+            self._adopt_source_version(source_version, len(chunk_ids))
+            self._append_rows(vectors, chunk_ids, file_ids, metadata)
+
+        if self.needs_compaction():
+            self.compact_async()
+        return self
+
+    def _append_rows(self, vectors: Sequence[Sequence[float]], chunk_ids: Sequence[str], file_ids: Sequence[Any],
+                     metadata: Optional[Sequence[Dict[str, Any]]] = None) -> None:
+        """Write rows to the tail and publish; the caller holds the write lock"""
+        block = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        if block.shape[1] != self.dimension:
+            raise ValueError(f"Vectors have {block.shape[1]} dimensions, store has {self.dimension}")
+        metadata = list(metadata) if metadata is not None else [{} for _ in chunk_ids]
+        rows = [{'id': chunk_id, 'file_id': file_id, 'metadata': meta}
+                for chunk_id, file_id, meta in zip(chunk_ids, file_ids, metadata)]
+
+        with open(self._path(TAIL_VECTORS_FILE), 'ab') as f:
+            f.write(block.astype('<f4').tobytes())
+        with open(self._path(TAIL_ROWS_FILE), 'a') as f:
+            f.writelines(json.dumps(row) + '\n' for row in rows)
+
+        with self._lock:
+            self.tail_matrix = np.vstack([self.tail_matrix, block])
+            self.tail_rows = self.tail_rows + rows
+
+            if len(self.tail_rows) >= self.tail_limit:
+                self._seal_tail()
+            else:
+                self._publish()
+
+    def _locate(self) -> Dict[str, List[Tuple[str, int]]]:
+        if self._locations is None:
+            locations = {}
+            for name, matrix, ids, file_ids, metadata in self._parts():
+                for row, chunk_id in enumerate(ids):
+                    locations.setdefault(chunk_id, []).append((name, row))
+            self._locations = locations
+        return self._locations
+
+    def delete(self, ids: Iterable[str], source_version: Optional[Sequence[Any]] = None) -> int:
+        """Tombstone every row with one of the given ids"""
+        with self._write_lock():
+            tombstones = self._tombstoned(ids)
+            deleted = sum(len(rows) for rows in tombstones.values()) - self.deleted_count
+            adopted = self._adopt_source_version(source_version, -deleted)
+            if deleted or adopted:
+                with self._lock:
+                    self.tombstones = tombstones
+                    self._publish()
+
+        if deleted and self.needs_compaction():
+            self.compact_async()
+        return deleted
+
+    def _tombstoned(self, ids: Iterable[str]) -> Dict[str, set]:
+        """Current tombstones plus every row with one of the given ids"""
+        locations = self._locate()
+        tombstones = {name: set(rows) for name, rows in self.tombstones.items()}
+        for chunk_id in ids:
+            for name, row in locations.get(chunk_id, []):
+                tombstones.setdefault(name, set()).add(row)
+        return tombstones
+
+    def delete_files(self, file_ids: Iterable[Any], source_version: Optional[Sequence[Any]] = None) -> int:
+        """Tombstone every row that belongs to one of the given files"""
+        drop = set(file_ids)
+        with self._lock:
+            ids = [chunk_id
+                   for name, matrix, row_ids, row_file_ids, metadata in self._parts()
+                   for chunk_id, file_id in zip(row_ids, row_file_ids) if file_id in drop]
+        return self.delete(ids, source_version=source_version)
+
+    def reconcile(self, source_ids: Dict[str, Any],
+                  fetch: Callable[[List[str]], Tuple[List[Sequence[float]], List[str], List[Any]]],
+                  source_version: Sequence[Any], batch_rows: int = 5000) -> Dict[str, int]:
+        """Bring the store in line with the source rows (chunk id -> file id) and record ``source_version``
+
+        Rows the source no longer has are tombstoned and missing ones are
+        fetched ``batch_rows`` at a time and appended. The whole pass holds
+        the write lock, so processes reconciling at once don't append twice.
+        """
+        with self._write_lock():
+            live = set()
+            for name, matrix, row_ids, file_ids, metadata in self._parts():
+                mask = self._live_mask(name, len(row_ids))
+                live.update(row_ids[i] for i in range(len(row_ids)) if mask is None or mask[i])
+            stale = [chunk_id for chunk_id in live if chunk_id not in source_ids]
+            missing = [chunk_id for chunk_id in source_ids if chunk_id not in live]
+
+            if stale:
+                with self._lock:
+                    self.tombstones = self._tombstoned(stale)
+            added = 0
+            for start in range(0, len(missing), batch_rows):
+                vectors, ids, file_ids = fetch(missing[start:start + batch_rows])
+                if ids:
+                    self._append_rows(vectors, ids, file_ids)
+                    added += len(ids)
+            with self._lock:
+                self.manifest['source_version'] = list(source_version)
+                self._publish()
+
+        if self.needs_compaction():
+            self.compact_async()
+        logging.info(f"Reconciled segment store {self.directory}: {added} rows added, {len(stale)} removed")
+        return {'added': added, 'removed': len(stale)}
+
+    def without_files(self, file_ids: Iterable[Any]) -> 'SegmentStore':
+        """Cache-compatible alias for delete_files; the store is patched in place"""
+        self.delete_files(file_ids)
+        return self
+
+    def without_chunks(self, chunk_ids: Iterable[str]) -> 'SegmentStore':
+        """Cache-compatible alias for delete; the store is patched in place"""
+        self.delete(chunk_ids)
+        return self
+
+    def _live_blocks(self, block_rows: int = 65536):
+        """Yield (vectors, ids, file_ids, metadata) for live rows in bounded blocks"""
+        for name, matrix, ids, file_ids, metadata in self._parts():
+            mask = self._live_mask(name, len(ids))
+            for start in range(0, len(ids), block_rows):
+                end = min(start + block_rows, len(ids))
+                keep = np.arange(start, end) if mask is None else np.nonzero(mask[start:end])[0] + start
+                if len(keep):
+                    yield (np.asarray(matrix[keep], dtype=np.float32),
+                           [ids[i] for i in keep], [file_ids[i] for i in keep], [metadata[i] for i in keep])
+
+    def _write_segment(self, blocks: List[np.ndarray], rows: int, ids: List[str],
+                       file_ids: List[Any], metadata: List[Dict[str, Any]]) -> str:
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        Segment.write(self.directory, name, blocks, rows, self.dimension, ids, file_ids, metadata)
+        with self._lock:
+            self.manifest['next_segment'] += 1
+            self.manifest['segments'] = self.manifest['segments'] + [name]
+            self.segments = self.segments + [Segment(self.directory, name)]
+            self._publish()
+        return name
+
+    def _seal_tail(self) -> None:
+        """Turn the live tail rows into a new immutable segment"""
+        mask = self._live_mask(TAIL, len(self.tail_rows))
+        keep = np.arange(len(self.tail_rows)) if mask is None else np.nonzero(mask)[0]
+
+        if len(keep):
+            rows = [self.tail_rows[i] for i in keep]
+            self._write_segment([self.tail_matrix[keep]], len(keep),
+                                [row['id'] for row in rows],
+                                [row.get('file_id') for row in rows],
+                                [row.get('metadata') or {} for row in rows])
+
+        for name in (TAIL_VECTORS_FILE, TAIL_ROWS_FILE):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.tail_matrix = np.empty((0, self.dimension), dtype=np.float32)
+        self.tail_rows = []
+        self.tombstones.pop(TAIL, None)
+        self._publish()
+
+    def needs_compaction(self) -> bool:
+        total = self.total_rows
+        if len(self.segments) > self.max_segments:
+            return True
+        return total > 0 and self.deleted_count / total > self.max_deleted_ratio
+
+    def compact(self) -> Dict[str, int]:
+        """Merge all segments and the tail into one segment, dropping tombstoned rows"""
+        with self._write_lock():
+            old_segments = list(self.manifest['segments'])
+            before = self.total_rows
+
+            ids, file_ids, metadata, blocks = [], [], [], []
+            for block, block_ids, block_file_ids, block_metadata in self._live_blocks():
+                blocks.append(block)
+                ids.extend(block_ids)
+                file_ids.extend(block_file_ids)
+                metadata.extend(block_metadata)
+
+            # Build the merged segment while searches keep using the current state
+            name = f"seg-{self.manifest['next_segment']:06d}"
+            if ids:
+                Segment.write(self.directory, name, blocks, len(ids), self.dimension, ids, file_ids, metadata)
+
+            with self._lock:
+                self.manifest['next_segment'] += 1
+                self.manifest['segments'] = [name] if ids else []
+                self.segments = [Segment(self.directory, name)] if ids else []
+                self.tombstones = {}
+                for tail_file in (TAIL_VECTORS_FILE, TAIL_ROWS_FILE):
+                    if os.path.exists(self._path(tail_file)):
+                        os.remove(self._path(tail_file))
+                self.tail_matrix = np.empty((0, self.dimension), dtype=np.float32)
+                self.tail_rows = []
+                self._publish()
+
+            # Readers that still map the old files keep working until they refresh
+            for name in old_segments:
+                for suffix in ('.npy', '.ids.json'):
+                    path = self._path(f"{name}{suffix}")
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        logging.info(f"Compacted segment store {self.directory}: {before} rows -> {len(ids)} rows")
+        return {'rows_before': before, 'rows_after': len(ids), 'segments_merged': len(old_segments)}
+
+    def compact_async(self) -> Optional[threading.Thread]:
+        """Run compaction in a background thread unless one is already running"""
+        with self._lock:
+            if self._compaction_thread and self._compaction_thread.is_alive():
+                return None
+
+            def run():
+                try:
+                    self.compact()
+                except Exception as e:
+                    logging.error(f"Error compacting segment store {self.directory}: {str(e)}")
+
+            self._compaction_thread = threading.Thread(target=run, name='segment-compaction', daemon=True)
+            self._compaction_thread.start()
+            return self._compaction_thread
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'dimension': self.dimension,
+            'segments': len(self.segments),
+            'tail_rows': len(self.tail_rows),
+            'live_rows': len(self),
+            'deleted_rows': self.deleted_count,
+            'generation': self.manifest['generation'],
+            'source_version': self.manifest.get('source_version')
+        }
+
+_open_stores: Dict[str, SegmentStore] = {}
+_open_stores_lock = threading.Lock()
+
+def open_segment_store(directory: str, dimension: Optional[int] = None, **kwargs) -> SegmentStore:
+    """Get the shared SegmentStore instance for a directory in this process"""
+    key = os.path.abspath(directory)
+    with _open_stores_lock:
+        store = _open_stores.get(key)
+        if store is None:
+            store = SegmentStore(directory, dimension=dimension, **kwargs)
+            _open_stores[key] = store
+        return store
+
+def register_segment_store(store: SegmentStore) -> SegmentStore:
+    """Make a newly created store the shared instance for its directory"""
+    with _open_stores_lock:
+        _open_stores[os.path.abspath(store.directory)] = store
+    return store
+
+def remove_segment_store(directory: str) -> None:
+    """Forget the shared instance for a directory and delete the store from disk"""
+    with _open_stores_lock:
+        store = _open_stores.pop(os.path.abspath(directory), None)
+    # A compaction still running would write its segment back into the removed directory
+    if store is not None and store._compaction_thread is not None:
+        store._compaction_thread.join()
+    shutil.rmtree(directory, ignore_errors=True)
@@ -1,112 +1,500 @@
 import os
 import json
+import uuid
+import hashlib
 import logging
+import threading
 import numpy as np
+from collections import deque
+from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Tuple, Optional
-from services.embedding_service import EmbeddingService
-from models import FileEmbedding, KnowledgeBaseFile
+from services.embeddings import EmbeddingService
+from models import FileEmbedding, KnowledgeBase
+from utils.vector_codec import decode_embedding, set_embedding
+from utils.vector_cache import KnowledgeBaseMatrix, vector_cache
+from utils.vector_segments import SegmentStore, register_segment_store
+from utils.bm25_index import BM25Index, get_bm25_index
+from utils.knowledge_base_index import (
+    index_new_chunks, knowledge_base_ids_for_file, knowledge_base_rows, knowledge_base_version,
+    quantized_path, segment_path, segment_store, unindex_chunks, unindex_files
+)
+from utils.hybrid_search import hybrid_settings, merge_candidates, rank_candidates
+from utils.knn_graph import knn_graphs
+from utils.embedding_dimensions import (
+    EmbeddingDimensionError, check_query_dimension, check_uniform_dimensions,
+    dimension_metadata, embedding_dimension, shorten_all, shorten
+)
+from utils.quantization import QuantizedMatrix, quantization_report, quantization_settings
 from app import db
 
+# Knowledge bases at least this large are served from memory-mapped segments
+SEGMENT_MIN_ROWS = int(os.environ.get('VECTOR_SEGMENT_MIN_ROWS', '200000'))
+
+# Rows per IN (...) clause when deleting or re-reading chunks by id
+_ID_BATCH = 500
+
+def chunk_hash(text: str) -> str:
+    """SHA-256 of a chunk's text, stored as embedding_metadata['chunk_hash']"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
 class VectorStore:
     def __init__(self, embedding_provider="openai"):
-        self.embedding_service = EmbeddingService(provider=embedding_provider)
-        self.dimension = self.embedding_service.get_embedding_dimension()
+        self.embedding_provider = embedding_provider
+        self._embedding_service = None
+    
+    @property
+    def embedding_service(self) -> EmbeddingService:
+        """Created on first use, so loading matrices needs no provider credentials"""
+        if self._embedding_service is None:
+            self._embedding_service = EmbeddingService(provider=self.embedding_provider)
+        return self._embedding_service
+    
+    @property
+    def dimension(self) -> int:
+        return self.embedding_service.get_embedding_dimension()
     
     def add_embeddings(self, file_id: int, text_chunks: List[str]) -> bool:
         """Add embeddings for text chunks to the vector store"""
         try:
             # Generate embeddings for all chunks
-            embeddings = self.embedding_service.generate_embeddings_batch(text_chunks)
+            embeddings = self.embedding_service.get_embeddings(text_chunks)
             
             if not embeddings:
                 logging.error("Failed to generate embeddings")
                 return False
             
-            # Store embeddings in database
-            for i, (chunk, embedding) in enumerate(zip(text_chunks, embeddings)):
-                file_embedding = FileEmbedding(
-                    file_id=file_id,
-                    chunk_index=i,
-                    chunk_text=chunk,
-                    embedding=json.dumps(embedding)
-                )
-                db.session.add(file_embedding)
+            kb_ids = self._knowledge_base_ids_for_file(file_id)
+            embeddings = shorten_all(embeddings, self._file_dimension(file_id, kb_ids))
             
+            # Store embeddings in database
+            chunk_ids = self._insert_chunks(file_id, list(enumerate(text_chunks)), embeddings, kb_ids)
             db.session.commit()
+            
+            self._index_new_chunks(kb_ids, file_id, chunk_ids, embeddings, text_chunks)
+            
             logging.info(f"Added {len(embeddings)} embeddings for file {file_id}")
             return True
         
+        except EmbeddingDimensionError:
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
             logging.error(f"Error adding embeddings: {str(e)}")
             return False
     
+    def _file_dimension(self, file_id: int, kb_ids: List[int]) -> Optional[int]:
+        """Embedding dimension for a file's chunks, None for full-size vectors"""
+        # Chunk rows are shared by all knowledge bases of the file, so they must agree on a size
+        dimensions = {self._knowledge_base_dimension(kb_id) for kb_id in kb_ids}
+        if len(dimensions) > 1:
+            raise EmbeddingDimensionError(
+                f"File {file_id} belongs to knowledge bases with different embedding dimensions: {sorted(dimensions, key=str)}"
+            )
+        return dimensions.pop() if dimensions else None
+    
+    def _insert_chunks(self, file_id: int, positioned_chunks: List[Tuple[int, str]],
+                       embeddings: List[List[float]], kb_ids: List[int]) -> List[str]:
+        """Add FileEmbedding rows for (chunk_index, text) pairs; returns their ids
+        
+        Rows are tagged with the file's knowledge base when it has exactly
+        one, so schemas without a link table keep new chunks in it.
+        """
+        model = self.embedding_service.model_name
+        knowledge_base_id = kb_ids[0] if len(kb_ids) == 1 else None
+        chunk_ids = []
+        for (i, chunk), embedding in zip(positioned_chunks, embeddings):
+            file_embedding = FileEmbedding(
+                id=str(uuid.uuid4()),
+                file_id=file_id,
+                knowledge_base_id=knowledge_base_id,
+                chunk_index=i,
+                chunk_text=chunk,
+                embedding_model=model,
+                embedding_metadata={**dimension_metadata(len(embedding), model), 'chunk_hash': chunk_hash(chunk)}
+            )
+            set_embedding(file_embedding, embedding)
+            db.session.add(file_embedding)
+            chunk_ids.append(file_embedding.id)
+        return chunk_ids
+    
+    def _index_new_chunks(self, kb_ids: List[int], file_id: int, chunk_ids: List[str],
+                          embeddings: List[List[float]], texts: List[str]) -> None:
+        """Patch cached knowledge base matrices and BM25 indexes instead of reloading them"""
+        index_new_chunks(kb_ids, file_id, chunk_ids, embeddings, texts)
+    
+    def _unindex_chunks(self, kb_ids: List[int], chunk_ids: List[str]) -> None:
+        unindex_chunks(kb_ids, chunk_ids)
+    
+    def _knowledge_base_ids_for_file(self, file_id: int) -> List[int]:
+        """Get the knowledge bases a file belongs to"""
+        return knowledge_base_ids_for_file(file_id)
+    
+    def _knowledge_base_dimension(self, knowledge_base_id: int) -> Optional[int]:
+        """Configured embedding_dimension of a knowledge base, None for full-size vectors"""
+        knowledge_base = KnowledgeBase.query.get(knowledge_base_id)
+        return embedding_dimension(knowledge_base.settings if knowledge_base else None)
+    
+    def _query_embedding(self, knowledge_base_id: int, query: str) -> Optional[List[float]]:
+        """Embed a query at the knowledge base's dimension"""
+        query_embedding = self.embedding_service.get_embedding(query)
+        if not query_embedding:
+            return query_embedding
+        return shorten(query_embedding, self._knowledge_base_dimension(knowledge_base_id))
+    
+    def _segment_path(self, knowledge_base_id: int) -> str:
+        return segment_path(knowledge_base_id)
+    
+    def _segment_store(self, knowledge_base_id: int) -> Optional[SegmentStore]:
+        """Get the on-disk segment store of a knowledge base, if it has one"""
+        return segment_store(knowledge_base_id)
+    
+    def _keyword_index(self, knowledge_base_id: int) -> BM25Index:
+        """Get the BM25 index of a knowledge base, building it from stored chunks on first use
+        
+        A built index whose document count no longer matches the database
+        (rows written or removed without the hooks reaching it) is
+        reconciled by diffing chunk ids.
+        """
+        index = get_bm25_index(knowledge_base_id)
+        if index.is_built:
+            if len(index) != knowledge_base_version(knowledge_base_id)[0]:
+                self._reconcile_keyword_index(knowledge_base_id, index)
+            return index
+        
+        index.clear()
+        rows = db.session.query(
+            FileEmbedding.id,
+            FileEmbedding.file_id,
+            FileEmbedding.chunk_text
+        ).filter(knowledge_base_rows(knowledge_base_id)).yield_per(5000)
+        
+        batch = []
+        for row in rows:
+            batch.append((row.id, row.file_id, row.chunk_text))
+            if len(batch) >= 5000:
+                index.add_documents(batch)
+                batch = []
+        index.add_documents(batch)
+        
+        index.mark_built()
+        logging.info(f"Built BM25 index for knowledge base {knowledge_base_id} ({len(index)} chunks)")
+        return index
+    
+    def _reconcile_keyword_index(self, knowledge_base_id: int, index: BM25Index) -> None:
+        """Drop chunks the database no longer has from a BM25 index and add the missing ones"""
+        rows = db.session.query(FileEmbedding.id).filter(knowledge_base_rows(knowledge_base_id)).all()
+        stored = {row.id for row in rows}
+        indexed = set(index.doc_ids())
+        
+        removed = index.delete_documents([doc_id for doc_id in indexed if doc_id not in stored])
+        missing = [chunk_id for chunk_id in stored if chunk_id not in indexed]
+        for start in range(0, len(missing), _ID_BATCH):
+            index.add_documents(
+                (row.id, row.file_id, row.chunk_text) for row in db.session.query(
+                    FileEmbedding.id, FileEmbedding.file_id, FileEmbedding.chunk_text
+                ).filter(FileEmbedding.id.in_(missing[start:start + _ID_BATCH]))
+            )
+        logging.info(f"Reconciled BM25 index for knowledge base {knowledge_base_id}: "
+                     f"{len(missing)} chunks added, {removed} removed")
+    
+    def _load_knowledge_base_matrix(self, knowledge_base_id: int):
+        """Load every vector of a knowledge base into one matrix
+
+        Large knowledge bases are written out once as memory-mapped segments
+        so every worker process shares the same pages instead of holding its
+        own copy. Smaller ones whose settings ask for ``vector_quantization``
+        keep only quantized codes in memory; those are reopened from disk
+        while the knowledge base is unchanged.
+        """
+        store = self._segment_store(knowledge_base_id)
+        if store is not None:
+            return self._reconcile_segment_store(knowledge_base_id, store)
+        
+        version = knowledge_base_version(knowledge_base_id)
+        knowledge_base = KnowledgeBase.query.get(knowledge_base_id)
+        settings = quantization_settings(knowledge_base.settings if knowledge_base else None)
+        if settings['vector_quantization'] != 'none':
+            quantized = QuantizedMatrix.load(
+                quantized_path(knowledge_base_id), settings['vector_quantization'],
+                pq_subspaces=settings['pq_subspaces'], rerank_factor=settings['rerank_factor'],
+                source_version=version
+            )
+            if quantized is not None:
+                return quantized
+        
+        # Only pull the vector columns; chunk text is fetched for the top hits only
+        rows = db.session.query(
+            FileEmbedding.id,
+            FileEmbedding.file_id,
+            FileEmbedding.embedding_blob,
+            FileEmbedding.embedding_dim,
+            FileEmbedding.embedding_dtype,
+            FileEmbedding.embedding_vector
+        ).filter(knowledge_base_rows(knowledge_base_id)).all()
+        
+        vectors, chunk_ids, row_file_ids = [], [], []
+        for row in rows:
+            try:
+                vector = decode_embedding(row)
+            except (json.JSONDecodeError, TypeError, ValueError) as e:
+                logging.warning(f"Invalid embedding data for record {row.id}: {str(e)}")
+                continue
+            if vector is None:
+                continue
+            vectors.append(vector)
+            chunk_ids.append(row.id)
+            row_file_ids.append(row.file_id)
+        
+        if not vectors:
+            return KnowledgeBaseMatrix.empty(self._knowledge_base_dimension(knowledge_base_id) or self.dimension)
+        
+        # Mixed sizes mean part of the knowledge base was embedded under another setting
+        stored = check_uniform_dimensions((len(vector) for vector in vectors), knowledge_base_id)
+        configured = self._knowledge_base_dimension(knowledge_base_id)
+        if configured is not None and stored != configured:
+            raise EmbeddingDimensionError(
+                f"Knowledge base {knowledge_base_id} is configured for {configured}-dimensional "
+                f"embeddings but stores {stored}-dimensional ones; re-embed it"
+            )
+        
+        if len(vectors) >= SEGMENT_MIN_ROWS:
+            logging.info(f"Moving {len(vectors)} vectors of knowledge base {knowledge_base_id} to segments")
+            return register_segment_store(SegmentStore.create(
+                self._segment_path(knowledge_base_id), np.vstack(vectors), chunk_ids, row_file_ids,
+                source_version=version
+            ))
+        
+        matrix = KnowledgeBaseMatrix(np.vstack(vectors), chunk_ids, row_file_ids)
+        return self._quantize(knowledge_base_id, matrix, settings, version)
+    
+    def _reconcile_segment_store(self, knowledge_base_id: int, store: SegmentStore) -> SegmentStore:
+        """Apply rows the store missed (written elsewhere or while it was offline) to a segment store"""
+        version = knowledge_base_version(knowledge_base_id)
+        if store.source_version == list(version):
+            return store
+        
+        rows = db.session.query(FileEmbedding.id, FileEmbedding.file_id).filter(
+            knowledge_base_rows(knowledge_base_id)
+        ).all()
+        store.reconcile({row.id: row.file_id for row in rows}, self._fetch_vectors, version)
+        return store
+    
+    def _fetch_vectors(self, chunk_ids: List[str]) -> Tuple[List[List[float]], List[str], List[Any]]:
+        """Decoded vectors of the given chunk rows, skipping rows without one"""
+        vectors, found_ids, row_file_ids = [], [], []
+        for start in range(0, len(chunk_ids), _ID_BATCH):
+            rows = db.session.query(
+                FileEmbedding.id,
+                FileEmbedding.file_id,
+                FileEmbedding.embedding_blob,
+                FileEmbedding.embedding_dim,
+                FileEmbedding.embedding_dtype,
+                FileEmbedding.embedding_vector
+            ).filter(FileEmbedding.id.in_(chunk_ids[start:start + _ID_BATCH])).all()
+            for row in rows:
+                try:
+                    vector = decode_embedding(row)
+                except (json.JSONDecodeError, TypeError, ValueError) as e:
+                    logging.warning(f"Invalid embedding data for record {row.id}: {str(e)}")
+                    continue
+                if vector is not None:
+                    vectors.append(vector)
+                    found_ids.append(row.id)
+                    row_file_ids.append(row.file_id)
+        return vectors, found_ids, row_file_ids
+    
+    def _quantize(self, knowledge_base_id: int, matrix: KnowledgeBaseMatrix, settings: Dict[str, Any],
+                  version: Tuple[int, Optional[str]]):
+        """Swap a loaded matrix for its quantized form if the knowledge base is configured for it
+        
+        A quantizer persisted with the same settings is reused, so rows are
+        only re-encoded; training (and its recall report) happens once per
+        knowledge base and settings.
+        """
+        method = settings['vector_quantization']
+        if method == 'none':
+            return matrix
+        
+        path = quantized_path(knowledge_base_id)
+        quantizer = QuantizedMatrix.load_quantizer(path, method, settings['pq_subspaces'], matrix.dimension)
+        quantized = QuantizedMatrix.build(
+            path, matrix.matrix, matrix.chunk_ids, matrix.file_ids,
+            method=method,
+            pq_subspaces=settings['pq_subspaces'],
+            rerank_factor=settings['rerank_factor'],
+            quantizer=quantizer,
+            source_version=version
+        )
+        if quantizer is None:
+            self._report_quantization(knowledge_base_id, matrix, quantized)
+        return quantized
+    
+    def _report_quantization(self, knowledge_base_id: int, matrix: KnowledgeBaseMatrix,
+                             quantized: QuantizedMatrix) -> None:
+        """Measure a newly trained quantizer in the background and record it in its own session"""
+        engine = db.engine
+        
+        def run():
+            try:
+                report = quantization_report(matrix, quantized)
+                logging.info(f"Quantized knowledge base {knowledge_base_id} with {report['method']}: "
+                             f"saved {report['memory_saved_bytes']} bytes, recall@10 {report['recall_at_10']}")
+                with Session(engine) as session:
+                    self._record_quantization_report(session, knowledge_base_id, report)
+            except Exception as e:
+                logging.warning(f"Could not measure quantization of knowledge base {knowledge_base_id}: {str(e)}")
+        
+        threading.Thread(target=run, name='quantization-report', daemon=True).start()
+    
+    def _record_quantization_report(self, session: Session, knowledge_base_id: int, report: Dict[str, Any]) -> None:
+        """Store the memory and recall figures in the knowledge base settings"""
+        try:
+            knowledge_base = session.get(KnowledgeBase, knowledge_base_id)
+            if knowledge_base is None:
+                return
+            settings = knowledge_base.settings
+            as_json = isinstance(settings, str)
+            settings = json.loads(settings) if as_json else dict(settings or {})
+            settings['quantization_report'] = report
+            # Reassign so the JSON column is marked dirty
+            knowledge_base.settings = json.dumps(settings) if as_json else settings
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logging.warning(f"Could not record quantization report for knowledge base {knowledge_base_id}: {str(e)}")
+    
+    def get_knowledge_base_matrix(self, knowledge_base_id: int):
+        """Get the cached vector matrix (or segment store) for a knowledge base
+        
+        This is the only loader behind ``vector_cache``; the cached entry is
+        revalidated against ``knowledge_base_version`` on every call, so rows
+        written by other processes are picked up.
+        """
+        return vector_cache.get(knowledge_base_id, self._load_knowledge_base_matrix, version=knowledge_base_version)
+    
     def semantic_search(self, knowledge_base_id: int, query: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Perform semantic search in a knowledge base"""
         try:
             # Generate query embedding
-            query_embedding = self.embedding_service.generate_query_embedding(query)
+            query_embedding = self._query_embedding(knowledge_base_id, query)
             
             if not query_embedding:
                 logging.error("Failed to generate query embedding")
                 return []
             
-            # Get file IDs for this knowledge base
-            kb_files = KnowledgeBaseFile.query.filter_by(knowledge_base_id=knowledge_base_id).all()
-            file_ids = [kbf.file_id for kbf in kb_files]
+            # One matrix-vector product over the cached knowledge base matrix
+            matrix = self.get_knowledge_base_matrix(knowledge_base_id)
+            if len(matrix):
+                check_query_dimension(query_embedding, matrix.dimension, knowledge_base_id)
+            hits = matrix.search(query_embedding, limit)
             
-            if not file_ids:
+            if not hits:
                 return []
             
-            # Get all embeddings for files in this knowledge base
-            embeddings = FileEmbedding.query.filter(FileEmbedding.file_id.in_(file_ids)).all()
+            records = FileEmbedding.query.filter(
+                FileEmbedding.id.in_([chunk_id for chunk_id, _, _ in hits])
+            ).all()
+            records_by_id = {record.id: record for record in records}
             
-            # Calculate similarities
             results = []
-            for embedding_record in embeddings:
-                try:
-                    stored_embedding = json.loads(embedding_record.embedding)
-                    similarity = self.embedding_service.cosine_similarity(query_embedding, stored_embedding)
-                    
-                    results.append({
-                        'id': embedding_record.id,
-                        'file_id': embedding_record.file_id,
-                        'chunk_index': embedding_record.chunk_index,
-                        'text': embedding_record.chunk_text,
-                        'similarity': similarity,
-                        'score': similarity * 100  # Convert to percentage
-                    })
-                except (json.JSONDecodeError, TypeError) as e:
-                    logging.warning(f"Invalid embedding data for record {embedding_record.id}: {str(e)}")
+            for chunk_id, file_id, similarity in hits:
+                record = records_by_id.get(chunk_id)
+                if record is None:
                     continue
-            
-            # Sort by similarity and return top results
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            return results[:limit]
+                
+                results.append({
+                    'id': record.id,
+                    'file_id': record.file_id,
+                    'chunk_index': record.chunk_index,
+                    'text': record.chunk_text,
+                    'similarity': similarity,
+                    'score': similarity * 100  # Convert to percentage
+                })
+            
+            return results
         
+        except EmbeddingDimensionError:
+            raise
         except Exception as e:
             logging.error(f"Error in semantic search: {str(e)}")
             return []
     
     def hybrid_search(self, knowledge_base_id: int, query: str, 
-                     semantic_weight: float = 0.7, 
-                     keyword_weight: float = 0.3, 
-                     limit: int = 10) -> List[Dict[str, Any]]:
-        """Perform hybrid search combining semantic and keyword search"""
+                     semantic_weight: Optional[float] = None, 
+                     keyword_weight: Optional[float] = None, 
+                     limit: int = 10,
+                     fusion: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Perform hybrid search combining semantic and keyword search
+
+        Dense candidates come from the cached matrix and sparse ones from the
+        BM25 index; both signals are scored for the union of candidates and
+        fused in one pass, so chunk rows are read from the database once, for
+        the final results only. Weights and fusion method default to the
+        knowledge base's settings.
+        """
         try:
-            # Get semantic search results
-            semantic_results = self.semantic_search(knowledge_base_id, query, limit * 2)
+            knowledge_base = KnowledgeBase.query.get(knowledge_base_id)
+            settings = hybrid_settings(
+                knowledge_base.settings if knowledge_base else None,
+                hybrid_fusion=fusion,
+                semantic_weight=semantic_weight,
+                keyword_weight=keyword_weight
+            )
+            pool = max(limit * 2, settings['hybrid_candidates'])
             
-            # Get keyword search results
-            keyword_results = self.keyword_search(knowledge_base_id, query, limit * 2)
+            query_embedding = self._query_embedding(knowledge_base_id, query)
+            matrix = self.get_knowledge_base_matrix(knowledge_base_id)
+            if query_embedding and len(matrix):
+                check_query_dimension(query_embedding, matrix.dimension, knowledge_base_id)
+            dense_hits = matrix.search(query_embedding, pool) if query_embedding else []
             
-            # Combine and re-rank results
-            combined_results = self._combine_search_results(
-                semantic_results, keyword_results, semantic_weight, keyword_weight
+            keyword_index = self._keyword_index(knowledge_base_id)
+            sparse_hits = keyword_index.search(query, pool)
+            
+            candidates = merge_candidates(
+                [chunk_id for chunk_id, _, _ in dense_hits],
+                [chunk_id for chunk_id, _, _ in sparse_hits]
             )
+            if not candidates:
+                return []
+            
+            if query_embedding:
+                dense = matrix.score_ids(query_embedding, candidates)
+            else:
+                dense = np.full(len(candidates), np.nan)
+            sparse = keyword_index.score_documents(query, candidates)
+            ranked = rank_candidates(candidates, dense, sparse, settings, limit)
             
-            return combined_results[:limit]
+            records = FileEmbedding.query.filter(
+                FileEmbedding.id.in_([chunk_id for chunk_id, _, _, _ in ranked])
+            ).all()
+            records_by_id = {record.id: record for record in records}
+            matches = {chunk_id: matched_terms for chunk_id, _, matched_terms in sparse_hits}
+            
+            results = []
+            for chunk_id, combined_score, semantic_score, keyword_score in ranked:
+                record = records_by_id.get(chunk_id)
+                if record is None:
+                    continue
+                
+                results.append({
+                    'id': record.id,
+                    'file_id': record.file_id,
+                    'chunk_index': record.chunk_index,
+                    'text': record.chunk_text,
+                    'similarity': semantic_score,
+                    'semantic_score': semantic_score,
+                    'keyword_score': keyword_score,
+                    'keyword_matches': matches.get(chunk_id, 0),
+                    'combined_score': combined_score,
+                    'score': combined_score * 100  # Convert to percentage
+                })
+            
+            return results
         
+        except EmbeddingDimensionError:
+            raise
         except Exception as e:
             logging.error(f"Error in hybrid search: {str(e)}")
             return []
@@ -114,94 +502,44 @@ class VectorStore:
     def keyword_search(self, knowledge_base_id: int, query: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Perform keyword-based search"""
         try:
-            # Get file IDs for this knowledge base
-            kb_files = KnowledgeBaseFile.query.filter_by(knowledge_base_id=knowledge_base_id).all()
-            file_ids = [kbf.file_id for kbf in kb_files]
+            # BM25 over the knowledge base's inverted index; only the query terms' postings are read
+            hits = self._keyword_index(knowledge_base_id).search(query, limit)
             
-            if not file_ids:
+            if not hits:
                 return []
             
-            # Simple keyword search using SQL LIKE
-            query_terms = query.lower().split()
-            embeddings = FileEmbedding.query.filter(FileEmbedding.file_id.in_(file_ids)).all()
+            records = FileEmbedding.query.filter(
+                FileEmbedding.id.in_([chunk_id for chunk_id, _, _ in hits])
+            ).all()
+            records_by_id = {record.id: record for record in records}
             
             results = []
-            for embedding_record in embeddings:
-                text_lower = embedding_record.chunk_text.lower()
-                score = 0
-                
-                # Count keyword matches
-                for term in query_terms:
-                    if term in text_lower:
-                        score += text_lower.count(term)
+            for chunk_id, score, matched_terms in hits:
+                record = records_by_id.get(chunk_id)
+                if record is None:
+                    continue
                 
-                if score > 0:
-                    results.append({
-                        'id': embedding_record.id,
-                        'file_id': embedding_record.file_id,
-                        'chunk_index': embedding_record.chunk_index,
-                        'text': embedding_record.chunk_text,
-                        'score': score,
-                        'keyword_matches': score
-                    })
-            
-            # Sort by score
-            results.sort(key=lambda x: x['score'], reverse=True)
-            return results[:limit]
+                results.append({
+                    'id': record.id,
+                    'file_id': record.file_id,
+                    'chunk_index': record.chunk_index,
+                    'text': record.chunk_text,
+                    'score': score,
+                    'keyword_matches': matched_terms
+                })
+            
+            return results
         
         except Exception as e:
             logging.error(f"Error in keyword search: {str(e)}")
             return []
     
-    def _combine_search_results(self, semantic_results: List[Dict], keyword_results: List[Dict], 
-                               semantic_weight: float, keyword_weight: float) -> List[Dict[str, Any]]:
-        """Combine and re-rank semantic and keyword search results"""
-        try:
-            # Create a dictionary to combine results by chunk ID
-            combined = {}
-            
-            # Add semantic results
-            for result in semantic_results:
-                chunk_id = result['id']
-                combined[chunk_id] = result.copy()
-                combined[chunk_id]['semantic_score'] = result['similarity']
-                combined[chunk_id]['keyword_score'] = 0
-            
-            # Add keyword results
-            for result in keyword_results:
-                chunk_id = result['id']
-                if chunk_id in combined:
-                    combined[chunk_id]['keyword_score'] = result['score']
-                else:
-                    combined[chunk_id] = result.copy()
-                    combined[chunk_id]['semantic_score'] = 0
-                    combined[chunk_id]['keyword_score'] = result['score']
-            
-            # Calculate combined scores
-            max_semantic = max((r.get('semantic_score', 0) for r in combined.values()), default=1)
-            max_keyword = max((r.get('keyword_score', 0) for r in combined.values()), default=1)
-            
-            for result in combined.values():
-                semantic_norm = result.get('semantic_score', 0) / max_semantic
-                keyword_norm = result.get('keyword_score', 0) / max_keyword
-                
-                result['combined_score'] = (
-                    semantic_weight * semantic_norm + 
-                    keyword_weight * keyword_norm
-                )
-            
-            # Convert back to list and sort
-            results_list = list(combined.values())
-            results_list.sort(key=lambda x: x['combined_score'], reverse=True)
-            
-            return results_list
-        
-        except Exception as e:
-            logging.error(f"Error combining search results: {str(e)}")
-            return semantic_results  # Fallback to semantic results
-    
     def get_similar_chunks(self, file_id: int, chunk_index: int, limit: int = 5) -> List[Dict[str, Any]]:
-        """Get chunks similar to a specific chunk"""
+        """Get chunks similar to a specific chunk
+
+        Neighbours come from the k-NN graph of the chunk's knowledge base,
+        so the lookup reads at most ``KNN_GRAPH_K`` precomputed entries.
+        """
         try:
             # Get the reference chunk
             reference_chunk = FileEmbedding.query.filter_by(
@@ -212,63 +550,156 @@ class VectorStore:
             if not reference_chunk:
                 return []
             
-            reference_embedding = json.loads(reference_chunk.embedding)
+            kb_ids = self._knowledge_base_ids_for_file(file_id)
+            if not kb_ids:
+                return []
             
-            # Get all other embeddings
-            other_embeddings = FileEmbedding.query.filter(
-                (FileEmbedding.file_id != file_id) | 
-                (FileEmbedding.chunk_index != chunk_index)
+            kb_id = kb_ids[0]
+            matrix = self.get_knowledge_base_matrix(kb_id)
+            if isinstance(matrix, KnowledgeBaseMatrix):
+                hits = knn_graphs.get(kb_id, matrix).similar_chunks(reference_chunk.id, limit)
+            else:
+                # Segment-backed and quantized knowledge bases keep no dense matrix to build a graph from
+                reference_embedding = decode_embedding(reference_chunk)
+                if reference_embedding is None:
+                    return []
+                hits = [hit for hit in matrix.search(reference_embedding, limit + 1)
+                        if hit[0] != reference_chunk.id][:limit]
+            
+            records = FileEmbedding.query.filter(
+                FileEmbedding.id.in_([chunk_id for chunk_id, _, _ in hits])
             ).all()
+            records_by_id = {record.id: record for record in records}
             
-            # Calculate similarities
             results = []
-            for embedding_record in other_embeddings:
-                try:
-                    stored_embedding = json.loads(embedding_record.embedding)
-                    similarity = self.embedding_service.cosine_similarity(reference_embedding, stored_embedding)
-                    
-                    results.append({
-                        'id': embedding_record.id,
-                        'file_id': embedding_record.file_id,
-                        'chunk_index': embedding_record.chunk_index,
-                        'text': embedding_record.chunk_text,
-                        'similarity': similarity
-                    })
-                except (json.JSONDecodeError, TypeError):
+            for chunk_id, _, similarity in hits:
+                record = records_by_id.get(chunk_id)
+                if record is None:
                     continue
-            
-            # Sort by similarity
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            return results[:limit]
+                
+                results.append({
+                    'id': record.id,
+                    'file_id': record.file_id,
+                    'chunk_index': record.chunk_index,
+                    'text': record.chunk_text,
+                    'similarity': similarity
+                })
+            
+            return results
         
         except Exception as e:
             logging.error(f"Error getting similar chunks: {str(e)}")
             return []
     
     def update_embeddings(self, file_id: int, new_text_chunks: List[str]) -> bool:
-        """Update embeddings for a file"""
+        """Bring a file's embeddings in line with its re-chunked text
+        
+        New chunks are matched to stored rows by the SHA-256 of their text
+        (``embedding_metadata['chunk_hash']``, computed from the stored text
+        for older rows). Matched rows are kept with their vectors and only
+        renumbered if they moved, stored rows left unmatched are deleted and
+        only new or edited chunks are embedded, so an edit costs embeddings
+        in proportion to the chunks it touched. Rows from another embedding
+        model or dimension are never reused.
+        """
+        kb_ids = []
         try:
-            # Delete existing embeddings
-            FileEmbedding.query.filter_by(file_id=file_id).delete()
-            
-            # Add new embeddings
-            success = self.add_embeddings(file_id, new_text_chunks)
+            kb_ids = self._knowledge_base_ids_for_file(file_id)
+            model = self.embedding_service.model_name
+            dimension = self._file_dimension(file_id, kb_ids)
+            
+            rows = db.session.query(
+                FileEmbedding.id,
+                FileEmbedding.chunk_index,
+                FileEmbedding.embedding_model,
+                FileEmbedding.embedding_dim,
+                FileEmbedding.embedding_metadata
+            ).filter(FileEmbedding.file_id == file_id).order_by(FileEmbedding.chunk_index).all()
+            
+            stale_ids = []
+            stored = []  # (id, chunk_index, chunk_hash or None, metadata)
+            for row in rows:
+                metadata = dict(row.embedding_metadata or {})
+                if dimension is None:
+                    wrong_size = metadata.get('dimension_mode') == 'shortened'
+                else:
+                    wrong_size = bool(row.embedding_dim) and row.embedding_dim != dimension
+                if row.embedding_model != model or wrong_size:
+                    stale_ids.append(row.id)
+                else:
+                    stored.append((row.id, row.chunk_index, metadata.get('chunk_hash'), metadata))
+            
+            # Rows written before chunk hashes were recorded are hashed from their text once
+            unhashed = [row_id for row_id, _, hash_, _ in stored if hash_ is None]
+            backfilled = {}
+            for start in range(0, len(unhashed), _ID_BATCH):
+                for row_id, text in db.session.query(FileEmbedding.id, FileEmbedding.chunk_text).filter(
+                        FileEmbedding.id.in_(unhashed[start:start + _ID_BATCH])):
+                    backfilled[row_id] = chunk_hash(text)
+            
+            candidates = {}
+            for row_id, chunk_index, hash_, metadata in stored:
+                hash_ = hash_ or backfilled.get(row_id)
+                candidates.setdefault(hash_, deque()).append((row_id, chunk_index, metadata))
+            
+            updates = []
+            new_chunks = []  # (chunk_index, text)
+            for i, chunk in enumerate(new_text_chunks):
+                hash_ = chunk_hash(chunk)
+                matches = candidates.get(hash_)
+                if not matches:
+                    new_chunks.append((i, chunk))
+                    continue
+                row_id, chunk_index, metadata = matches.popleft()
+                if chunk_index != i or row_id in backfilled:
+                    updates.append({'id': row_id, 'chunk_index': i,
+                                    'embedding_metadata': {**metadata, 'chunk_hash': hash_}})
+            removed_ids = stale_ids + [row_id for matches in candidates.values() for row_id, _, _ in matches]
+            
+            embeddings = []
+            if new_chunks:
+                embeddings = self.embedding_service.get_embeddings([chunk for _, chunk in new_chunks])
+                if not embeddings:
+                    logging.error("Failed to generate embeddings")
+                    return False
+                embeddings = shorten_all(embeddings, dimension)
+            
+            for start in range(0, len(removed_ids), _ID_BATCH):
+                FileEmbedding.query.filter(
+                    FileEmbedding.id.in_(removed_ids[start:start + _ID_BATCH])
+                ).delete(synchronize_session=False)
+            if updates:
+                db.session.bulk_update_mappings(FileEmbedding, updates)
+            chunk_ids = self._insert_chunks(file_id, new_chunks, embeddings, kb_ids)
+            db.session.commit()
             
-            if success:
-                logging.info(f"Updated embeddings for file {file_id}")
+            self._unindex_chunks(kb_ids, removed_ids)
+            self._index_new_chunks(kb_ids, file_id, chunk_ids, embeddings, [chunk for _, chunk in new_chunks])
             
-            return success
+            logging.info(f"Updated embeddings for file {file_id}: kept {len(new_text_chunks) - len(new_chunks)}, "
+                         f"embedded {len(chunk_ids)}, deleted {len(removed_ids)}, updated {len(updates)}")
+            return True
         
+        except EmbeddingDimensionError:
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
+            # Only this file's knowledge bases can have been left half updated
+            for kb_id in kb_ids:
+                vector_cache.invalidate(kb_id)
             logging.error(f"Error updating embeddings: {str(e)}")
             return False
     
     def delete_embeddings(self, file_id: int) -> bool:
         """Delete all embeddings for a file"""
         try:
+            kb_ids = self._knowledge_base_ids_for_file(file_id)
             FileEmbedding.query.filter_by(file_id=file_id).delete()
             db.session.commit()
+            
+            unindex_files(kb_ids, [file_id])
+            
             logging.info(f"Deleted embeddings for file {file_id}")
             return True
         
@@ -284,9 +715,7 @@ class VectorStore:
             
             if knowledge_base_id:
                 # Filter by knowledge base
-                kb_files = KnowledgeBaseFile.query.filter_by(knowledge_base_id=knowledge_base_id).all()
-                file_ids = [kbf.file_id for kbf in kb_files]
-                query = query.filter(FileEmbedding.file_id.in_(file_ids))
+                query = query.filter(knowledge_base_rows(knowledge_base_id))
             
             total_embeddings = query.count()
             unique_files = query.with_entities(FileEmbedding.file_id).distinct().count()
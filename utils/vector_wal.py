@@ -0,0 +1,221 @@
+import os
+import json
+import struct
+import zlib
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Sequence
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+OP_UPSERT = 1
+OP_DELETE = 2
+
+# op (uint8), lsn (uint64), payload length (uint32), crc32 of payload (uint32)
+RECORD_HEADER = struct.Struct('<BQII')
+# JSON header length (uint32) inside an upsert payload, followed by float32 vector bytes
+JSON_LENGTH = struct.Struct('<I')
+
+class LogChanges(NamedTuple):
+    """What other processes did to a log since this process last held its lock"""
+    reset: bool
+    records: List[Dict[str, Any]]
+
+class WriteAheadLog:
+    """Append-only log of vector upserts and deletes
+
+    Every record carries a log sequence number (LSN) so a snapshot can note
+    the last LSN it contains and replay skips anything older. A torn write at
+    the end of the file fails its CRC and is truncated on the next open.
+
+    Several processes may share one log. Writers hold ``exclusive()``, an
+    advisory file lock next to the log, around appends, snapshots and
+    resets; on entry it reads whatever the other processes appended since,
+    so LSNs stay unique and every process can apply those records first.
+    """
+
+    def __init__(self, path: str, fsync: bool = True, start_lsn: int = 0):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._held = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # A snapshot may have emptied the log; never hand out an LSN it already covers
+        self.last_lsn = start_lsn
+        with self._file_lock():
+            for record in self.replay(after_lsn=start_lsn):
+                self.last_lsn = record['lsn']
+            self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, 'ab')
+        stat = os.fstat(self._file.fileno())
+        self._inode = stat.st_ino
+        # Bytes of the log this process has written or read
+        self._offset = stat.st_size
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def exclusive(self):
+        """Hold the log's cross-process writer lock, yielding ``LogChanges`` made elsewhere
+
+        ``reset`` means another process snapshotted and replaced the log:
+        the caller must reload the snapshot, then apply ``records`` newer
+        than it. Nested calls in the holding thread yield no changes.
+        """
+        with self._lock:
+            if self._held:
+                yield LogChanges(False, [])
+                return
+            with self._file_lock():
+                self._held += 1
+                try:
+                    yield self._catch_up()
+                finally:
+                    self._held -= 1
+
+    def changed(self) -> bool:
+        """Whether another process has written to or replaced the log; a cheap stat, no lock"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return stat.st_ino != self._inode or stat.st_size != self._offset
+
+    def _catch_up(self) -> LogChanges:
+        reset = False
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_ino != self._inode:
+            self._file.close()
+            self._file = open(self.path, 'ab')
+            self._inode = os.fstat(self._file.fileno()).st_ino
+            self._offset = 0
+            reset = True
+
+        records = list(self.replay(position=self._offset)) if reset or stat.st_size != self._offset else []
+        for record in records:
+            self.last_lsn = max(self.last_lsn, record['lsn'])
+        self._offset = os.fstat(self._file.fileno()).st_size
+        return LogChanges(reset, records)
+
+    def _encode_upsert(self, lsn: int, vector_id: str, vector: np.ndarray,
+                       metadata: Dict[str, Any]) -> bytes:
+        header = json.dumps({'id': vector_id, 'metadata': metadata}).encode('utf-8')
+        payload = JSON_LENGTH.pack(len(header)) + header + np.asarray(vector, dtype='<f4').tobytes()
+        return RECORD_HEADER.pack(OP_UPSERT, lsn, len(payload), zlib.crc32(payload)) + payload
+
+    def _encode_delete(self, lsn: int, ids: Sequence[str]) -> bytes:
+        payload = json.dumps({'ids': list(ids)}).encode('utf-8')
+        return RECORD_HEADER.pack(OP_DELETE, lsn, len(payload), zlib.crc32(payload)) + payload
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._offset = self._file.tell()
+
+    def append_upserts(self, ids: Sequence[str], vectors: np.ndarray,
+                       metadata: Sequence[Dict[str, Any]]) -> int:
+        """Log a batch of upserts with one write; returns the last LSN used"""
+        with self._lock:
+            parts = []
+            for vector_id, vector, meta in zip(ids, vectors, metadata):
+                self.last_lsn += 1
+                parts.append(self._encode_upsert(self.last_lsn, vector_id, vector, meta))
+            self._write(b''.join(parts))
+            return self.last_lsn
+
+    def append_delete(self, ids: Sequence[str]) -> int:
+        """Log the deletion of a set of ids; returns its LSN"""
+        with self._lock:
+            self.last_lsn += 1
+            self._write(self._encode_delete(self.last_lsn, ids))
+            return self.last_lsn
+
+    def replay(self, after_lsn: int = 0, position: int = 0) -> Iterator[Dict[str, Any]]:
+        """Yield decoded records newer than ``after_lsn`` in log order, reading from byte ``position``"""
+        if not os.path.exists(self.path):
+            return
+
+        valid_end = position
+        with open(self.path, 'rb') as f:
+            f.seek(position)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                op, lsn, length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid_end = f.tell()
+
+                if lsn <= after_lsn:
+                    continue
+
+                if op == OP_UPSERT:
+                    (json_length,) = JSON_LENGTH.unpack_from(payload)
+                    start = JSON_LENGTH.size
+                    header_data = json.loads(payload[start:start + json_length])
+                    yield {
+                        'op': 'upsert',
+                        'lsn': lsn,
+                        'id': header_data['id'],
+                        'metadata': header_data.get('metadata', {}),
+                        'vector': np.frombuffer(payload, dtype='<f4', offset=start + json_length)
+                    }
+                elif op == OP_DELETE:
+                    yield {'op': 'delete', 'lsn': lsn, 'ids': json.loads(payload)['ids']}
+
+            file_size = f.seek(0, os.SEEK_END)
+
+        if valid_end < file_size:
+            logging.warning(f"Truncating {file_size - valid_end} bytes of incomplete records from {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def reset(self) -> None:
+        """Drop all records once a snapshot covers them; LSNs keep increasing
+
+        Call it inside ``exclusive()``. The log is replaced by a new empty
+        file, which tells other processes to reload the snapshot.
+        """
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._file.close()
+            self._open()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()